@@ -1,29 +1,438 @@
 from __future__ import unicode_literals
-from win32com import client as com
-from win32com.client import constants as C
-from pywintypes import com_error
-from collections import OrderedDict
+import time
+import os
+
+# Record the start of import before anything else so that '--profile'
+# can account for the time spent importing dependencies.
+_START = time.time()
+if os.environ.get('MSW_PROFILE_OUTPUT'):
+    import cProfile
+    _PROFILE = cProfile.Profile()
+    _PROFILE.enable()
+else:
+    _PROFILE = None
+
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 from pkg_resources import iter_entry_points
+import functools
+import itertools
+import multiprocessing
+import json
+import threading
+import zipfile
+import tempfile
+import binascii
+import shutil
 import click
-import os
+import zlib
+import io
+import re
+import sqlite3
+import hashlib
+import struct
+import csv
+import uuid
+import cmd
+import glob
+import shlex
+import socket
+import posixpath
 
-VERSION = '0.1'
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+# The 'futures' backport provides this on Python 2
+from concurrent import futures
+
+try:
+    import asyncio
+except ImportError:  # Python 2
+    asyncio = None
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree
+
+try:
+    from PIL import Image
+except ImportError:
+    # Pillow is only needed to create PNG previews.
+    Image = None
+
+try:
+    import psutil
+except ImportError:
+    # psutil is only needed to admit queued jobs by the CPU and memory in use.
+    psutil = None
+
+try:
+    import uno
+    from com.sun.star.beans import PropertyValue
+except ImportError:
+    # The soffice backend needs LibreOffice's Python UNO bridge.
+    uno = PropertyValue = None
 
 try:
-    WORD = com.gencache.EnsureDispatch('Word.Application')
-    TEMPLATE_DIR = WORD.Options.DefaultFilePath(C.wdUserTemplatesPath)
-except com_error as e:
-    raise click.ClickException(e.excepinfo[2])
-except Exception as e:
-    raise click.ClickException("Unable to load 'Word.Application'.")
+    from win32com import client as com
+    from pywintypes import com_error
+    import pythoncom
+except ImportError:
+    # Without pywin32 (eg. on Linux) the commands which do not need Word still work.
+    com = pythoncom = None
+
+    class com_error(Exception):
+        ''' Stands in for pywintypes.com_error: (hresult, strerror, excepinfo, argerror). '''
+        def __init__(self, *args):
+            super(com_error, self).__init__(*args)
+            self.excepinfo = args[2] if len(args) > 2 else None
+
+VERSION = '0.1'
+
+
+class WordConstants(object):
+    '''
+    The values of the Word enumerations used by MSWord-CLI. These are fixed by
+    Word's type library, so they are defined here rather than read from
+    win32com's generated constants, which are only available once Word has
+    been dispatched.
+    '''
+    # WdAlertLevel
+    wdAlertsNone = 0
+    # WdDefaultFilePath
+    wdUserTemplatesPath = 2
+    wdWorkgroupTemplatesPath = 3
+    # WdSaveOptions
+    wdDoNotSaveChanges = 0
+    wdSaveChanges = -1
+    wdPromptToSaveChanges = -2
+    # WdStatistic
+    wdStatisticWords = 0
+    wdStatisticPages = 2
+    wdStatisticCharacters = 3
+    # WdPrintOutItem
+    wdPrintDocumentContent = 0
+    wdPrintProperties = 1
+    wdPrintComments = 2
+    wdPrintMarkup = 2
+    wdPrintStyles = 3
+    wdPrintAutoTextEntries = 4
+    wdPrintKeyAssignments = 5
+    wdPrintEnvelope = 6
+    wdPrintDocumentWithMarkup = 7
+    # WdPrintOutPages
+    wdPrintAllPages = 0
+    wdPrintOddPagesOnly = 1
+    wdPrintEvenPagesOnly = 2
+    # WdPrintOutRange
+    wdPrintAllDocument = 0
+    wdPrintSelection = 1
+    wdPrintCurrentPage = 2
+    wdPrintFromTo = 3
+    wdPrintRangeOfPages = 4
+    # WdExportFormat
+    wdExportFormatPDF = 17
+    wdExportFormatXPS = 18
+    # WdExportOptimizeFor
+    wdExportOptimizeForPrint = 0
+    wdExportOptimizeForOnScreen = 1
+    # WdExportRange
+    wdExportAllDocument = 0
+    wdExportSelection = 1
+    wdExportCurrentPage = 2
+    wdExportFromTo = 3
+    # WdExportItem
+    wdExportDocumentContent = 0
+    wdExportDocumentWithMarkup = 7
+    # WdExportCreateBookmarks
+    wdExportCreateNoBookmarks = 0
+    wdExportCreateHeadingBookmarks = 1
+    wdExportCreateWordBookmarks = 2
+    # WdSaveFormat
+    wdFormatDocument = 0
+    wdFormatText = 2
+    wdFormatRTF = 6
+    wdFormatHTML = 8
+    wdFormatFilteredHTML = 10
+    wdFormatXMLDocument = 12
+    wdFormatFlatXML = 19
+    wdFormatOpenDocumentText = 23
+    wdFormatPDF = 17
+    # WdCompareDestination and WdGranularity
+    wdCompareDestinationNew = 2
+    wdGranularityCharLevel = 0
+    wdGranularityWordLevel = 1
+    # WdReplace, WdFindWrap and WdCollapseDirection
+    wdReplaceAll = 2
+    wdFindStop = 0
+    wdCollapseEnd = 0
+    # WdOutlineLevel
+    wdOutlineLevelBodyText = 10
+    # WdViewType
+    wdPrintView = 3
+    # MsoDocProperties
+    msoPropertyTypeString = 4
+
+
+C = WordConstants()
+
+
+class Profiler(object):
+    '''
+    Records wall-clock timings for each phase of a run. Timings are
+    always recorded (it is cheap) but only reported when enabled.
+    '''
+    def __init__(self, start, profile=None):
+        self.start = start
+        self.profile = profile
+        self.phases = []
+        self.last = start
+
+    def record(self, name, start, end):
+        ''' Record a phase which ran from start to end. '''
+        self.phases.append((name, start, end))
+        self.last = end
+
+    @contextmanager
+    def phase(self, name):
+        ''' Context manager which records the enclosed block as a phase. '''
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.time())
+
+    def enable_profile(self):
+        ''' Start a cProfile run unless one is already running. '''
+        if self.profile is None:
+            import cProfile
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+    def dump_stats(self, path):
+        ''' Stop the cProfile run and write its stats to path. '''
+        if self.profile is not None:
+            self.profile.disable()
+            self.profile.dump_stats(path)
+
+    def report(self):
+        '''
+        Return a phase breakdown as a list of lines. A phase which ran within
+        another (eg. 'dispatch' during a command) is subtracted from it, so
+        that each phase is reported by its own time.
+        '''
+        total = time.time() - self.start
+        nested = [0] * len(self.phases)
+        stack = []
+        for i in sorted(range(len(self.phases)), key=lambda i: (self.phases[i][1], -self.phases[i][2])):
+            name, start, end = self.phases[i]
+            while stack and not self.phases[stack[-1]][1] <= start <= end <= self.phases[stack[-1]][2]:
+                stack.pop()
+            if stack:
+                nested[stack[-1]] += end - start
+            stack.append(i)
+        rows = [(name, end - start - nested[i]) for i, (name, start, end) in enumerate(self.phases)]
+        accounted = sum(elapsed for name, elapsed in rows)
+        rows.append(('other', max(total - accounted, 0)))
+        width = max(len(name) for name, elapsed in rows + [('total', 0)])
+        lines = ['Profile (wall-clock):']
+        for name, elapsed in rows:
+            percent = 100.0 * elapsed / total if total else 0
+            lines.append('  {0:<{1}}  {2:8.3f}s  {3:5.1f}%'.format(name, width, elapsed, percent))
+        lines.append('  {0:<{1}}  {2:8.3f}s'.format('total', width, total))
+        return lines
+
+
+PROFILER = Profiler(_START, _PROFILE)
+PROFILER.record('import', _START, time.time())
+
+
+
+class Application(object):
+    '''
+    Stands in for the Word.Application COM object (or the application of
+    another backend, see set_backend), which is only dispatched (starting
+    Word if it is not running) when first used. Commands which do not need
+    Word therefore never start it.
+    '''
+    def __init__(self):
+        object.__setattr__(self, '_app', None)
+
+    def _dispatch(self):
+        if self._app is None:
+            with PROFILER.phase('dispatch'):
+                app = BACKEND.dispatch()
+            object.__setattr__(self, '_app', app)
+        return self._app
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            # Introspection (eg. by copy or mock) should not start Word
+            raise AttributeError(name)
+        return getattr(self._dispatch(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._dispatch(), name, value)
+
+
+WORD = Application()
+
+# The file in which the template catalog is cached. See template_catalog().
+TEMPLATE_CATALOG = os.path.join(click.get_app_dir('msw'), 'templates.json')
+
+TEMPLATE_EXTENSIONS = ('.dotx', '.dotm', '.dot')
+
+CATALOG = None
+
+
+def word_template_dirs():
+    '''
+    Return the user and workgroup templates paths set in Word's File Options
+    dialog (those which are set). Returns an empty list if Word is not
+    available.
+    '''
+    if com is None:
+        return []
+    try:
+        paths = [WORD.Options.DefaultFilePath(C.wdUserTemplatesPath),
+                 WORD.Options.DefaultFilePath(C.wdWorkgroupTemplatesPath)]
+    except com_error as e:
+        raise click.ClickException(e.excepinfo[2])
+    return [path for path in paths if path]
+
+
+def extra_template_dirs():
+    ''' Return the directories listed in the MSW_TEMPLATE_PATH environment variable. '''
+    return [os.path.abspath(path) for path in os.environ.get('MSW_TEMPLATE_PATH', '').split(os.pathsep) if path]
+
+
+class TemplateCatalog(object):
+    '''
+    An index of the templates in Word's user and workgroup templates
+    directories and the directories listed in MSW_TEMPLATE_PATH, including
+    their subdirectories. The index is cached in the file at path and is
+    only rebuilt when the modification time of one of the directories
+    changes (ie. when a file is added, removed or renamed). Word's templates
+    directories are also cached and are only looked up again on refresh.
+    '''
+    def __init__(self, path=None, refresh=False):
+        self.path = path or TEMPLATE_CATALOG
+        cache = {} if refresh else self._load()
+        extras = extra_template_dirs()
+        if cache.get('extras') == extras and self._current(cache.get('dirs', {})):
+            self.roots = cache['roots']
+            self.templates = [tuple(entry) for entry in cache['templates']]
+            self.dirs = cache['dirs']
+        else:
+            word = cache['word'] if 'word' in cache else word_template_dirs()
+            self.scan(word, extras)
+
+    def _load(self):
+        try:
+            with io.open(self.path, encoding='utf-8') as f:
+                return json.load(f)
+        except (EnvironmentError, ValueError):
+            return {}
+
+    def _current(self, dirs):
+        ''' Return True if dirs (a dict of directory paths to mtimes) is unchanged. '''
+        for path, mtime in dirs.items():
+            try:
+                if os.stat(path).st_mtime != mtime:
+                    return False
+            except OSError:
+                return False
+        return bool(dirs)
+
+    def scan(self, word, extras):
+        ''' Index the templates in the directories word and extras and save the cache. '''
+        self.roots = []
+        for root in word + extras:
+            if root not in self.roots and os.path.isdir(root):
+                self.roots.append(root)
+        self.templates = []
+        self.dirs = {}
+        for root in self.roots:
+            for dirpath, dirnames, filenames in os.walk(root):
+                dirnames.sort()
+                self.dirs[dirpath] = os.stat(dirpath).st_mtime
+                for name in sorted(filenames):
+                    if not name.startswith('~$') and os.path.splitext(name)[1].lower() in TEMPLATE_EXTENSIONS:
+                        self.templates.append((root, os.path.relpath(os.path.join(dirpath, name), root)))
+        cache = dict(word=word, extras=extras, roots=self.roots, dirs=self.dirs, templates=self.templates)
+        try:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            with io.open(self.path, 'w', encoding='utf-8') as f:
+                f.write(json.dumps(cache, ensure_ascii=False))
+        except EnvironmentError:
+            pass
+
+    def paths(self):
+        ''' Return the full paths of the templates in the catalog. '''
+        return [os.path.join(root, rel) for root, rel in self.templates]
+
+    def find(self, name):
+        '''
+        Return the full paths of the templates matching name, which is a path
+        relative to a templates directory or the end of one (eg. a bare file
+        name), with or without its extension. Exact relative paths are
+        preferred to partial paths. If the same relative path exists in more
+        than one directory, the first directory wins. Names are not case
+        sensitive.
+        '''
+        name = os.path.normcase(os.path.normpath(name)).lower()
+        exact = OrderedDict()
+        partial = OrderedDict()
+        for root, rel in self.templates:
+            norm = os.path.normcase(rel).lower()
+            for candidate in (norm, os.path.splitext(norm)[0]):
+                if candidate == name:
+                    exact.setdefault(norm, os.path.join(root, rel))
+                elif candidate.endswith(os.sep + name):
+                    partial.setdefault(norm, os.path.join(root, rel))
+        return list((exact or partial).values())
+
+    def resolve(self, name):
+        '''
+        Return the full path of the one template matching name. Raises
+        LookupError if there are none or more than one.
+        '''
+        matches = self.find(name)
+        if len(matches) > 1:
+            raise LookupError('Template "%s" is ambiguous. It matches:\n  %s' % (name, '\n  '.join(matches)))
+        if not matches:
+            for root in self.roots:
+                if os.path.exists(os.path.join(root, name)):
+                    return os.path.join(root, name)
+            raise LookupError('Template "%s" was not found in the templates directories.' % name)
+        return matches[0]
+
+
+def template_catalog(refresh=False):
+    ''' Return the TemplateCatalog, which is loaded on first use only. '''
+    global CATALOG
+    if CATALOG is None or refresh:
+        CATALOG = TemplateCatalog(refresh=refresh)
+    return CATALOG
 
 
 class Template(click.Path):
     '''
     The Template type resolves relative paths first to the cwd and then
-    to the template directory set in Word's File Options dialog. Upon
-    resolving the realative path, it behaves as click.Path. Absolute
-    paths receive no special treatment.
+    through the template catalog, which accepts a bare template name or a
+    partial path within the templates directories. Upon resolving the
+    realative path, it behaves as click.Path. Absolute paths receive no
+    special treatment.
     '''
     def convert(self, value, param, ctx):
         if not os.path.isabs(value):
@@ -32,8 +441,11 @@ class Template(click.Path):
                 # Use existing file in cwd
                 value = os.path.abspath(value)
             else:
-                # Assume template dir
-                value = os.path.join(TEMPLATE_DIR, value)
+                # Look up template directories
+                try:
+                    value = template_catalog().resolve(value)
+                except LookupError as e:
+                    self.fail(e.args[0], param, ctx)
         # Pass on to click.Path for further validation
         return super(Template, self).convert(value, param, ctx)
 
@@ -63,354 +475,6189 @@ def print_version(ctx, param, value):
     ctx.exit()   
 
 
-@click.group(chain=True)
-@click.option('--version', is_flag=True, callback=print_version,
-              expose_value=False, is_eager=True, 
-              help='Print version info and exit.')
-def cli():
-    ''' 
-    Command line interface for Microsoft Word. 
-    
-    Run 'msw <command> --help' to display help for a specific command. 
+def error_code(e):
+    '''
+    Return the HRESULT of a com_error as a hex string (eg. '0x800A1066').
     '''
-    pass
+    try:
+        return '0x%08X' % (e.args[0] & 0xFFFFFFFF)
+    except (IndexError, TypeError):
+        return 'unknown'
 
 
-@cli.command('open')
-@click.argument('path', type=click.Path(exists=True, resolve_path=True))
-@click.option('--show/--hide', default=True, 
-              help='Display or hide the document.')
-def open(path, show):
-    ''' 
-    Open an existing document and activate. 
+class Metrics(object):
     '''
-    click.echo('Opening document at "%s"' % path)
-    try:
-        WORD.Documents.Open(FileName=path, Visible=show)
-        if show and not WORD.Visible:
-            # Only change state to visible if not visible
-            # otherwise leave Word's visible state as-is
-            WORD.Visible = show
-    except com_error as e:
-        raise click.ClickException(e.excepinfo[2])
+    A registry of counters, gauges and histograms which renders its
+    contents in the Prometheus text exposition format. All updates are
+    thread safe. Metrics must be declared before use.
+    '''
+    BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
 
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = OrderedDict()
 
-@cli.command('new')
-@click.option('-t', '--template', type=Template(exists=True, dir_okay=False, resolve_path=True), 
-              help='Use template at PATH.')
-@click.option('--show/--hide', default=True, 
-              help='Display or hide the document.')
-def new(template, show):
-    ''' 
-    Create a new document and activate. 
-    
-    When the template path is relative, an attempt will be made to load 
-    the template from the current working directory, and then from the 
-    template directory set in Word's File Options dialog. If your 
-    template file is in another location, you must specify an absolute 
-    path.
+    def declare(self, name, type, help, buckets=None):
+        ''' Declare a metric of type 'counter', 'gauge' or 'histogram'. '''
+        self._metrics[name] = {
+            'type':    type,
+            'help':    help,
+            'buckets': tuple(buckets or self.BUCKETS),
+            'values':  OrderedDict()
+        }
 
-    If no template path is provided, a new blank document will be created.
-    '''
-    try:
-        if template:
-            click.echo('Opening new document using template: "%s"' % template)
-            doc = WORD.Documents.Add(template, Visible=show)
+    def _key(self, labels):
+        return tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        ''' Increment a counter or gauge by value. '''
+        with self._lock:
+            values = self._metrics[name]['values']
+            key = self._key(labels)
+            values[key] = values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        ''' Set a gauge to value. '''
+        with self._lock:
+            self._metrics[name]['values'][self._key(labels)] = value
+
+    def observe(self, name, value, **labels):
+        ''' Record an observation in a histogram. '''
+        with self._lock:
+            metric = self._metrics[name]
+            key = self._key(labels)
+            if key not in metric['values']:
+                metric['values'][key] = {'buckets': [0] * len(metric['buckets']), 'sum': 0, 'count': 0}
+            hist = metric['values'][key]
+            for i, bound in enumerate(metric['buckets']):
+                if value <= bound:
+                    hist['buckets'][i] += 1
+            hist['sum'] += value
+            hist['count'] += 1
+
+    def get(self, name, **labels):
+        ''' Return the current value of a counter or gauge. '''
+        with self._lock:
+            return self._metrics[name]['values'].get(self._key(labels), 0)
+
+    @contextmanager
+    def track(self, command):
+        '''
+        Context manager which records the duration and outcome of a command.
+        A com_error raised within the block is counted as a failure under its
+        HRESULT and then re-raised.
+        '''
+        start = time.time()
+        try:
+            yield
+        except com_error as e:
+            self.inc('msw_failures_total', command=command, code=error_code(e))
+            raise
+        except Exception:
+            self.inc('msw_failures_total', command=command, code='unknown')
+            raise
         else:
-            click.echo('Opening new blank document.')
-            doc = WORD.Documents.Add(Visible=show)
-        if show and not WORD.Visible:
-            # Only change state to visible if not visible
-            # otherwise leave Word's visible state as-is
-            WORD.Visible = show
-    except com_error as e:
-        raise click.ClickException(e.excepinfo[2])
+            self.inc('msw_documents_processed_total', command=command)
+        finally:
+            self.observe('msw_command_duration_seconds', time.time() - start, command=command)
 
+    def render(self):
+        ''' Return all metrics in the Prometheus text format. '''
+        def fmt(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ''
+            return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                                     for k, v in pairs)
 
-PRINT_OUT_ITEMS = OrderedDict([
-    ('document_content',  C.wdPrintDocumentContent),
-    ('doc_with_markup',   C.wdPrintDocumentWithMarkup),
-    ('comments',          C.wdPrintComments),
-    ('properties',        C.wdPrintProperties),
-    ('markup',            C.wdPrintMarkup),
-    ('styles',            C.wdPrintStyles),
-    ('auto_text_entries', C.wdPrintAutoTextEntries),
-    ('key_assignments',   C.wdPrintKeyAssignments),
-    ('envelope',          C.wdPrintEnvelope)
-])
+        lines = []
+        with self._lock:
+            for name, metric in self._metrics.items():
+                lines.append('# HELP %s %s' % (name, metric['help']))
+                lines.append('# TYPE %s %s' % (name, metric['type']))
+                for labels, value in metric['values'].items():
+                    if metric['type'] == 'histogram':
+                        for bound, count in zip(metric['buckets'], value['buckets']):
+                            lines.append('%s_bucket%s %s' % (name, fmt(labels, [('le', bound)]), count))
+                        lines.append('%s_bucket%s %s' % (name, fmt(labels, [('le', '+Inf')]), value['count']))
+                        lines.append('%s_sum%s %s' % (name, fmt(labels), value['sum']))
+                        lines.append('%s_count%s %s' % (name, fmt(labels), value['count']))
+                    else:
+                        lines.append('%s%s %s' % (name, fmt(labels), value))
+        return '\n'.join(lines) + '\n'
 
-@cli.command('print')
-@click.option('-c', '--copies', default=1, help='The number of copies to be printed.')
-@click.option('-p', '--pages', type=str, help='The page numbers and page ranges '
-              'to be printed, separated by commas. For example, "2, 6-10" prints '
-              'page 2 and pages 6 through 10. Ignored if \'--current-page\' or '
-              '\'--selection\' is specified.')
-@click.option('--even', 'pagetype', flag_value=C.wdPrintEvenPagesOnly,
-              help='Print even-numbered pages only.')
-@click.option('--odd', 'pagetype', flag_value=C.wdPrintOddPagesOnly, 
-              help='Print odd-numbered pages only.')
-@click.option('--current-page', 'range', flag_value=C.wdPrintCurrentPage, 
-              help='Print the current page only.')
-@click.option('--selection', 'range', flag_value=C.wdPrintSelection, 
-              help='Print the current selection.')
-@click.option('--no-collate', is_flag=True, help='Do not collate multiple copies.')
-@click.option('--to-file', type=click.Path(dir_okay=False, resolve_path=True), 
-              help='Print document to file at PATH.')
-@click.option('--append', is_flag=True, help='Append the document to the file specified '
-              'by the \'--to-file\' option rather than overwriting it.')
-@click.option('--columns', type=click.Choice(['1', '2', '3', '4']), default='1',
-              help='The number of pages to fit horizontally on one page. '
-              'Use with the \'--rows\' option to print multiple pages on a single sheet.')
-@click.option('--rows', type=click.Choice(['1', '2', '4']), default='1',
-              help='The number of pages to fit vertically on one page. '
-              'Use with the \'--columns\' argument to print multiple pages on a single sheet.')
-@click.option('--item', type=click.Choice(PRINT_OUT_ITEMS.keys()), default='document_content', 
-              help='The item to be printed. Defaults to \'document_content\'.')
-def prnt(copies, pages, pagetype, range, item, no_collate, to_file, append, columns, rows):
-    ''' 
-    Print active document to default printer. 
+    def write(self, path):
+        '''
+        Write all metrics to the file at path. The file is replaced atomically
+        so that the textfile collector never reads a partial file.
+        '''
+        tmp = '%s.%s.tmp' % (path, os.getpid())
+        with click.open_file(tmp, 'w') as f:
+            f.write(self.render())
+        if hasattr(os, 'replace'):
+            os.replace(tmp, path)
+        else:  # Python 2
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(tmp, path)
 
-    The options '--pages', '--current-page' and '--selection' are mutualy exclusive.
-    The '--pages' option is ignored if '--current-page' or '--selection' is specified.
-    The last option specified  of '--current-page' or '--selection' will be honored.
-    If none of these options are specified, the entire document is exported.
 
-    The options '--even' and '--odd' are mutualy exclusive. Only the last one specified 
-    will be honored.  If neither is specified, both even and odd pages will be printed.
+METRICS = Metrics()
+METRICS.declare('msw_documents_processed_total', 'counter', 'Documents processed successfully.')
+METRICS.declare('msw_failures_total', 'counter', 'Failed operations by error code.')
+METRICS.declare('msw_command_duration_seconds', 'histogram', 'Duration of each command in seconds.')
+METRICS.declare('msw_queue_depth', 'gauge', 'Documents waiting to be processed.')
+METRICS.declare('msw_word_restarts_total', 'counter', 'Word instances restarted after a failure.')
+METRICS.declare('msw_queue_wait_seconds', 'histogram', 'Seconds queued jobs waited by priority class.',
+                buckets=(1, 5, 15, 60, 300, 900, 3600, 14400, 86400))
+METRICS.declare('msw_admission_throttled_total', 'counter', 'Queued jobs held back by the load of the host.')
+
+
+class MetricsWriter(threading.Thread):
     '''
-    click.echo('Printing %s copies of pages: %s' % (copies, pages or 'all'))
-    options = {
-        'Background':       True,
-        'Copies':           copies,
-        'Collate':          not no_collate,
-        'Item':             PRINT_OUT_ITEMS[item],
-        'PrintToFile':      False,
-        'PageType':         C.wdPrintAllPages,
-        'Range':            C.wdPrintAllDocument,
-        'PrintZoomColumn':  int(columns),
-        'PrintZoomRow':     int(rows)
-    }
-    if range:
-        options['Range'] = range
-    elif pages:
-        options['Pages'] = pages
-        options['Range'] = C.wdPrintRangeOfPages
+    A daemon thread which writes the metrics registry to a textfile
+    every `interval` seconds until stopped. A final write is made on stop.
+    '''
+    def __init__(self, metrics, path, interval=15):
+        super(MetricsWriter, self).__init__()
+        self.daemon = True
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self._stopped = threading.Event()
 
-    if pagetype:
-        options['PageType'] = pagetype
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.metrics.write(self.path)
 
-    if to_file:
-        options['PrintToFile'] = True
-        options['OutputFileName'] = to_file
-        if append:
-            options['Append'] = True
-    
-    try:
-        WORD.ActiveDocument.PrintOut(**options)
-    except com_error as e:
-        raise click.ClickException(e.excepinfo[2])
+    def stop(self):
+        self._stopped.set()
+        self.metrics.write(self.path)
 
 
-@cli.command('export')
-@click.option('--pdf', 'format', flag_value=C.wdExportFormatPDF, default=True,
-              help="Export document into PDF format. The default.")
-@click.option('--xps', 'format', flag_value=C.wdExportFormatXPS,
-              help='Export document into XML Paper Specification (XPS) format.')
-@click.option('--show', is_flag=True, help='Open the new file in the appropriate viewer after exporting.')
-@click.option('--for-print', 'optimize', flag_value=C.wdExportOptimizeForPrint, default=True,
-              help='Export for print, which is higher quailty and results in a larger file size. '
-              'The default.')
-@click.option('--for-screen', 'optimize', flag_value=C.wdExportOptimizeForOnScreen,
-              help='Export for screen, which is a lower quality and results in a smaller file size.')
-@click.option('--pages', type=str, callback=validate_range, 
-              help='The range of pages to export. For example, "3-6" exports '
-              'pages 3 through 6 and "2-2" exports page 2 only. Ignored if '
-              '\'--current-page\' or \'--selection\' is specified.')
-@click.option('--current-page', 'range', flag_value=C.wdExportCurrentPage, 
-              help='Export the current page only.')
-@click.option('--selection', 'range', flag_value=C.wdExportSelection, 
-              help='Export the current selection.')
-@click.option('--with-markup', 'markup', is_flag=True, help='Export the document with markup.')
-@click.option('--with-props', 'properties', is_flag=True, 
-              help='Include document properties in the newly exported file.')
-@click.option('--without-irm', 'irm', is_flag=True, help='Exclude IRM permissions to an XPS document '
-              'if the source document has IRM protections.')
-@click.option('--with-heading-bookmarks', 'bookmarks', flag_value=C.wdExportCreateHeadingBookmarks,
-              help='Create a bookmark in the exported document for each Microsoft Word heading, which '
-              'includes only headings within the main document and text boxes not within headers, '
-              'footers, endnotes, footnotes, or comments.')
-@click.option('--with-word-bookmarks', 'bookmarks', flag_value=C.wdExportCreateWordBookmarks,
-              help='Create a bookmark in the exported document for each Word bookmark, which includes '
-              'all bookmarks except those contained within headers and footers.')
-@click.option('--without-structure-tags', 'struct', is_flag=True,
-              help='Exclude extra data to help screen readers, for example information about the flow '
-              'and logical organization of the content.')
-@click.option('--without-bitmaped-fonts', 'bitmap', is_flag=True, help='Exclude a bitmap of the text. '
-              'The viewer\'s computer substitutes an appropriate font if the authored one is not '
-              'available. Warning: always inlcude a bitmap when font licenses do not permit a font to '
-              'be embedded in the PDF file.')
-@click.option('--useiso19005-1', is_flag=True, help='Limit PDF usage to the PDF subset standardized '
-              'as ISO 19005-1. If used, the resulting files are more reliably self-contained but may '
-              'be larger or show more visual artifacts due to the restrictions of the format.') 
-@click.argument('path', type=click.Path(dir_okay=True, resolve_path=True))
-def export(path, format, show, optimize, pages, range, markup, properties, irm, bookmarks, struct, bitmap, useiso19005_1):
+def serve_metrics(metrics, port, host='127.0.0.1'):
     '''
-    Save active document as PDF or XPS format to PATH.
+    Serve the metrics registry at 'http://host:port/metrics' from a daemon
+    thread. Returns the server; call its 'shutdown' method to stop it.
+    '''
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = metrics.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
 
-    If PATH points to a directory rather than a file, a new file will be created
-    in that directory using the name of the document. For example:
+        def log_message(self, *args):
+            pass
 
-        somedoc.docx => somedoc.pdf
+    server = HTTPServer((host, port), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
 
-    A relative path will resolve to the current working directory. You may want to
-    use an absolute path to ensure the document is saved to the correct location.
 
-    The options '--pdf' and '--xps' are mutualy exclusive. Only the last one specified 
-    will be honored.  The default is '--pdf', which will be assumed if neither is specified.
+# =========================================================
+# PDF reading and merging
+# =========================================================
 
-    The options '--pages', '--current-page' and '--selection' are mutualy exclusive.
-    The '--pages' option is ignored if '--current-page' or '--selection' is specified.
-    The last option specified  of '--current-page' or '--selection' will be honored.
-    If none of these options are specified, the entire document is exported.
+class PdfError(ValueError):
+    ''' Raised when a PDF file cannot be read. '''
 
-    The options '--with-heading-bookmarks' and '--with-word-bookmarks' are mutualy exclusive.
-    Only the last one specified will be honored.  If neither is specified, no bookmarks are exported.
-    '''  
-    try:
-        if os.path.isdir(path):
-            # No filename specified. Used document name
-            name = os.path.splitext(WORD.ActiveDocument.Name)[0]
-            path = os.path.join(path, name)
-        if os.path.splitext(path)[1].lower() not in ['.pdf', '.xps']:
-            # No file extension specified. Use file format.
-            if format == C.wdExportFormatPDF:
-                ext = '.pdf'
-            else:
-                ext = '.xps'
-            path += ext
-        click.echo('Exporting to "%s"...' % path)
-        options = {
-                'OutputFileName':     path,
-                'ExportFormat':       format,
-                'OpenAfterExport':    show,
-                'OptimizeFor':        optimize,
-                'Range':              range if range else C.wdExportFromTo if pages else C.wdExportAllDocument,
-                'Item':               C.wdExportDocumentWithMarkup if markup else C.wdExportDocumentContent,
-                'IncludeDocProps':    properties,
-                'KeepIRM':            not irm,
-                'CreateBookmarks':    bookmarks or C.wdExportCreateNoBookmarks,
-                'DocStructureTags':   not struct,
-                'BitmapMissingFonts': not bitmap,
-                'UseISO19005_1':      useiso19005_1
-        }
 
-        if pages:
-            options['From'] = pages[0]
-            options['To'] = pages[1]
+class PdfName(type('')):
+    ''' A PDF name object (without the leading slash). '''
 
-        WORD.ActiveDocument.ExportAsFixedFormat(**options)
-    except com_error as e:
-        raise click.ClickException(e.excepinfo[2])
 
-@cli.command('save')
-@click.option('-a', '--all', is_flag=True,
-              help='Save all open documents.')
-@click.option('-f', '--force', is_flag=True,
-              help='Do not prompt to save changes.')
-@click.option('-p', '--path', type=click.Path(resolve_path=True),
-              help='Save document to PATH.')
-def save(all, force, path):
-    ''' 
-    Save document(s). 
-    
-    If a path is given, the active document is saved
-    with a new name at PATH. The --all and --force 
-    options are ignored when a path is provided.
-    
-    If no path is given, the active document is saved 
+class PdfString(bytes):
+    ''' A PDF string object (raw bytes). '''
+
+    def text(self):
+        ''' Decode the string as PDFDocEncoding or UTF-16. '''
+        if self[:2] == b'\xfe\xff':
+            return self[2:].decode('utf-16-be', 'replace')
+        return self.decode('latin-1')
+
+    @classmethod
+    def from_text(cls, text):
+        ''' Encode text as PDFDocEncoding if possible or UTF-16 if not. '''
+        try:
+            return cls(text.encode('ascii'))
+        except UnicodeError:
+            return cls(b'\xfe\xff' + text.encode('utf-16-be'))
+
+
+class PdfRef(tuple):
+    ''' An indirect reference (num, gen). '''
+    def __new__(cls, num, gen=0):
+        return tuple.__new__(cls, (num, gen))
+
+    num = property(lambda self: self[0])
+    gen = property(lambda self: self[1])
+
+
+class PdfStream(dict):
+    '''
+    A PDF stream: a dictionary plus data. To keep memory use bounded, data
+    read from a file is not loaded until 'read' is called; 'chunks' copies
+    it in pieces instead.
+    '''
+    def __init__(self, items=(), data=None, source=None):
+        super(PdfStream, self).__init__(items)
+        self._data = data
+        self.source = source  # (fileobj, offset, length)
+
+    def read(self):
+        ''' Return the raw (still encoded) stream data. '''
+        if self._data is None:
+            f, offset, length = self.source
+            f.seek(offset)
+            self._data = f.read(length)
+        return self._data
+
+    def chunks(self, size=65536):
+        ''' Yield the raw stream data in chunks. '''
+        if self._data is not None:
+            yield self._data
+            return
+        f, offset, length = self.source
+        while length > 0:
+            f.seek(offset)
+            chunk = f.read(min(size, length))
+            if not chunk:
+                raise PdfError('Unexpected end of stream data.')
+            offset += len(chunk)
+            length -= len(chunk)
+            yield chunk
+
+    def decode(self):
+        ''' Return the decoded stream data. Only FlateDecode is supported. '''
+        data = self.read()
+        filters = self.get('Filter', [])
+        params = self.get('DecodeParms', [])
+        if not isinstance(filters, list):
+            filters, params = [filters], [params]
+        for i, name in enumerate(filters):
+            if name != 'FlateDecode':
+                raise PdfError('Unsupported stream filter: %s' % name)
+            data = zlib.decompress(data)
+            param = params[i] if i < len(params) else None
+            if isinstance(param, dict) and param.get('Predictor', 1) >= 10:
+                data = _png_unpredict(data, param.get('Columns', 1),
+                                      param.get('Colors', 1) * param.get('BitsPerComponent', 8))
+        return data
+
+
+def _png_unpredict(data, columns, bits):
+    ''' Reverse PNG row predictors as used by xref and object streams. '''
+    bpp = max(bits // 8, 1)
+    rowlen = (columns * bits + 7) // 8
+    data = bytearray(data)
+    out = bytearray()
+    prev = bytearray(rowlen)
+    for start in range(0, len(data), rowlen + 1):
+        kind = data[start]
+        row = data[start + 1:start + 1 + rowlen]
+        for i in range(len(row)):
+            left = row[i - bpp] if i >= bpp else 0
+            up = prev[i]
+            if kind == 1:
+                row[i] = (row[i] + left) & 0xFF
+            elif kind == 2:
+                row[i] = (row[i] + up) & 0xFF
+            elif kind == 3:
+                row[i] = (row[i] + ((left + up) >> 1)) & 0xFF
+            elif kind == 4:
+                upleft = prev[i - bpp] if i >= bpp else 0
+                p = left + up - upleft
+                pa, pb, pc = abs(p - left), abs(p - up), abs(p - upleft)
+                pred = left if pa <= pb and pa <= pc else up if pb <= pc else upleft
+                row[i] = (row[i] + pred) & 0xFF
+        out.extend(row)
+        prev = row
+    return bytes(out)
+
+
+_PDF_SKIP = re.compile(br'(?:[ \t\n\r\f\x00]+|%[^\r\n]*)+')
+_PDF_NUMBER = re.compile(br'[+-]?(?:\d+\.?\d*|\.\d+)')
+_PDF_REF = re.compile(br'[ \t\n\r\f\x00]+(\d+)[ \t\n\r\f\x00]+R(?![^ \t\n\r\f\x00()<>\[\]{}/%])')
+_PDF_NAME = re.compile(br'/([^ \t\n\r\f\x00()<>\[\]{}/%]*)')
+_PDF_KEYWORD = re.compile(br'[A-Za-z\'"*]+')
+_PDF_HEX = re.compile(br'<([0-9A-Fa-f \t\n\r\f\x00]*)>')
+_PDF_OBJ = re.compile(br'\s*(\d+)\s+(\d+)\s+obj')
+_PDF_OBJ_END = re.compile(br'(?<![A-Za-z/#])(?:stream|endobj)(?![A-Za-z])')
+_PDF_ESCAPES = {b'n': b'\n', b'r': b'\r', b't': b'\t', b'b': b'\b', b'f': b'\f'}
+
+
+class _Truncated(Exception):
+    ''' The buffer ended before the object did. '''
+
+
+def _skip(buf, pos):
+    m = _PDF_SKIP.match(buf, pos)
+    return m.end() if m else pos
+
+
+def _parse_string(buf, pos):
+    ''' Parse a literal string starting after its opening parenthesis. '''
+    out = bytearray()
+    depth = 1
+    end = len(buf)
+    while pos < end:
+        c = buf[pos:pos + 1]
+        if c == b'\\':
+            n = buf[pos + 1:pos + 2]
+            if n in _PDF_ESCAPES:
+                out.extend(_PDF_ESCAPES[n])
+                pos += 2
+            elif n == b'\r':
+                pos += 3 if buf[pos + 2:pos + 3] == b'\n' else 2
+            elif n == b'\n':
+                pos += 2
+            elif n.isdigit():
+                m = re.compile(br'[0-7]{1,3}').match(buf, pos + 1)
+                out.append(int(m.group(), 8) & 0xFF)
+                pos = m.end()
+            else:
+                out.extend(n)
+                pos += 2
+            continue
+        if c == b'(':
+            depth += 1
+        elif c == b')':
+            depth -= 1
+            if not depth:
+                return PdfString(bytes(out)), pos + 1
+        out.extend(c)
+        pos += 1
+    raise _Truncated
+
+
+def _parse_name(raw):
+    return PdfName(re.sub(br'#([0-9A-Fa-f]{2})', lambda m: bytes(bytearray([int(m.group(1), 16)])),
+                          raw).decode('latin-1'))
+
+
+def parse_object(buf, pos=0):
+    '''
+    Parse one PDF object from buf at pos and return (object, end position).
+    Stream data is not handled here; see PdfReader.
+    '''
+    pos = _skip(buf, pos)
+    if pos >= len(buf):
+        raise _Truncated
+    c = buf[pos:pos + 1]
+    if c == b'/':
+        m = _PDF_NAME.match(buf, pos)
+        return _parse_name(m.group(1)), m.end()
+    if c == b'<':
+        if buf[pos + 1:pos + 2] == b'<':
+            result = {}
+            pos += 2
+            while True:
+                pos = _skip(buf, pos)
+                if buf[pos:pos + 2] == b'>>':
+                    return result, pos + 2
+                if pos >= len(buf):
+                    raise _Truncated
+                key, pos = parse_object(buf, pos)
+                value, pos = parse_object(buf, pos)
+                result[key] = value
+        m = _PDF_HEX.match(buf, pos)
+        if not m:
+            raise _Truncated
+        digits = re.sub(br'[^0-9A-Fa-f]', b'', m.group(1))
+        if len(digits) % 2:
+            digits += b'0'
+        return PdfString(binascii.unhexlify(digits)), m.end()
+    if c == b'[':
+        result = []
+        pos += 1
+        while True:
+            pos = _skip(buf, pos)
+            if buf[pos:pos + 1] == b']':
+                return result, pos + 1
+            if pos >= len(buf):
+                raise _Truncated
+            value, pos = parse_object(buf, pos)
+            result.append(value)
+    if c == b'(':
+        return _parse_string(buf, pos + 1)
+    m = _PDF_NUMBER.match(buf, pos)
+    if m:
+        raw = m.group()
+        if b'.' in raw:
+            return float(raw), m.end()
+        ref = _PDF_REF.match(buf, m.end())
+        if ref:
+            return PdfRef(int(raw), int(ref.group(1))), ref.end()
+        return int(raw), m.end()
+    m = _PDF_KEYWORD.match(buf, pos)
+    if m:
+        word = m.group()
+        if word == b'true':
+            return True, m.end()
+        if word == b'false':
+            return False, m.end()
+        if word == b'null':
+            return None, m.end()
+        raise PdfError('Unexpected keyword %r at offset %s.' % (word, pos))
+    raise PdfError('Unexpected character %r at offset %s.' % (c, pos))
+
+
+def serialize_object(obj, remap=None):
+    '''
+    Serialize obj as PDF syntax. If given, remap(ref) must return the
+    object number to write in place of each indirect reference.
+    '''
+    if obj is True:
+        return b'true'
+    if obj is False:
+        return b'false'
+    if obj is None:
+        return b'null'
+    if isinstance(obj, PdfRef):
+        return ('%d 0 R' % (remap(obj) if remap else obj.num)).encode('ascii')
+    if isinstance(obj, PdfName):
+        raw = obj.encode('latin-1')
+        return b'/' + re.sub(br'[^!-~]|[()<>\[\]{}/%#]',
+                             lambda m: ('#%02X' % bytearray(m.group())[0]).encode('ascii'), raw)
+    if isinstance(obj, PdfString):
+        return b'<' + binascii.hexlify(obj) + b'>'
+    if isinstance(obj, int) or type(obj).__name__ == 'long':
+        return str(obj).encode('ascii')
+    if isinstance(obj, float):
+        return (('%.6f' % obj).rstrip('0').rstrip('.') or '0').encode('ascii')
+    if isinstance(obj, dict):
+        return b'<<' + b' '.join(serialize_object(PdfName(k)) + b' ' + serialize_object(v, remap)
+                                 for k, v in obj.items()) + b'>>'
+    if isinstance(obj, (list, tuple)):
+        return b'[' + b' '.join(serialize_object(v, remap) for v in obj) + b']'
+    raise PdfError('Cannot serialize %r.' % (obj,))
+
+
+class PdfReader(object):
+    '''
+    A minimal PDF reader which loads only the cross-reference data up front
+    and parses objects on demand. Supports classic xref tables, xref streams
+    and object streams (FlateDecode only). Encrypted files are not supported.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.file = io.open(path, 'rb')
+        self.xref = {}
+        self._objstm = OrderedDict()
+        try:
+            self.trailer = self._read_xrefs()
+        except Exception:
+            self.file.close()
+            raise
+        if 'Encrypt' in self.trailer:
+            self.file.close()
+            raise PdfError('Encrypted PDF files are not supported: %s' % path)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _read_at(self, offset, size):
+        self.file.seek(offset)
+        return self.file.read(size)
+
+    def _read_xrefs(self):
+        self.file.seek(0, io.SEEK_END)
+        size = self.file.tell()
+        tail = self._read_at(max(size - 2048, 0), 2048)
+        i = tail.rfind(b'startxref')
+        if i < 0:
+            raise PdfError('No startxref found; the file may be truncated: %s' % self.path)
+        offset = int(re.compile(br'startxref\s+(\d+)').match(tail, i).group(1))
+        trailer = None
+        seen = set()
+        while offset is not None and offset not in seen:
+            seen.add(offset)
+            head = self._read_at(offset, 4)
+            if head == b'xref':
+                section = self._read_xref_table(offset)
+                if isinstance(section.get('XRefStm'), int):
+                    self._read_xref_stream(section['XRefStm'])
+            else:
+                section = self._read_xref_stream(offset)
+            if trailer is None:
+                trailer = section
+            offset = section.get('Prev')
+        return trailer
+
+    def _read_xref_table(self, offset):
+        chunk = 65536
+        while True:
+            buf = self._read_at(offset, chunk)
+            i = buf.find(b'trailer')
+            if i >= 0:
+                try:
+                    trailer, end = parse_object(buf, i + 7)
+                    break
+                except _Truncated:
+                    pass
+            if len(buf) < chunk:
+                raise PdfError('Truncated xref table in %s' % self.path)
+            chunk *= 2
+        lines = re.compile(br'(\d+)[ \t]+(\d+)[ \t]*(?:([nf])[ \t]*)?[\r\n]+').finditer(buf, 4, i)
+        num = 0
+        for m in lines:
+            if m.group(3) is None:
+                # Subsection header: first object number and count
+                num = int(m.group(1))
+                continue
+            if m.group(3) == b'n' and num not in self.xref:
+                self.xref[num] = (1, int(m.group(1)), int(m.group(2)))
+            elif num not in self.xref:
+                self.xref[num] = (0, 0, 0)
+            num += 1
+        return trailer
+
+    def _read_xref_stream(self, offset):
+        stream = self._read_object_at(offset)
+        if not isinstance(stream, PdfStream) or stream.get('Type') != 'XRef':
+            raise PdfError('Invalid cross-reference data in %s' % self.path)
+        widths = stream['W']
+        index = stream.get('Index', [0, stream['Size']])
+        data = bytearray(stream.decode())
+        pos = 0
+        for start, count in zip(index[::2], index[1::2]):
+            for num in range(start, start + count):
+                fields = []
+                for w in widths:
+                    value = 0
+                    for b in data[pos:pos + w]:
+                        value = (value << 8) | b
+                    fields.append(value)
+                    pos += w
+                if not widths[0]:
+                    fields[0] = 1
+                if num not in self.xref:
+                    self.xref[num] = tuple(fields)
+        return stream
+
+    def _read_object_at(self, offset):
+        chunk = 4096
+        while True:
+            buf = self._read_at(offset, chunk)
+            header = _PDF_OBJ.match(buf)
+            if not header:
+                raise PdfError('No object found at offset %s in %s' % (offset, self.path))
+            complete = len(buf) < chunk
+            # Parse the value before looking for the keyword which follows it,
+            # as its strings may contain 'stream' or 'endobj'
+            try:
+                obj, end = parse_object(buf, header.end())
+            except _Truncated:
+                if complete:
+                    raise PdfError('Truncated object at offset %s in %s' % (offset, self.path))
+            else:
+                # The value is only whole once the keyword (and the end of
+                # line after 'stream') is read
+                m = _PDF_OBJ_END.match(buf, _skip(buf, end))
+                if complete or (m and len(buf) - m.end() >= 2):
+                    break
+            chunk *= 4
+        if not (m and m.group() == b'stream' and isinstance(obj, dict)):
+            return obj
+        end = m.end()
+        if buf[end:end + 2] == b'\r\n':
+            end += 2
+        elif buf[end:end + 1] in (b'\n', b'\r'):
+            end += 1
+        length = self.resolve(obj.get('Length'))
+        if not isinstance(length, int):
+            raise PdfError('Invalid stream length at offset %s in %s' % (offset, self.path))
+        return PdfStream(obj, source=(self.file, offset + end, length))
+
+    def _read_from_objstm(self, stmnum, index):
+        if stmnum not in self._objstm:
+            stream = self.get(PdfRef(stmnum))
+            data = stream.decode()
+            header = [int(x) for x in data[:stream['First']].split()]
+            self._objstm[stmnum] = (stream['First'], header, data)
+            if len(self._objstm) > 4:
+                # Keep only a few decoded object streams in memory
+                self._objstm.popitem(last=False)
+        first, header, data = self._objstm[stmnum]
+        obj, end = parse_object(data, first + header[index * 2 + 1])
+        return obj
+
+    def get(self, ref):
+        ''' Return the object for an indirect reference (or None if free). '''
+        entry = self.xref.get(ref[0])
+        if entry is None or entry[0] == 0:
+            return None
+        if entry[0] == 1:
+            return self._read_object_at(entry[1])
+        return self._read_from_objstm(entry[1], entry[2])
+
+    def resolve(self, obj):
+        ''' Resolve obj if it is an indirect reference. '''
+        while isinstance(obj, PdfRef):
+            obj = self.get(obj)
+        return obj
+
+    @property
+    def catalog(self):
+        return self.resolve(self.trailer['Root'])
+
+    def pages(self):
+        '''
+        Return a list of (ref, page) for each page in order. Inheritable
+        attributes are copied from ancestor nodes onto each page.
+        '''
+        result = []
+        inherit = ('Resources', 'MediaBox', 'CropBox', 'Rotate')
+        root = self.catalog['Pages']
+        stack = [(root, {})]
+        seen = set()
+        while stack:
+            ref, inherited = stack.pop()
+            if ref in seen:
+                raise PdfError('Circular page tree in %s' % self.path)
+            seen.add(ref)
+            node = self.resolve(ref)
+            attrs = dict(inherited)
+            attrs.update((k, node[k]) for k in inherit if k in node)
+            if node.get('Type') == 'Pages' or 'Kids' in node:
+                for kid in reversed(self.resolve(node['Kids'])):
+                    stack.append((kid, attrs))
+            else:
+                page = dict(node)
+                for key, value in attrs.items():
+                    page.setdefault(key, value)
+                result.append((ref, page))
+        return result
+
+    def page_count(self):
+        ''' Return the page count given by the root of the page tree. '''
+        return self.resolve(self.resolve(self.catalog['Pages']).get('Count'))
+
+    def page_labels(self):
+        ''' Return a list of (page index, label dict) from the PageLabels number tree. '''
+        labels = []
+        root = self.resolve(self.catalog.get('PageLabels'))
+        stack = [root] if root else []
+        while stack:
+            node = self.resolve(stack.pop())
+            nums = self.resolve(node.get('Nums', []))
+            for index, label in zip(nums[::2], nums[1::2]):
+                labels.append((index, self.resolve(label)))
+            stack.extend(reversed(self.resolve(node.get('Kids', []))))
+        return sorted(labels, key=lambda item: item[0])
+
+    def _named_dests(self):
+        if not hasattr(self, '_dests'):
+            self._dests = {}
+            catalog = self.catalog
+            old = self.resolve(catalog.get('Dests'))
+            if old:
+                for key, value in old.items():
+                    self._dests[key] = value
+            names = self.resolve(catalog.get('Names'))
+            tree = self.resolve(names.get('Dests')) if names else None
+            stack = [tree] if tree else []
+            while stack:
+                node = self.resolve(stack.pop())
+                items = self.resolve(node.get('Names', []))
+                for key, value in zip(items[::2], items[1::2]):
+                    self._dests[key] = value
+                stack.extend(self.resolve(node.get('Kids', [])))
+        return self._dests
+
+    def named_dests(self):
+        '''
+        Return a dict of the name (as bytes) of each named destination of the
+        document to its explicit destination array.
+        '''
+        dests = {}
+        for name, dest in self._named_dests().items():
+            dest = self.resolve(dest)
+            if isinstance(dest, dict):
+                dest = self.resolve(dest.get('D'))
+            if isinstance(dest, list) and dest:
+                dests[name if isinstance(name, bytes) else name.encode('latin-1')] = dest
+        return dests
+
+    def resolve_dest(self, dest):
+        ''' Resolve a (possibly named) destination to an explicit array or None. '''
+        dest = self.resolve(dest)
+        if isinstance(dest, (PdfName, PdfString)):
+            dest = self.resolve(self._named_dests().get(dest))
+        if isinstance(dest, dict):
+            dest = self.resolve(dest.get('D'))
+        return dest if isinstance(dest, list) and dest else None
+
+    def outlines(self):
+        '''
+        Return the document outline (bookmarks) as a list of nodes. Each node
+        is a dict with 'title' (PdfString), 'dest' (explicit destination array
+        or None) and 'children'.
+        '''
+        root = self.resolve(self.catalog.get('Outlines'))
+        seen = set()
+
+        def walk(ref):
+            nodes = []
+            while isinstance(ref, PdfRef) and ref not in seen:
+                seen.add(ref)
+                item = self.resolve(ref)
+                dest = item.get('Dest')
+                action = self.resolve(item.get('A'))
+                if dest is None and isinstance(action, dict) and action.get('S') == 'GoTo':
+                    dest = action.get('D')
+                nodes.append({
+                    'title':    self.resolve(item.get('Title', PdfString(b''))),
+                    'dest':     self.resolve_dest(dest) if dest is not None else None,
+                    'children': walk(item.get('First'))
+                })
+                ref = item.get('Next')
+            return nodes
+
+        return walk(root.get('First')) if root else []
+
+
+class PdfWriter(object):
+    '''
+    Writes a PDF file one object at a time. Only the offset of each object
+    is kept in memory.
+    '''
+    def __init__(self, fileobj):
+        self.file = fileobj
+        self.offsets = [None]
+        self.file.write(b'%PDF-1.7\n%\xe2\xe3\xcf\xd3\n')
+
+    def allocate(self):
+        ''' Reserve and return a new object number. '''
+        self.offsets.append(None)
+        return len(self.offsets) - 1
+
+    def write(self, num, obj, remap=None):
+        ''' Write obj (which may be a PdfStream) as object number num. '''
+        self.offsets[num] = self.file.tell()
+        self.file.write(('%d 0 obj\n' % num).encode('ascii'))
+        if isinstance(obj, PdfStream):
+            header = dict(obj)
+            header['Length'] = obj.source[2] if obj.source else len(obj.read())
+            self.file.write(serialize_object(header, remap) + b'\nstream\n')
+            for chunk in obj.chunks():
+                self.file.write(chunk)
+            self.file.write(b'\nendstream')
+        else:
+            self.file.write(serialize_object(obj, remap))
+        self.file.write(b'\nendobj\n')
+
+    def write_raw(self, num, data):
+        ''' Write already serialized data as object number num. '''
+        self.offsets[num] = self.file.tell()
+        self.file.write(('%d 0 obj\n' % num).encode('ascii') + data + b'\nendobj\n')
+
+    def close(self, root, info=None):
+        ''' Write the cross-reference table and trailer. '''
+        start = self.file.tell()
+        self.file.write(('xref\n0 %d\n' % len(self.offsets)).encode('ascii'))
+        self.file.write(b'0000000000 65535 f \n')
+        for offset in self.offsets[1:]:
+            self.file.write(('%010d 00000 n \n' % (offset or 0)).encode('ascii'))
+        trailer = {'Size': len(self.offsets), 'Root': PdfRef(root)}
+        if info:
+            trailer['Info'] = PdfRef(info)
+        self.file.write(b'trailer\n' + serialize_object(trailer) + b'\n')
+        self.file.write(('startxref\n%d\n%%%%EOF\n' % start).encode('ascii'))
+
+
+def merge_pdfs(sources, output):
+    '''
+    Merge PDF files into a single PDF at output, copying one object at a
+    time so that memory use does not depend on the size of the documents.
+
+    Each item in sources is either a path or a (path, title) tuple and may be
+    produced lazily (a generator). Bookmarks, page labels and named
+    destinations of each source are preserved. When a title is given, the
+    source gets a top-level bookmark with its own bookmarks nested beneath
+    it. Links to named destinations are made explicit, as two sources may
+    use the same names; the names of the first source to use each are kept.
+
+    Returns the total page count.
+    '''
+    with io.open(output, 'wb') as f:
+        writer = PdfWriter(f)
+        pages_root = writer.allocate()
+        kids = []
+        labels = []
+        has_labels = False
+        outlines = []
+        dests = {}
+        for source in sources:
+            path, title = source if isinstance(source, tuple) else (source, None)
+            with PdfReader(path) as reader:
+                pages = reader.pages()
+                remap = dict((ref, writer.allocate()) for ref, page in pages)
+                pending = []
+
+                def lookup(ref):
+                    if ref not in remap:
+                        remap[ref] = writer.allocate()
+                        pending.append(ref)
+                    return remap[ref]
+
+                def explicit_links(obj):
+                    ''' Replace the named destination of a link annotation or GoTo action in obj. '''
+                    for holder, key in ((obj, 'Dest'), (obj, 'D'), (obj.get('A'), 'D')):
+                        if not isinstance(holder, dict) or not isinstance(holder.get(key), (PdfName, PdfString)):
+                            continue
+                        if key == 'D' and holder.get('S') != 'GoTo':
+                            continue
+                        dest = reader.resolve_dest(holder[key])
+                        if dest and dest[0] in remap:
+                            holder[key] = dest
+
+                def flush():
+                    while pending:
+                        ref = pending.pop()
+                        obj = reader.get(ref)
+                        if isinstance(obj, dict) and obj.get('Type') in ('Pages', 'Catalog'):
+                            # Never pull in another page tree via a stray reference
+                            obj = None
+                        if isinstance(obj, dict):
+                            explicit_links(obj)
+                        writer.write(remap[ref], obj, lookup)
+
+                for ref, page in pages:
+                    for key in ('Parent', 'StructParents', 'B', 'PieceInfo'):
+                        page.pop(key, None)
+                    page['Parent'] = PdfRef(pages_root)
+                    for annot in reader.resolve(page.get('Annots')) or []:
+                        if isinstance(annot, dict):
+                            explicit_links(annot)
+                    writer.write(remap[ref], page, lookup)
+                    flush()
+                    kids.append(PdfRef(remap[ref]))
+
+                base = len(kids) - len(pages)
+                source_labels = reader.page_labels()
+                has_labels = has_labels or bool(source_labels)
+                if not source_labels or source_labels[0][0] != 0:
+                    # Continue the physical page numbering
+                    source_labels.insert(0, (0, {'S': PdfName('D'), 'St': base + 1}))
+                for index, label in source_labels:
+                    labels.append(('%d ' % (base + index)).encode('ascii') + serialize_object(label, lookup))
+                for name, dest in reader.named_dests().items():
+                    if name not in dests and dest[0] in remap:
+                        # Serialized while the references of this source can be remapped
+                        dests[name] = serialize_object(dest, lookup)
+                flush()
+
+                def convert(nodes):
+                    result = []
+                    for node in nodes:
+                        dest = node['dest']
+                        if dest and isinstance(dest[0], PdfRef) and dest[0] in remap:
+                            dest = [PdfRef(remap[dest[0]])] + dest[1:]
+                        else:
+                            dest = None
+                        result.append({'title': node['title'], 'dest': dest,
+                                       'children': convert(node['children'])})
+                    return result
+
+                children = convert(reader.outlines())
+                if title is not None:
+                    outlines.append({'title': PdfString.from_text(title),
+                                     'dest': [kids[base], PdfName('Fit')] if pages else None,
+                                     'children': children})
+                else:
+                    outlines.extend(children)
+
+        writer.write(pages_root, {'Type': PdfName('Pages'), 'Kids': kids, 'Count': len(kids)})
+        catalog = {'Type': PdfName('Catalog'), 'Pages': PdfRef(pages_root)}
+        if has_labels:
+            # Labels were serialized as each source was read, with its own remapping
+            catalog['PageLabels'] = PdfRef(writer.allocate())
+            writer.write_raw(catalog['PageLabels'].num, b'<</Nums [' + b' '.join(labels) + b']>>')
+        if dests:
+            tree = writer.allocate()
+            writer.write_raw(tree, b'<</Names [' + b' '.join(serialize_object(PdfString(name)) + b' ' + dests[name]
+                                                            for name in sorted(dests)) + b']>>')
+            catalog['Names'] = {'Dests': PdfRef(tree)}
+        if outlines:
+            catalog['Outlines'] = PdfRef(_write_outlines(writer, outlines))
+            catalog['PageMode'] = PdfName('UseOutlines')
+        root = writer.allocate()
+        writer.write(root, catalog)
+        writer.close(root)
+    return len(kids)
+
+
+def _write_outlines(writer, nodes):
+    ''' Write an outline tree and return the object number of its root. '''
+    root = writer.allocate()
+
+    def write_level(nodes, parent):
+        nums = [writer.allocate() for node in nodes]
+        total = 0
+        for i, node in enumerate(nodes):
+            item = {'Title': node['title'], 'Parent': PdfRef(parent)}
+            if i:
+                item['Prev'] = PdfRef(nums[i - 1])
+            if i + 1 < len(nodes):
+                item['Next'] = PdfRef(nums[i + 1])
+            if node['dest']:
+                item['Dest'] = node['dest']
+            if node['children']:
+                first, last, count = write_level(node['children'], nums[i])
+                item.update(First=PdfRef(first), Last=PdfRef(last), Count=-count)
+                total += count
+            writer.write(nums[i], item)
+        return nums[0], nums[-1], total + len(nodes)
+
+    first, last, count = write_level(nodes, root)
+    writer.write(root, {'Type': PdfName('Outlines'), 'First': PdfRef(first),
+                        'Last': PdfRef(last), 'Count': count})
+    return root
+
+
+class VerificationError(PdfError):
+    ''' Raised when an exported PDF is incomplete or is not what was asked for. '''
+
+
+# How many times to export a PDF which fails verification before giving up.
+# A bad export is usually transient, unlike Word's errors, which are not retried.
+VERIFY_ATTEMPTS = 2
+
+
+# The PDF/A identification of ISO 19005-1 in XMP metadata (as an attribute or an element)
+_PDFA_1 = re.compile(br'pdfaid:part\s*(?:=\s*["\']1["\']|>\s*1\s*<)')
+
+
+def verify_pdf(path, pages=None, pdfa=False):
+    '''
+    Check that the PDF at path was written completely by parsing its
+    trailer and page tree (but no content streams), that it has 'pages'
+    pages if given and, if pdfa, that its metadata claims conformance to
+    ISO 19005-1. Returns the page count or raises a VerificationError. The
+    time taken is recorded in METRICS under 'verify'.
+    '''
+    with METRICS.track('verify'):
+        if not os.path.getsize(path):
+            raise VerificationError('The PDF is empty: %s' % path)
+        try:
+            with PdfReader(path) as pdf:
+                count = len(pdf.pages())
+                declared = pdf.page_count()
+                metadata = pdf.resolve(pdf.catalog.get('Metadata')) if pdfa else None
+                if pdfa and not (isinstance(metadata, PdfStream) and _PDFA_1.search(metadata.decode())):
+                    raise VerificationError('The PDF is not marked as conforming to ISO 19005-1: %s' % path)
+        except VerificationError:
+            raise
+        except (PdfError, KeyError, TypeError, AttributeError, zlib.error) as e:
+            raise VerificationError('The PDF cannot be read (%s): %s' % (e, path))
+        if not count or count != declared:
+            raise VerificationError('The page tree of the PDF has %d pages but counts %s: %s' % (
+                count, declared, path))
+        if pages is not None and count != pages:
+            raise VerificationError('The PDF has %d pages rather than %d: %s' % (count, pages, path))
+    return count
+
+
+def expected_pages(doc, pages=None, range=None):
+    '''
+    Return the number of pages which exporting the pages or range of doc
+    (as for export_fixed_format) should produce, or None if unknown.
+    '''
+    if range == C.wdExportCurrentPage:
+        return 1
+    if range:
+        return None
+    if pages:
+        return pages[1] - pages[0] + 1
+    return doc.ComputeStatistics(C.wdStatisticPages)
+
+
+# =========================================================
+# Backends
+# =========================================================
+#
+# A backend supplies the objects which the commands drive: dispatch()
+# returns the shared Application behind WORD and new_instance() an
+# independent, hidden one for the batch commands. Backends other than COM
+# emulate the part of Word's object model which the commands use (see
+# EmulatedApplication); other calls raise a com_error, so the commands
+# report them as they do Word's errors.
+
+# An HRESULT of DISP_E_EXCEPTION, which is how Word reports its errors
+DISP_E_EXCEPTION = -2147352567
+
+# The LibreOffice filters for the WdSaveFormat values of 'convert'
+SOFFICE_FILTERS = {
+    C.wdFormatDocument:         'MS Word 97',
+    C.wdFormatXMLDocument:      'MS Word 2007 XML',
+    C.wdFormatRTF:              'Rich Text Format',
+    C.wdFormatOpenDocumentText: 'writer8',
+    C.wdFormatHTML:             'HTML (StarWriter)',
+    C.wdFormatFilteredHTML:     'HTML (StarWriter)',
+    C.wdFormatText:             'Text (encoded)',
+    C.wdFormatPDF:              'writer_pdf_Export',
+}
+
+# The LibreOffice character sets for the code pages of ENCODINGS
+SOFFICE_CHARSETS = {
+    65001: 'UTF8',
+    1200:  'UNICODE',
+    1252:  'MS_1252',
+    28591: 'ISO_8859_1',
+    20127: 'ASCII_US',
+}
+
+
+def backend_error(message, source='MSWord-CLI'):
+    ''' Return a com_error of message as Word would raise it. '''
+    return com_error(DISP_E_EXCEPTION, 'Exception occurred.', (0, source, message, None, 0, 0), None)
+
+
+class ComBackend(object):
+    ''' Drives Microsoft Word through COM (Windows only). '''
+    def dispatch(self):
+        if com is None:
+            raise click.ClickException('Microsoft Word is not available on this system.')
+        try:
+            return com.gencache.EnsureDispatch('Word.Application')
+        except com_error as e:
+            raise click.ClickException(e.excepinfo[2])
+        except Exception as e:
+            raise click.ClickException("Unable to load 'Word.Application'.")
+
+    def new_instance(self):
+        if com is None:
+            raise click.ClickException('Microsoft Word is not available on this system.')
+        app = com.DispatchEx('Word.Application')
+        app.Visible = False
+        app.DisplayAlerts = C.wdAlertsNone
+        return app
+
+
+class EmulatedDocuments(object):
+    ''' The Documents collection of an EmulatedApplication. '''
+    def __init__(self, app):
+        self.app = app
+
+    def __iter__(self):
+        return iter(list(self.app.docs))
+
+    def __len__(self):
+        return len(self.app.docs)
+
+    @property
+    def Count(self):
+        return len(self.app.docs)
+
+    def Item(self, index):
+        if isinstance(index, int):
+            if 0 < index <= len(self.app.docs):
+                return self.app.docs[index - 1]
+        else:
+            for doc in self.app.docs:
+                if doc.Name == index:
+                    return doc
+        raise backend_error('The requested member of the collection does not exist.')
+
+    __call__ = Item
+
+    def Open(self, FileName, ConfirmConversions=True, ReadOnly=False, AddToRecentFiles=True, Visible=True,
+             **kwargs):
+        if not os.path.isfile(FileName):
+            raise backend_error("Sorry, we couldn't find your file. (%s)" % FileName)
+        return self.app._opened(self.app.open_document(os.path.abspath(FileName), ReadOnly))
+
+    def Add(self, Template=None, NewTemplate=False, DocumentType=0, Visible=True):
+        if Template and not os.path.isfile(Template):
+            raise backend_error("Sorry, we couldn't find your file. (%s)" % Template)
+        return self.app._opened(self.app.add_document(Template))
+
+
+class EmulatedApplication(object):
+    '''
+    The part of Word's Application object used by the commands, for backends
+    which are not Word. Subclasses implement open_document and add_document
+    to return an EmulatedDocument.
+    '''
+    backend = 'emulated'
+
+    def __init__(self):
+        self.docs = []
+        self.active = None
+        self.Documents = EmulatedDocuments(self)
+        self.Visible = False
+        self.DisplayAlerts = C.wdAlertsNone
+        # Printing is always done in the foreground
+        self.BackgroundPrintingStatus = 0
+        self.untitled = itertools.count(1)
+
+    @property
+    def ActiveDocument(self):
+        if self.active is None:
+            raise backend_error('This command is not available because no document is open.')
+        return self.active
+
+    def _opened(self, doc):
+        self.docs.append(doc)
+        self.active = doc
+        return doc
+
+    def _closed(self, doc):
+        self.docs.remove(doc)
+        if self.active is doc:
+            self.active = self.docs[-1] if self.docs else None
+
+    def Quit(self, SaveChanges=C.wdDoNotSaveChanges, *args):
+        for doc in list(self.docs):
+            doc.Close(SaveChanges)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        raise backend_error('%s is not supported by the %s backend.' % (name, self.backend))
+
+
+class EmulatedDocument(object):
+    '''
+    The part of Word's Document object used by the commands. Subclasses
+    implement save, export, print_out and close.
+    '''
+    def __init__(self, app, path=None):
+        self.app = app
+        self.FullName = path or 'Document%d' % next(app.untitled)
+        self.Saved = True
+        self.TrackRevisions = False
+
+    @property
+    def Name(self):
+        return os.path.basename(self.FullName)
+
+    @property
+    def Path(self):
+        return os.path.dirname(self.FullName)
+
+    def Activate(self):
+        self.app.active = self
+
+    def ComputeStatistics(self, Statistic, IncludeFootnotesAndEndnotes=False):
+        if Statistic != C.wdStatisticPages:
+            raise backend_error('Only the page count is supported by the %s backend.' % self.app.backend)
+        return self.pages()
+
+    def Save(self, NoPrompt=False, OriginalFormat=None):
+        if not self.Path:
+            raise backend_error('The document must be saved with a name first.')
+        self.save(self.FullName, None, None)
+        self.Saved = True
+
+    def SaveAs2(self, FileName, FileFormat=None, LockComments=False, Password='', AddToRecentFiles=True,
+                WritePassword='', ReadOnlyRecommended=False, EmbedTrueTypeFonts=False, SaveNativePictureFormat=False,
+                SaveFormsData=False, SaveAsAOCELetter=False, Encoding=None, **kwargs):
+        FileName = os.path.abspath(FileName)
+        self.save(FileName, FileFormat, Encoding)
+        if FileFormat != C.wdFormatPDF:
+            self.FullName = FileName
+            self.Saved = True
+
+    SaveAs = SaveAs2
+
+    def ExportAsFixedFormat(self, OutputFileName, ExportFormat, OpenAfterExport=False,
+                            OptimizeFor=C.wdExportOptimizeForPrint, Range=C.wdExportAllDocument, From=1, To=1,
+                            Item=C.wdExportDocumentContent, IncludeDocProps=False, KeepIRM=True,
+                            CreateBookmarks=C.wdExportCreateNoBookmarks, DocStructureTags=True,
+                            BitmapMissingFonts=True, UseISO19005_1=False):
+        if Range not in (C.wdExportAllDocument, C.wdExportFromTo):
+            raise backend_error('Only whole documents and page ranges can be exported by the %s backend.'
+                                % self.app.backend)
+        self.export(os.path.abspath(OutputFileName), ExportFormat, dict(
+            OptimizeFor=OptimizeFor, Pages=(From, To) if Range == C.wdExportFromTo else None,
+            Item=Item, IncludeDocProps=IncludeDocProps, CreateBookmarks=CreateBookmarks,
+            DocStructureTags=DocStructureTags, UseISO19005_1=UseISO19005_1
+        ))
+        if OpenAfterExport:
+            click.launch(OutputFileName)
+
+    def PrintOut(self, **options):
+        if options.get('Range', C.wdPrintAllDocument) not in (C.wdPrintAllDocument, C.wdPrintRangeOfPages):
+            raise backend_error('Only whole documents and page ranges can be printed by the %s backend.'
+                                % self.app.backend)
+        self.print_out(options)
+
+    def Close(self, SaveChanges=C.wdPromptToSaveChanges, OriginalFormat=None, RouteDocument=False):
+        if SaveChanges == C.wdSaveChanges and not self.Saved:
+            self.Save()
+        self.close()
+        self.app._closed(self)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        raise backend_error('%s is not supported by the %s backend.' % (name, self.app.backend))
+
+
+class RecordingDocument(EmulatedDocument):
+    ''' A document of a RecordingApplication, which records each call rather than acting on it. '''
+    def pages(self):
+        return self.app.pages
+
+    def save(self, path, fileformat, encoding):
+        self.app.record('save', self.FullName, path=path, format=fileformat, encoding=encoding)
+
+    def export(self, path, format, options):
+        self.app.record('export', self.FullName, path=path, format=format, **options)
+
+    def print_out(self, options):
+        self.app.record('print', self.FullName, **options)
+
+    def close(self):
+        self.app.record('close', self.FullName)
+
+
+class RecordingApplication(EmulatedApplication):
+    '''
+    An in-memory application which writes no files but appends each call
+    to the list calls as (action, document, details), for tests and for
+    benchmarking everything but Word itself. Each document has pages pages.
+    '''
+    backend = 'recording'
+
+    def __init__(self, calls=None, pages=1):
+        super(RecordingApplication, self).__init__()
+        self.calls = [] if calls is None else calls
+        self.pages = pages
+
+    def record(self, action, document, **details):
+        self.calls.append((action, document, details))
+
+    def open_document(self, path, read_only):
+        self.record('open', path, read_only=read_only)
+        return RecordingDocument(self, path)
+
+    def add_document(self, template):
+        doc = RecordingDocument(self)
+        self.record('new', doc.FullName, template=template)
+        return doc
+
+
+class RecordingBackend(object):
+    ''' Records calls in memory (see RecordingApplication); every instance appends to calls. '''
+    def __init__(self):
+        self.calls = []
+        self.app = None
+
+    def dispatch(self):
+        if self.app is None:
+            self.app = RecordingApplication(self.calls)
+        return self.app
+
+    def new_instance(self):
+        return RecordingApplication(self.calls)
+
+
+def uno_properties(**kwargs):
+    ''' Return a tuple of UNO PropertyValues of kwargs. '''
+    return tuple(PropertyValue(Name=name, Value=value) for name, value in sorted(kwargs.items()))
+
+
+class SofficeDocument(EmulatedDocument):
+    ''' A document of a SofficeApplication, which wraps a LibreOffice text document. '''
+    def __init__(self, app, component, path=None):
+        super(SofficeDocument, self).__init__(app, path)
+        self.component = component
+
+    @property
+    def Saved(self):
+        return not self.component.isModified()
+
+    @Saved.setter
+    def Saved(self, value):
+        if 'component' in self.__dict__:
+            self.component.setModified(not value)
+
+    def pages(self):
+        return self.component.getCurrentController().getPropertyValue('PageCount')
+
+    def store(self, path, filter_name, **properties):
+        with self.app.errors():
+            self.component.storeToURL(uno.systemPathToFileUrl(path), uno_properties(
+                FilterName=filter_name, Overwrite=True, **properties))
+
+    def save(self, path, fileformat, encoding):
+        if fileformat is None:
+            with self.app.errors():
+                self.component.store()
+            return
+        if fileformat not in SOFFICE_FILTERS:
+            raise backend_error('This format is not supported by the soffice backend.')
+        properties = {}
+        if fileformat == C.wdFormatText:
+            properties['FilterOptions'] = '%s,CRLF,,' % SOFFICE_CHARSETS.get(encoding, 'UTF8')
+        self.store(path, SOFFICE_FILTERS[fileformat], **properties)
+
+    def export(self, path, format, options):
+        if format != C.wdExportFormatPDF:
+            raise backend_error('Only PDF can be exported by the soffice backend.')
+        data = dict(
+            ExportBookmarks=options['CreateBookmarks'] != C.wdExportCreateNoBookmarks,
+            ExportNotes=options['Item'] == C.wdExportDocumentWithMarkup,
+            UseTaggedPDF=options['DocStructureTags'],
+            SelectPdfVersion=1 if options['UseISO19005_1'] else 0,
+            ReduceImageResolution=options['OptimizeFor'] == C.wdExportOptimizeForOnScreen,
+        )
+        if options['Pages']:
+            data['PageRange'] = '%d-%d' % options['Pages']
+        self.store(path, 'writer_pdf_Export',
+                   FilterData=uno.Any('[]com.sun.star.beans.PropertyValue', uno_properties(**data)))
+
+    def print_out(self, options):
+        properties = dict(CopyCount=options.get('Copies', 1), Collate=options.get('Collate', True), Wait=True)
+        if options.get('Pages'):
+            properties['Pages'] = options['Pages']
+        if options.get('PrintToFile'):
+            properties['FileName'] = uno.systemPathToFileUrl(os.path.abspath(options['OutputFileName']))
+        with self.app.errors():
+            # print is a keyword in Python 2
+            getattr(self.component, 'print')(uno_properties(**properties))
+
+    def close(self):
+        with self.app.errors():
+            self.component.close(True)
+
+
+class SofficeApplication(EmulatedApplication):
+    '''
+    Drives the text documents of a LibreOffice listener through UNO. If
+    process is given, the listener is this instance's own and is stopped
+    (and its profile removed) on Quit.
+    '''
+    backend = 'soffice'
+
+    def __init__(self, desktop, process=None, profile=None):
+        super(SofficeApplication, self).__init__()
+        self.desktop = desktop
+        self.process = process
+        self.profile = profile
+
+    @contextmanager
+    def errors(self):
+        ''' Raise the UNO exceptions of LibreOffice as com_errors. '''
+        try:
+            yield
+        except uno.getClass('com.sun.star.uno.Exception') as e:
+            raise backend_error(e.Message or e.__class__.__name__, 'LibreOffice')
+
+    def load(self, url, **properties):
+        with self.errors():
+            component = self.desktop.loadComponentFromURL(url, '_blank', 0, uno_properties(Hidden=True,
+                                                                                         **properties))
+        if component is None:
+            raise backend_error('LibreOffice was unable to open the document.', 'LibreOffice')
+        return component
+
+    def open_document(self, path, read_only):
+        return SofficeDocument(self, self.load(uno.systemPathToFileUrl(path), ReadOnly=read_only), path)
+
+    def add_document(self, template):
+        if template:
+            component = self.load(uno.systemPathToFileUrl(os.path.abspath(template)), AsTemplate=True)
+        else:
+            component = self.load('private:factory/swriter')
+        return SofficeDocument(self, component)
+
+    def Quit(self, SaveChanges=C.wdDoNotSaveChanges, *args):
+        super(SofficeApplication, self).Quit(SaveChanges)
+        if self.process is not None:
+            try:
+                self.desktop.terminate()
+            except Exception:
+                # The listener may already be gone
+                pass
+            try:
+                self.process.wait(10)
+            except Exception:
+                self.process.kill()
+            shutil.rmtree(self.profile, ignore_errors=True)
+            self.process = None
+
+
+class SofficeBackend(object):
+    '''
+    Drives a headless LibreOffice through UNO. The shared application
+    connects to a listener at MSW_SOFFICE_PORT (starting one, which outlives
+    msw, if none is running) so that no process is started per document.
+    Batch instances each start their own listener with its own profile.
+    '''
+    def __init__(self, program=None, host='127.0.0.1', port=None, timeout=60):
+        self.program = program or os.environ.get('MSW_SOFFICE', 'soffice')
+        self.host = host
+        self.port = int(port or os.environ.get('MSW_SOFFICE_PORT', 2002))
+        self.timeout = timeout
+
+    def start(self, port, profile=None):
+        ''' Start a headless listener on port and return its process. '''
+        import subprocess
+        args = [self.program, '--headless', '--invisible', '--nologo', '--norestore', '--nodefault',
+                '--accept=socket,host=%s,port=%d;urp;StarOffice.ComponentContext' % (self.host, port)]
+        if profile:
+            args.append('-env:UserInstallation=%s' % uno.systemPathToFileUrl(profile))
+        try:
+            return subprocess.Popen(args, stdin=subprocess.DEVNULL if hasattr(subprocess, 'DEVNULL') else None)
+        except OSError as e:
+            raise click.ClickException('Unable to start LibreOffice (%s): %s' % (self.program, e))
+
+    def connect(self, port, process=None):
+        ''' Return the Desktop of the listener on port, waiting for it to start if process is given. '''
+        local = uno.getComponentContext()
+        resolver = local.ServiceManager.createInstanceWithContext('com.sun.star.bridge.UnoUrlResolver', local)
+        url = 'uno:socket,host=%s,port=%d;urp;StarOffice.ComponentContext' % (self.host, port)
+        deadline = time.time() + self.timeout
+        while True:
+            try:
+                context = resolver.resolve(url)
+                return context.ServiceManager.createInstanceWithContext('com.sun.star.frame.Desktop', context)
+            except uno.getClass('com.sun.star.connection.NoConnectException'):
+                if process is None or process.poll() is not None or time.time() > deadline:
+                    raise click.ClickException('Unable to connect to LibreOffice on port %d.' % port)
+                time.sleep(0.25)
+
+    def dispatch(self):
+        if uno is None:
+            raise click.ClickException('LibreOffice (with its Python UNO bridge) is not available on this system.')
+        try:
+            return SofficeApplication(self.connect(self.port))
+        except click.ClickException:
+            # Not running: start the persistent listener
+            return SofficeApplication(self.connect(self.port, self.start(self.port)))
+
+    def new_instance(self):
+        if uno is None:
+            raise click.ClickException('LibreOffice (with its Python UNO bridge) is not available on this system.')
+        sock = socket.socket()
+        sock.bind((self.host, 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        profile = tempfile.mkdtemp(prefix='msw-soffice-')
+        process = self.start(port, profile)
+        try:
+            return SofficeApplication(self.connect(port, process), process, profile)
+        except click.ClickException:
+            process.kill()
+            shutil.rmtree(profile, ignore_errors=True)
+            raise
+
+
+# The backends of '--backend', by name. Plugins add others with 'msw.backend'
+# entry points which load a class like these.
+BACKENDS = OrderedDict([
+    ('com', ComBackend),
+    ('recording', RecordingBackend),
+    ('soffice', SofficeBackend),
+])
+
+with PROFILER.phase('plugins'):
+    for plugin in iter_entry_points(group='msw.backend'):
+        BACKENDS[plugin.name] = plugin.load()
+
+BACKEND = ComBackend()
+
+
+def set_backend(name):
+    '''
+    Make the backend called name the one which WORD and new_instance use,
+    discarding the application of the previous backend. Returns it.
+    '''
+    global BACKEND
+    if not isinstance(BACKEND, BACKENDS[name]):
+        BACKEND = BACKENDS[name]()
+        if isinstance(WORD, Application):
+            object.__setattr__(WORD, '_app', None)
+    return BACKEND
+
+
+# =========================================================
+# Parallel Word instances
+# =========================================================
+
+# HRESULTs which indicate that a Word instance has died or hung up
+RPC_ERRORS = (
+    -2147023174,  # 0x800706BA: The RPC server is unavailable.
+    -2147023170,  # 0x800706BE: The remote procedure call failed.
+    -2147417848,  # 0x80010108: The object invoked has disconnected from its clients.
+)
+
+
+def new_instance():
+    '''
+    Return a new, hidden instance of Word which is independent of WORD and
+    will not display alerts. Must be called from a thread which has
+    initialized COM.
+    '''
+    return BACKEND.new_instance()
+
+
+def error_message(e):
+    ''' Return a message suitable for display from an exception. '''
+    if isinstance(e, com_error):
+        try:
+            return e.excepinfo[2] or e.args[1]
+        except (IndexError, TypeError):
+            return e.args[1] if len(e.args) > 1 else str(e)
+    return str(e) or e.__class__.__name__
+
+
+class WordExecutor(object):
+    '''
+    Runs functions on up to 'size' dedicated threads, each of which
+    initializes COM and drives its own hidden instance of Word created by
+    'factory' when first needed. A thread whose instance dies is given a
+    fresh one. Use as a context manager or call shutdown() when done.
+    '''
+    def __init__(self, size=1, factory=None):
+        self.size = max(size, 1)
+        self.factory = factory or new_instance
+        self._jobs = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._shutdown = False
+
+    def submit(self, func, *args, **kwargs):
+        '''
+        Schedule func(app, *args, **kwargs) to run with one of the instances
+        of Word and return a concurrent.futures.Future of its result.
+        '''
+        future = futures.Future()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError('Cannot submit to an executor which has been shut down.')
+            self._jobs.put((future, func, args, kwargs))
+            if len(self._threads) < self.size:
+                thread = threading.Thread(target=self._worker)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+        METRICS.set('msw_queue_depth', self._jobs.qsize())
+        return future
+
+    def _worker(self):
+        if pythoncom is not None:
+            pythoncom.CoInitialize()
+        app = None
+        try:
+            while True:
+                job = self._jobs.get()
+                if job is None:
+                    break
+                future, func, args, kwargs = job
+                METRICS.set('msw_queue_depth', self._jobs.qsize())
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    if app is None:
+                        app = self.factory()
+                    future.set_result(func(app, *args, **kwargs))
+                except Exception as e:
+                    if isinstance(e, com_error) and e.args and e.args[0] in RPC_ERRORS:
+                        METRICS.inc('msw_word_restarts_total')
+                        app = None
+                    future.set_exception(e)
+        finally:
+            if app is not None:
+                try:
+                    app.Quit(C.wdDoNotSaveChanges)
+                except com_error:
+                    pass
+            if pythoncom is not None:
+                pythoncom.CoUninitialize()
+
+    def shutdown(self, wait=True):
+        '''
+        Stop the threads (and quit their instances of Word) once the jobs
+        already submitted are done. Waits for them if wait is True.
+        '''
+        with self._lock:
+            if not self._shutdown:
+                self._shutdown = True
+                for thread in self._threads:
+                    self._jobs.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
+            METRICS.set('msw_queue_depth', 0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+
+class WordPool(object):
+    '''
+    Runs jobs in parallel on 'size' worker threads, each of which drives its
+    own hidden instance of Word created by 'factory'. A worker whose instance
+    dies is given a fresh one.
+    '''
+    def __init__(self, size=1, factory=None):
+        self.size = max(size, 1)
+        self.factory = factory
+
+    def imap(self, func, items):
+        '''
+        Call func(app, item) for each item and yield (item, result, error)
+        tuples in the order of items as soon as each is available. Exactly one
+        of result and error is set.
+        '''
+        items = list(items)
+        with WordExecutor(min(self.size, len(items)), self.factory) as executor:
+            results = [executor.submit(func, item) for item in items]
+            for item, future in zip(items, results):
+                error = future.exception()
+                yield item, None if error is not None else future.result(), error
+
+
+class Batch(object):
+    '''
+    Runs a job for each of many items on a WordPool, echoing the outcome of
+    each as it completes and recording it in METRICS under 'command'.
+    Failures are collected in 'failures' rather than aborting the batch.
+    Successes are only echoed if verbose is True. A job which raises a
+    VerificationError is run again (up to VERIFY_ATTEMPTS times).
+    '''
+    def __init__(self, command, jobs=1, factory=None, verbose=True):
+        self.command = command
+        self.verbose = verbose
+        self.pool = WordPool(jobs, factory)
+        self.failures = []
+        self.completed = 0
+
+    def run(self, func, items, describe=None):
+        '''
+        Call func(app, item) for each item and yield (item, result) for each
+        success in the order of items. describe(item) names an item in output.
+        '''
+        describe = describe or (lambda item: item)
+        items = list(items)
+
+        def tracked(app, item):
+            with METRICS.track(self.command):
+                for attempt in itertools.count(1):
+                    try:
+                        return func(app, item)
+                    except VerificationError as e:
+                        if attempt == VERIFY_ATTEMPTS:
+                            raise
+                        click.echo('Retrying %s: %s' % (describe(item), e), err=True)
+
+        for i, (item, result, error) in enumerate(self.pool.imap(tracked, items), start=1):
+            if error is None:
+                self.completed += 1
+                if self.verbose:
+                    click.echo('[%d/%d] %s' % (i, len(items), describe(item)))
+                yield item, result
+            else:
+                self.failures.append((item, error))
+                click.echo('[%d/%d] Failed: %s: %s' % (i, len(items), describe(item), error_message(error)),
+                           err=True)
+
+    def check(self):
+        ''' Raise a ClickException if any item failed. '''
+        if self.failures:
+            raise click.ClickException('%d of %d documents failed.' % (
+                len(self.failures), len(self.failures) + self.completed))
+
+
+def check_destinations(pairs):
+    '''
+    Raise a UsageError if two of the (source, destination) pairs would be
+    written to the same destination, as documents with the same name in
+    different directories would be.
+    '''
+    seen = {}
+    for src, dest in pairs:
+        key = os.path.normcase(os.path.abspath(dest))
+        if key in seen:
+            raise click.UsageError('"%s" and "%s" would both be written to "%s".' % (seen[key], src, dest))
+        seen[key] = src
+
+
+def split_range(frm, to, count):
+    '''
+    Split the page range frm-to into count contiguous ranges of near equal
+    size. Returns a list of (frm, to) tuples (fewer if there are fewer pages).
+    '''
+    pages = to - frm + 1
+    count = max(min(count, pages), 1)
+    size, extra = divmod(pages, count)
+    ranges = []
+    for i in range(count):
+        end = frm + size + (1 if i < extra else 0) - 1
+        ranges.append((frm, end))
+        frm = end + 1
+    return ranges
+
+
+def export_shard(app, shard):
+    '''
+    Export pages frm-to of the document at src to path in app. The document
+    is opened read-only and hidden and closed again without saving.
+    '''
+    src, (frm, to), path, options = shard
+    doc = app.Documents.Open(FileName=src, ReadOnly=True, Visible=False, AddToRecentFiles=False)
+    try:
+        doc.ExportAsFixedFormat(OutputFileName=path, Range=C.wdExportFromTo, From=frm, To=to, **options)
+    finally:
+        doc.Close(C.wdDoNotSaveChanges)
+    return path
+
+
+def export_sharded(doc, path, shards, options, pages=None, factory=None):
+    '''
+    Export the saved document doc to the PDF at path by splitting its pages into
+    shards which are exported in parallel on separate instances of Word and
+    then merged. If given, pages is a (frm, to) tuple limiting the export.
+    '''
+    frm, to = pages or (1, doc.ComputeStatistics(C.wdStatisticPages))
+    ranges = split_range(frm, to, shards)
+    tmpdir = tempfile.mkdtemp(prefix='msw-')
+    try:
+        jobs = [(doc.FullName, r, os.path.join(tmpdir, '%04d.pdf' % i), options)
+                for i, r in enumerate(ranges)]
+        batch = Batch('export_shard', len(ranges), factory)
+        parts = [part for job, part in batch.run(export_shard, jobs, lambda job: 'Pages %s-%s' % job[1])]
+        batch.check()
+        try:
+            merge_pdfs(parts, path)
+        except (PdfError, EnvironmentError) as e:
+            raise click.ClickException('Unable to merge exported pages: %s' % e)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+# =========================================================
+# Library API
+# =========================================================
+#
+# Plain functions on explicit Application and Document handles, which the
+# commands below wrap, for use from other Python code. AsyncWord runs them
+# (or any other function of an Application) for an asyncio event loop.
+
+def open_document(app, path, visible=True):
+    ''' Open the document at path in app and return it. '''
+    return app.Documents.Open(FileName=path, Visible=visible)
+
+
+def new_document(app, template=None, visible=True):
+    ''' Create a new document in app, from the template at path template if given, and return it. '''
+    if template:
+        return app.Documents.Add(template, Visible=visible)
+    return app.Documents.Add(Visible=visible)
+
+
+def show_word(app):
+    ''' Make app visible if it is hidden (leaving it as is otherwise). '''
+    if not app.Visible:
+        app.Visible = True
+
+
+def export_path(doc, path, format=C.wdExportFormatPDF):
+    '''
+    Return the file to export doc to for path, which may be a directory (to
+    use the name of the document) or lack an extension (to use the format's).
+    '''
+    if os.path.isdir(path):
+        path = os.path.join(path, os.path.splitext(doc.Name)[0])
+    if os.path.splitext(path)[1].lower() not in ['.pdf', '.xps']:
+        path += '.pdf' if format == C.wdExportFormatPDF else '.xps'
+    return path
+
+
+def export_fixed_format(doc, path, options=None, pages=None, range=None, show=False):
+    '''
+    Export doc to path as PDF or XPS with options (see export_options; by
+    default a PDF for print). pages is a (from, to) tuple of the pages to
+    export and range a WdExportRange which overrides it. If show is True,
+    the file is opened in its viewer. Returns path.
+    '''
+    if options is None:
+        options = export_options(C.wdExportFormatPDF, C.wdExportOptimizeForPrint, False, False, False,
+                                 C.wdExportCreateNoBookmarks, False, False, False)
+    options = dict(options, OutputFileName=path, OpenAfterExport=show,
+                   Range=range if range else C.wdExportFromTo if pages else C.wdExportAllDocument)
+    if pages and not range:
+        options['From'], options['To'] = pages
+    doc.ExportAsFixedFormat(**options)
+    return path
+
+
+def default_print_options():
+    ''' Return the PrintOut options of the 'print' command without options. '''
+    return print_options(1, None, None, None, 'document_content', False, None, False, '1', '1')
+
+
+def print_out(doc, options=None):
+    ''' Print doc with the PrintOut options (see print_options). '''
+    doc.PrintOut(**(options or default_print_options()))
+
+
+def save_document(doc, path=None, prompt=True):
+    '''
+    Save doc (a Document, or the Documents collection to save them all) to
+    its path, prompting for the names of new documents unless prompt is
+    False. If path is given, the document is saved there instead.
+    '''
+    if path:
+        doc.SaveAs(path)
+    else:
+        doc.Save(NoPrompt=not prompt)
+
+
+def close_document(app, doc, save_changes=C.wdPromptToSaveChanges):
+    '''
+    Close doc (a Document, or the Documents collection to close them all)
+    once any background print jobs have spooled and quit app if no other
+    documents are open. Returns True if app was quit.
+    '''
+    if app.BackgroundPrintingStatus:
+        # Closing before print jobs have spooled can truncate them
+        wait_for_spool(app)
+    doc.Close(save_changes)
+    if not app.Documents.Count:
+        app.Quit()
+        return True
+    return False
+
+
+def list_documents(app):
+    '''
+    Return a list of dicts of the 'index', 'name', 'active' and 'saved'
+    state of each document open in app.
+    '''
+    documents = []
+    for i, doc in enumerate(app.Documents, start=1):
+        documents.append({'index': i, 'name': doc.Name, 'active': app.ActiveDocument == doc,
+                          'saved': bool(doc.Saved)})
+    return documents
+
+
+class AsyncWord(object):
+    '''
+    Runs functions of an Application for an asyncio event loop on 'size'
+    hidden instances of Word (see WordExecutor), so that a coroutine can
+    await many of them at once, for example:
+
+        with AsyncWord(4) as word:
+            await asyncio.gather(*[word.export(src, dest) for src, dest in pairs])
+
+    Each method returns an asyncio future.
+    '''
+    def __init__(self, size=1, factory=None, loop=None):
+        if asyncio is None:
+            raise RuntimeError('AsyncWord requires asyncio (Python 3.4 or later).')
+        self.executor = WordExecutor(size, factory)
+        self.loop = loop
+
+    def run(self, func, *args, **kwargs):
+        ''' Return a future of func(app, *args, **kwargs) run with one of the instances of Word. '''
+        return asyncio.wrap_future(self.executor.submit(func, *args, **kwargs), loop=self.loop)
+
+    def convert(self, src, dest, format='docx', encoding='utf-8'):
+        ''' Convert the document at src to dest in a format and encoding of the 'convert' command. '''
+        return self.run(convert_document, (src, dest, SAVE_FORMATS[format][0], ENCODINGS[encoding]))
+
+    def export(self, src, dest, options=None, pages=None):
+        ''' Export the document at src to dest (see export_fixed_format). '''
+        return self.run(_export_hidden, src, dest, options, pages)
+
+    def print_out(self, src, options=None):
+        ''' Print the document at src in the foreground (see print_out). '''
+        return self.run(print_document, (src, None, options or default_print_options()))
+
+    def close(self):
+        ''' Quit the instances of Word once the functions already run are done. '''
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _export_hidden(app, src, dest, options, pages):
+    doc = open_hidden(app, src)
+    try:
+        return export_fixed_format(doc, dest, options, pages)
+    finally:
+        doc.Close(C.wdDoNotSaveChanges)
+
+
+class Group(click.Group):
+    '''
+    A click.Group which records a profiler phase for each subcommand,
+    including subcommands added by plugins.
+    '''
+    def add_command(self, cmd, name=None):
+        callback = cmd.callback
+        if callback is not None:
+            phase = 'command:%s' % (name or cmd.name)
+            @functools.wraps(callback)
+            def timed(*args, **kwargs):
+                with PROFILER.phase(phase):
+                    return callback(*args, **kwargs)
+            cmd.callback = timed
+        super(Group, self).add_command(cmd, name)
+
+
+@click.group(chain=True, cls=Group)
+@click.option('--version', is_flag=True, callback=print_version,
+              expose_value=False, is_eager=True, 
+              help='Print version info and exit.')
+@click.option('--metrics-file', type=click.Path(dir_okay=False, resolve_path=True),
+              help='Periodically write metrics in Prometheus text format to PATH.')
+@click.option('--metrics-port', type=int,
+              help='Serve metrics in Prometheus text format on localhost at PORT.')
+@click.option('--metrics-interval', type=float, default=15,
+              help='Seconds between writes of the \'--metrics-file\'. Defaults to 15.')
+@click.option('--backend', type=click.Choice(list(BACKENDS)), envvar='MSW_BACKEND',
+              help='Drive Word through COM (the default), LibreOffice (soffice) or an in-memory recording.')
+@click.option('--profile', is_flag=True, envvar='MSW_PROFILE',
+              help='Print the time spent in each phase of the run to stderr on exit.')
+@click.option('--profile-output', type=click.Path(dir_okay=False, resolve_path=True),
+              envvar='MSW_PROFILE_OUTPUT',
+              help='Write cProfile stats for the run to PATH (a .pstats file).')
+@click.pass_context
+def cli(ctx, metrics_file, metrics_port, metrics_interval, backend, profile, profile_output):
+    ''' 
+    Command line interface for Microsoft Word. 
+    
+    Run 'msw <command> --help' to display help for a specific command. 
+
+    Set the MSW_PROFILE and MSW_PROFILE_OUTPUT environment variables rather
+    than '--profile' and '--profile-output' to include import time in the
+    cProfile stats.
+    '''
+    PROFILER.record('parse', PROFILER.last, time.time())
+    if backend:
+        set_backend(backend)
+    if profile_output:
+        PROFILER.enable_profile()
+        ctx.call_on_close(lambda: PROFILER.dump_stats(profile_output))
+    if profile:
+        ctx.call_on_close(lambda: click.echo('\n'.join(PROFILER.report()), err=True))
+    if metrics_file:
+        writer = MetricsWriter(METRICS, metrics_file, metrics_interval)
+        writer.start()
+        ctx.call_on_close(writer.stop)
+    if metrics_port is not None:
+        server = serve_metrics(METRICS, metrics_port)
+        ctx.call_on_close(server.shutdown)
+
+
+@cli.command('open')
+@click.argument('path', type=click.Path(exists=True, resolve_path=True))
+@click.option('--show/--hide', default=True, 
+              help='Display or hide the document.')
+def open(path, show):
+    ''' 
+    Open an existing document and activate. 
+    '''
+    click.echo('Opening document at "%s"' % path)
+    try:
+        with METRICS.track('open'):
+            open_document(WORD, path, show)
+        if show:
+            # Only change state to visible if not visible
+            # otherwise leave Word's visible state as-is
+            show_word(WORD)
+    except com_error as e:
+        raise click.ClickException(e.excepinfo[2])
+
+
+@cli.command('new')
+@click.option('-t', '--template', type=Template(exists=True, dir_okay=False, resolve_path=True), 
+              help='Use template at PATH.')
+@click.option('--show/--hide', default=True, 
+              help='Display or hide the document.')
+def new(template, show):
+    ''' 
+    Create a new document and activate. 
+    
+    When the template path is relative, an attempt will be made to load 
+    the template from the current working directory, and then from the 
+    user and workgroup template directories set in Word's File Options
+    dialog and the directories in the MSW_TEMPLATE_PATH environment
+    variable (including subdirectories). A bare template name (with or
+    without extension) or the end of its path is enough if it is unique.
+    See the 'templates' command. If your template file is in another
+    location, you must specify an absolute path.
+
+    If no template path is provided, a new blank document will be created.
+    '''
+    try:
+        if template:
+            click.echo('Opening new document using template: "%s"' % template)
+        else:
+            click.echo('Opening new blank document.')
+        new_document(WORD, template, show)
+        if show:
+            # Only change state to visible if not visible
+            # otherwise leave Word's visible state as-is
+            show_word(WORD)
+    except com_error as e:
+        raise click.ClickException(e.excepinfo[2])
+
+
+@cli.command('templates')
+@click.argument('name', required=False)
+@click.option('--refresh', is_flag=True,
+              help='Look up the template directories in Word again and rebuild the catalog.')
+def templates(name, refresh):
+    '''
+    List available templates.
+
+    Lists the full path of each template in the user and workgroup template
+    directories set in Word's File Options dialog and the directories in the
+    MSW_TEMPLATE_PATH environment variable. If NAME is given, only the
+    templates which '--template NAME' would match are listed.
+
+    The catalog of templates is cached and is rebuilt automatically when a
+    template is added to or removed from one of the directories. Use
+    '--refresh' after changing the directories in Word.
+    '''
+    catalog = template_catalog(refresh)
+    for path in catalog.find(name) if name else catalog.paths():
+        click.echo(path)
+
+
+PRINT_OUT_ITEMS = OrderedDict([
+    ('document_content',  C.wdPrintDocumentContent),
+    ('doc_with_markup',   C.wdPrintDocumentWithMarkup),
+    ('comments',          C.wdPrintComments),
+    ('properties',        C.wdPrintProperties),
+    ('markup',            C.wdPrintMarkup),
+    ('styles',            C.wdPrintStyles),
+    ('auto_text_entries', C.wdPrintAutoTextEntries),
+    ('key_assignments',   C.wdPrintKeyAssignments),
+    ('envelope',          C.wdPrintEnvelope)
+])
+
+PRINT_OPTIONS = [
+    click.option('-c', '--copies', default=1, help='The number of copies to be printed.'),
+    click.option('-p', '--pages', type=str, help='The page numbers and page ranges '
+                 'to be printed, separated by commas. For example, "2, 6-10" prints '
+                 'page 2 and pages 6 through 10. Ignored if \'--current-page\' or '
+                 '\'--selection\' is specified.'),
+    click.option('--even', 'pagetype', flag_value=C.wdPrintEvenPagesOnly,
+                 help='Print even-numbered pages only.'),
+    click.option('--odd', 'pagetype', flag_value=C.wdPrintOddPagesOnly, 
+                 help='Print odd-numbered pages only.'),
+    click.option('--current-page', 'range', flag_value=C.wdPrintCurrentPage, 
+                 help='Print the current page only.'),
+    click.option('--selection', 'range', flag_value=C.wdPrintSelection, 
+                 help='Print the current selection.'),
+    click.option('--no-collate', is_flag=True, help='Do not collate multiple copies.'),
+    click.option('--to-file', type=click.Path(dir_okay=False, resolve_path=True), 
+                 help='Print document to file at PATH.'),
+    click.option('--append', is_flag=True, help='Append the document to the file specified '
+                 'by the \'--to-file\' option rather than overwriting it.'),
+    click.option('--columns', type=click.Choice(['1', '2', '3', '4']), default='1',
+                 help='The number of pages to fit horizontally on one page. '
+                 'Use with the \'--rows\' option to print multiple pages on a single sheet.'),
+    click.option('--rows', type=click.Choice(['1', '2', '4']), default='1',
+                 help='The number of pages to fit vertically on one page. '
+                 'Use with the \'--columns\' argument to print multiple pages on a single sheet.'),
+    click.option('--item', type=click.Choice(PRINT_OUT_ITEMS.keys()), default='document_content', 
+                 help='The item to be printed. Defaults to \'document_content\'.')
+]
+
+
+def print_out_options(func):
+    '''
+    Decorator which adds the options of the print command to a command.
+    '''
+    for option in reversed(PRINT_OPTIONS):
+        func = option(func)
+    return func
+
+
+def print_options(copies, pages, pagetype, range, item, no_collate, to_file, append, columns, rows):
+    '''
+    Return the keyword arguments for Document.PrintOut from the print options.
+    '''
+    options = {
+        'Background':       True,
+        'Copies':           copies,
+        'Collate':          not no_collate,
+        'Item':             PRINT_OUT_ITEMS[item],
+        'PrintToFile':      False,
+        'PageType':         C.wdPrintAllPages,
+        'Range':            C.wdPrintAllDocument,
+        'PrintZoomColumn':  int(columns),
+        'PrintZoomRow':     int(rows)
+    }
+    if range:
+        options['Range'] = range
+    elif pages:
+        options['Pages'] = pages
+        options['Range'] = C.wdPrintRangeOfPages
+
+    if pagetype:
+        options['PageType'] = pagetype
+
+    if to_file:
+        options['PrintToFile'] = True
+        options['OutputFileName'] = to_file
+        if append:
+            options['Append'] = True
+    return options
+
+
+def wait_for_spool(app, timeout=600, interval=0.5):
+    '''
+    Wait until app has no background print jobs left to spool. Returns False
+    if they are still spooling after timeout seconds.
+    '''
+    deadline = time.time() + timeout
+    while app.BackgroundPrintingStatus:
+        if time.time() > deadline:
+            return False
+        time.sleep(interval)
+    return True
+
+
+@cli.command('print')
+@print_out_options
+def prnt(copies, pages, pagetype, range, item, no_collate, to_file, append, columns, rows):
+    ''' 
+    Print active document to default printer. 
+
+    The options '--pages', '--current-page' and '--selection' are mutualy exclusive.
+    The '--pages' option is ignored if '--current-page' or '--selection' is specified.
+    The last option specified  of '--current-page' or '--selection' will be honored.
+    If none of these options are specified, the entire document is exported.
+
+    The options '--even' and '--odd' are mutualy exclusive. Only the last one specified 
+    will be honored.  If neither is specified, both even and odd pages will be printed.
+    '''
+    click.echo('Printing %s copies of pages: %s' % (copies, pages or 'all'))
+    options = print_options(copies, pages, pagetype, range, item, no_collate, to_file, append, columns, rows)
+    
+    try:
+        with METRICS.track('print'):
+            print_out(WORD.ActiveDocument, options)
+    except com_error as e:
+        raise click.ClickException(e.excepinfo[2])
+
+
+class Spooler(object):
+    '''
+    Prints documents back-to-back in the background in one instance of Word.
+    At most max_pending print jobs are left spooling at once. As Word spools
+    background jobs in the order they were submitted, the oldest documents are
+    closed as BackgroundPrintingStatus drops. 'report' is called with
+    (key, seconds, error) for each document once its job has spooled, where
+    key defaults to the path of the document.
+    '''
+    def __init__(self, app, options, report, max_pending=4, timeout=600, interval=0.5):
+        self.app = app
+        self.options = options
+        self.report = report
+        self.max_pending = max(max_pending, 1)
+        self.timeout = timeout
+        self.interval = interval
+        self.pending = deque()
+
+    def submit(self, src, key=None, output=None):
+        '''
+        Open the document at src hidden and start printing it. If output is
+        given, the document is printed to a new file at that path.
+        '''
+        key = src if key is None else key
+        options = dict(self.options)
+        if output:
+            options.update(PrintToFile=True, OutputFileName=output, Append=False)
+        self.reap(self.max_pending - 1)
+        try:
+            doc = self.app.Documents.Open(FileName=src, ReadOnly=True, Visible=False, AddToRecentFiles=False)
+        except com_error as e:
+            self.report(key, None, e)
+            return
+        start = time.time()
+        try:
+            doc.PrintOut(**options)
+        except com_error as e:
+            doc.Close(C.wdDoNotSaveChanges)
+            self.report(key, None, e)
+            return
+        self.pending.append((key, doc, start))
+
+    def _close(self, error=None):
+        key, doc, start = self.pending.popleft()
+        try:
+            doc.Close(C.wdDoNotSaveChanges)
+        except com_error as e:
+            error = error or e
+        self.report(key, time.time() - start, error)
+
+    def reap(self, limit=0):
+        ''' Close spooled documents until no more than limit are pending. '''
+        while len(self.pending) > limit:
+            for i in range(len(self.pending) - self.app.BackgroundPrintingStatus):
+                self._close()
+            if len(self.pending) > limit:
+                if time.time() - self.pending[0][2] > self.timeout:
+                    self._close(click.ClickException('Timed out waiting for the print job to spool.'))
+                else:
+                    time.sleep(self.interval)
+
+
+def print_documents(app, job):
+    '''
+    Print a chunk of (key, src, output) items in app with a Spooler,
+    returning once all have spooled.
+    '''
+    items, options, report, max_pending, timeout = job
+    spooler = Spooler(app, options, report, max_pending, timeout)
+    for key, src, output in items:
+        spooler.submit(src, key, output)
+    spooler.reap()
+
+
+def spool_batch(items, options, jobs=1, max_pending=4, timeout=600):
+    '''
+    Print (key, src, output) items on jobs instances of Word, reporting the
+    spool time of each. Returns a dict mapping each key to an error or None.
+    '''
+    lock = threading.Lock()
+    results = OrderedDict()
+    srcs = dict((key, src) for key, src, output in items)
+
+    def report(key, seconds, error):
+        with lock:
+            results[key] = error
+            if error is None:
+                METRICS.inc('msw_documents_processed_total', command='print-batch')
+                METRICS.observe('msw_command_duration_seconds', seconds, command='print-batch')
+                click.echo('[%d/%d] Spooled in %.1fs: %s' % (len(results), len(items), seconds, srcs[key]))
+            else:
+                METRICS.inc('msw_failures_total', command='print-batch',
+                            code=error_code(error) if isinstance(error, com_error) else 'unknown')
+                click.echo('[%d/%d] Failed: %s: %s' % (len(results), len(items), srcs[key], error_message(error)),
+                           err=True)
+
+    chunks = [(items[i::jobs], options, report, max_pending, timeout) for i in range(min(jobs, len(items)))]
+    for chunk, result, error in WordPool(jobs).imap(print_documents, chunks):
+        if error is not None:
+            # The instance of Word failed; report whatever was not yet reported
+            for key, src, output in chunk[0]:
+                if key not in results:
+                    report(key, None, error)
+    return results
+
+
+def read_print_index(path):
+    '''
+    Read the index of a print-to-file batch and return a dict of entries by
+    position. A missing or unreadable index is treated as empty.
+    '''
+    entries = {}
+    try:
+        with io.open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    entries[entry['index']] = entry
+    except (EnvironmentError, ValueError, KeyError):
+        pass
+    return entries
+
+
+def concatenate_segments(items, errors, path, append=False):
+    '''
+    Concatenate the segment file of each (index, src, segment) item in order
+    into the file at path with a streaming copy. Items with an error (or no
+    segment file) are left out. Returns the index entries, which record the
+    byte offset and length of each segment in the output.
+    '''
+    entries = []
+    with io.open(path, 'ab' if append else 'wb') as out:
+        out.seek(0, io.SEEK_END)
+        for index, src, segment in items:
+            entry = OrderedDict([('index', index), ('src', src), ('offset', out.tell()), ('length', 0)])
+            error = errors.get(index)
+            if error is None and not os.path.isfile(segment):
+                error = 'No output was printed.'
+            if error is None:
+                with io.open(segment, 'rb') as f:
+                    shutil.copyfileobj(f, out, 1024 * 1024)
+                entry['length'] = out.tell() - entry['offset']
+                entry['status'] = 'ok'
+            else:
+                entry['status'] = 'failed'
+                entry['error'] = error if isinstance(error, type('')) else error_message(error)
+            entries.append(entry)
+    return entries
+
+
+@cli.command('print-batch')
+@click.argument('src', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False, resolve_path=True))
+@print_out_options
+@click.option('-j', '--jobs', type=click.IntRange(1), default=1,
+              help='The number of instances of Word to run in parallel. Defaults to 1.')
+@click.option('--max-pending', type=click.IntRange(1), default=4,
+              help='The number of print jobs each instance of Word may have spooling at once. '
+              'Defaults to 4.')
+@click.option('--timeout', type=float, default=600,
+              help='Seconds to wait for a print job to spool before giving up. Defaults to 600.')
+@click.option('--resume', is_flag=True,
+              help='With \'--to-file\', only reprint documents which failed or changed in the previous run.')
+def print_batch(src, copies, pages, pagetype, range, item, no_collate, to_file, append, columns, rows,
+                jobs, max_pending, timeout, resume):
+    '''
+    Print many documents to default printer.
+
+    Each SRC document is opened read-only in a hidden instance of Word (separate from
+    any documents you have open) and printed in the background. Documents are submitted
+    back-to-back, and each is closed (and Word quit) only once its print job has been
+    spooled. The time each document took to spool is reported.
+
+    With '--to-file', all of the documents are printed, in order, into the one file.
+    Each document is printed to its own segment file (in the directory PATH.segments)
+    in parallel and the segments are then concatenated. The byte offset and length of
+    each document within the file are written to an index at PATH.idx. If any document
+    fails, the segments are kept and a second run with '--resume' only prints the
+    documents which failed or have changed since (by their modification time and
+    size in the index) before concatenating the file again.
+
+    The print options are the same as for the 'print' command. The '--current-page'
+    and '--selection' options do not apply to hidden documents.
+    '''
+    if resume and not to_file:
+        raise click.BadParameter('Requires \'--to-file\'.', param_hint="'--resume'")
+    if resume and append:
+        raise click.BadParameter('Cannot be used with \'--append\'.', param_hint="'--resume'")
+    options = print_options(copies, pages, pagetype, range, item, no_collate, None, False, columns, rows)
+    src_list = list(src)
+    if not to_file:
+        click.echo('Printing %d document(s)...' % len(src_list))
+        errors = spool_batch([(i, path, None) for i, path in enumerate(src_list)],
+                             options, jobs, max_pending, timeout)
+    else:
+        segments = to_file + '.segments'
+        index_path = to_file + '.idx'
+        if not os.path.isdir(segments):
+            os.makedirs(segments)
+        items = [(i, path, os.path.join(segments, '%06d.prn' % i)) for i, path in enumerate(src_list)]
+        previous = read_print_index(index_path) if resume else {}
+        # Taken before printing, so that a document which changes meanwhile is reprinted
+        stats = dict((i, os.stat(path)) for i, path in enumerate(src_list))
+
+        def done(item):
+            entry = previous.get(item[0], {})
+            stat = stats[item[0]]
+            return (entry.get('src') == item[1] and entry.get('status') == 'ok' and
+                    entry.get('mtime') == stat.st_mtime and entry.get('size') == stat.st_size and
+                    os.path.isfile(item[2]) and os.path.getsize(item[2]) == entry.get('length'))
+
+        todo = [item for item in items if not done(item)]
+        click.echo('Printing %d of %d document(s) to "%s"...' % (len(todo), len(items), to_file))
+        errors = spool_batch(todo, options, jobs, max_pending, timeout)
+        entries = concatenate_segments(items, errors, to_file, append)
+        with io.open(index_path, 'w', encoding='utf-8') as f:
+            for entry in entries:
+                entry['mtime'] = stats[entry['index']].st_mtime
+                entry['size'] = stats[entry['index']].st_size
+                f.write(type('')(json.dumps(entry)) + '\n')
+        errors = dict((e['index'], e.get('error')) for e in entries)
+        if all(error is None for error in errors.values()):
+            shutil.rmtree(segments, ignore_errors=True)
+    failures = [key for key, error in errors.items() if error is not None]
+    if failures:
+        message = '%d of %d documents failed.' % (len(failures), len(src_list))
+        if to_file:
+            message += ' Run again with \'--resume\' to print only the failed documents.'
+        raise click.ClickException(message)
+
+
+def export_options(format, optimize, markup, properties, irm, bookmarks, struct, bitmap, useiso19005_1):
+    '''
+    Return the keyword arguments for Document.ExportAsFixedFormat from the
+    export options, other than the output file and range.
+    '''
+    return {
+        'ExportFormat':       format,
+        'OptimizeFor':        optimize,
+        'Item':               C.wdExportDocumentWithMarkup if markup else C.wdExportDocumentContent,
+        'IncludeDocProps':    properties,
+        'KeepIRM':            not irm,
+        'CreateBookmarks':    bookmarks or C.wdExportCreateNoBookmarks,
+        'DocStructureTags':   not struct,
+        'BitmapMissingFonts': not bitmap,
+        'UseISO19005_1':      useiso19005_1
+    }
+
+
+@cli.command('export')
+@click.option('--pdf', 'format', flag_value=C.wdExportFormatPDF, default=True,
+              help="Export document into PDF format. The default.")
+@click.option('--xps', 'format', flag_value=C.wdExportFormatXPS,
+              help='Export document into XML Paper Specification (XPS) format.')
+@click.option('--show', is_flag=True, help='Open the new file in the appropriate viewer after exporting.')
+@click.option('--for-print', 'optimize', flag_value=C.wdExportOptimizeForPrint, default=True,
+              help='Export for print, which is higher quailty and results in a larger file size. '
+              'The default.')
+@click.option('--for-screen', 'optimize', flag_value=C.wdExportOptimizeForOnScreen,
+              help='Export for screen, which is a lower quality and results in a smaller file size.')
+@click.option('--pages', type=str, callback=validate_range, 
+              help='The range of pages to export. For example, "3-6" exports '
+              'pages 3 through 6 and "2-2" exports page 2 only. Ignored if '
+              '\'--current-page\' or \'--selection\' is specified.')
+@click.option('--current-page', 'range', flag_value=C.wdExportCurrentPage, 
+              help='Export the current page only.')
+@click.option('--selection', 'range', flag_value=C.wdExportSelection, 
+              help='Export the current selection.')
+@click.option('--with-markup', 'markup', is_flag=True, help='Export the document with markup.')
+@click.option('--with-props', 'properties', is_flag=True, 
+              help='Include document properties in the newly exported file.')
+@click.option('--without-irm', 'irm', is_flag=True, help='Exclude IRM permissions to an XPS document '
+              'if the source document has IRM protections.')
+@click.option('--with-heading-bookmarks', 'bookmarks', flag_value=C.wdExportCreateHeadingBookmarks,
+              help='Create a bookmark in the exported document for each Microsoft Word heading, which '
+              'includes only headings within the main document and text boxes not within headers, '
+              'footers, endnotes, footnotes, or comments.')
+@click.option('--with-word-bookmarks', 'bookmarks', flag_value=C.wdExportCreateWordBookmarks,
+              help='Create a bookmark in the exported document for each Word bookmark, which includes '
+              'all bookmarks except those contained within headers and footers.')
+@click.option('--without-structure-tags', 'struct', is_flag=True,
+              help='Exclude extra data to help screen readers, for example information about the flow '
+              'and logical organization of the content.')
+@click.option('--without-bitmaped-fonts', 'bitmap', is_flag=True, help='Exclude a bitmap of the text. '
+              'The viewer\'s computer substitutes an appropriate font if the authored one is not '
+              'available. Warning: always inlcude a bitmap when font licenses do not permit a font to '
+              'be embedded in the PDF file.')
+@click.option('--useiso19005-1', is_flag=True, help='Limit PDF usage to the PDF subset standardized '
+              'as ISO 19005-1. If used, the resulting files are more reliably self-contained but may '
+              'be larger or show more visual artifacts due to the restrictions of the format.') 
+@click.option('--shards', type=click.IntRange(1), default=1,
+              help='Split the pages into N ranges which are exported in parallel on separate '
+              'instances of Word and then merged into one file. PDF only. Defaults to 1.')
+@click.option('--verify', is_flag=True,
+              help='Check that the PDF is complete and has the expected number of pages (and, with '
+              '\'--useiso19005-1\', is marked as PDF/A-1), exporting it once more if not. PDF only.')
+@click.argument('path', type=click.Path(dir_okay=True, resolve_path=True))
+def export(path, format, show, optimize, pages, range, markup, properties, irm, bookmarks, struct, bitmap,
+           useiso19005_1, shards, verify):
+    '''
+    Save active document as PDF or XPS format to PATH.
+
+    If PATH points to a directory rather than a file, a new file will be created
+    in that directory using the name of the document. For example:
+
+        somedoc.docx => somedoc.pdf
+
+    A relative path will resolve to the current working directory. You may want to
+    use an absolute path to ensure the document is saved to the correct location.
+
+    The options '--pdf' and '--xps' are mutualy exclusive. Only the last one specified 
+    will be honored.  The default is '--pdf', which will be assumed if neither is specified.
+
+    The options '--pages', '--current-page' and '--selection' are mutualy exclusive.
+    The '--pages' option is ignored if '--current-page' or '--selection' is specified.
+    The last option specified  of '--current-page' or '--selection' will be honored.
+    If none of these options are specified, the entire document is exported.
+
+    The options '--with-heading-bookmarks' and '--with-word-bookmarks' are mutualy exclusive.
+    Only the last one specified will be honored.  If neither is specified, no bookmarks are exported.
+
+    With '--shards', the document is exported from the copy last saved to disk, so any
+    unsaved changes are not included. Bookmarks and page labels are preserved when the
+    shards are merged. The '--current-page' and '--selection' options cannot be sharded.
+
+    With '--verify', the trailer and page tree of the PDF are read back (without
+    its content) to check that it is complete and has as many pages as the
+    document or '--pages' range. The page count of '--selection' is not checked.
+    '''  
+    if verify and format != C.wdExportFormatPDF:
+        raise click.BadParameter('Only PDF exports can be verified.', param_hint="'--verify'")
+    if shards > 1:
+        if format != C.wdExportFormatPDF:
+            raise click.BadParameter('Only PDF exports can be sharded.', param_hint="'--shards'")
+        if range:
+            raise click.BadParameter('The current page or selection cannot be sharded.',
+                                     param_hint="'--shards'")
+    try:
+        doc = WORD.ActiveDocument
+        path = export_path(doc, path, format)
+        click.echo('Exporting to "%s"...' % path)
+        options = export_options(format, optimize, markup, properties, irm, bookmarks, struct, bitmap,
+                                 useiso19005_1)
+
+        if shards > 1:
+            if not doc.Path:
+                raise click.ClickException('The document must be saved before it can be exported in shards.')
+            if not doc.Saved:
+                click.echo('Warning: unsaved changes will not be included in the export.')
+        expected = expected_pages(doc, pages, range) if verify else None
+
+        for attempt in itertools.count(1):
+            with METRICS.track('export'):
+                if shards > 1:
+                    export_sharded(doc, path, shards, options, pages)
+                else:
+                    export_fixed_format(doc, path, options, pages, range, show and not verify)
+            if not verify:
+                break
+            start = time.time()
+            try:
+                count = verify_pdf(path, expected, useiso19005_1)
+            except VerificationError as e:
+                if attempt == VERIFY_ATTEMPTS:
+                    raise click.ClickException(str(e))
+                click.echo('Verification failed: %s. Exporting again...' % e, err=True)
+            else:
+                click.echo('Verified %d page(s) in %.2f seconds.' % (count, time.time() - start))
+                break
+        if show and (shards > 1 or verify):
+            click.launch(path)
+    except com_error as e:
+        raise click.ClickException(e.excepinfo[2])
+
+
+SAVE_FORMATS = OrderedDict([
+    ('docx',          (C.wdFormatXMLDocument,      '.docx')),
+    ('doc',           (C.wdFormatDocument,         '.doc')),
+    ('rtf',           (C.wdFormatRTF,              '.rtf')),
+    ('odt',           (C.wdFormatOpenDocumentText, '.odt')),
+    ('html',          (C.wdFormatHTML,             '.html')),
+    ('filtered-html', (C.wdFormatFilteredHTML,     '.html')),
+    ('txt',           (C.wdFormatText,             '.txt')),
+    ('xml',           (C.wdFormatFlatXML,          '.xml'))
+])
+
+# Windows code pages (msoEncoding values) for the text encodings of '--encoding'
+ENCODINGS = OrderedDict([
+    ('utf-8',    65001),
+    ('utf-16',   1200),
+    ('cp1252',   1252),
+    ('latin-1',  28591),
+    ('ascii',    20127)
+])
+
+
+def convert_document(app, job):
+    '''
+    Open the document at src read-only and hidden in app, save a copy of it
+    to dest in the given format and encoding and close it without prompting.
+    '''
+    src, dest, fileformat, encoding = job
+    doc = app.Documents.Open(FileName=src, ReadOnly=True, Visible=False,
+                             AddToRecentFiles=False, ConfirmConversions=False)
+    try:
+        doc.SaveAs2(FileName=dest, FileFormat=fileformat, Encoding=encoding, AddToRecentFiles=False)
+    finally:
+        doc.Close(C.wdDoNotSaveChanges)
+    return dest
+
+
+@cli.command('convert')
+@click.argument('src', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False, resolve_path=True))
+@click.option('--to', 'fmt', type=click.Choice(SAVE_FORMATS.keys()), default='docx',
+              help='The format to convert to. Defaults to \'docx\'.')
+@click.option('-o', '--out', type=click.Path(file_okay=False, resolve_path=True), required=True,
+              help='The directory to save the converted documents to.')
+@click.option('-e', '--encoding', type=click.Choice(ENCODINGS.keys()), default='utf-8',
+              help='The text encoding of \'txt\' and \'html\' output. Defaults to \'utf-8\'.')
+@click.option('-j', '--jobs', type=click.IntRange(1), default=1,
+              help='The number of instances of Word to run in parallel. Defaults to 1.')
+def convert(src, fmt, out, encoding, jobs):
+    '''
+    Convert documents to another format.
+
+    Each SRC document is opened read-only in a hidden instance of Word (separate
+    from any documents you have open), saved to the '--out' directory in the
+    chosen format and closed. The file extension is set by the format:
+
+        somedoc.doc => OUT/somedoc.docx
+
+    A failure to convert one document does not stop the others; the failures
+    are listed as they happen and the command exits with an error at the end.
+    '''
+    fileformat, ext = SAVE_FORMATS[fmt]
+    items = [(path, os.path.join(out, os.path.splitext(os.path.basename(path))[0] + ext),
+              fileformat, ENCODINGS[encoding]) for path in src]
+    check_destinations(item[:2] for item in items)
+    if not os.path.isdir(out):
+        os.makedirs(out)
+    click.echo('Converting %d document(s) to %s...' % (len(items), fmt))
+    batch = Batch('convert', jobs)
+    for item, dest in batch.run(convert_document, items, lambda item: item[1]):
+        pass
+    batch.check()
+
+
+@cli.command('save')
+@click.option('-a', '--all', is_flag=True,
+              help='Save all open documents.')
+@click.option('-f', '--force', is_flag=True,
+              help='Do not prompt to save changes.')
+@click.option('-p', '--path', type=click.Path(resolve_path=True),
+              help='Save document to PATH.')
+def save(all, force, path):
+    ''' 
+    Save document(s). 
+    
+    If a path is given, the active document is saved
+    with a new name at PATH. The --all and --force 
+    options are ignored when a path is provided.
+    
+    If no path is given, the active document is saved 
     to its current path.
     '''
-    click.echo('save to "%s"' % path)
+    click.echo('save to "%s"' % path)
+    try:
+        with METRICS.track('save'):
+            if path:
+                click.echo('Saving document to: "%s"' % path)
+                save_document(WORD.ActiveDocument, path)
+            else:
+                if all:
+                    doc = WORD.Documents
+                else:
+                    doc = WORD.ActiveDocument
+                click.echo('Saving changes to existing document.')
+                save_document(doc, prompt=not force)
+    except com_error as e:
+        raise click.ClickException(e.excepinfo[2])
+
+
+@cli.command('close')
+@click.option('-a', '--all', is_flag=True,
+              help='Close all open documents.')
+@click.option('-f', '--force', is_flag=True,
+              help='Force close without saving changes.')
+def close(all, force):
+    ''' 
+    Close document(s). 
+    
+    Unless the --force option is used, Word will prompt
+    to save any changes.
+    
+    Will only quit Word if no other documents are open.
+    '''
+    try:
+        with METRICS.track('close'):
+            if all:
+                doc = WORD.Documents
+            else:
+                doc = WORD.ActiveDocument
+            if WORD.BackgroundPrintingStatus:
+                click.echo('Waiting for print jobs to spool...')
+            if force:
+                click.echo('Force closing document...')
+            else:
+                click.echo('Closing document...')
+            # Only quits if no other documents are open
+            close_document(WORD, doc, C.wdDoNotSaveChanges if force else C.wdPromptToSaveChanges)
+    except com_error as e:
+        raise click.ClickException(e.excepinfo[2])
+    
+
+def validate_index(ctx, param, value):
+    '''
+    Click callback which returns a document index as an int and a document
+    name as is.
+    '''
+    return int(value) if value.isdigit() else value
+
+
+@cli.command('activate')
+@click.argument('index', callback=validate_index)
+def activate(index):
+    ''' 
+    Activate a document. 
+
+    INDEX is the number of the document in the list of the 'docs' command
+    or its name.
+    '''
+    click.echo('Activate document at index "%s"' % index)
+    try:
+        WORD.Documents.Item(index).Activate()
+    except com_error as e:
+        raise click.ClickException(e.excepinfo[2])
+
+
+@cli.command('docs') # Or should it be 'list' or 'ls'???
+def docs():
+    ''' 
+    List open documents. 
+    '''
+    if WORD.Documents.Count:
+        click.echo('\nOpen Documents:\n')
+        template = ' {{}} [{{: ={}}}] {{}}{{}}'.format(len(str(WORD.Documents.Count)))
+        for doc in list_documents(WORD):
+            click.echo(template.format('*' if doc['active'] else ' ', doc['index'], doc['name'],
+                                       '' if doc['saved'] else '*'))
+    else:
+        click.echo('\nNo open documents found.')
+
+
+# =========================================================
+# Reading OOXML packages without Word
+# =========================================================
+
+OOXML_EXTENSIONS = ('.docx', '.docm', '.dotx', '.dotm')
+
+W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+REL_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+
+# The elements of docProps/core.xml and docProps/app.xml reported by 'inspect'
+CORE_PROPERTIES = OrderedDict([
+    ('title',          'title'),
+    ('subject',        'subject'),
+    ('creator',        'author'),
+    ('keywords',       'keywords'),
+    ('description',    'description'),
+    ('category',       'category'),
+    ('lastModifiedBy', 'last_modified_by'),
+    ('revision',       'revision'),
+    ('created',        'created'),
+    ('modified',       'modified')
+])
+
+APP_PROPERTIES = OrderedDict([
+    ('Template',    'template'),
+    ('Pages',       'pages'),
+    ('Words',       'words'),
+    ('Characters',  'characters'),
+    ('Application', 'application')
+])
+
+INTEGER_PROPERTIES = ('revision', 'pages', 'words', 'characters')
+
+# Elements of the main document part which indicate tracked changes
+REVISION_TAGS = set('{%s}%s' % (W_NS, tag) for tag in
+                    ('ins', 'del', 'moveFrom', 'moveTo', 'rPrChange', 'pPrChange', 'sectPrChange'))
+
+
+def local_name(tag):
+    ''' Return the tag of an element without its namespace. '''
+    return tag.rsplit('}', 1)[-1]
+
+
+def is_ooxml(path):
+    ''' Return True if the file at path is a Word OOXML package (docx, docm, dotx or dotm). '''
+    return os.path.splitext(path)[1].lower() in OOXML_EXTENSIONS
+
+
+def iterparse_part(package, name, keep=()):
+    '''
+    Incrementally parse the part at name of the open zipfile package, yielding
+    ('start', element) and ('end', element) events. Once its 'end' event has
+    been yielded, an element is removed from the tree unless it is within an
+    element whose tag is in keep (which is removed at its own end instead).
+    Memory use is therefore bounded by the largest kept element rather than
+    the size of the part.
+    '''
+    with package.open(name) as f:
+        stack = []
+        kept = 0
+        for event, elem in ElementTree.iterparse(f, ('start', 'end')):
+            if event == 'start':
+                stack.append(elem)
+                if elem.tag in keep:
+                    kept += 1
+                yield event, elem
+            else:
+                yield event, elem
+                stack.pop()
+                if elem.tag in keep:
+                    kept -= 1
+                if stack and not kept:
+                    stack[-1].remove(elem)
+
+
+def main_part(package):
+    '''
+    Return the name of the main document part of the open zipfile package,
+    as given by the package relationships.
+    '''
+    try:
+        for event, elem in iterparse_part(package, '_rels/.rels'):
+            if event == 'end' and elem.get('Type', '').endswith('/officeDocument'):
+                return elem.get('Target').lstrip('/')
+    except KeyError:
+        pass
+    return 'word/document.xml'
+
+
+def inspect_package(path, revisions=False):
+    '''
+    Return an OrderedDict of the properties of the OOXML package at path,
+    read from docProps/core.xml and docProps/app.xml. If revisions is True,
+    the main document part is scanned (up to the first change) to report
+    whether the document contains tracked changes.
+    '''
+    info = OrderedDict([('path', path)])
+    info.update((field, None) for field in CORE_PROPERTIES.values())
+    info.update((field, None) for field in APP_PROPERTIES.values())
+    with zipfile.ZipFile(path) as package:
+        names = set(package.namelist())
+        for part, fields in (('docProps/core.xml', CORE_PROPERTIES), ('docProps/app.xml', APP_PROPERTIES)):
+            if part not in names:
+                continue
+            for event, elem in iterparse_part(package, part):
+                field = fields.get(local_name(elem.tag))
+                if event == 'end' and field and elem.text and elem.text.strip():
+                    value = elem.text.strip()
+                    info[field] = int(value) if field in INTEGER_PROPERTIES and value.isdigit() else value
+        if revisions:
+            info['has_revisions'] = False
+            for event, elem in iterparse_part(package, main_part(package)):
+                if elem.tag in REVISION_TAGS:
+                    info['has_revisions'] = True
+                    break
+    return info
+
+
+# The built-in document properties read by Word for legacy documents
+COM_PROPERTIES = OrderedDict([
+    ('title',            'Title'),
+    ('subject',          'Subject'),
+    ('author',           'Author'),
+    ('keywords',         'Keywords'),
+    ('description',      'Comments'),
+    ('category',         'Category'),
+    ('last_modified_by', 'Last Author'),
+    ('revision',         'Revision Number'),
+    ('created',          'Creation Date'),
+    ('modified',         'Last Save Time'),
+    ('template',         'Template'),
+    ('pages',            'Number of Pages'),
+    ('words',            'Number of Words'),
+    ('characters',       'Number of Characters'),
+    ('application',      'Application Name')
+])
+
+
+def open_hidden(app, path):
+    ''' Open the document at path in app read-only, hidden and without conversion prompts. '''
+    return app.Documents.Open(FileName=path, ReadOnly=True, Visible=False,
+                              AddToRecentFiles=False, ConfirmConversions=False)
+
+
+def document_properties(doc, path, revisions=False):
+    ''' Return the same properties as inspect_package for the open document doc. '''
+    info = OrderedDict([('path', path)])
+    props = doc.BuiltInDocumentProperties
+    for field, name in COM_PROPERTIES.items():
+        try:
+            value = props(name).Value
+        except com_error:
+            value = None
+        if hasattr(value, 'isoformat'):
+            value = value.isoformat()
+        info[field] = value if value not in ('', None) else None
+    if revisions:
+        info['has_revisions'] = doc.Revisions.Count > 0
+    return info
+
+
+def inspect_document(app, job):
+    '''
+    Return the same properties as inspect_package for a document which only
+    Word can read, by opening it read-only and hidden in app.
+    '''
+    path, revisions = job
+    doc = open_hidden(app, path)
+    try:
+        return document_properties(doc, path, revisions)
+    finally:
+        doc.Close(C.wdDoNotSaveChanges)
+
+
+def _inspect(job):
+    ''' Inspect one package for a PackageBatch; job is a (path, revisions) tuple. '''
+    return inspect_package(*job)
+
+
+def parallel_map(func, items, jobs=1, chunksize=16):
+    '''
+    Map func over items in order, using a pool of jobs processes if jobs is
+    greater than 1. Results are yielded as they become available. func must
+    be a module level function.
+    '''
+    if jobs <= 1:
+        for item in items:
+            yield func(item)
+        return
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for result in pool.imap(func, items, chunksize):
+            yield result
+    finally:
+        pool.terminate()
+
+
+# The errors raised by reading (or rewriting) an OOXML package which is damaged or not as expected
+PACKAGE_ERRORS = (zipfile.BadZipfile, ElementTree.ParseError, EnvironmentError, KeyError)
+
+
+class PackageJob(object):
+    '''
+    Calls func(item) for parallel_map and returns (item, result, None), or
+    (item, None, message) if it raises one of errors. It can be sent to the
+    processes of a pool as long as func is a module level function.
+    '''
+    def __init__(self, func, errors=PACKAGE_ERRORS):
+        self.func = func
+        self.errors = errors
+
+    def __call__(self, item):
+        try:
+            return item, self.func(item), None
+        except self.errors as e:
+            return item, None, error_message(e)
+
+
+class PackageBatch(object):
+    '''
+    Runs a job for each of many OOXML packages with parallel_map (in jobs
+    processes), echoing each failure and recording the outcome of each in
+    METRICS under 'command'. Failures are collected in 'failures' rather than
+    aborting the batch, as Batch does for the documents which need Word.
+    '''
+    def __init__(self, command, jobs=1, errors=PACKAGE_ERRORS):
+        self.command = command
+        self.jobs = jobs
+        self.errors = errors
+        self.failures = []
+
+    def run(self, func, items, describe=None, processed=None):
+        '''
+        Call func(item) for each item and yield (item, result) for each
+        success in the order of items. describe(item) names an item in output
+        (by default the item, or its first element if it is a tuple). A
+        success is only counted as processed if processed(result) is True
+        (by default every success is).
+        '''
+        describe = describe or (lambda item: item[0] if isinstance(item, tuple) else item)
+        for item, result, error in parallel_map(PackageJob(func, self.errors), items, self.jobs):
+            if error is None:
+                if processed is None or processed(result):
+                    METRICS.inc('msw_documents_processed_total', command=self.command)
+                yield item, result
+            else:
+                METRICS.inc('msw_failures_total', command=self.command, code='unknown')
+                click.echo('Failed: %s: %s' % (describe(item), error), err=True)
+                self.failures.append((item, error))
+
+
+def echo_record(record, as_json=False):
+    ''' Echo a record (an OrderedDict with a 'path') as JSON or as indented text. '''
+    if as_json:
+        click.echo(json.dumps(record, default=str))
+    else:
+        click.echo(record['path'])
+        for key, value in record.items():
+            if key != 'path' and value is not None:
+                click.echo('  %s: %s' % (key, value))
+
+
+@cli.command('inspect')
+@click.argument('path', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False, resolve_path=True))
+@click.option('--revisions', is_flag=True,
+              help='Also report whether each document contains tracked changes.')
+@click.option('--json', 'as_json', is_flag=True, help='Output one JSON object per document.')
+@click.option('-j', '--jobs', type=click.IntRange(1), default=1,
+              help='The number of processes reading documents in parallel. Defaults to 1.')
+def inspect(path, revisions, as_json, jobs):
+    '''
+    Display the properties of documents.
+
+    Reports the title, author, last author, page and word counts, template and
+    other properties of each PATH. Word documents in OOXML format (docx, docm,
+    dotx and dotm) are read directly and Word is never started. Legacy formats
+    (such as doc) are opened read-only in a hidden instance of Word, after the
+    other documents have been reported.
+
+    The '--revisions' option reads the body of each document (up to the first
+    tracked change) and is slower for large documents.
+    '''
+    failed = []
+    legacy = [p for p in path if not is_ooxml(p)]
+    packages = PackageBatch('inspect', jobs)
+    for job, info in packages.run(_inspect, [(p, revisions) for p in path if is_ooxml(p)]):
+        echo_record(info, as_json)
+    failed.extend(packages.failures)
+    if legacy:
+        batch = Batch('inspect', verbose=False)
+        for item, info in batch.run(inspect_document, [(p, revisions) for p in legacy], lambda item: item[0]):
+            echo_record(info, as_json)
+        failed.extend(batch.failures)
+    if failed:
+        raise click.ClickException('%d of %d documents failed.' % (len(failed), len(path)))
+
+
+def wtag(tag):
+    ''' Return the qualified name of a tag in the WordprocessingML namespace. '''
+    return '{%s}%s' % (W_NS, tag)
+
+
+HEADING_STYLE = re.compile(r'^heading (\d)$', re.IGNORECASE)
+
+
+def read_styles(package):
+    '''
+    Return a dict mapping the style ids of the paragraph styles in the open
+    zipfile package to (name, level) tuples, where level is the outline
+    level (1-9) of a heading style or None. Levels are inherited through
+    'basedOn'.
+    '''
+    styles = {}
+    if 'word/styles.xml' not in package.namelist():
+        return styles
+    for event, elem in iterparse_part(package, 'word/styles.xml', keep=(wtag('style'),)):
+        if event == 'end' and elem.tag == wtag('style') and elem.get(wtag('type')) == 'paragraph':
+            name = elem.find(wtag('name'))
+            based = elem.find(wtag('basedOn'))
+            level = elem.find('%s/%s' % (wtag('pPr'), wtag('outlineLvl')))
+            styles[elem.get(wtag('styleId'))] = (
+                name.get(wtag('val')) if name is not None else elem.get(wtag('styleId')),
+                int(level.get(wtag('val'))) + 1 if level is not None else None,
+                based.get(wtag('val')) if based is not None else None
+            )
+    resolved = {}
+    for sid in styles:
+        name, level, based = styles[sid]
+        seen = set([sid])
+        while level is None and based in styles and based not in seen:
+            seen.add(based)
+            level, based = styles[based][1:]
+        match = HEADING_STYLE.match(name)
+        if level is None and match:
+            level = int(match.group(1))
+        resolved[sid] = (name, level if level is not None and level <= 9 else None)
+    return resolved
+
+
+def paragraph_text(elem):
+    '''
+    Return the text of the w:p element elem. Deleted text and the text of
+    paragraphs nested within elem (such as in text boxes) is excluded.
+    '''
+    parts = []
+    for child in elem:
+        tag = child.tag
+        if tag == wtag('t'):
+            parts.append(child.text or '')
+        elif tag in (wtag('tab'), wtag('ptab')):
+            parts.append('\t')
+        elif tag in (wtag('br'), wtag('cr')):
+            parts.append('\n')
+        elif tag in (wtag('noBreakHyphen'),):
+            parts.append('-')
+        elif tag not in (wtag('p'), wtag('del'), wtag('moveFrom'), wtag('pPr'), wtag('rPr'), wtag('instrText')):
+            parts.append(paragraph_text(child))
+    return ''.join(parts)
+
+
+def package_paragraphs(path, styles=False):
+    '''
+    Yield an OrderedDict for each paragraph of the OOXML package at path,
+    in document order, with its 'text' and, if styles is True, the name of
+    its 'style' and its heading 'level' (or None). The package is parsed
+    incrementally and only one paragraph is held in memory at a time.
+    '''
+    with zipfile.ZipFile(path) as package:
+        names = read_styles(package) if styles else {}
+        for event, elem in iterparse_part(package, main_part(package), keep=(wtag('p'),)):
+            if event != 'end' or elem.tag != wtag('p'):
+                continue
+            para = OrderedDict([('text', paragraph_text(elem))])
+            if styles:
+                ppr = elem.find(wtag('pPr'))
+                sid = level = None
+                if ppr is not None:
+                    pstyle = ppr.find(wtag('pStyle'))
+                    sid = pstyle.get(wtag('val')) if pstyle is not None else None
+                    outline = ppr.find(wtag('outlineLvl'))
+                    if outline is not None and int(outline.get(wtag('val'))) < 9:
+                        level = int(outline.get(wtag('val'))) + 1
+                name, style_level = names.get(sid or 'Normal', (sid or 'Normal', None))
+                para['style'] = name
+                para['level'] = level or style_level
+            yield para
+
+
+def paragraphs_of(doc, styles=False):
+    ''' Yield the same paragraphs as package_paragraphs for the open document doc. '''
+    for p in doc.Paragraphs:
+        para = OrderedDict([('text', p.Range.Text.rstrip('\r\x07').replace('\x0b', '\n'))])
+        if styles:
+            para['style'] = p.Style.NameLocal
+            para['level'] = p.OutlineLevel if p.OutlineLevel != C.wdOutlineLevelBodyText else None
+        yield para
+
+
+def document_paragraphs(app, path, styles=False):
+    '''
+    Yield the same paragraphs as package_paragraphs for a document which only
+    Word can read, by opening it read-only and hidden in app.
+    '''
+    doc = open_hidden(app, path)
+    try:
+        for para in paragraphs_of(doc, styles):
+            yield para
+    finally:
+        doc.Close(C.wdDoNotSaveChanges)
+
+
+@cli.command('text')
+@click.argument('path', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False, resolve_path=True))
+@click.option('--styles', is_flag=True, help='Include the style name and heading level of each paragraph.')
+@click.option('--json', 'as_json', is_flag=True, help='Output one JSON object per paragraph.')
+def text(path, styles, as_json):
+    '''
+    Output the text of documents.
+
+    Writes the text of each paragraph of each PATH to stdout as it is read.
+    With '--styles' each line is prefixed by the paragraph's style name and
+    heading level, separated by tabs. With '--json' each paragraph is output
+    as a JSON object with the 'path' of the document and the paragraph's
+    'index' (from 0).
+
+    Word documents in OOXML format (docx, docm, dotx and dotm) are read
+    directly in constant memory and Word is never started. Legacy formats
+    (such as doc) are opened read-only in a hidden instance of Word.
+    '''
+    failed = []
+    app = None
+    try:
+        for p in path:
+            try:
+                if is_ooxml(p):
+                    paragraphs = package_paragraphs(p, styles)
+                else:
+                    if app is None:
+                        app = new_instance()
+                    paragraphs = document_paragraphs(app, p, styles)
+                for i, para in enumerate(paragraphs):
+                    if as_json:
+                        record = OrderedDict([('path', p), ('index', i)])
+                        record.update(para)
+                        click.echo(json.dumps(record))
+                    elif styles:
+                        click.echo('%s\t%s\t%s' % (para['style'], para['level'] or '', para['text']))
+                    else:
+                        click.echo(para['text'])
+            except (zipfile.BadZipfile, ElementTree.ParseError, EnvironmentError, KeyError, com_error) as e:
+                METRICS.inc('msw_failures_total', command='text',
+                            code=error_code(e) if isinstance(e, com_error) else 'unknown')
+                click.echo('Failed: %s: %s' % (p, error_message(e)), err=True)
+                failed.append(p)
+            else:
+                METRICS.inc('msw_documents_processed_total', command='text')
+    finally:
+        if app is not None:
+            app.Quit(C.wdDoNotSaveChanges)
+    if failed:
+        raise click.ClickException('%d of %d documents failed.' % (len(failed), len(path)))
+
+
+# =========================================================
+# Document index
+# =========================================================
+
+# Legacy formats which are indexed by opening them in Word
+LEGACY_EXTENSIONS = ('.doc', '.dot', '.rtf', '.odt')
+
+INDEX_FIELDS = list(CORE_PROPERTIES.values()) + list(APP_PROPERTIES.values()) + ['template_path']
+
+
+def file_hash(path):
+    ''' Return the SHA-1 hex digest of the contents of the file at path. '''
+    digest = hashlib.sha1()
+    with io.open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def attached_template(package):
+    '''
+    Return the full path of the template attached to the document in the open
+    zipfile package (from the relationships of word/settings.xml) or None.
+    '''
+    try:
+        for event, elem in iterparse_part(package, 'word/_rels/settings.xml.rels'):
+            if event == 'end' and elem.get('Type', '').endswith('/attachedTemplate'):
+                target = elem.get('Target')
+                if target.startswith('file:///'):
+                    target = target[8:]
+                return target
+    except KeyError:
+        pass
+    return None
+
+
+def _index_package(job):
+    '''
+    Read the properties and text of one package for a PackageBatch. job is a
+    (path, old_hash) tuple. Returns (hash, info, text), where info and text
+    are None if the hash is unchanged.
+    '''
+    path, old_hash = job
+    digest = file_hash(path)
+    if digest == old_hash:
+        return digest, None, None
+    info = inspect_package(path)
+    with zipfile.ZipFile(path) as package:
+        info['template_path'] = attached_template(package)
+    text = '\n'.join(para['text'] for para in package_paragraphs(path))
+    return digest, info, text
+
+
+def index_document(app, job):
+    '''
+    Read the properties and text of a document which only Word can read, by
+    opening it read-only and hidden in app. Returns the same (hash, info,
+    text) tuple as _index_package.
+    '''
+    path, old_hash = job
+    digest = file_hash(path)
+    if digest == old_hash:
+        return digest, None, None
+    doc = open_hidden(app, path)
+    try:
+        info = document_properties(doc, path)
+        info['template_path'] = doc.AttachedTemplate.FullName or None
+        text = '\n'.join(para['text'] for para in paragraphs_of(doc))
+    finally:
+        doc.Close(C.wdDoNotSaveChanges)
+    return digest, info, text
+
+
+class DocumentIndex(object):
+    '''
+    A persistent index of the properties and text of documents, stored in
+    the SQLite database at path. Text is held in a full-text search table
+    (FTS5 where available, otherwise FTS4).
+    '''
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS documents (id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, '
+            'mtime REAL, size INTEGER, hash TEXT, indexed REAL, %s)' % ', '.join(INDEX_FIELDS)
+        )
+        try:
+            self.db.execute('CREATE VIRTUAL TABLE IF NOT EXISTS document_text USING fts5(body)')
+        except sqlite3.OperationalError:
+            self.db.execute('CREATE VIRTUAL TABLE IF NOT EXISTS document_text USING fts4(body)')
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def scan(self, roots, extensions):
+        '''
+        Walk the directories roots for files with extensions. Returns a list of
+        (path, mtime, size, old_hash) tuples for files which are new or whose
+        mtime or size has changed, and a list of the paths in the index under
+        roots which no longer exist.
+        '''
+        known = dict((row[0], row[1:]) for row in self.db.execute('SELECT path, mtime, size, hash FROM documents'))
+        changed = []
+        seen = set()
+        for root in roots:
+            for dirpath, dirnames, filenames in os.walk(root):
+                dirnames.sort()
+                for name in sorted(filenames):
+                    # Skip the lock files Word creates for open documents
+                    if name.startswith('~$') or os.path.splitext(name)[1].lower() not in extensions:
+                        continue
+                    path = os.path.join(dirpath, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    seen.add(path)
+                    old = known.get(path)
+                    if old is None or old[0] != stat.st_mtime or old[1] != stat.st_size:
+                        changed.append((path, stat.st_mtime, stat.st_size, old[2] if old else None))
+        prefixes = tuple(os.path.join(root, '') for root in roots)
+        removed = [path for path in known if path.startswith(prefixes) and path not in seen]
+        return changed, removed
+
+    def store(self, path, mtime, size, digest, info=None, text=None):
+        '''
+        Record the document at path. If info is None only the mtime, size and
+        hash are updated (the contents are unchanged).
+        '''
+        row = self.db.execute('SELECT id FROM documents WHERE path = ?', (path,)).fetchone()
+        if info is None and row is not None:
+            self.db.execute('UPDATE documents SET mtime = ?, size = ?, hash = ? WHERE id = ?',
+                            (mtime, size, digest, row[0]))
+            return
+        values = [mtime, size, digest, time.time()] + [info.get(field) for field in INDEX_FIELDS]
+        if row is None:
+            cursor = self.db.execute(
+                'INSERT INTO documents (path, mtime, size, hash, indexed, %s) VALUES (?, %s)' %
+                (', '.join(INDEX_FIELDS), ', '.join('?' * (len(values)))), [path] + values
+            )
+            docid = cursor.lastrowid
+        else:
+            docid = row[0]
+            self.db.execute(
+                'UPDATE documents SET mtime = ?, size = ?, hash = ?, indexed = ?, %s WHERE id = ?' %
+                ', '.join('%s = ?' % field for field in INDEX_FIELDS), values + [docid]
+            )
+            self.db.execute('DELETE FROM document_text WHERE rowid = ?', (docid,))
+        self.db.execute('INSERT INTO document_text (rowid, body) VALUES (?, ?)', (docid, text or ''))
+
+    def remove(self, paths):
+        ''' Remove the documents at paths from the index. '''
+        for path in paths:
+            row = self.db.execute('SELECT id FROM documents WHERE path = ?', (path,)).fetchone()
+            if row is not None:
+                self.db.execute('DELETE FROM document_text WHERE rowid = ?', (row[0],))
+                self.db.execute('DELETE FROM documents WHERE id = ?', (row[0],))
+
+    def query(self, text=None, limit=None, **filters):
+        '''
+        Yield an OrderedDict of the indexed properties of each document whose
+        text matches the full-text query text and whose properties match the
+        filters, in order of path. Filter values are case-insensitive patterns
+        in which '*' matches any characters (and other characters, including
+        '%' and '_', only match themselves). A 'template' filter matches either
+        the template name or its path.
+        '''
+        where = []
+        args = []
+        if text:
+            where.append('id IN (SELECT rowid FROM document_text WHERE document_text MATCH ?)')
+            args.append(text)
+        for field, pattern in sorted(filters.items()):
+            if pattern is None:
+                continue
+            like = re.sub(r'([\\%_])', r'\\\1', pattern).replace('*', '%')
+            if field == 'template':
+                where.append("(template LIKE ? ESCAPE '\\' OR template_path LIKE ? ESCAPE '\\')")
+                args.extend([like, like])
+            else:
+                where.append("%s LIKE ? ESCAPE '\\'" % field)
+                args.append(like)
+        sql = 'SELECT path, %s FROM documents' % ', '.join(INDEX_FIELDS)
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY path'
+        if limit:
+            sql += ' LIMIT %d' % limit
+        for row in self.db.execute(sql, args):
+            yield OrderedDict(zip(['path'] + INDEX_FIELDS, row))
+
+
+def build_index(index, roots, jobs=1, batch_size=500):
+    '''
+    Bring index up to date with the documents under the directories roots.
+    Only files whose mtime or size has changed are read, and only those whose
+    contents (by hash) have changed are reindexed. OOXML packages are read in
+    jobs processes and legacy formats in jobs instances of Word. Documents
+    which can no longer be read are removed from the index. Returns a
+    dict of the counts of 'added', 'updated', 'unchanged', 'removed' and
+    'failed' documents.
+    '''
+    changed, removed = index.scan(roots, OOXML_EXTENSIONS + LEGACY_EXTENSIONS)
+    counts = dict(added=0, updated=0, unchanged=0, removed=len(removed), failed=0)
+    index.remove(removed)
+    stats = dict((path, (mtime, size, old)) for path, mtime, size, old in changed)
+
+    def record(path, digest, info, text):
+        mtime, size, old = stats[path]
+        index.store(path, mtime, size, digest, info, text)
+        counts['unchanged' if info is None else 'updated' if old else 'added'] += 1
+        if sum(counts.values()) % batch_size == 0:
+            index.db.commit()
+
+    packages = PackageBatch('index', jobs)
+    for item, result in packages.run(_index_package, [(path, old) for path, mtime, size, old in changed
+                                                      if is_ooxml(path)]):
+        record(item[0], *result)
+    failures = list(packages.failures)
+    legacy = [(path, old) for path, mtime, size, old in changed if not is_ooxml(path)]
+    if legacy:
+        batch = Batch('index', jobs, verbose=False)
+        for item, result in batch.run(index_document, legacy, lambda item: item[0]):
+            record(item[0], *result)
+        failures.extend(batch.failures)
+    # Rather than keep the properties and text of what the document used to be
+    index.remove([item[0] for item, error in failures])
+    counts['failed'] = len(failures)
+    index.db.commit()
+    return counts
+
+
+INDEX_DB = os.path.join(click.get_app_dir('msw'), 'index.sqlite')
+
+
+@cli.command('index')
+@click.argument('action', type=click.Choice(['build', 'query']))
+@click.argument('args', nargs=-1)
+@click.option('--db', type=click.Path(dir_okay=False, resolve_path=True), default=INDEX_DB,
+              envvar='MSW_INDEX', show_default=True, help='The index database.')
+@click.option('-j', '--jobs', type=click.IntRange(1), default=1,
+              help='The number of processes (or instances of Word) reading documents when building.')
+@click.option('--title', help='Only documents whose title matches PATTERN.', metavar='PATTERN')
+@click.option('--author', help='Only documents whose author matches PATTERN.', metavar='PATTERN')
+@click.option('--template', help='Only documents whose template name or path matches PATTERN.',
+              metavar='PATTERN')
+@click.option('--limit', type=click.IntRange(1), help='Output at most N documents.', metavar='N')
+@click.option('--json', 'as_json', is_flag=True, help='Output the properties of each document as JSON.')
+def index(action, args, db, jobs, title, author, template, limit, as_json):
+    '''
+    Build or query an index of documents.
+
+    'index build DIR...' adds the documents under each DIR to the index,
+    along with their properties and text. Rebuilding only reads documents
+    whose size or modification time has changed and removes documents
+    which no longer exist.
+
+    'index query [TEXT...]' outputs the path of each indexed document which
+    contains TEXT (a full-text query, eg. 'indemnity NEAR/5 clause') and
+    matches the '--title', '--author' and '--template' patterns, in which
+    '*' matches any characters. Paths are output one per line.
+    '''
+    if action == 'build':
+        if not args:
+            raise click.UsageError('At least one DIR is required.')
+        roots = [os.path.abspath(arg) for arg in args]
+        for root in roots:
+            if not os.path.isdir(root):
+                raise click.BadParameter('Directory "%s" does not exist.' % root, param_hint='DIR')
+        with DocumentIndex(db) as idx:
+            counts = build_index(idx, roots, jobs)
+        click.echo('Indexed: {added} added, {updated} updated, {unchanged} unchanged, '
+                   '{removed} removed, {failed} failed.'.format(**counts))
+        if counts['failed']:
+            raise click.ClickException('%d documents failed.' % counts['failed'])
+    else:
+        with DocumentIndex(db) as idx:
+            try:
+                for record in idx.query(' '.join(args), limit, title=title, author=author, template=template):
+                    if as_json:
+                        click.echo(json.dumps(record))
+                    else:
+                        click.echo(record['path'])
+            except sqlite3.OperationalError as e:
+                raise click.ClickException('Invalid query: %s' % e)
+
+
+# =========================================================
+# Rendering templates
+# =========================================================
+
+# The parts of a package in which fields are substituted
+FIELD_PARTS = re.compile(r'^word/(document|header\d*|footer\d*|footnotes|endnotes)\.xml$')
+
+PLACEHOLDER = re.compile(r'\{\{\s*([\w.-]+)\s*\}\}', re.UNICODE)
+
+# Fields are marked in the serialized XML of a part with characters from the
+# Unicode private use area, which do not otherwise occur in documents.
+FIELD_MARK = re.compile('\ue000([^\ue001]*)\ue001')
+
+XML_SPACE = '{http://www.w3.org/XML/1998/namespace}space'
+
+# Content types of the main part of templates and of the documents created from them
+DOCUMENT_CONTENT_TYPE = b'application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml'
+MACRO_CONTENT_TYPE = b'application/vnd.ms-word.document.macroEnabled.main+xml'
+TEMPLATE_CONTENT_TYPES = (
+    (b'application/vnd.openxmlformats-officedocument.wordprocessingml.template.main+xml', DOCUMENT_CONTENT_TYPE),
+    (b'application/vnd.ms-word.template.macroEnabledTemplate.main+xml', MACRO_CONTENT_TYPE)
+)
+
+
+def mark(name):
+    ''' Return the marker of the field name. '''
+    return '\ue000%s\ue001' % name
+
+
+def deflate(data):
+    ''' Return data compressed with raw deflate, as stored in zip files. '''
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush()
+
+
+def zip_member(name, data):
+    ''' Return a member for write_zip named name containing the bytes data. '''
+    return name, len(data), zlib.crc32(data) & 0xFFFFFFFF, deflate(data), zipfile.ZIP_DEFLATED
+
+
+def raw_members(package):
+    '''
+    Yield a member for write_zip for each member of the open zipfile package,
+    with its data exactly as stored (ie. without decompressing it).
+    '''
+    f = package.fp
+    for info in package.infolist():
+        f.seek(info.header_offset)
+        header = f.read(30)
+        if header[:4] != b'PK\x03\x04':
+            raise zipfile.BadZipfile('Bad local header for "%s".' % info.filename)
+        name_length, extra_length = struct.unpack('<HH', header[26:30])
+        f.seek(info.header_offset + 30 + name_length + extra_length)
+        yield (info.filename, info.file_size, info.CRC, f.read(info.compress_size), info.compress_type)
+
+
+def write_zip(path, members, timestamp=None):
+    '''
+    Write a zip file to path from members, a list of (name, size, crc, data,
+    method) tuples where data is compressed by method (see zip_member and
+    raw_members). Members are compressed by the caller so that unchanging
+    members can be compressed once and written many times, or copied from
+    another zip file as they are.
+    '''
+    t = time.localtime(timestamp)
+    dostime = t.tm_hour << 11 | t.tm_min << 5 | t.tm_sec // 2
+    dosdate = max(t.tm_year - 1980, 0) << 9 | t.tm_mon << 5 | t.tm_mday
+    directory = []
+    with io.open(path, 'wb') as f:
+        for name, size, crc, data, method in members:
+            name = name.encode('utf-8')
+            offset = f.tell()
+            f.write(struct.pack('<IHHHHHIIIHH', 0x04034b50, 20, 0x800, method, dostime, dosdate,
+                                crc, len(data), size, len(name), 0))
+            f.write(name)
+            f.write(data)
+            directory.append(struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, 20, 20, 0x800, method, dostime,
+                                         dosdate, crc, len(data), size, len(name),
+                                         0, 0, 0, 0, 0, offset) + name)
+        start = f.tell()
+        for entry in directory:
+            f.write(entry)
+        f.write(struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, len(directory), len(directory),
+                            f.tell() - start, start, 0))
+
+
+def rewrite_package(path, members):
+    '''
+    Replace the zip file at path with one containing members (see write_zip).
+    The new file is written alongside and renamed over the old one once it is
+    complete, so an interruption never leaves a partial file at path.
+    '''
+    tmp = path + '.msw-tmp'
+    try:
+        write_zip(tmp, members)
+        getattr(os, 'replace', os.rename)(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def text_nodes(elem):
+    ''' Return the w:t elements of the w:p element elem, excluding those in nested paragraphs. '''
+    nodes = []
+    for child in elem:
+        if child.tag == wtag('t'):
+            nodes.append(child)
+        elif child.tag != wtag('p'):
+            nodes.extend(text_nodes(child))
+    return nodes
+
+
+def set_text(node, text):
+    ''' Set the text of the w:t element node, preserving its whitespace. '''
+    node.text = text
+    node.set(XML_SPACE, 'preserve')
+
+
+def mark_placeholders(root):
+    '''
+    Replace each {{name}} placeholder in the paragraphs under root with the
+    marker of the field name. Word often splits the text of a placeholder
+    across several runs; the marker is placed in the run where it starts.
+    '''
+    for p in root.iter(wtag('p')):
+        nodes = text_nodes(p)
+        texts = [node.text or '' for node in nodes]
+        full = ''.join(texts)
+        if '{{' not in full:
+            continue
+        owner = []
+        for i, t in enumerate(texts):
+            owner.extend([i] * len(t))
+        result = [''] * len(nodes)
+        pos = 0
+        for match in PLACEHOLDER.finditer(full):
+            for c in range(pos, match.start()):
+                result[owner[c]] += full[c]
+            result[owner[match.start()]] += mark(match.group(1))
+            pos = match.end()
+        for c in range(pos, len(full)):
+            result[owner[c]] += full[c]
+        for node, t in zip(nodes, result):
+            if t != node.text:
+                set_text(node, t)
+
+
+def mark_content_controls(root, names=None):
+    '''
+    Replace the content of each content control under root which has a tag
+    (or failing that, a title) with the marker of its tag. If names is given,
+    only the content controls whose tag (or title) is in names are replaced.
+    '''
+    for sdt in root.iter(wtag('sdt')):
+        props = sdt.find(wtag('sdtPr'))
+        content = sdt.find(wtag('sdtContent'))
+        if props is None or content is None:
+            continue
+        name = props.find(wtag('tag'))
+        if name is None:
+            name = props.find(wtag('alias'))
+        if name is None or names is not None and name.get(wtag('val')) not in names:
+            continue
+        placeholder = props.find(wtag('showingPlcHdr'))
+        if placeholder is not None:
+            props.remove(placeholder)
+        nodes = list(content.iter(wtag('t')))
+        if not nodes:
+            parent = content.find(wtag('p'))
+            parent = parent if parent is not None else content
+            run = parent.find(wtag('r'))
+            if run is None:
+                run = ElementTree.SubElement(parent, wtag('r'))
+            nodes = [ElementTree.SubElement(run, wtag('t'))]
+        set_text(nodes[0], mark(name.get(wtag('val'))))
+        for node in nodes[1:]:
+            node.text = ''
+
+
+def mark_bookmarks(root, names=None):
+    '''
+    Replace the runs within each bookmark under root (other than hidden
+    bookmarks, whose names start with '_') with a run containing the marker
+    of its name. If names is given, only the bookmarks in names are
+    replaced. Only runs in the paragraph where the bookmark starts are
+    replaced; a bookmark which starts between paragraphs (or table rows)
+    starts at the next paragraph, and one which ends before it is skipped.
+    '''
+    def is_end(elem, start):
+        return elem.tag == wtag('bookmarkEnd') and elem.get(wtag('id')) == start.get(wtag('id'))
+
+    for parent in list(root.iter()):
+        children = list(parent)
+        for start in children:
+            if start.tag != wtag('bookmarkStart') or start.get(wtag('name'), '_').startswith('_'):
+                continue
+            if names is not None and start.get(wtag('name')) not in names:
+                continue
+            following = list(parent)[list(parent).index(start) + 1:]
+            if parent.tag == wtag('p'):
+                para, index = parent, list(parent).index(start) + 1
+            else:
+                # A run is only valid within a paragraph
+                para = None
+                for elem in following:
+                    if is_end(elem, start):
+                        break
+                    para = elem if elem.tag == wtag('p') else elem.find('.//' + wtag('p'))
+                    if para is not None:
+                        break
+                if para is None:
+                    continue
+                following = list(para)
+                index = 1 if len(para) and para[0].tag == wtag('pPr') else 0
+            for elem in following:
+                if is_end(elem, start):
+                    break
+                if elem.tag == wtag('r'):
+                    para.remove(elem)
+            run = ElementTree.Element(wtag('r'))
+            set_text(ElementTree.SubElement(run, wtag('t')), mark(start.get(wtag('name'))))
+            para.insert(index, run)
+
+
+def read_namespaces(data):
+    ''' Return a list of the (prefix, uri) namespace declarations in the XML data. '''
+    return [ns for event, ns in ElementTree.iterparse(io.BytesIO(data), ('start-ns',))]
+
+
+def serialize_part(root, namespaces):
+    '''
+    Serialize the element root with the prefixes of namespaces (as returned
+    by read_namespaces). Declarations which ElementTree would drop as unused
+    are restored, as they may still be referenced by mc:Ignorable.
+    '''
+    for prefix, uri in namespaces:
+        if prefix:
+            try:
+                ElementTree.register_namespace(prefix, uri)
+            except ValueError:
+                pass
+    xml = ElementTree.tostring(root, encoding='utf-8').decode('utf-8')
+    end = xml.index('>', xml.index('<', xml.index('?>') + 2 if xml.startswith('<?') else 0))
+    head = xml[:end]
+    missing = ''.join(' xmlns:%s="%s"' % (prefix, uri) for prefix, uri in namespaces
+                      if prefix and 'xmlns:%s=' % prefix not in head)
+    if head.endswith('/'):
+        end -= 1
+    return xml[:end] + missing + xml[end:]
+
+
+def line_break(namespaces):
+    '''
+    Return the XML which ends a w:t element, breaks the line and starts
+    another w:t, with the prefix of W_NS among namespaces (as returned by
+    read_namespaces).
+    '''
+    prefix = dict((uri, prefix) for prefix, uri in namespaces if prefix).get(W_NS, 'w')
+    return '</{0}:t><{0}:br/><{0}:t xml:space="preserve">'.format(prefix)
+
+
+class DocumentTemplate(object):
+    '''
+    A Word template (or document) in OOXML format, parsed once and rendered
+    many times. Fields are {{name}} placeholders in the text, content controls
+    with a tag or title of name and bookmarks named name. If names is given,
+    only the content controls and bookmarks in names are fields; the others
+    are left as they are. Parts which contain no fields are compressed once
+    and copied into each rendered document; only the parts with fields are
+    rebuilt for each document.
+    '''
+    def __init__(self, path, names=None):
+        self.path = path
+        self.names = names
+        self.fields = set()
+        self.members = []
+        with zipfile.ZipFile(path) as package:
+            self.macros = any(name.endswith('vbaProject.bin') for name in package.namelist())
+            for info in package.infolist():
+                data = package.read(info)
+                if info.filename == '[Content_Types].xml':
+                    for old, new in TEMPLATE_CONTENT_TYPES:
+                        data = data.replace(old, new)
+                    if not self.macros:
+                        # Without its macros the document is saved as .docx
+                        data = data.replace(MACRO_CONTENT_TYPE, DOCUMENT_CONTENT_TYPE)
+                if FIELD_PARTS.match(info.filename):
+                    segments = self._parse(data)
+                    if len(segments) > 1:
+                        self.members.append((info.filename, segments, line_break(read_namespaces(data))))
+                        continue
+                self.members.append(zip_member(info.filename, data))
+
+    def _parse(self, data):
+        '''
+        Return a list of alternating literal strings and field names making up
+        the XML data of a part once its fields have been marked.
+        '''
+        root = ElementTree.fromstring(data)
+        mark_content_controls(root, self.names)
+        mark_bookmarks(root, self.names)
+        mark_placeholders(root)
+        xml = serialize_part(root, read_namespaces(data))
+        segments = FIELD_MARK.split(xml)
+        self.fields.update(segments[1::2])
+        return segments
+
+    def render(self, path, values):
+        '''
+        Write a document to path with the fields of the template replaced by
+        the text of values, a dict of field names to values. Newlines in values
+        become line breaks. Raises KeyError for a field which has no value.
+        '''
+        members = []
+        for member in self.members:
+            if isinstance(member[1], list):
+                name, segments, br = member
+                parts = []
+                for i, segment in enumerate(segments):
+                    if i % 2:
+                        value = values[segment]
+                        value = '' if value is None else ('%s' % value).replace('\r\n', '\n')
+                        segment = escape_xml(value).replace('\n', br)
+                    parts.append(segment)
+                member = zip_member(name, ''.join(parts).encode('utf-8'))
+            members.append(member)
+        write_zip(path, members)
+
+
+def escape_xml(text):
+    ''' Escape text for inclusion in XML character data. '''
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def read_rows(path):
+    '''
+    Yield a dict for each row of the data file at path, which is CSV (with
+    a header row), a JSON array of objects or JSON Lines (.jsonl).
+    '''
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.csv':
+        with io.open(path, encoding='utf-8-sig', newline='') as f:
+            for row in csv.DictReader(f):
+                yield row
+    elif ext in ('.jsonl', '.ndjson'):
+        with io.open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        with io.open(path, encoding='utf-8') as f:
+            rows = json.load(f)
+        if not isinstance(rows, list):
+            raise ValueError('Expected a JSON array of objects.')
+        for row in rows:
+            yield row
+
+
+UNSAFE_FILENAME = re.compile(r'[\\/:*?"<>|\x00-\x1f]')
+
+
+@cli.command('render')
+@click.argument('template', type=Template(exists=True, dir_okay=False, resolve_path=True))
+@click.argument('data', type=click.Path(exists=True, dir_okay=False, resolve_path=True))
+@click.option('-o', '--out', type=click.Path(file_okay=False, resolve_path=True), required=True,
+              help='The directory to save the rendered documents to.')
+@click.option('-n', '--name', metavar='PATTERN',
+              help='The file name (without extension) of each document, in which {field} is replaced '
+                   'by the value of field and {n} by the row number. Defaults to TEMPLATE-{n}.')
+@click.option('--pdf', is_flag=True, help='Also export each document to PDF (requires Word).')
+@click.option('-j', '--jobs', type=click.IntRange(1), default=1,
+              help='The number of instances of Word exporting PDFs in parallel. Defaults to 1.')
+def render(template, data, out, name, pdf, jobs):
+    '''
+    Create a document from a template for each row of data.
+
+    DATA is a CSV file (with a header row of field names), a JSON array of
+    objects or a JSON Lines (.jsonl) file. Each row creates a document in
+    the '--out' directory in which the fields of the TEMPLATE are replaced
+    by the values of the row. Fields are:
+
+    \b
+        * {{field}} placeholders in the text of the document, its headers,
+          footers, footnotes or endnotes;
+        * content controls whose tag (or title) is a field of DATA;
+        * bookmarks named after a field of DATA.
+
+    Other content controls and bookmarks are left as they are.
+
+    The template must be in OOXML format (dotx, dotm, docx or docm) and the
+    documents are created without Word. Word is only used to export PDFs.
+    '''
+    if not is_ooxml(template):
+        raise click.BadParameter('Template "%s" is not in OOXML format.' % template, param_hint='TEMPLATE')
+    try:
+        rows = list(read_rows(data))
+    except (ValueError, csv.Error) as e:
+        raise click.ClickException('Unable to read "%s": %s' % (data, e))
+    try:
+        tmpl = DocumentTemplate(template, set(key for row in rows for key in row))
+    except (zipfile.BadZipfile, ElementTree.ParseError, KeyError) as e:
+        raise click.ClickException('Unable to read template "%s": %s' % (template, e))
+    stem = os.path.splitext(os.path.basename(template))[0]
+    name = name or stem + '-{n}'
+    ext = '.docm' if tmpl.macros else '.docx'
+    if not os.path.isdir(out):
+        os.makedirs(out)
+    rendered = []
+    failed = 0
+    for n, row in enumerate(rows, 1):
+        try:
+            filename = UNSAFE_FILENAME.sub('_', name.format(**dict(row, n=n)))
+            path = os.path.join(out, filename + ext)
+            tmpl.render(path, row)
+        except (KeyError, IndexError, ValueError, EnvironmentError) as e:
+            METRICS.inc('msw_failures_total', command='render', code='unknown')
+            if isinstance(e, KeyError):
+                e = 'No value for field %s' % e
+            click.echo('Failed: row %d: %s' % (n, e), err=True)
+            failed += 1
+        else:
+            METRICS.inc('msw_documents_processed_total', command='render')
+            rendered.append(path)
+    click.echo('Rendered %d document(s) to %s' % (len(rendered), out))
+    if pdf and rendered:
+        items = [(path, os.path.splitext(path)[0] + '.pdf', C.wdFormatPDF, ENCODINGS['utf-8'])
+                 for path in rendered]
+        click.echo('Exporting %d document(s) to PDF...' % len(items))
+        batch = Batch('render', jobs)
+        for item, dest in batch.run(convert_document, items, lambda item: item[1]):
+            pass
+        failed += len(batch.failures)
+    if failed:
+        raise click.ClickException('%d of %d documents failed.' % (failed, len(rows)))
+
+
+# =========================================================
+# Find and replace
+# =========================================================
+
+def wildcard_regex(pattern):
+    '''
+    Translate a pattern in the syntax of Word's 'Use wildcards' option to a
+    Python regular expression: ? (any character), * (any characters), @ (one
+    or more of the preceding), {n,m}, [abc], [!abc], < and > (start and end
+    of a word), (groups) and \\ (escape the following character).
+    '''
+    regex = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\' and i + 1 < len(pattern):
+            i += 1
+            regex.append(re.escape(pattern[i]))
+        elif c == '?':
+            regex.append('.')
+        elif c == '*':
+            regex.append('.*?')
+        elif c == '@':
+            regex.append('+')
+        elif c == '<':
+            regex.append(r'\b(?=\w)')
+        elif c == '>':
+            regex.append(r'\b(?<=\w)')
+        elif c in '(){}':
+            regex.append(c)
+        elif c == '[':
+            end = pattern.find(']', i + 1)
+            if end == -1:
+                raise ValueError('Unbalanced [ in wildcard pattern.')
+            chars = pattern[i + 1:end]
+            negate = chars.startswith('!')
+            chars = chars[1:] if negate else chars
+            regex.append('[%s%s]' % ('^' if negate else '', chars.replace('\\', '\\\\')))
+            i = end
+        else:
+            regex.append(re.escape(c))
+        i += 1
+    return ''.join(regex)
+
+
+def wildcard_template(replacement):
+    '''
+    Translate a replacement in the syntax of Word's 'Use wildcards' option
+    (in which \\1 to \\9 are groups and ^& is the whole match) to a template
+    for re.sub.
+    '''
+    template = []
+    i = 0
+    while i < len(replacement):
+        c = replacement[i]
+        if c == '\\' and i + 1 < len(replacement) and replacement[i + 1].isdigit():
+            template.append('\\' + replacement[i + 1])
+            i += 1
+        elif replacement.startswith('^&', i):
+            template.append('\\g<0>')
+            i += 1
+        else:
+            template.append(c.replace('\\', '\\\\'))
+        i += 1
+    return ''.join(template)
+
+
+def compile_replace(pattern, replacement, mode='literal', match_case=False, whole_word=False):
+    '''
+    Return a (regex, template) tuple for re.sub from a pattern and replacement
+    in the given mode ('literal', 'wildcards' or 'regex'). Raises re.error or
+    ValueError for an invalid pattern.
+    '''
+    if mode == 'literal':
+        regex, template = re.escape(pattern), replacement.replace('\\', '\\\\')
+    elif mode == 'wildcards':
+        regex, template = wildcard_regex(pattern), wildcard_template(replacement)
+    else:
+        regex, template = pattern, replacement
+    if whole_word:
+        regex = r'(?<!\w)(?:%s)(?!\w)' % regex
+    return re.compile(regex, (0 if match_case else re.IGNORECASE) | re.UNICODE), template
+
+
+def replace_text(root, regex, template):
+    '''
+    Replace the matches of regex in the text of each paragraph under root with
+    template, returning the number of replacements. Matches may span runs; the
+    replacement text takes the formatting of the run in which the match starts.
+    '''
+    count = 0
+    for p in root.iter(wtag('p')):
+        nodes = text_nodes(p)
+        texts = [node.text or '' for node in nodes]
+        full = ''.join(texts)
+        matches = [m for m in regex.finditer(full) if m.end() > m.start()]
+        if not matches:
+            continue
+        owner = []
+        for i, t in enumerate(texts):
+            owner.extend([i] * len(t))
+        result = [''] * len(nodes)
+        pos = 0
+        for match in matches:
+            for c in range(pos, match.start()):
+                result[owner[c]] += full[c]
+            result[owner[match.start()]] += match.expand(template)
+            pos = match.end()
+        for c in range(pos, len(full)):
+            result[owner[c]] += full[c]
+        for node, t in zip(nodes, result):
+            if t != node.text:
+                set_text(node, t)
+        count += len(matches)
+    return count
+
+
+def replace_package(path, regex, template, dry_run=False):
+    '''
+    Replace the matches of regex with template in the text of the OOXML
+    package at path (its body, headers, footers, footnotes and endnotes) and
+    return the number of replacements. The package is only rewritten if
+    something was replaced and dry_run is False. Only the changed parts are
+    reserialized; the other parts are copied as they are.
+    '''
+    count = 0
+    members = []
+    with zipfile.ZipFile(path) as package:
+        for member in raw_members(package):
+            if FIELD_PARTS.match(member[0]):
+                data = package.read(member[0])
+                root = ElementTree.fromstring(data)
+                replaced = replace_text(root, regex, template)
+                if replaced:
+                    count += replaced
+                    member = zip_member(member[0], serialize_part(root, read_namespaces(data)).encode('utf-8'))
+            members.append(member)
+    if count and not dry_run:
+        rewrite_package(path, members)
+    return count
+
+
+def _replace_package(job):
+    ''' Replace in one package for a PackageBatch; returns the number of matches. '''
+    path, pattern, replacement, options, dry_run = job
+    regex, template = compile_replace(pattern, replacement, **options)
+    return replace_package(path, regex, template, dry_run)
+
+
+def replace_document(app, job):
+    '''
+    Replace pattern with replacement in every story of the document at path
+    (in app) with Word's Find and Replace, and save it. Returns the number of
+    matches, which are only counted if dry_run is True.
+    '''
+    path, pattern, replacement, options, dry_run, track_changes = job
+    if options['mode'] == 'regex':
+        raise ValueError('Regular expressions are only supported for OOXML documents.')
+    if options['mode'] == 'literal':
+        # Word treats ^ as the start of a special character in both strings
+        pattern, replacement = pattern.replace('^', '^^'), replacement.replace('^', '^^')
+    find = dict(FindText=pattern, MatchCase=options['match_case'], MatchWholeWord=options['whole_word'],
+                MatchWildcards=options['mode'] == 'wildcards', Forward=True, Wrap=C.wdFindStop, Format=False)
+    doc = app.Documents.Open(FileName=path, Visible=False, AddToRecentFiles=False, ConfirmConversions=False)
+    try:
+        if track_changes and not dry_run:
+            # Must be on before the replacements are made for them to be recorded
+            doc.TrackRevisions = True
+        count = 0
+        for story in doc.StoryRanges:
+            while story is not None:
+                rng = story.Duplicate
+                while rng.Find.Execute(**find):
+                    count += 1
+                    rng.Collapse(C.wdCollapseEnd)
+                if not dry_run and count:
+                    story.Find.Execute(ReplaceWith=replacement, Replace=C.wdReplaceAll, **find)
+                story = story.NextStoryRange
+        if count and not dry_run:
+            doc.Save()
+    finally:
+        doc.Close(C.wdDoNotSaveChanges)
+    return count
+
+
+@cli.command('replace')
+@click.argument('pattern')
+@click.argument('replacement')
+@click.argument('src', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False, resolve_path=True))
+@click.option('--wildcards', 'mode', flag_value='wildcards',
+              help='PATTERN uses the wildcards of Word\'s Find and Replace dialog.')
+@click.option('--regex', 'mode', flag_value='regex',
+              help='PATTERN is a Python regular expression (OOXML documents only).')
+@click.option('--literal', 'mode', flag_value='literal', default=True, help='PATTERN is plain text (the default).')
+@click.option('-c', '--match-case', is_flag=True, help='Only match text with the same case.')
+@click.option('-w', '--whole-word', is_flag=True, help='Only match whole words.')
+@click.option('-n', '--dry-run', is_flag=True, help='Report the number of matches without changing anything.')
+@click.option('--word', 'use_word', is_flag=True, help='Use Word\'s Find and Replace for every document.')
+@click.option('--track-changes', is_flag=True, help='Record the replacements as tracked changes (uses Word).')
+@click.option('-j', '--jobs', type=click.IntRange(1), default=1,
+              help='The number of processes (or instances of Word) to run in parallel. Defaults to 1.')
+def replace(pattern, replacement, src, mode, match_case, whole_word, dry_run, use_word, track_changes, jobs):
+    '''
+    Find and replace text in documents.
+
+    Replaces each match of PATTERN in each SRC document with REPLACEMENT and
+    saves the document in place. Matches are not case sensitive unless
+    '--match-case' is given. With '--wildcards', \\1 in REPLACEMENT is the
+    first group in PATTERN and ^& the whole match. With '--regex', \\1 and
+    \\g<name> are groups.
+
+    Word documents in OOXML format (docx, docm, dotx and dotm) are changed
+    directly without Word. Matches may span runs of differently formatted
+    text; the replacement takes the formatting of the start of the match.
+    Other formats, and all documents with '--word' or '--track-changes', are
+    changed with Word's Find and Replace in a hidden instance of Word.
+    '''
+    options = dict(mode=mode, match_case=match_case, whole_word=whole_word)
+    use_word = use_word or track_changes
+    if use_word and mode == 'regex':
+        raise click.UsageError('Regular expressions cannot be used with Word.')
+    try:
+        compile_replace(pattern, replacement, **options)
+    except (re.error, ValueError) as e:
+        raise click.BadParameter('%s' % e, param_hint='PATTERN')
+    counts = OrderedDict((path, None) for path in src)
+    failed = []
+
+    def report(path, count):
+        counts[path] = count
+        if count:
+            click.echo('%s: %d %s' % (path, count, 'match(es)' if dry_run else 'replacement(s)'))
+
+    packages = PackageBatch('replace', jobs, errors=PACKAGE_ERRORS + (re.error,))
+    for job, count in packages.run(_replace_package, [(path, pattern, replacement, options, dry_run)
+                                                      for path in src if is_ooxml(path) and not use_word]):
+        report(job[0], count)
+    failed.extend(packages.failures)
+    documents = [(path, pattern, replacement, options, dry_run, track_changes)
+                 for path in src if use_word or not is_ooxml(path)]
+    if documents:
+        batch = Batch('replace', jobs, verbose=False)
+        for item, count in batch.run(replace_document, documents, lambda item: item[0]):
+            report(item[0], count)
+        failed.extend(batch.failures)
+    total = sum(count for count in counts.values() if count)
+    changed = len([count for count in counts.values() if count])
+    if dry_run:
+        click.echo('Found %d match(es) in %d of %d document(s).' % (total, changed, len(src)))
+    else:
+        click.echo('Replaced %d occurrence(s) in %d of %d document(s).' % (total, changed, len(src)))
+    if failed:
+        raise click.ClickException('%d of %d documents failed.' % (len(failed), len(src)))
+
+
+# =========================================================
+# Document properties
+# =========================================================
+
+CP_NS = 'http://schemas.openxmlformats.org/package/2006/metadata/core-properties'
+DC_NS = 'http://purl.org/dc/elements/1.1/'
+CUSTOM_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/custom-properties'
+VT_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/docPropsVTypes'
+
+# The namespaces of docProps/core.xml, in case a part does not declare one it needs
+CORE_NAMESPACES = [
+    ('cp', CP_NS),
+    ('dc', DC_NS),
+    ('dcterms', 'http://purl.org/dc/terms/'),
+    ('dcmitype', 'http://purl.org/dc/dcmitype/'),
+    ('xsi', 'http://www.w3.org/2001/XMLSchema-instance')
+]
+
+# The core properties which can be set and their elements in docProps/core.xml
+CORE_ELEMENTS = OrderedDict([
+    ('title',            '{%s}title' % DC_NS),
+    ('subject',          '{%s}subject' % DC_NS),
+    ('author',           '{%s}creator' % DC_NS),
+    ('keywords',         '{%s}keywords' % CP_NS),
+    ('description',      '{%s}description' % DC_NS),
+    ('category',         '{%s}category' % CP_NS),
+    ('last_modified_by', '{%s}lastModifiedBy' % CP_NS)
+])
+
+# The parts, content types and relationships of the property parts, for packages without them
+PROPERTY_PARTS = {
+    'docProps/core.xml': ('application/vnd.openxmlformats-package.core-properties+xml',
+                          'http://schemas.openxmlformats.org/package/2006/relationships/metadata/core-properties'),
+    'docProps/custom.xml': ('application/vnd.openxmlformats-officedocument.custom-properties+xml',
+                            'http://schemas.openxmlformats.org/officeDocument/2006/relationships/custom-properties')
+}
+
+# The fmtid of all custom properties
+CUSTOM_FMTID = '{D5CDD505-2E9C-101B-9397-08002B2CF9AE}'
+
+
+def split_properties(values):
+    '''
+    Split values, a dict of property names to values, into dicts of core
+    and custom properties. Names in CORE_ELEMENTS are core properties unless
+    prefixed by 'custom:'; all other names are custom properties.
+    '''
+    core = OrderedDict()
+    custom = OrderedDict()
+    for name, value in values.items():
+        if name in CORE_ELEMENTS:
+            core[name] = value
+        else:
+            custom[name[7:] if name.startswith('custom:') else name] = value
+    return core, custom
+
+
+def read_custom_properties(package):
+    '''
+    Return an OrderedDict of the custom properties in the open zipfile
+    package, mapping each name to a (type, text) tuple where type is the
+    local name of its value element (eg. 'lpwstr', 'i4' or 'filetime').
+    '''
+    props = OrderedDict()
+    if 'docProps/custom.xml' not in package.namelist():
+        return props
+    for event, elem in iterparse_part(package, 'docProps/custom.xml', keep=('{%s}property' % CUSTOM_NS,)):
+        if event == 'end' and elem.tag == '{%s}property' % CUSTOM_NS and len(elem):
+            props[elem.get('name')] = (local_name(elem[0].tag), elem[0].text or '')
+    return props
+
+
+def custom_part(props):
+    ''' Return the XML of docProps/custom.xml containing props (see read_custom_properties). '''
+    xml = ['<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+           '<Properties xmlns="%s" xmlns:vt="%s">' % (CUSTOM_NS, VT_NS)]
+    for pid, (name, (kind, text)) in enumerate(props.items(), 2):
+        xml.append('<property fmtid="%s" pid="%d" name="%s"><vt:%s>%s</vt:%s></property>' %
+                   (CUSTOM_FMTID, pid, escape_xml(name).replace('"', '&quot;'), kind, escape_xml(text), kind))
+    xml.append('</Properties>')
+    return ''.join(xml)
+
+
+def core_part(data, props):
+    '''
+    Return the XML of docProps/core.xml with the core properties props set,
+    given its existing XML data (or None).
+    '''
+    if data is None:
+        data = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                '<cp:coreProperties %s/>' % ' '.join('xmlns:%s="%s"' % ns for ns in CORE_NAMESPACES)
+                ).encode('utf-8')
+    namespaces = read_namespaces(data)
+    root = ElementTree.fromstring(data)
+    for name, value in props.items():
+        elem = root.find(CORE_ELEMENTS[name])
+        if elem is None:
+            elem = ElementTree.SubElement(root, CORE_ELEMENTS[name])
+        elem.text = value
+    declared = set(prefix for prefix, uri in namespaces)
+    return serialize_part(root, namespaces + [ns for ns in CORE_NAMESPACES if ns[0] not in declared])
+
+
+def add_part(members, name):
+    '''
+    Add the content type override and package relationship of the property
+    part name to members (a dict of names to data) of a package without it.
+    '''
+    content_type, rel_type = PROPERTY_PARTS[name]
+    types = members['[Content_Types].xml'].decode('utf-8')
+    types = types.replace('</Types>', '<Override PartName="/%s" ContentType="%s"/></Types>' % (name, content_type))
+    members['[Content_Types].xml'] = types.encode('utf-8')
+    rels = members['_rels/.rels'].decode('utf-8')
+    ids = set(re.findall(r'Id="([^"]*)"', rels))
+    rid = next('rIdMsw%d' % i for i in range(1, len(ids) + 2) if 'rIdMsw%d' % i not in ids)
+    rels = rels.replace('</Relationships>', '<Relationship Id="%s" Type="%s" Target="%s"/></Relationships>' %
+                        (rid, rel_type, name))
+    members['_rels/.rels'] = rels.encode('utf-8')
+
+
+def package_properties(path):
+    '''
+    Return an OrderedDict of the core properties (as inspect_package) and
+    the custom properties of the OOXML package at path.
+    '''
+    info = inspect_package(path)
+    props = OrderedDict([('path', path)])
+    props.update((field, info[field]) for field in CORE_PROPERTIES.values())
+    with zipfile.ZipFile(path) as package:
+        for name, (kind, text) in read_custom_properties(package).items():
+            props.setdefault(name, text)
+    return props
+
+
+def set_package_properties(path, values):
+    '''
+    Set the properties values (a dict of names to values, see split_properties)
+    of the OOXML package at path. Only docProps/core.xml and docProps/custom.xml
+    are rewritten; the other members of the package are copied byte for byte.
+    '''
+    core, custom = split_properties(values)
+    with zipfile.ZipFile(path) as package:
+        names = package.namelist()
+        changed = OrderedDict()
+        if core:
+            data = package.read('docProps/core.xml') if 'docProps/core.xml' in names else None
+            changed['docProps/core.xml'] = core_part(data, core).encode('utf-8')
+        if custom:
+            props = read_custom_properties(package)
+            for name, value in custom.items():
+                props[name] = ('lpwstr', value)
+            changed['docProps/custom.xml'] = custom_part(props).encode('utf-8')
+        missing = [name for name in changed if name not in names]
+        if missing:
+            for name in ('[Content_Types].xml', '_rels/.rels'):
+                changed[name] = package.read(name)
+            for name in missing:
+                add_part(changed, name)
+        members = [zip_member(member[0], changed.pop(member[0])) if member[0] in changed else member
+                   for member in raw_members(package)]
+        members.extend(zip_member(name, data) for name, data in changed.items())
+    rewrite_package(path, members)
+
+
+def document_custom_properties(doc):
+    ''' Return an OrderedDict of the names and values of the custom properties of the open document doc. '''
+    props = OrderedDict()
+    for prop in doc.CustomDocumentProperties:
+        value = prop.Value
+        props[prop.Name] = value.isoformat() if hasattr(value, 'isoformat') else value
+    return props
+
+
+def get_document_properties(app, path):
+    ''' Return the same properties as package_properties for a document which only Word can read. '''
+    doc = open_hidden(app, path)
+    try:
+        info = document_properties(doc, path)
+        props = OrderedDict((field, info[field]) for field in ['path'] + list(CORE_PROPERTIES.values()))
+        for name, value in document_custom_properties(doc).items():
+            props.setdefault(name, value)
+        return props
+    finally:
+        doc.Close(C.wdDoNotSaveChanges)
+
+
+def set_document_properties(app, job):
+    ''' Set the properties of a document which only Word can read and save it. '''
+    path, values = job
+    core, custom = split_properties(values)
+    doc = app.Documents.Open(FileName=path, Visible=False, AddToRecentFiles=False, ConfirmConversions=False)
+    try:
+        for name, value in core.items():
+            doc.BuiltInDocumentProperties(COM_PROPERTIES[name]).Value = value
+        for name, value in custom.items():
+            try:
+                doc.CustomDocumentProperties(name).Value = value
+            except com_error:
+                doc.CustomDocumentProperties.Add(Name=name, LinkToContent=False,
+                                                 Type=C.msoPropertyTypeString, Value=value)
+        doc.Saved = False
+        doc.Save()
+    finally:
+        doc.Close(C.wdDoNotSaveChanges)
+    return path
+
+
+
+
+def _set_package_properties(job):
+    ''' Set the properties of one package for a PackageBatch; job is a (path, values) tuple. '''
+    set_package_properties(*job)
+
+
+def parse_property(ctx, param, value):
+    ''' Validate NAME=VALUE properties and return them as an OrderedDict. '''
+    props = OrderedDict()
+    for item in value:
+        name, sep, text = item.partition('=')
+        if not sep or not name:
+            raise click.BadParameter('"%s" is not in the form NAME=VALUE.' % item)
+        props[name] = text
+    return props
+
+
+def read_property_rows(path):
+    '''
+    Return a list of (path, values) tuples from the CSV file at path, which
+    has a 'path' column and a column for each property. Relative paths are
+    relative to the CSV file and empty cells are ignored.
+    '''
+    jobs = []
+    base = os.path.dirname(path)
+    with io.open(path, encoding='utf-8-sig', newline='') as f:
+        reader = csv.DictReader(f)
+        if 'path' not in (reader.fieldnames or []):
+            raise ValueError('There is no "path" column.')
+        for row in reader:
+            values = OrderedDict((name, row[name]) for name in reader.fieldnames
+                                 if name != 'path' and row[name] not in ('', None))
+            jobs.append((os.path.join(base, row['path']), values))
+    return jobs
+
+
+@cli.command('props')
+@click.argument('action', type=click.Choice(['get', 'set']))
+@click.argument('src', nargs=-1, type=click.Path(exists=True, dir_okay=False, resolve_path=True))
+@click.option('-p', '--property', 'properties', multiple=True, callback=parse_property, metavar='NAME=VALUE',
+              help='A property to set on each SRC. May be given more than once.')
+@click.option('--csv', 'csv_path', type=click.Path(exists=True, dir_okay=False, resolve_path=True),
+              help='Set the properties in the columns of a CSV file on the document in its \'path\' column.')
+@click.option('--json', 'as_json', is_flag=True, help='Output the properties of each document as JSON.')
+@click.option('-j', '--jobs', type=click.IntRange(1), default=1,
+              help='The number of processes (or instances of Word) to run in parallel. Defaults to 1.')
+def props(action, src, properties, csv_path, as_json, jobs):
+    '''
+    Get or set the properties of documents.
+
+    'props get SRC...' outputs the core properties (title, subject, author,
+    keywords, description, category, last_modified_by and others) and the
+    custom properties of each document.
+
+    'props set SRC... -p NAME=VALUE...' sets properties on each SRC and
+    saves it. '--csv FILE' sets different properties on each document from
+    a CSV file with a 'path' column (relative to FILE) and a column for each
+    property (empty cells are left unchanged). Names other than the core
+    properties above are custom properties; prefix a name with 'custom:' to
+    set a custom property of the same name as a core property.
+
+    Word documents in OOXML format (docx, docm, dotx and dotm) are read and
+    changed directly without Word, and only their property parts are
+    rewritten. Other formats are opened in a hidden instance of Word.
+    '''
+    if action == 'get':
+        jobs_list = list(src)
+        ooxml, legacy = package_properties, get_document_properties
+    else:
+        if not properties and not csv_path:
+            raise click.UsageError('Set at least one property with --property or --csv.')
+        jobs_list = [(path, properties) for path in src] if properties else []
+        if csv_path:
+            try:
+                jobs_list.extend(read_property_rows(csv_path))
+            except (ValueError, csv.Error, KeyError) as e:
+                raise click.ClickException('Unable to read "%s": %s' % (csv_path, e))
+        for path, values in jobs_list:
+            if not os.path.isfile(path):
+                raise click.ClickException('Document "%s" does not exist.' % path)
+        ooxml, legacy = _set_package_properties, set_document_properties
+    if not jobs_list:
+        raise click.UsageError('At least one SRC is required.')
+
+    def path_of(job):
+        return job if action == 'get' else job[0]
+
+    def report(record):
+        if action == 'get':
+            echo_record(record, as_json)
+
+    failed = []
+    packages = PackageBatch('props', jobs)
+    for job, result in packages.run(ooxml, [job for job in jobs_list if is_ooxml(path_of(job))], path_of):
+        report(result)
+    failed.extend(packages.failures)
+    documents = [job for job in jobs_list if not is_ooxml(path_of(job))]
+    if documents:
+        batch = Batch('props', jobs, verbose=False)
+        for job, result in batch.run(legacy, documents, path_of):
+            report(result)
+        failed.extend(batch.failures)
+    if action == 'set':
+        click.echo('Set properties on %d of %d document(s).' % (len(jobs_list) - len(failed), len(jobs_list)))
+    if failed:
+        raise click.ClickException('%d of %d documents failed.' % (len(failed), len(jobs_list)))
+
+
+# =========================================================
+# Sanitizing
+# =========================================================
+
+APP_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/extended-properties'
+CT_NS = 'http://schemas.openxmlformats.org/package/2006/content-types'
+
+# Tracked changes which are accepted by keeping their content...
+INSERTED_TAGS = set(wtag(tag) for tag in ('ins', 'moveTo'))
+# ...or by dropping it
+DELETED_TAGS = set(wtag(tag) for tag in ('del', 'moveFrom'))
+# Records of earlier formatting and the bounds of moves, which are dropped
+CHANGE_TAGS = set(wtag(tag) for tag in ('rPrChange', 'pPrChange', 'sectPrChange', 'tblPrChange', 'tblPrExChange',
+                                        'trPrChange', 'tcPrChange', 'tblGridChange', 'numberingChange',
+                                        'cellIns', 'cellDel', 'cellMerge', 'moveFromRangeStart',
+                                        'moveFromRangeEnd', 'moveToRangeStart', 'moveToRangeEnd'))
+COMMENT_TAGS = set(wtag(tag) for tag in ('commentRangeStart', 'commentRangeEnd', 'commentReference'))
+
+# The types (the last segment) of the relationships of the main part to the comment parts
+COMMENT_RELATIONSHIPS = ('comments', 'commentsExtended', 'commentsIds', 'commentsExtensible', 'people')
+
+# The properties of docProps/core.xml and docProps/app.xml which identify people
+PERSONAL_PROPERTIES = OrderedDict([
+    ('author',           ('docProps/core.xml', '{%s}creator' % DC_NS)),
+    ('last_modified_by', ('docProps/core.xml', '{%s}lastModifiedBy' % CP_NS)),
+    ('manager',          ('docProps/app.xml', '{%s}Manager' % APP_NS)),
+    ('company',          ('docProps/app.xml', '{%s}Company' % APP_NS))
+])
+
+
+def accept_changes(elem, counts):
+    '''
+    Accept the tracked changes within elem and remove its comment marks,
+    adding the number of insertions, deletions and formatting changes to
+    counts. Returns True if anything was changed.
+    '''
+    changed = False
+    deleted_marks = set()
+    children = []
+    for child in elem:
+        if child.tag in DELETED_TAGS:
+            counts['deletions'] += 1
+        elif child.tag in INSERTED_TAGS:
+            counts['insertions'] += 1
+            accept_changes(child, counts)
+            children.extend(child)
+        elif child.tag in CHANGE_TAGS:
+            counts['formatting'] += 1
+        elif child.tag in COMMENT_TAGS:
+            pass
+        elif (child.tag == wtag('tr') and child.find('%s/%s' % (wtag('trPr'), wtag('del'))) is not None or
+              child.tag == wtag('tc') and child.find('%s/%s' % (wtag('tcPr'), wtag('cellDel'))) is not None):
+            # A deleted row or cell
+            counts['deletions'] += 1
+        else:
+            if child.tag == wtag('p') and child.find('%s/%s/%s' % (wtag('pPr'), wtag('rPr'), wtag('del'))) is not None:
+                deleted_marks.add(child)
+            reference = child.tag == wtag('r') and child.find(wtag('commentReference')) is not None
+            changed = accept_changes(child, counts) or changed
+            if reference and all(c.tag == wtag('rPr') for c in child):
+                # The run held only the comment reference
+                continue
+            children.append(child)
+            continue
+        changed = True
+    if not changed:
+        return False
+
+    # A paragraph whose mark was deleted is joined to the paragraph after it,
+    # which keeps its own properties
+    result = []
+    joined = None
+    for child in children:
+        if joined is not None:
+            if child.tag == wtag('p'):
+                content = [c for c in joined if c.tag != wtag('pPr')]
+                index = 1 if len(child) and child[0].tag == wtag('pPr') else 0
+                child[index:index] = content
+            elif any(c.tag != wtag('pPr') for c in joined):
+                result.append(joined)
+            joined = None
+        if child in deleted_marks:
+            joined = child
+        else:
+            result.append(child)
+    if joined is not None and any(c.tag != wtag('pPr') for c in joined):
+        result.append(joined)
+    elem[:] = result
+    return True
+
+
+def part_rels(name):
+    ''' Return the name of the relationships part of the part name. '''
+    folder, base = posixpath.split(name)
+    return posixpath.join(folder, '_rels', base + '.rels')
+
+
+def sanitize_package(path, dest=None, dry_run=False):
+    '''
+    Accept all tracked changes, remove all comments and the personal
+    properties (see PERSONAL_PROPERTIES) of the OOXML package at path and
+    return an OrderedDict report of what was removed. The package is
+    rewritten (or written to dest) unless dry_run is True. Only the changed
+    parts are reserialized; the other parts are copied as they are.
+    '''
+    counts = OrderedDict([('insertions', 0), ('deletions', 0), ('formatting', 0), ('comments', 0)])
+    properties = []
+    changed = OrderedDict()  # Part names to their new data, or None to remove them
+    with zipfile.ZipFile(path) as package:
+        names = package.namelist()
+        main = main_part(package)
+        rels = part_rels(main)
+        if rels in names:
+            data = package.read(rels)
+            root = ElementTree.fromstring(data)
+            removed = []
+            for rel in list(root):
+                if rel.get('Type', '').rsplit('/', 1)[-1] in COMMENT_RELATIONSHIPS and \
+                        rel.get('TargetMode') != 'External':
+                    target = rel.get('Target')
+                    if target.startswith('/'):
+                        target = target[1:]
+                    else:
+                        target = posixpath.normpath(posixpath.join(posixpath.dirname(main), target))
+                    root.remove(rel)
+                    removed.append(target)
+            if removed:
+                changed[rels] = serialize_part(root, read_namespaces(data)).encode('utf-8')
+                data = package.read('[Content_Types].xml')
+                types = ElementTree.fromstring(data)
+                for target in removed:
+                    if target not in names:
+                        continue
+                    if target.endswith('comments.xml'):
+                        counts['comments'] += sum(1 for event, elem in iterparse_part(package, target)
+                                                  if event == 'end' and elem.tag == wtag('comment'))
+                    changed[target] = None
+                    if part_rels(target) in names:
+                        changed[part_rels(target)] = None
+                    for override in types.findall('{%s}Override' % CT_NS):
+                        if override.get('PartName') == '/' + target:
+                            types.remove(override)
+                changed['[Content_Types].xml'] = serialize_part(types, read_namespaces(data)).encode('utf-8')
+        for name in names:
+            if FIELD_PARTS.match(name) or name == main:
+                data = package.read(name)
+                root = ElementTree.fromstring(data)
+                if accept_changes(root, counts):
+                    changed[name] = serialize_part(root, read_namespaces(data)).encode('utf-8')
+        for part in ('docProps/core.xml', 'docProps/app.xml'):
+            if part not in names:
+                continue
+            data = package.read(part)
+            root = ElementTree.fromstring(data)
+            for name, (owner, tag) in PERSONAL_PROPERTIES.items():
+                elem = root.find(tag) if owner == part else None
+                if elem is not None and (elem.text or '').strip():
+                    root.remove(elem)
+                    properties.append(name)
+            if any(PERSONAL_PROPERTIES[name][0] == part for name in properties):
+                changed[part] = serialize_part(root, read_namespaces(data)).encode('utf-8')
+        if not dry_run and (changed or dest):
+            members = [zip_member(member[0], changed[member[0]]) if member[0] in changed else member
+                       for member in raw_members(package) if changed.get(member[0], True) is not None]
+    if not dry_run and (changed or dest):
+        rewrite_package(dest or path, members)
+    record = OrderedDict([('path', path)])
+    record.update(counts)
+    record['properties'] = ', '.join(properties) or None
+    return record
+
+
+def sanitize_summary(record):
+    ''' Return a line describing what sanitize_package removed from a document. '''
+    removed = ['%d %s' % (record[key], label) for key, label in (
+        ('insertions', 'insertion(s) accepted'), ('deletions', 'deletion(s) accepted'),
+        ('formatting', 'formatting change(s) accepted'), ('comments', 'comment(s) removed')) if record[key]]
+    if record['properties']:
+        removed.append('properties removed: %s' % record['properties'])
+    return '%s: %s' % (record['path'], '; '.join(removed) or 'nothing to remove')
+
+
+def _sanitize_package(job):
+    ''' Sanitize one package for a PackageBatch; job is a (path, dest, dry_run) tuple. '''
+    return sanitize_package(*job)
+
+
+@cli.command('sanitize')
+@click.argument('src', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False, resolve_path=True))
+@click.option('-o', '--out', type=click.Path(file_okay=False, resolve_path=True),
+              help='Write the sanitized documents to this directory rather than changing each SRC.')
+@click.option('-n', '--dry-run', is_flag=True, help='Report what would be removed without changing anything.')
+@click.option('--json', 'as_json', is_flag=True, help='Output the report of each document as JSON.')
+@click.option('-j', '--jobs', type=click.IntRange(1), default=1,
+              help='The number of processes to run in parallel. Defaults to 1.')
+def sanitize(src, out, dry_run, as_json, jobs):
+    '''
+    Prepare documents for publishing.
+
+    Accepts all tracked changes (insertions, deletions, moves and
+    formatting), removes all comments and removes the author, last author,
+    manager and company properties of each SRC document, and reports what
+    was removed from each.
+
+    Word documents in OOXML format (docx, docm, dotx and dotm) are changed
+    directly without Word, and only the affected parts of each are
+    rewritten. Other formats cannot be sanitized.
+    '''
+    if out:
+        check_destinations((path, os.path.join(out, os.path.basename(path))) for path in src)
+        if not os.path.isdir(out):
+            os.makedirs(out)
+    failed = [path for path in src if not is_ooxml(path)]
+    for path in failed:
+        click.echo('Failed: %s: Only Word documents in OOXML format can be sanitized.' % path, err=True)
+    packages = [(path, os.path.join(out, os.path.basename(path)) if out else None, dry_run)
+                for path in src if is_ooxml(path)]
+    batch = PackageBatch('sanitize', jobs)
+    for job, record in batch.run(_sanitize_package, packages):
+        if as_json:
+            echo_record(record, as_json)
+        else:
+            click.echo(sanitize_summary(record))
+    failed.extend(batch.failures)
+    if failed:
+        raise click.ClickException('%d of %d documents failed.' % (len(failed), len(src)))
+
+
+# =========================================================
+# Tables
+# =========================================================
+
+# Elements which may wrap rows, cells and paragraphs
+WRAPPER_TAGS = set('{%s}%s' % (W_NS, tag) for tag in ('sdt', 'sdtContent', 'customXml', 'smartTag'))
+
+
+def children(elem, tag):
+    ''' Yield the children of elem with the tag, including those within content controls. '''
+    for child in elem:
+        if child.tag == tag:
+            yield child
+        elif child.tag in WRAPPER_TAGS:
+            for grandchild in children(child, tag):
+                yield grandchild
+
+
+def table_rows(tbl, fill_merged=False):
+    '''
+    Return the rows of the w:tbl element tbl and a list of the tables nested
+    in its cells. Each row is a list of the text of its cells, aligned to the
+    grid of the table: a cell which spans several columns is followed by
+    empty cells, as is a cell which is merged with the one above it. If
+    fill_merged is True, the text of a merged cell is repeated in every
+    position it covers instead.
+    '''
+    rows = []
+    nested = []
+    above = {}
+    for tr in children(tbl, wtag('tr')):
+        cells = []
+        before = tr.find('%s/%s' % (wtag('trPr'), wtag('gridBefore')))
+        if before is not None:
+            cells.extend([''] * int(before.get(wtag('val'), 0)))
+        for tc in children(tr, wtag('tc')):
+            col = len(cells)
+            props = tc.find(wtag('tcPr'))
+            span = merge = None
+            if props is not None:
+                span = props.find(wtag('gridSpan'))
+                merge = props.find(wtag('vMerge'))
+            span = int(span.get(wtag('val'), 1)) if span is not None else 1
+            if merge is not None and merge.get(wtag('val'), 'continue') != 'restart':
+                text = above.get(col, '') if fill_merged else ''
+            else:
+                text = '\n'.join(paragraph_text(p) for p in children(tc, wtag('p')))
+                above[col] = text
+            cells.append(text)
+            cells.extend([text if fill_merged else ''] * (span - 1))
+            nested.extend(children(tc, wtag('tbl')))
+        rows.append(cells)
+    return rows, nested
+
+
+def package_tables(path, fill_merged=False):
+    '''
+    Yield a (table, row, cells) tuple for each row of each table of the OOXML
+    package at path, where table is the number of the table in the document
+    (from 1, with '.' separating the numbers of nested tables, eg. '3.1'),
+    row is the number of the row (from 1) and cells is a list of the text of
+    its cells (see table_rows). Only one table is held in memory at a time.
+    '''
+    def walk(tbl, number):
+        rows, nested = table_rows(tbl, fill_merged)
+        for i, cells in enumerate(rows, 1):
+            yield number, i, cells
+        for i, child in enumerate(nested, 1):
+            for row in walk(child, '%s.%d' % (number, i)):
+                yield row
+
+    with zipfile.ZipFile(path) as package:
+        depth = 0
+        count = 0
+        for event, elem in iterparse_part(package, main_part(package), keep=(wtag('tbl'),)):
+            if elem.tag != wtag('tbl'):
+                continue
+            if event == 'start':
+                depth += 1
+            else:
+                depth -= 1
+                if not depth:
+                    count += 1
+                    for row in walk(elem, '%d' % count):
+                        yield row
+
+
+def split_cell_text(text):
+    ''' Return the text of a table cell from Word without its end of cell mark. '''
+    return text.rstrip('\x07').rstrip('\r').replace('\r', '\n').replace('\x0b', '\n')
+
+
+# The namespace of the Flat OPC packages of Range.WordOpenXML
+PKG_NS = 'http://schemas.microsoft.com/office/2006/xmlPackage'
+
+
+def word_table_xml(table):
+    '''
+    Return the w:tbl element of the Word table object table, read from the
+    Flat OPC package of its range in one call.
+    '''
+    root = ElementTree.fromstring(table.Range.WordOpenXML.encode('utf-8'))
+    for part in root.iter('{%s}part' % PKG_NS):
+        if part.get('{%s}name' % PKG_NS) == '/word/document.xml':
+            tbl = next(part.iter(wtag('tbl')), None)
+            if tbl is not None:
+                return tbl
+    raise ValueError('No table in the XML of the range.')
+
+
+def word_table_rows(table, fill_merged=False):
+    '''
+    Return the rows of the Word table object table as lists of cell text
+    (see table_rows). The text of the whole table is fetched at once and
+    split at the end of cell marks, which needs one call per row for the
+    number of cells. Tables which contain other tables or merged cells (or
+    whose rows differ in their number of cells, as with horizontally merged
+    cells) are read from the XML of the table instead, in one call.
+    '''
     try:
-        if path:
-            click.echo('Saving document to: "%s"' % path)
-            WORD.ActiveDocument.SaveAs(path)
-        else:
-            if all:
-                doc = WORD.Documents
+        if table.Tables.Count or not table.Uniform:
+            raise ValueError('Nested or non-uniform table')
+        counts = [table.Rows(i).Cells.Count for i in range(1, table.Rows.Count + 1)]
+        marks = table.Range.Text.split('\r\x07')
+        if len(marks) != sum(counts) + len(counts) + 1:
+            raise ValueError('Unexpected end of cell marks')
+        rows = []
+        for count in counts:
+            rows.append([split_cell_text(text) for text in marks[:count]])
+            # Each row ends with an end of row mark
+            marks = marks[count + 1:]
+        return rows
+    except (com_error, ValueError):
+        return table_rows(word_table_xml(table), fill_merged)[0]
+
+
+def document_tables(app, path, fill_merged=False):
+    ''' Yield the same rows as package_tables for a document which only Word can read. '''
+    def walk(table, number):
+        for i, cells in enumerate(word_table_rows(table, fill_merged), 1):
+            yield number, i, cells
+        for i, child in enumerate(table.Tables, 1):
+            for row in walk(child, '%s.%d' % (number, i)):
+                yield row
+
+    doc = open_hidden(app, path)
+    try:
+        for i, table in enumerate(doc.Tables, 1):
+            for row in walk(table, '%d' % i):
+                yield row
+    finally:
+        doc.Close(C.wdDoNotSaveChanges)
+
+
+@cli.command('tables')
+@click.argument('path', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False, resolve_path=True))
+@click.option('--json', 'as_json', is_flag=True, help='Output one JSON object per row instead of CSV.')
+@click.option('--fill-merged', is_flag=True, help='Repeat the text of merged cells in every column and row they cover.')
+def tables(path, as_json, fill_merged):
+    '''
+    Output the rows of the tables in documents.
+
+    Writes each row of each table of each PATH to stdout as it is read, as
+    CSV (with the columns path, table, row and then the cells) or with
+    '--json' as JSON Lines. Tables are numbered from 1 in the order they
+    appear; a table nested in a cell of table 3 is numbered 3.1. Cells are
+    aligned to the columns of the table, so a cell which spans columns or is
+    merged with the cell above is followed or replaced by empty cells unless
+    '--fill-merged' is given.
+
+    Word documents in OOXML format (docx, docm, dotx and dotm) are read
+    directly, one table at a time, without Word. Legacy formats (such as
+    doc) are opened read-only in a hidden instance of Word.
+    '''
+    stdout = click.get_text_stream('stdout')
+    writer = csv.writer(stdout, lineterminator='\n')
+    failed = []
+    app = None
+    try:
+        for p in path:
+            try:
+                if is_ooxml(p):
+                    rows = package_tables(p, fill_merged)
+                else:
+                    if app is None:
+                        app = new_instance()
+                    rows = document_tables(app, p, fill_merged)
+                for table, row, cells in rows:
+                    if as_json:
+                        click.echo(json.dumps(OrderedDict([('path', p), ('table', table), ('row', row),
+                                                           ('cells', cells)])))
+                    else:
+                        writer.writerow([p, table, row] + cells)
+            except (zipfile.BadZipfile, ElementTree.ParseError, EnvironmentError, KeyError, ValueError,
+                    com_error) as e:
+                METRICS.inc('msw_failures_total', command='tables',
+                            code=error_code(e) if isinstance(e, com_error) else 'unknown')
+                click.echo('Failed: %s: %s' % (p, error_message(e)), err=True)
+                failed.append(p)
             else:
-                doc = WORD.ActiveDocument
-            click.echo('Saving changes to existing document.')
-            doc.Save(NoPrompt=force)
-    except com_error as e:
-        raise click.ClickException(e.excepinfo[2])
+                METRICS.inc('msw_documents_processed_total', command='tables')
+    finally:
+        if app is not None:
+            app.Quit(C.wdDoNotSaveChanges)
+    if failed:
+        raise click.ClickException('%d of %d documents failed.' % (len(failed), len(path)))
 
 
-@cli.command('close')
-@click.option('-a', '--all', is_flag=True,
-              help='Close all open documents.')
-@click.option('-f', '--force', is_flag=True,
-              help='Force close without saving changes.')
-def close(all, force):
-    ''' 
-    Close document(s). 
-    
-    Unless the --force option is used, Word will prompt
-    to save any changes.
-    
-    Will only quit Word if no other documents are open.
+# =========================================================
+# Previews
+# =========================================================
+
+THUMBNAIL_REL = 'http://schemas.openxmlformats.org/package/2006/relationships/metadata/thumbnail'
+
+
+def package_thumbnail(package):
+    '''
+    Return the data of the thumbnail image embedded in the open zipfile
+    package (when saved with 'Save Thumbnail') or None.
+    '''
+    try:
+        for event, elem in iterparse_part(package, '_rels/.rels'):
+            if event == 'end' and elem.get('Type') == THUMBNAIL_REL:
+                return package.read(elem.get('Target').lstrip('/'))
+    except KeyError:
+        pass
+    return None
+
+
+def save_image(data, dest, size):
+    '''
+    Save the image data (in any format Pillow can read) to dest as a PNG
+    scaled to fit within size by size pixels.
+    '''
+    if Image is None:
+        raise click.ClickException('PNG previews require Pillow. Install it with "pip install Pillow".')
+    image = Image.open(io.BytesIO(data))
+    image.thumbnail((size, size))
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+    image.save(dest, 'PNG')
+    return dest
+
+
+def is_up_to_date(src, dest):
+    ''' Return True if dest exists and is newer than src. '''
+    try:
+        return os.path.getmtime(dest) >= os.path.getmtime(src)
+    except OSError:
+        return False
+
+
+def _preview_package(job):
+    '''
+    Create a preview from the thumbnail of one package for a PackageBatch;
+    returns False if the package has no thumbnail.
     '''
+    src, dest, size = job[:3]
+    with zipfile.ZipFile(src) as package:
+        data = package_thumbnail(package)
+    if data is None:
+        return False
+    save_image(data, dest, size)
+    return True
+
+
+def preview_document(app, job):
+    '''
+    Create a preview of the first page of the document at src in app: a PDF
+    optimized for screen if fmt is 'pdf' or otherwise a PNG of size pixels
+    rendered from the page's metafile.
+    '''
+    src, dest, size, fmt = job
+    doc = open_hidden(app, src)
     try:
-        if all:
-            doc = WORD.Documents
+        if fmt == 'pdf':
+            doc.ExportAsFixedFormat(OutputFileName=dest, ExportFormat=C.wdExportFormatPDF,
+                                    OptimizeFor=C.wdExportOptimizeForOnScreen,
+                                    Range=C.wdExportFromTo, From=1, To=1)
         else:
-            doc = WORD.ActiveDocument
-        if force:
-            click.echo('Force closing document...')
-            doc.Close(C.wdDoNotSaveChanges)
+            window = doc.ActiveWindow
+            window.View.Type = C.wdPrintView
+            save_image(bytes(window.Panes(1).Pages(1).EnhMetaFileBits), dest, size)
+    finally:
+        doc.Close(C.wdDoNotSaveChanges)
+    return dest
+
+
+@cli.command('preview')
+@click.argument('src', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False, resolve_path=True))
+@click.option('-o', '--out', type=click.Path(file_okay=False, resolve_path=True), required=True,
+              help='The directory to save the previews to.')
+@click.option('--png', 'fmt', flag_value='png', default=True, help='Create PNG images. The default.')
+@click.option('--pdf', 'fmt', flag_value='pdf', help='Create PDFs of the first page, optimized for screen.')
+@click.option('-s', '--size', type=click.IntRange(16), default=256,
+              help='The maximum width and height of PNG previews in pixels. Defaults to 256.')
+@click.option('--no-thumbnail', 'thumbnail', flag_value=False, default=True,
+              help='Always render the first page in Word, even if a document contains a thumbnail.')
+@click.option('-f', '--force', is_flag=True, help='Recreate previews which are up to date.')
+@click.option('-j', '--jobs', type=click.IntRange(1), default=1,
+              help='The number of processes (or instances of Word) to run in parallel. Defaults to 1.')
+def preview(src, out, fmt, size, thumbnail, force, jobs):
+    '''
+    Create a preview of the first page of documents.
+
+    Saves a preview of each SRC document to the '--out' directory, named
+    after the document:
+
+        somedoc.docx => OUT/somedoc.png
+
+    PNG previews (which require Pillow) use the thumbnail saved in the
+    document when there is one (see 'Save Thumbnail' in Word's Save As
+    dialog), without starting Word. Otherwise the first page is rendered in
+    a hidden instance of Word. Previews which are newer than their document
+    are skipped unless '--force' is given.
+    '''
+    if fmt == 'png' and Image is None:
+        raise click.ClickException('PNG previews require Pillow. Install it with "pip install Pillow".')
+    dests = [(path, os.path.join(out, os.path.splitext(os.path.basename(path))[0] + '.' + fmt)) for path in src]
+    check_destinations(dests)
+    if not os.path.isdir(out):
+        os.makedirs(out)
+    items = []
+    skipped = 0
+    for path, dest in dests:
+        if not force and is_up_to_date(path, dest):
+            skipped += 1
         else:
-            click.echo('Closing document...')
-            doc.Close(C.wdPromptToSaveChanges)
+            items.append((path, dest, size, fmt))
+    failed = []
+    thumbnails = 0
+    rendered = []
+    packages = [item for item in items if fmt == 'png' and thumbnail and is_ooxml(item[0])]
+    batch = PackageBatch('preview', jobs)
+    for item, created in batch.run(_preview_package, packages, processed=bool):
+        if created:
+            thumbnails += 1
+        else:
+            rendered.append(item)
+    failed.extend(batch.failures)
+    rendered.extend(item for item in items if item not in packages)
+    if rendered:
+        batch = Batch('preview', jobs, verbose=False)
+        for item, dest in batch.run(preview_document, rendered, lambda item: item[0]):
+            pass
+        failed.extend(batch.failures)
+    created = len(items) - len(failed)
+    click.echo('Created %d preview(s) (%d from thumbnails), %d up to date.' % (created, thumbnails, skipped))
+    if failed:
+        raise click.ClickException('%d of %d documents failed.' % (len(failed), len(src)))
 
-        if not WORD.Documents.Count:
-            # Only quit if no other documents are open
-            WORD.Quit()
-    except com_error as e:
-        raise click.ClickException(e.excepinfo[2])
-    
 
-@cli.command('activate')
-@click.argument('index', type=int)
-def activate(index):
-    ''' 
-    Activate a document. 
+# =========================================================
+# Document comparison
+# =========================================================
+
+def compare_documents(app, job):
     '''
-    click.echo('Activate document at index "%s"' % index)
+    Compare the documents at original and revised in app and save the
+    redline to docx and/or export it (with markup) to pdf with the export
+    options. Returns the number of revisions.
+    '''
+    original, revised, docx, pdf, options, export = job
+    first = open_hidden(app, original)
     try:
-        WORD.Documents.Item(index).Activate()
-    except com_error as e:
-        raise click.ClickException(e.excepinfo[2])
+        second = open_hidden(app, revised)
+        try:
+            redline = app.CompareDocuments(OriginalDocument=first, RevisedDocument=second,
+                                           Destination=C.wdCompareDestinationNew, **options)
+            try:
+                count = redline.Revisions.Count
+                if docx:
+                    redline.SaveAs2(FileName=docx, FileFormat=C.wdFormatXMLDocument, AddToRecentFiles=False)
+                if pdf:
+                    redline.ExportAsFixedFormat(OutputFileName=pdf, Range=C.wdExportAllDocument, **export)
+            finally:
+                redline.Close(C.wdDoNotSaveChanges)
+        finally:
+            second.Close(C.wdDoNotSaveChanges)
+    finally:
+        first.Close(C.wdDoNotSaveChanges)
+    return count
 
 
-@cli.command('docs') # Or should it be 'list' or 'ls'???
-def docs():
-    ''' 
-    List open documents. 
+def read_pairs(path):
     '''
-    if WORD.Documents.Count:
-        click.echo('\nOpen Documents:\n')
-        template = ' {{}} [{{: ={}}}] {{}}{{}}'.format(len(str(WORD.Documents.Count)))
-        for i, doc in enumerate(WORD.Documents, start=1):
-            active = '*' if WORD.ActiveDocument == doc else ' '
-            saved = '*' if not doc.Saved else ''
-            click.echo(template.format(active, i, doc.Name, saved))
+    Return the (original, revised, name) of each row of the CSV, JSON or
+    JSON Lines file at path (see read_rows) with the columns 'original',
+    'revised' and optionally 'name'. Relative paths are relative to the file.
+    '''
+    base = os.path.dirname(path)
+    pairs = []
+    for i, row in enumerate(read_rows(path), start=1):
+        if not row.get('original') or not row.get('revised'):
+            raise ValueError('Row %d has no \'original\' or \'revised\' document.' % i)
+        pairs.append((os.path.join(base, row['original']), os.path.join(base, row['revised']),
+                      row.get('name') or None))
+    return pairs
+
+
+def same_contents(first, second):
+    ''' Return True if the files at first and second are byte-identical. '''
+    return os.path.getsize(first) == os.path.getsize(second) and file_hash(first) == file_hash(second)
+
+
+@cli.command('compare')
+@click.argument('docs', metavar='[ORIGINAL REVISED]...', nargs=-1,
+                type=click.Path(exists=True, dir_okay=False, resolve_path=True))
+@click.option('--pairs', type=click.Path(exists=True, dir_okay=False, resolve_path=True),
+              help='A CSV, JSON or JSON Lines file of pairs, with the columns "original", "revised" '
+              'and optionally "name" (the file name of the redline).')
+@click.option('-o', '--out', type=click.Path(file_okay=False, resolve_path=True), required=True,
+              help='The directory to save the redlines to.')
+@click.option('--docx/--no-docx', default=True, help='Save each redline as a Word document. The default.')
+@click.option('--pdf', is_flag=True, help='Export each redline, with markup, to PDF.')
+@click.option('--for-screen', 'optimize', flag_value=C.wdExportOptimizeForOnScreen,
+              default=C.wdExportOptimizeForPrint, help='Export PDFs for screen rather than for print.')
+@click.option('--author', help='The author of the revisions. Defaults to Word\'s user name.')
+@click.option('--character-level', is_flag=True, help='Mark changes by character rather than by word.')
+@click.option('--ignore-formatting', is_flag=True, help='Do not mark changes of formatting.')
+@click.option('-j', '--jobs', type=click.IntRange(1), default=1,
+              help='The number of instances of Word to run in parallel. Defaults to 1.')
+def compare(docs, pairs, out, docx, pdf, optimize, author, character_level, ignore_formatting, jobs):
+    '''
+    Compare pairs of documents and save the redlines.
+
+    Pairs are given as ORIGINAL REVISED arguments and/or in a '--pairs'
+    file. Each pair is compared in Word (as with Review > Compare) and the
+    redline is saved to the '--out' directory as REVISED-redline.docx (and
+    .pdf with '--pdf'), or with the name given in the '--pairs' file:
+
+    \b
+        msw compare --pdf --out redlines draft.docx final.docx
+        msw compare --pairs deal.csv --out redlines --jobs 4
+
+    The number of revisions of each pair is listed. Pairs whose documents
+    are byte-identical are skipped without opening them in Word.
+    '''
+    if len(docs) % 2:
+        raise click.BadParameter('Expected pairs of documents.', param_hint='ORIGINAL REVISED')
+    if not docx and not pdf:
+        raise click.UsageError('Nothing to do with both \'--no-docx\' and no \'--pdf\'.')
+    items = [(docs[i], docs[i + 1], None) for i in range(0, len(docs), 2)]
+    if pairs:
+        try:
+            items += read_pairs(pairs)
+        except (ValueError, EnvironmentError, csv.Error) as e:
+            raise click.BadParameter(str(e), param_hint='--pairs')
+    if not items:
+        raise click.UsageError('No documents to compare.')
+    options = {
+        'Granularity':       C.wdGranularityCharLevel if character_level else C.wdGranularityWordLevel,
+        'CompareFormatting': not ignore_formatting
+    }
+    if author:
+        options['RevisedAuthor'] = author
+    export = export_options(C.wdExportFormatPDF, optimize, True, False, False, C.wdExportCreateNoBookmarks,
+                            False, False, False)
+    jobs_list = []
+    identical = 0
+    for original, revised, name in items:
+        for path in (original, revised):
+            if not os.path.isfile(path):
+                raise click.BadParameter('"%s" does not exist.' % path, param_hint='--pairs')
+        if same_contents(original, revised):
+            click.echo('%s -> %s: identical, skipped' % (original, revised))
+            identical += 1
+            continue
+        stem = os.path.join(out, UNSAFE_FILENAME.sub('_', name) if name else
+                            os.path.splitext(os.path.basename(revised))[0] + '-redline')
+        jobs_list.append((original, revised, stem + '.docx' if docx else None, stem + '.pdf' if pdf else None,
+                          options, export))
+    check_destinations([(job[1], dest) for job in jobs_list for dest in job[2:4] if dest])
+    if not os.path.isdir(out):
+        os.makedirs(out)
+    total = 0
+    batch = Batch('compare', jobs, verbose=False)
+    for job, count in batch.run(compare_documents, jobs_list, lambda job: '%s -> %s' % job[:2]):
+        click.echo('%s -> %s: %d revision(s)' % (job[0], job[1], count))
+        total += count
+    click.echo('Compared %d pair(s): %d revision(s), %d identical pair(s) skipped.' % (
+        batch.completed, total, identical))
+    batch.check()
+
+
+# =========================================================
+# Shared directory job queue
+# =========================================================
+
+def export_document(app, job):
+    '''
+    Open the document at src read-only and hidden in app, export it to dest
+    with the ExportAsFixedFormat options and close it. If the job includes
+    a true 'verify', the PDF is then checked with verify_pdf.
+    '''
+    src, dest, options = job[:3]
+    verify = len(job) > 3 and job[3]
+    options = dict({'Range': C.wdExportAllDocument}, **options)
+    doc = open_hidden(app, src)
+    try:
+        doc.ExportAsFixedFormat(OutputFileName=dest, **options)
+        if verify:
+            pages = (options['From'], options['To']) if options['Range'] == C.wdExportFromTo else None
+            verify_pdf(dest, expected_pages(doc, pages), options.get('UseISO19005_1'))
+    finally:
+        doc.Close(C.wdDoNotSaveChanges)
+    return dest
+
+
+def print_document(app, job):
+    '''
+    Open the document at src read-only and hidden in app and print it with
+    the PrintOut options (in the foreground), to the file dest if it is set.
+    '''
+    src, dest, options = job
+    options = dict(options, Background=False)
+    if dest:
+        options.update(PrintToFile=True, OutputFileName=dest)
+    doc = open_hidden(app, src)
+    try:
+        doc.PrintOut(**options)
+    finally:
+        doc.Close(C.wdDoNotSaveChanges)
+    return dest
+
+
+# The functions which run each kind of queued job: func(app, args)
+QUEUE_JOBS = {
+    'convert': convert_document,
+    'export':  export_document,
+    'print':   print_document
+}
+
+# The priority classes of queued jobs, most urgent first. A pending job is
+# only claimed once no job of a more urgent class is pending.
+PRIORITIES = OrderedDict([
+    ('urgent',   0),
+    ('normal',   1),
+    ('backfill', 2)
+])
+
+# The name of a pending or leased job: the rank of its priority class, the
+# time it was submitted, a sequence number, a random part and its tenant.
+JOB_NAME = re.compile(r'^(\d)-\d{13}-\d{6}-[0-9a-f]{8}-([\w.]+?)(?:~|\.json$)')
+
+
+def job_fields(name):
+    '''
+    Return the (priority rank, tenant) of the file name of a job. Jobs named
+    before there were priorities are 'normal' jobs of the 'default' tenant.
+    '''
+    match = JOB_NAME.match(name)
+    if match is None:
+        return PRIORITIES['normal'], 'default'
+    return int(match.group(1)), match.group(2)
+
+
+class Lease(object):
+    '''
+    A job claimed from a JobQueue by a worker. While the lease is active (as
+    a context manager) a thread touches the lease file every 'interval'
+    seconds to show that the worker is alive. 'lost' is set if the lease
+    has been reclaimed by another worker.
+    '''
+    def __init__(self, path, job, interval):
+        self.path = path
+        self.job = job
+        self.interval = interval
+        self.lost = False
+        self.started = time.time()
+        self._stop = threading.Event()
+
+    def heartbeat(self):
+        ''' Renew the lease. Returns False if it has been lost. '''
+        try:
+            os.utime(self.path, None)
+        except OSError:
+            self.lost = True
+        return not self.lost
+
+    def _beat(self):
+        while not self._stop.wait(self.interval):
+            if not self.heartbeat():
+                break
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._beat)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+class Admission(object):
+    '''
+    Decides whether a worker may start another queued job, given the load of
+    its host: the percentage of CPU in use, the MB of memory available and
+    the number of instances of Word restarted after a failure in the last
+    'window' seconds. A limit of None is not checked, nor is a reading which
+    the host cannot provide (CPU and memory need psutil, although the load
+    average is used for the CPU where there is one). The readings are shared
+    by every worker and taken at most once every 'interval' seconds.
+    on_throttle(reason) is called when jobs start to be held back.
+    '''
+    def __init__(self, max_cpu=None, min_memory=None, max_restarts=None, window=300, interval=1.0,
+                 on_throttle=None):
+        self.max_cpu = max_cpu
+        self.min_memory = min_memory
+        self.max_restarts = max_restarts
+        self.window = window
+        self.interval = interval
+        self.on_throttle = on_throttle
+        self.throttled = False
+        self._restarts = deque()
+        self._readings = None
+        self._taken = 0
+        self._lock = threading.Lock()
+
+    def readings(self):
+        ''' Return the (CPU percentage, MB of memory available) of the host; either may be None. '''
+        with self._lock:
+            if self._readings is None or time.time() - self._taken >= self.interval:
+                cpu = memory = None
+                if psutil is not None:
+                    cpu = psutil.cpu_percent()
+                    memory = psutil.virtual_memory().available / 1048576.0
+                elif hasattr(os, 'getloadavg'):
+                    cpu = 100.0 * os.getloadavg()[0] / multiprocessing.cpu_count()
+                self._readings = cpu, memory
+                self._taken = time.time()
+            return self._readings
+
+    def restarted(self):
+        ''' Record that an instance of Word was restarted after a failure. '''
+        with self._lock:
+            self._restarts.append(time.time())
+
+    def check(self):
+        '''
+        Return None if another job may start or the reason it may not, which
+        is counted in METRICS.
+        '''
+        with self._lock:
+            while self._restarts and time.time() - self._restarts[0] > self.window:
+                self._restarts.popleft()
+            restarts = len(self._restarts)
+        cpu, memory = self.readings()
+        if self.max_restarts is not None and restarts >= self.max_restarts:
+            reason = 'word'
+            message = '%d instances of Word restarted in the last %d seconds.' % (restarts, self.window)
+        elif self.max_cpu is not None and cpu is not None and cpu > self.max_cpu:
+            reason, message = 'cpu', 'CPU at %.0f%% (limit %.0f%%).' % (cpu, self.max_cpu)
+        elif self.min_memory is not None and memory is not None and memory < self.min_memory:
+            reason, message = 'memory', '%d MB of memory available (limit %d MB).' % (memory, self.min_memory)
+        else:
+            self.throttled = False
+            return None
+        METRICS.inc('msw_admission_throttled_total', reason=reason)
+        if not self.throttled and self.on_throttle:
+            self.on_throttle(message)
+        self.throttled = True
+        return message
+
+
+class JobQueue(object):
+    '''
+    A queue of jobs in a directory shared by any number of workers on any
+    number of hosts. Each job is a JSON file which moves between the
+    subdirectories 'pending', 'leased', 'done' and 'failed' by renaming,
+    which is atomic, so exactly one worker can claim a job. A worker keeps
+    its lease alive by touching the lease file; a lease which has not been
+    touched for lease_timeout seconds is returned to 'pending' by the next
+    worker to notice, up to max_attempts times. So is a job whose export
+    fails verification.
+
+    Each job has a priority class (see PRIORITIES) and a tenant. The jobs of
+    the most urgent class are claimed first, and within a class the tenant
+    with the fewest jobs running (on any host) and claimed by this queue of
+    its last fair_window claims goes first, so that one tenant's backlog
+    does not hold up the others.
+    '''
+    STATES = ('pending', 'leased', 'done', 'failed')
+
+    def __init__(self, path, lease_timeout=60, max_attempts=3, fair_window=100):
+        self.path = path
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        # Orders the jobs submitted in the same millisecond
+        self._sequence = itertools.count()
+        # The tenants of the last jobs claimed
+        self._served = deque(maxlen=fair_window)
+        self._lock = threading.Lock()
+        for state in self.STATES + ('tmp',):
+            directory = os.path.join(path, state)
+            if not os.path.isdir(directory):
+                try:
+                    os.makedirs(directory)
+                except OSError:
+                    # Created by another worker in the meantime
+                    if not os.path.isdir(directory):
+                        raise
+
+    def _path(self, state, name):
+        return os.path.join(self.path, state, name)
+
+    def _write(self, state, name, record):
+        ''' Write record to state/name atomically (by way of tmp). '''
+        tmp = self._path('tmp', '%s.%s' % (uuid.uuid4().hex, name))
+        with io.open(tmp, 'w', encoding='utf-8') as f:
+            f.write(type('')(json.dumps(record)))
+        getattr(os, 'replace', os.rename)(tmp, self._path(state, name))
+
+    def _read(self, path):
+        with io.open(path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def submit(self, kind, args, priority='normal', tenant='default'):
+        '''
+        Add a job to run QUEUE_JOBS[kind](app, args) with the priority class
+        priority for tenant and return its id.
+        '''
+        tenant = re.sub(r'[^\w.]', '_', tenant) or 'default'
+        jobid = '%d-%013d-%06d-%s-%s' % (PRIORITIES[priority], int(time.time() * 1000),
+                                         next(self._sequence) % 1000000, uuid.uuid4().hex[:8], tenant)
+        self._write('pending', jobid + '.json', dict(id=jobid, kind=kind, args=args, attempts=0,
+                                                     priority=priority, tenant=tenant, submitted=time.time()))
+        return jobid
+
+    def claim(self, worker):
+        '''
+        Claim the next pending job (see JobQueue) for worker and return a
+        Lease, or None if there are no pending jobs. The time the job waited
+        is recorded in METRICS by its priority class.
+        '''
+        pending = [name for name in os.listdir(os.path.join(self.path, 'pending')) if name.endswith('.json')]
+        if not pending:
+            return None
+        shares = {}
+        with self._lock:
+            served = list(self._served)
+        for tenant in [job_fields(name)[1] for name in os.listdir(os.path.join(self.path, 'leased'))] + served:
+            shares[tenant] = shares.get(tenant, 0) + 1
+
+        def order(name):
+            rank, tenant = job_fields(name)
+            return rank, shares.get(tenant, 0), name
+
+        for name in sorted(pending, key=order):
+            lease = self._path('leased', '%s~%s.json' % (name[:-5], worker))
+            try:
+                # Touched first so that the lease does not look expired when
+                # the job has waited longer than lease_timeout
+                os.utime(self._path('pending', name), None)
+                os.rename(self._path('pending', name), lease)
+            except OSError:
+                # Claimed by another worker
+                continue
+            try:
+                job = self._read(lease)
+            except (OSError, IOError):
+                # Reclaimed by another worker already
+                continue
+            with self._lock:
+                self._served.append(job_fields(name)[1])
+            METRICS.observe('msw_queue_wait_seconds', time.time() - job.get('queued', job['submitted']),
+                            priority=job.get('priority', 'normal'))
+            return Lease(lease, job, self.lease_timeout / 3.0)
+        return None
+
+    def complete(self, lease, worker, result=None, error=None):
+        '''
+        Record the result (or error) of the job of lease in 'done' (or
+        'failed') and release the lease. Returns False, recording nothing, if
+        the lease was lost.
+        '''
+        if lease.lost or not os.path.exists(lease.path):
+            return False
+        record = dict(lease.job, worker=worker, started=lease.started, finished=time.time())
+        if error is None:
+            record['result'] = result
+        else:
+            record['error'] = error
+        self._write('done' if error is None else 'failed', lease.job['id'] + '.json', record)
+        try:
+            os.remove(lease.path)
+        except OSError:
+            pass
+        return True
+
+    def retry(self, lease, worker, error):
+        '''
+        Return the job of lease to 'pending' to be run again after error,
+        unless it has been attempted max_attempts times or the lease was
+        lost. Returns True if the job was returned.
+        '''
+        if lease.lost or not os.path.exists(lease.path):
+            return False
+        job = dict(lease.job, last_error=error, attempts=lease.job.get('attempts', 0) + 1, queued=time.time())
+        if job['attempts'] >= self.max_attempts:
+            return False
+        self._write('pending', job['id'] + '.json', job)
+        try:
+            os.remove(lease.path)
+        except OSError:
+            pass
+        return True
+
+    def reclaim(self, worker):
+        '''
+        Return the jobs whose leases have expired to 'pending' (or move them to
+        'failed' after max_attempts). Returns the number of leases reclaimed.
+        '''
+        count = 0
+        now = time.time()
+        for name in os.listdir(os.path.join(self.path, 'leased')):
+            path = self._path('leased', name)
+            try:
+                if now - os.path.getmtime(path) < self.lease_timeout:
+                    continue
+                # Take the lease over so that only one worker reclaims it
+                tmp = self._path('tmp', '%s.%s' % (worker, name))
+                os.rename(path, tmp)
+            except OSError:
+                continue
+            job = self._read(tmp)
+            job['attempts'] = job.get('attempts', 0) + 1
+            owner = name[:-5].partition('~')[2]
+            if job['attempts'] >= self.max_attempts:
+                job['error'] = 'The lease expired %d times (last held by %s).' % (job['attempts'], owner)
+                self._write('failed', job['id'] + '.json', job)
+            else:
+                job['queued'] = time.time()
+                self._write('pending', job['id'] + '.json', job)
+            os.remove(tmp)
+            count += 1
+        return count
+
+    def status(self):
+        ''' Return an OrderedDict of the number of jobs in each state. '''
+        return OrderedDict((state, len([name for name in os.listdir(os.path.join(self.path, state))
+                                        if name.endswith('.json')]))
+                           for state in self.STATES)
+
+    def waiting(self):
+        '''
+        Return an OrderedDict of the (number of pending jobs, seconds the
+        longest of them has waited or None) of each priority class.
+        '''
+        names = dict((rank, priority) for priority, rank in PRIORITIES.items())
+        waiting = OrderedDict((priority, (0, None)) for priority in PRIORITIES)
+        now = time.time()
+        for name in os.listdir(os.path.join(self.path, 'pending')):
+            priority = names.get(job_fields(name)[0])
+            if not name.endswith('.json') or priority is None:
+                continue
+            try:
+                # Jobs are written to 'pending' when they are (re)queued
+                wait = now - os.path.getmtime(self._path('pending', name))
+            except OSError:
+                # Claimed in the meantime
+                continue
+            count, longest = waiting[priority]
+            waiting[priority] = count + 1, max(wait, longest or 0)
+        return waiting
+
+    def work(self, worker, factory=None, exit_when_empty=False, poll=1.0, report=None, admission=None):
+        '''
+        Claim and run jobs on an instance of Word created by factory (on first
+        use) until there are no jobs left (if exit_when_empty) or forever.
+        report(job, result, error) is called after each job. If an Admission
+        is given, no job is claimed while it holds them back. Returns the
+        number of jobs run.
+        '''
+        factory = factory or new_instance
+        app = None
+        count = 0
+        if pythoncom is not None:
+            pythoncom.CoInitialize()
+        try:
+            while True:
+                self.reclaim(worker)
+                throttled = admission is not None and admission.check() is not None
+                lease = None if throttled else self.claim(worker)
+                if lease is None:
+                    status = self.status()
+                    if exit_when_empty and not status['leased'] and not (throttled and status['pending']):
+                        break
+                    time.sleep(poll)
+                    continue
+                job = lease.job
+                result = error = code = None
+                retry = False
+                with lease:
+                    try:
+                        if app is None:
+                            app = factory()
+                        result = QUEUE_JOBS[job['kind']](app, tuple(job['args']))
+                    except Exception as e:
+                        if isinstance(e, com_error) and e.args and e.args[0] in RPC_ERRORS:
+                            METRICS.inc('msw_word_restarts_total')
+                            if admission is not None:
+                                admission.restarted()
+                            app = None
+                        error = error_message(e)
+                        code = error_code(e) if isinstance(e, com_error) else 'unknown'
+                        retry = isinstance(e, VerificationError)
+                if retry and self.retry(lease, worker, error):
+                    # Reported once it has run again
+                    continue
+                if self.complete(lease, worker, result, error):
+                    count += 1
+                    if error is None:
+                        METRICS.inc('msw_documents_processed_total', command='queue')
+                    else:
+                        METRICS.inc('msw_failures_total', command='queue', code=code)
+                    if report:
+                        report(job, result, error)
+        finally:
+            if app is not None:
+                try:
+                    app.Quit(C.wdDoNotSaveChanges)
+                except com_error:
+                    pass
+            if pythoncom is not None:
+                pythoncom.CoUninitialize()
+        return count
+
+
+def worker_name(index=0):
+    ''' Return a name for a worker which is unique across hosts and processes. '''
+    return re.sub(r'[^\w.-]', '_', '%s-%d-%d' % (socket.gethostname(), os.getpid(), index))
+
+
+SRC_ARGUMENT = click.Argument(['src'], nargs=-1, required=True,
+                              type=click.Path(exists=True, dir_okay=False, resolve_path=True))
+
+
+def queue_convert_jobs(args):
+    ''' Return the (kind, args) of the jobs for 'convert' and its arguments. '''
+    params = convert.make_context('convert', list(args)).params
+    fileformat, ext = SAVE_FORMATS[params['fmt']]
+    jobs = [('convert', [path, os.path.join(params['out'], os.path.splitext(os.path.basename(path))[0] + ext),
+                         fileformat, ENCODINGS[params['encoding']]]) for path in params['src']]
+    check_destinations(job[:2] for kind, job in jobs)
+    if not os.path.isdir(params['out']):
+        os.makedirs(params['out'])
+    return jobs
+
+
+def queue_export_jobs(args):
+    ''' Return the (kind, args) of the jobs for 'export PATH SRC...' and the export options. '''
+    command = click.Command('export', params=export.params + [SRC_ARGUMENT])
+    params = command.make_context('export', list(args)).params
+    for name, hint in (('show', '--show'), ('range', '--current-page/--selection')):
+        if params[name]:
+            raise click.BadParameter('Cannot be queued.', param_hint=hint)
+    if params['shards'] > 1:
+        raise click.BadParameter('Cannot be queued.', param_hint='--shards')
+    options = export_options(*[params[name] for name in ('format', 'optimize', 'markup', 'properties', 'irm',
+                                                          'bookmarks', 'struct', 'bitmap', 'useiso19005_1')])
+    if params['pages']:
+        options.update(Range=C.wdExportFromTo, From=params['pages'][0], To=params['pages'][1])
+    if params['verify'] and params['format'] != C.wdExportFormatPDF:
+        raise click.BadParameter('Only PDF exports can be verified.', param_hint='--verify')
+    # Jobs are only verified if asked, so that they run on workers without verification
+    verify = [True] if params['verify'] else []
+    ext = '.pdf' if params['format'] == C.wdExportFormatPDF else '.xps'
+    path = params['path']
+    if len(params['src']) > 1 or os.path.isdir(path):
+        jobs = [('export', [src, os.path.join(path, os.path.splitext(os.path.basename(src))[0] + ext), options]
+                 + verify) for src in params['src']]
+        check_destinations(job[:2] for kind, job in jobs)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        return jobs
+    if os.path.splitext(path)[1].lower() not in ['.pdf', '.xps']:
+        path += ext
+    return [('export', [params['src'][0], path, options] + verify)]
+
+
+def queue_print_jobs(args):
+    ''' Return the (kind, args) of the jobs for 'print [--out DIR] SRC...' and the print options. '''
+    out = click.Option(['--out'], type=click.Path(file_okay=False, resolve_path=True),
+                       help='Print each document to a file in this directory.')
+    command = click.Command('print', params=prnt.params + [out, SRC_ARGUMENT])
+    params = command.make_context('print', list(args)).params
+    for name, hint in (('range', '--current-page/--selection'), ('to_file', '--to-file'), ('append', '--append')):
+        if params[name]:
+            raise click.BadParameter('Cannot be queued.', param_hint=hint)
+    names = ('copies', 'pages', 'pagetype', 'range', 'item', 'no_collate', 'to_file', 'append', 'columns', 'rows')
+    options = print_options(*[params[name] for name in names])
+    jobs = [('print', [src, os.path.join(params['out'], os.path.splitext(os.path.basename(src))[0] + '.prn')
+                       if params['out'] else None, options]) for src in params['src']]
+    if params['out']:
+        check_destinations(job[:2] for kind, job in jobs)
+        if not os.path.isdir(params['out']):
+            os.makedirs(params['out'])
+    return jobs
+
+
+# Functions returning the jobs to submit for each kind from its command line arguments
+QUEUE_SUBMITTERS = OrderedDict([
+    ('convert', queue_convert_jobs),
+    ('export',  queue_export_jobs),
+    ('print',   queue_print_jobs)
+])
+
+
+@cli.command('queue', context_settings=dict(ignore_unknown_options=True))
+@click.argument('action', type=click.Choice(['submit', 'work', 'status']))
+@click.argument('queue_dir', metavar='QUEUE', type=click.Path(file_okay=False, resolve_path=True))
+@click.argument('args', nargs=-1, type=click.UNPROCESSED)
+@click.option('--workers', type=click.IntRange(1), default=1,
+              help='The number of instances of Word each \'work\' process runs. Defaults to 1.')
+@click.option('--lease-timeout', type=float, default=60,
+              help='Seconds after which the job of a worker which has stopped responding is '
+              'reclaimed. Defaults to 60.')
+@click.option('--max-attempts', type=click.IntRange(1), default=3,
+              help='The number of times a job is attempted before it fails. Defaults to 3.')
+@click.option('--poll', type=float, default=1.0, help='Seconds between checks for new jobs. Defaults to 1.')
+@click.option('--exit-when-empty', is_flag=True, help='Stop working once there are no jobs left.')
+@click.option('--priority', type=click.Choice(list(PRIORITIES)), default='normal',
+              help='The priority class of submitted jobs. Defaults to normal.')
+@click.option('--tenant', default='default', envvar='MSW_TENANT',
+              help='The tenant (eg. team or client) whose share submitted jobs count against.')
+@click.option('--max-cpu', type=float, help='Start no job while more than this percentage of CPU is in use.')
+@click.option('--min-memory', type=int, help='Start no job while less than this many MB of memory are available.')
+@click.option('--max-restarts', type=click.IntRange(1),
+              help='Start no job while this many instances of Word have been restarted in the last 5 minutes.')
+def queue_command(action, queue_dir, args, workers, lease_timeout, max_attempts, poll, exit_when_empty,
+                  priority, tenant, max_cpu, min_memory, max_restarts):
+    '''
+    Distribute jobs to workers on many hosts.
+
+    QUEUE is a directory shared by every host (eg. on a network share).
+
+    'queue submit QUEUE convert|export|print ARGS...' adds a job to QUEUE
+    for each document. The ARGS are those of the 'convert' command, of the
+    'export' command followed by the SRC documents, or of the 'print'
+    command followed by the SRC documents (with '--out DIR' to print each
+    to a file in DIR rather than to the worker's printer). For example:
+
+    \b
+        msw queue submit Q convert --to pdf --out \\\\share\\out a.doc b.doc
+        msw queue submit Q export --for-screen \\\\share\\out a.docx b.docx
+
+    'queue work QUEUE' runs jobs from QUEUE on '--workers' hidden instances
+    of Word until stopped (or until no jobs are left with '--exit-when-empty').
+    Results are written to QUEUE/done and failures to QUEUE/failed. The job
+    of a worker which dies is returned to the queue after '--lease-timeout'.
+    The options of 'queue' itself must come before the ACTION:
+
+    \b
+        msw queue --workers 4 work \\\\share\\Q
+        msw queue --priority urgent --tenant legal submit \\\\share\\Q ...
+
+    Jobs of the 'urgent' priority class are claimed before 'normal' jobs,
+    which are claimed before 'backfill' jobs. Within a class the tenants
+    take turns. '--max-cpu', '--min-memory' and '--max-restarts' hold back
+    new jobs while the host is busy or Word keeps failing ('--max-cpu' and
+    '--min-memory' need psutil on Windows).
+
+    'queue status QUEUE' outputs the number of jobs in each state and how
+    long the pending jobs of each priority class have waited.
+    '''
+    jobs = JobQueue(queue_dir, lease_timeout, max_attempts)
+    if action == 'submit':
+        if not args or args[0] not in QUEUE_SUBMITTERS:
+            raise click.UsageError('Expected one of %s after QUEUE.' % ', '.join(QUEUE_SUBMITTERS))
+        try:
+            submitted = QUEUE_SUBMITTERS[args[0]](args[1:])
+        except click.ClickException as e:
+            raise click.UsageError('%s: %s' % (args[0], e.format_message()))
+        for kind, job_args in submitted:
+            jobs.submit(kind, job_args, priority, tenant)
+        click.echo('Submitted %d job(s) to %s' % (len(submitted), queue_dir))
+    elif action == 'work':
+        if args:
+            raise click.UsageError('Unexpected arguments: %s' % ' '.join(args))
+
+        def report(job, result, error):
+            if error is None:
+                click.echo('Done: %s %s' % (job['kind'], job['args'][0]))
+            else:
+                click.echo('Failed: %s %s: %s' % (job['kind'], job['args'][0], error), err=True)
+
+        admission = None
+        if (max_cpu, min_memory, max_restarts) != (None, None, None):
+            admission = Admission(max_cpu, min_memory, max_restarts,
+                                  on_throttle=lambda reason: click.echo('Holding back jobs: %s' % reason, err=True))
+        threads = [threading.Thread(target=jobs.work, args=(worker_name(i),),
+                                    kwargs=dict(exit_when_empty=exit_when_empty, poll=poll, report=report,
+                                                admission=admission))
+                   for i in range(workers)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(0.5)
     else:
-        click.echo('\nNo open documents found.')
+        for state, count in jobs.status().items():
+            click.echo('%s: %d' % (state, count))
+        for name, (count, longest) in jobs.waiting().items():
+            if count:
+                click.echo('pending %s: %d (longest wait %.0f seconds)' % (name, count, longest))
+
+
+# =========================================================
+# PDF binders
+# =========================================================
+
+# The directory in which exported PDFs are cached. See ExportCache.
+EXPORT_CACHE = os.path.join(click.get_app_dir('msw'), 'exports')
+
+
+class ExportCache(object):
+    '''
+    A directory of PDFs exported from documents, keyed by the contents of
+    each document and the export options. A document is only exported again
+    once it or the options change.
+    '''
+    def __init__(self, path):
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def key(self, src, options):
+        ''' Return the key of the export of the document at src with options. '''
+        digest = hashlib.sha1(file_hash(src).encode('ascii'))
+        digest.update(json.dumps(options, sort_keys=True).encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, key):
+        ''' Return the path of the cached PDF of key or None. '''
+        path = os.path.join(self.path, key + '.pdf')
+        return path if os.path.isfile(path) else None
+
+    def temp(self, key):
+        ''' Return a path to export the PDF of key to before it is added. '''
+        return os.path.join(self.path, '%s.%s.tmp' % (key, uuid.uuid4().hex[:8]))
+
+    def put(self, key, tmp):
+        ''' Add the PDF at tmp to the cache as key and return its path. '''
+        path = os.path.join(self.path, key + '.pdf')
+        getattr(os, 'replace', os.rename)(tmp, path)
+        return path
+
+
+@cli.command('binder')
+@click.argument('src', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False, resolve_path=True))
+@click.option('-o', '--out', type=click.Path(dir_okay=False, resolve_path=True), required=True,
+              help='The PDF file to write the binder to.')
+@click.option('--for-screen', 'optimize', flag_value=C.wdExportOptimizeForOnScreen,
+              default=C.wdExportOptimizeForPrint, help='Export for screen rather than for print.')
+@click.option('--with-word-bookmarks', 'bookmarks', flag_value=C.wdExportCreateWordBookmarks,
+              default=C.wdExportCreateHeadingBookmarks,
+              help='Nest the Word bookmarks of each document rather than its headings.')
+@click.option('--cache', type=click.Path(file_okay=False, resolve_path=True), envvar='MSW_EXPORT_CACHE',
+              default=EXPORT_CACHE, help='The directory of cached exports. Defaults to the user\'s app '
+              'directory or the MSW_EXPORT_CACHE environment variable.')
+@click.option('--no-cache', is_flag=True, help='Export every document, without the cache.')
+@click.option('--verify', is_flag=True,
+              help='Check that each export is complete and has all of the pages of its document, '
+              'exporting it once more if not.')
+@click.option('--sanitize', is_flag=True,
+              help='Export copies of the documents with tracked changes accepted and comments and personal '
+              'properties removed (see the \'sanitize\' command). OOXML documents only.')
+@click.option('-j', '--jobs', type=click.IntRange(1), default=1,
+              help='The number of instances of Word exporting in parallel. Defaults to 1.')
+def binder(src, out, optimize, bookmarks, cache, no_cache, verify, sanitize, jobs):
+    '''
+    Merge many documents into one PDF.
+
+    Each SRC document is exported to PDF (SRC PDFs are included as is) and
+    the PDFs are merged, in order, into the '--out' file with a top-level
+    bookmark for each document (named after its file) and the bookmarks of
+    its headings nested underneath:
+
+    \b
+        msw binder --out closing.pdf --jobs 4 deal\\*.docx
+
+    Exports are cached, so documents which have not changed since the last
+    binder are not exported again. The binder is written as the exports
+    complete, one page at a time, so memory use does not grow with the
+    size of the binder.
+    '''
+    if sanitize:
+        legacy = [path for path in src if os.path.splitext(path)[1].lower() != '.pdf' and not is_ooxml(path)]
+        if legacy:
+            raise click.BadParameter('Only OOXML documents can be sanitized: %s' % ', '.join(legacy),
+                                     param_hint="'--sanitize'")
+    options = export_options(C.wdExportFormatPDF, optimize, False, False, False, bookmarks, False, False, False)
+    tmpdir = tempfile.mkdtemp(prefix='msw-')
+    try:
+        store = ExportCache(tmpdir if no_cache else cache)
+        sources = [None] * len(src)
+        items = []
+        cached = 0
+        for i, path in enumerate(src):
+            if os.path.splitext(path)[1].lower() == '.pdf':
+                sources[i] = path
+                continue
+            key = store.key(path, dict(options, Sanitize=True) if sanitize else options)
+            sources[i] = store.get(key)
+            if sources[i] is None:
+                items.append((i, path, key))
+            else:
+                cached += 1
+
+        sanitized = {}
+        if sanitize and items:
+            # Word exports sanitized copies, named as the documents are
+            copies = dict((path, os.path.join(tmpdir, str(i), os.path.basename(path))) for i, path, key in items)
+            for copy in copies.values():
+                os.makedirs(os.path.dirname(copy))
+            packages = PackageBatch('binder', jobs)
+            for job, record in packages.run(_sanitize_package, [(path, copies[path], False) for path in copies]):
+                click.echo('Sanitized %s' % sanitize_summary(record))
+                sanitized[job[0]] = copies[job[0]]
+            if packages.failures:
+                raise click.ClickException('%d of %d documents could not be sanitized.' % (
+                    len(packages.failures), len(copies)))
+
+        def export_job(app, item):
+            i, path, key = item
+            tmp = store.temp(key)
+            try:
+                export_document(app, (sanitized.get(path, path), tmp, options, verify))
+            except Exception:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise
+            return tmp
+
+        batch = Batch('binder', jobs)
+        exported = batch.run(export_job, items, lambda item: item[1])
+
+        def stream():
+            # Merge each document as soon as it and those before it are ready
+            pending = None
+            for i, path in enumerate(src):
+                title = os.path.splitext(os.path.basename(path))[0]
+                if sources[i] is not None:
+                    yield sources[i], title
+                    continue
+                if pending is None:
+                    pending = next(exported, None)
+                if pending is not None and pending[0][0] == i:
+                    (i, path, key), tmp = pending
+                    pending = None
+                    yield store.put(key, tmp), title
+                # Otherwise its export failed and it is left out
+
+        click.echo('Binding %d document(s) (%d from the cache)...' % (len(src), cached))
+        try:
+            pages = merge_pdfs(stream(), out)
+        except (PdfError, EnvironmentError) as e:
+            raise click.ClickException('Unable to merge the exported documents: %s' % e)
+        click.echo('Wrote %d page(s) to "%s"' % (pages, out))
+        if batch.failures:
+            raise click.ClickException('%d of %d documents failed and are missing from the binder.' % (
+                len(batch.failures), len(src)))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+# =========================================================
+# Interactive shell
+# =========================================================
+
+def split_line(line):
+    '''
+    Split a command line into arguments. Arguments may be quoted with single
+    or double quotes. Backslashes are left as is (as in Windows paths).
+    '''
+    lexer = shlex.shlex(line, posix=True)
+    lexer.whitespace_split = True
+    lexer.escape = ''
+    return list(lexer)
+
+
+class DocumentNames(object):
+    '''
+    The names of the documents open in app, cached for tab completion. The
+    names are fetched again only when the number of open documents changes
+    or after 'stale' is set (eg. after a document is saved under a new name).
+    '''
+    def __init__(self, app):
+        self.app = app
+        self.names = []
+        self.count = None
+        self.stale = True
+
+    def __call__(self):
+        try:
+            count = self.app.Documents.Count
+            if self.stale or count != self.count:
+                self.names = [doc.Name for doc in self.app.Documents]
+                self.count = count
+                self.stale = False
+        except (com_error, click.ClickException):
+            return []
+        return self.names
+
+
+class Shell(cmd.Cmd):
+    '''
+    Reads and runs lines of commands of group (which take the same arguments
+    as on the command line) until 'exit' or the end of input.
+    '''
+    prompt = 'msw> '
+    intro = 'MSWord-CLI shell. Type \'help\' for the commands or \'exit\' to quit.'
+    # Commands after which the names of open documents may have changed
+    RENAMES = ('save',)
+
+    def __init__(self, group, app, stdin=None, stdout=None):
+        cmd.Cmd.__init__(self, stdin=stdin, stdout=stdout)
+        self.group = group
+        self.documents = DocumentNames(app)
+        if stdin is not None:
+            self.use_rawinput = False
+
+    def preloop(self):
+        try:
+            import readline
+        except ImportError:
+            return
+        # Complete whole words, including those with hyphens and paths
+        readline.set_completer_delims(' \t\n')
+
+    def emptyline(self):
+        pass
+
+    def do_exit(self, line):
+        ''' Exit the shell. '''
+        return True
+
+    do_quit = do_exit
+
+    def do_EOF(self, line):
+        self.stdout.write('\n')
+        return True
+
+    def do_help(self, line):
+        ''' Show the help of the shell or of a command. '''
+        self.run(split_line(line) + ['--help'])
+        if not line:
+            click.echo('\nRun several commands on one line as with \'msw\'. Type \'exit\' to quit.')
+
+    def default(self, line):
+        try:
+            args = split_line(line)
+        except ValueError as e:
+            click.echo('Error: %s' % e, err=True)
+            return
+        self.run(args)
+
+    def run(self, args):
+        ''' Run the commands of args, reporting errors rather than exiting. '''
+        if 'shell' in args:
+            click.echo('Error: The shell is already running.', err=True)
+            return
+        try:
+            self.group.main(args, prog_name='msw', standalone_mode=False)
+        except click.ClickException as e:
+            e.show()
+        except click.Abort:
+            click.echo('Aborted!', err=True)
+        except com_error as e:
+            click.echo('Error: %s' % error_message(e), err=True)
+        except SystemExit:
+            pass
+        if any(arg in self.RENAMES for arg in args):
+            self.documents.stale = True
+
+    def command(self, words):
+        ''' Return the command (of a chain of commands) which the last of words belong to. '''
+        for word in reversed(words):
+            command = self.group.commands.get(word)
+            if command is not None:
+                return command
+        return None
+
+    def completenames(self, text, *ignored):
+        names = list(self.group.list_commands(None)) + ['exit', 'help', 'quit']
+        return [name for name in names if name.startswith(text)]
+
+    def completedefault(self, text, line, begidx, endidx):
+        try:
+            words = split_line(line[:begidx])
+        except ValueError:
+            return []
+        command = self.command(words)
+        if command is None:
+            return []
+        params = dict((opt, param) for param in command.params if isinstance(param, click.Option)
+                      for opt in param.opts + param.secondary_opts)
+        if text.startswith('-'):
+            return sorted(opt for opt in list(params) + ['--help'] if opt.startswith(text))
+        option = params.get(words[-1]) if words else None
+        if option is not None and not option.is_flag:
+            candidates = getattr(option.type, 'choices', None)
+            if candidates is not None:
+                return [choice for choice in candidates if choice.startswith(text)]
+            return self.complete_path(text)
+        if command.name == 'activate' and words[-1] == 'activate':
+            # Its only argument is a document
+            return ['"%s"' % name if ' ' in name else name for name in self.documents()
+                    if name.startswith(text.strip('"'))]
+        candidates = self.completenames(text)
+        if any(isinstance(param, click.Argument) and isinstance(param.type, click.Path) for param in command.params):
+            candidates += self.complete_path(text)
+        return candidates
+
+    def complete_path(self, text):
+        return [path + os.sep if os.path.isdir(path) else path for path in glob.glob(text + '*')]
+
+
+@cli.command('shell')
+def shell():
+    '''
+    Run commands interactively in one session.
+
+    Each line is run as the arguments of 'msw' (one command or a chain of
+    commands), for example:
+
+    \b
+        msw> open report.docx
+        msw> export --for-screen report.pdf close
+
+    Word is started (or attached to) once and plugins are loaded once, so
+    each command runs without the delay of starting 'msw'. Press Tab to
+    complete commands, options, paths and the names of open documents
+    (after 'activate'). Type 'exit' or press Ctrl+Z (Ctrl+D) to quit.
+    '''
+    stdin = click.get_text_stream('stdin')
+    Shell(cli, WORD, stdin=None if stdin.isatty() else stdin).cmdloop()
 
 
 # Get and load commands from plugins
-for plugin in iter_entry_points(group='msw.plugin'):
-    cli.add_command(plugin.load())
+with PROFILER.phase('plugins'):
+    for plugin in iter_entry_points(group='msw.plugin'):
+        cli.add_command(plugin.load())
 
    
 if __name__ == '__main__':
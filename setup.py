@@ -15,8 +15,13 @@ setup(
     py_modules=['msword_cli'],
     install_requires=[
         'pywin32',
-        'click>=3'
+        'click>=3',
+        'futures; python_version < "3"'
     ],
+    extras_require={
+        'preview': ['Pillow'],
+        'admission': ['psutil']
+    },
     entry_points='''
         [console_scripts]
         msw=msword_cli:cli
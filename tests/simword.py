@@ -0,0 +1,634 @@
+'''
+A simulated Word server for testing and benchmarking on systems without Word.
+
+Unlike the MockApp of tests.util, the simulated Word runs in a separate
+process and every property access and method call is a round trip to it,
+as it is with COM. Like Word, the server handles one call at a time, so
+calls from several clients queue up behind each other. Costs and failures
+are configurable (see Profile): the latency of each call, the time to open
+and render a document in proportion to its size, memory which grows with
+each document opened, calls rejected because the server is busy, failed
+commands and crashes.
+
+    >>> app = dispatch_ex(latency=('lognormal', -7, 0.5), render_cost_per_mb=0.2)
+    >>> doc = app.Documents.Open(FileName='foo.docx')
+    >>> doc.ExportAsFixedFormat(OutputFileName='foo.pdf', ExportFormat=17)
+    >>> doc.Close(0)
+    >>> app.Quit()
+
+Errors are raised as msword_cli.com_error with the HRESULTs Word would
+give, so the error handling of msword_cli can be exercised. dispatch_ex
+stands in for win32com.client.DispatchEx and factory(**config) returns a
+factory for WordPool, Batch and JobQueue. To benchmark a batch:
+
+    python -m tests.simword --docs 40 --jobs 4 --latency 0.002
+'''
+from __future__ import unicode_literals
+from multiprocessing.connection import Listener, Client, wait
+import multiprocessing
+import itertools
+import threading
+import functools
+import random
+import shutil
+import time
+import os
+
+import msword_cli
+from msword_cli import com_error
+from .util import make_docx, make_pdf
+
+# HRESULTs
+DISP_E_EXCEPTION = -2147352567        # 0x80020009: Exception occurred (details in excepinfo)
+RPC_E_CALL_REJECTED = -2147418111     # 0x80010001: Call was rejected by callee.
+RPC_S_SERVER_UNAVAILABLE = -2147023174  # 0x800706BA: The RPC server is unavailable.
+RPC_E_DISCONNECTED = -2147417848      # 0x80010108: The object invoked has disconnected from its clients.
+# Word's own error codes (in excepinfo[5])
+WD_FILE_NOT_FOUND = -2146823114       # 0x800A1436
+WD_COMMAND_FAILED = -2146824090       # 0x800A1066
+WD_NO_DOCUMENT = -2146824040          # 0x800A1098
+WD_BAD_INDEX = -2146822347            # 0x800A1735
+
+
+class Profile(object):
+    '''
+    The costs and failures of a simulated Word. Times are in seconds and
+    may be a number or a distribution: ('uniform', low, high),
+    ('normal', mean, stddev), ('lognormal', mu, sigma) of the log of the
+    time, or ('exponential', mean). Rates are probabilities per call.
+
+    latency:             the cost of every call (the IPC round trip).
+    startup:             the time to start the server.
+    open_cost:           the fixed cost of opening a document...
+    open_cost_per_mb:    ...plus this per MB of the document's file.
+    render_cost:         the fixed cost of exporting, printing or saving...
+    render_cost_per_mb:  ...plus this per MB (in proportion to the pages rendered).
+    page_size:           the bytes of file per page of a document.
+    memory_per_document: bytes allocated (and never freed) for each document opened.
+    memory_limit:        bytes beyond which the server crashes.
+    busy_rate:           calls rejected with RPC_E_CALL_REJECTED.
+    failure_rate:        opens, saves, exports and prints which fail.
+    crash_rate:          calls on which the server dies.
+    crash_after:         the number of calls after which the server dies.
+    fail_paths:          substrings of the paths of documents which fail to open.
+    seed:                the seed of the random choices.
+    '''
+    DEFAULTS = dict(latency=0, startup=0, open_cost=0, open_cost_per_mb=0, render_cost=0,
+                    render_cost_per_mb=0, page_size=20000, memory_per_document=0, memory_limit=None,
+                    busy_rate=0, failure_rate=0, crash_rate=0, crash_after=None, fail_paths=(), seed=None)
+
+    def __init__(self, **config):
+        unknown = set(config) - set(self.DEFAULTS)
+        if unknown:
+            raise TypeError('Unknown settings: %s' % ', '.join(sorted(unknown)))
+        for name, default in self.DEFAULTS.items():
+            setattr(self, name, config.get(name, default))
+
+    def __repr__(self):
+        return 'Profile(%s)' % ', '.join('%s=%r' % (name, getattr(self, name)) for name in sorted(self.DEFAULTS))
+
+
+def sample(spec, rng):
+    ''' Return a time in seconds from the number or distribution spec. '''
+    if not spec:
+        return 0
+    if isinstance(spec, (int, float)):
+        return spec
+    kind, args = spec[0], spec[1:]
+    if kind == 'uniform':
+        return rng.uniform(*args)
+    if kind == 'normal':
+        return max(rng.gauss(*args), 0)
+    if kind == 'lognormal':
+        return rng.lognormvariate(*args)
+    if kind == 'exponential':
+        return rng.expovariate(1.0 / args[0])
+    raise ValueError('Unknown distribution: %r' % (kind,))
+
+
+class WordError(Exception):
+    ''' An error raised by a simulated object: (message, scode). '''
+
+
+class Crash(Exception):
+    ''' Raised to kill the server without replying. '''
+
+
+class Ref(object):
+    ''' A reference to a server object, as passed between the client and server. '''
+    def __init__(self, id, typename, methods):
+        self.id = id
+        self.typename = typename
+        self.methods = methods
+
+
+# =========================================================
+# Simulated objects (in the server process)
+# =========================================================
+
+class SimObject(object):
+    ''' A simulated object. Names in METHODS are methods, anything else is a property. '''
+    METHODS = ()
+
+
+class SimRevisions(SimObject):
+    def __init__(self, count=0):
+        self.Count = count
+
+
+def count_changes(first, second, block=1024):
+    ''' Return the number of blocks of the files at first and second which differ. '''
+    count = 0
+    with open(first, 'rb') as a, open(second, 'rb') as b:
+        while True:
+            x, y = a.read(block), b.read(block)
+            if not x and not y:
+                return count
+            count += x != y
+
+
+class SimDocument(SimObject):
+    METHODS = ('Activate', 'Close', 'ComputeStatistics', 'ExportAsFixedFormat', 'PrintOut', 'Save',
+               'SaveAs', 'SaveAs2')
+
+    def __init__(self, app, path=None, visible=True, readonly=False):
+        self.app = app
+        self.source = path
+        self.size = os.path.getsize(path) if path else 0
+        self.FullName = os.path.abspath(path) if path else 'Document%d' % next(app.counter)
+        self.Name = os.path.basename(self.FullName)
+        self.Path = os.path.dirname(self.FullName) if path else ''
+        self.ReadOnly = readonly
+        self.Visible = visible
+        self.Saved = True
+        self.Revisions = SimRevisions()
+
+    @property
+    def pages(self):
+        return max(self.size // self.app.profile.page_size, 1)
+
+    def Activate(self):
+        self.app.active = self
+
+    def Close(self, SaveChanges=None, *args, **kwargs):
+        self.app.docs.remove(self)
+        if self.app.active is self:
+            self.app.active = self.app.docs[-1] if self.app.docs else None
+
+    def ComputeStatistics(self, Statistic, *args):
+        if Statistic == msword_cli.C.wdStatisticPages:
+            return self.pages
+        return self.size // 6
+
+    def ExportAsFixedFormat(self, OutputFileName, ExportFormat, Range=0, From=1, To=None, **kwargs):
+        pages = self.pages
+        if Range == msword_cli.C.wdExportFromTo:
+            pages = max(min(To or pages, self.pages) - From + 1, 0)
+        self.app.render(self, pages)
+        if ExportFormat == msword_cli.C.wdExportFormatPDF:
+            make_pdf(OutputFileName, pages, bookmarks=bool(kwargs.get('CreateBookmarks')))
+        else:
+            with open(OutputFileName, 'wb') as f:
+                f.write(b'PK\x05\x06' + b'\x00' * 18)
+
+    def PrintOut(self, Background=True, PrintToFile=False, OutputFileName=None, Append=False, **kwargs):
+        if PrintToFile and OutputFileName:
+            with open(OutputFileName, 'ab' if Append else 'wb') as f:
+                f.write(b'%!PS-Adobe-3.0\n%%Title: ' + self.Name.encode('utf-8') + b'\n%%EOF\n')
+        if Background:
+            self.app.spool(self)
+        else:
+            self.app.render(self, self.pages)
+
+    def Save(self, *args, **kwargs):
+        if self.source is None:
+            raise WordError('Use SaveAs to name a new document.')
+        self.app.render(self, self.pages)
+        self.Saved = True
+
+    def SaveAs2(self, FileName, FileFormat=None, **kwargs):
+        self.app.render(self, self.pages)
+        if FileFormat == msword_cli.C.wdFormatPDF:
+            make_pdf(FileName, self.pages)
+        elif self.source and os.path.abspath(FileName) != os.path.abspath(self.source):
+            shutil.copyfile(self.source, FileName)
+        elif not self.source:
+            make_docx(FileName)
+        self.source = FileName
+        self.size = os.path.getsize(FileName)
+        self.FullName = os.path.abspath(FileName)
+        self.Name = os.path.basename(FileName)
+        self.Path = os.path.dirname(self.FullName)
+        self.Saved = True
+
+    def SaveAs(self, FileName, FileFormat=None, **kwargs):
+        self.SaveAs2(FileName, FileFormat, **kwargs)
+
+
+class SimDocuments(SimObject):
+    METHODS = ('Add', 'Close', 'Item', 'Open', 'Save')
+
+    def __init__(self, app):
+        self.app = app
+
+    @property
+    def Count(self):
+        return len(self.app.docs)
+
+    def Item(self, index):
+        for i, doc in enumerate(self.app.docs, start=1):
+            if index == i or index == doc.Name:
+                return doc
+        raise WordError('The requested member of the collection does not exist.', WD_BAD_INDEX)
+
+    def Open(self, FileName, ReadOnly=False, Visible=True, **kwargs):
+        app = self.app
+        if not os.path.isfile(FileName) or any(part in FileName for part in app.profile.fail_paths):
+            raise WordError('Sorry, we couldn\'t find your file. Was it moved, renamed, or deleted?\n(%s)' %
+                            FileName, WD_FILE_NOT_FOUND)
+        app.maybe_fail()
+        doc = SimDocument(app, FileName, Visible, ReadOnly)
+        app.wait(sample(app.profile.open_cost, app.rng) + app.profile.open_cost_per_mb * doc.size / 1e6)
+        app.allocate()
+        app.docs.append(doc)
+        app.active = doc
+        app.stats['documents_opened'] += 1
+        return doc
+
+    def Add(self, Template=None, NewTemplate=False, DocumentType=0, Visible=True):
+        app = self.app
+        doc = SimDocument(app, visible=Visible)
+        app.allocate()
+        app.docs.append(doc)
+        app.active = doc
+        return doc
+
+    def Close(self, *args, **kwargs):
+        for doc in list(self.app.docs):
+            doc.Close()
+
+    def Save(self, *args, **kwargs):
+        for doc in self.app.docs:
+            if doc.source:
+                doc.Save()
+
+
+class SimApplication(SimObject):
+    METHODS = ('CompareDocuments', 'Quit', 'SimStats')
+
+    def __init__(self, profile):
+        self.profile = profile
+        self.rng = random.Random(profile.seed)
+        self.counter = itertools.count(1)
+        self.docs = []
+        self.active = None
+        self.spooling = []
+        self.memory = []
+        self.Documents = SimDocuments(self)
+        self.Visible = False
+        self.DisplayAlerts = -1
+        self.ScreenUpdating = True
+        self.Version = '16.0'
+        self.Name = 'Microsoft Word'
+        self.quitting = False
+        self.stats = dict(calls=0, busy=0, failures=0, documents_opened=0, render_time=0.0)
+
+    @property
+    def ActiveDocument(self):
+        if self.active is None:
+            raise WordError('This command is not available because no document is open.', WD_NO_DOCUMENT)
+        return self.active
+
+    @property
+    def BackgroundPrintingStatus(self):
+        now = time.time()
+        self.spooling = [until for until in self.spooling if until > now]
+        return len(self.spooling)
+
+    def CompareDocuments(self, OriginalDocument, RevisedDocument, Destination=2, **kwargs):
+        for doc in (OriginalDocument, RevisedDocument):
+            self.render(doc, doc.pages)
+        redline = self.Documents.Add()
+        redline.size = RevisedDocument.size
+        if OriginalDocument.source and RevisedDocument.source:
+            redline.Revisions = SimRevisions(count_changes(OriginalDocument.source, RevisedDocument.source))
+        return redline
+
+    def Quit(self, *args, **kwargs):
+        self.quitting = True
+
+    def SimStats(self):
+        ''' Return the counters of the server (not part of Word). '''
+        return dict(self.stats, memory=sum(len(block) for block in self.memory), pid=os.getpid())
+
+    # Simulation helpers
+
+    def wait(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def render_time(self, doc, pages):
+        per_mb = self.profile.render_cost_per_mb * doc.size / 1e6 * pages / max(doc.pages, 1)
+        return sample(self.profile.render_cost, self.rng) + per_mb
+
+    def render(self, doc, pages):
+        self.maybe_fail()
+        seconds = self.render_time(doc, pages)
+        self.stats['render_time'] += seconds
+        self.wait(seconds)
+
+    def spool(self, doc):
+        self.maybe_fail()
+        start = max(self.spooling + [time.time()])
+        self.spooling.append(start + self.render_time(doc, doc.pages))
+
+    def maybe_fail(self):
+        if self.profile.failure_rate and self.rng.random() < self.profile.failure_rate:
+            self.stats['failures'] += 1
+            raise WordError('Command failed', WD_COMMAND_FAILED)
+
+    def allocate(self):
+        if self.profile.memory_per_document:
+            self.memory.append(bytearray(self.profile.memory_per_document))
+            limit = self.profile.memory_limit
+            if limit and sum(len(block) for block in self.memory) > limit:
+                raise Crash()
+
+
+# =========================================================
+# The server
+# =========================================================
+
+class Server(object):
+    ''' Handles the calls of any number of clients to one SimApplication, one at a time. '''
+    def __init__(self, profile):
+        self.profile = profile
+        self.app = SimApplication(profile)
+        self.objects = {}
+
+    def ref(self, obj):
+        self.objects[id(obj)] = obj
+        return Ref(id(obj), type(obj).__name__, type(obj).METHODS)
+
+    def encode(self, value):
+        if isinstance(value, SimObject):
+            return self.ref(value)
+        return value
+
+    def decode(self, value):
+        if isinstance(value, Ref):
+            return self.objects[value.id]
+        return value
+
+    def handle(self, request):
+        '''
+        Return the reply to a request: (op, ref, name, args, kwargs) where op
+        is 'get', 'set' or 'call'. The reply is ('ok', value) or ('error',
+        hresult, message, excepinfo).
+        '''
+        app = self.app
+        profile = self.profile
+        app.stats['calls'] += 1
+        app.wait(sample(profile.latency, app.rng))
+        if profile.crash_after is not None and app.stats['calls'] > profile.crash_after:
+            raise Crash()
+        if profile.crash_rate and app.rng.random() < profile.crash_rate:
+            raise Crash()
+        if profile.busy_rate and app.rng.random() < profile.busy_rate:
+            app.stats['busy'] += 1
+            return ('error', RPC_E_CALL_REJECTED, 'Call was rejected by callee.', None)
+        op, ref, name, args, kwargs = request
+        obj = self.objects[ref.id] if ref else app
+        args = [self.decode(arg) for arg in args]
+        kwargs = dict((key, self.decode(value)) for key, value in kwargs.items())
+        try:
+            if name.startswith('_') or (op == 'call') != (name in type(obj).METHODS):
+                raise AttributeError(name)
+            if op == 'get':
+                value = getattr(obj, name)
+            elif op == 'set':
+                setattr(obj, name, args[0])
+                value = None
+            else:
+                value = getattr(obj, name)(*args, **kwargs)
+        except WordError as e:
+            message, scode = (e.args + (WD_COMMAND_FAILED,))[:2]
+            return ('error', DISP_E_EXCEPTION, 'Exception occurred.',
+                    (0, 'Microsoft Word', message, None, 0, scode))
+        except (AttributeError, TypeError) as e:
+            return ('error', -2147352570, 'Unknown name.', (0, None, str(e), None, 0, 0))
+        return ('ok', self.encode(value))
+
+    def serve(self, listener, timeout=0.05):
+        ''' Serve clients until Quit is called or every client has disconnected. '''
+        connections = []
+        lock = threading.Lock()
+
+        def accept():
+            while True:
+                try:
+                    conn = listener.accept()
+                except (EOFError, IOError, OSError):
+                    break
+                with lock:
+                    connections.append(conn)
+
+        thread = threading.Thread(target=accept)
+        thread.daemon = True
+        thread.start()
+        connected = False
+        while True:
+            with lock:
+                current = list(connections)
+            if not current:
+                if connected:
+                    return
+                time.sleep(timeout)
+                continue
+            connected = True
+            for conn in wait(current, timeout):
+                try:
+                    request = conn.recv()
+                except (EOFError, IOError, OSError):
+                    with lock:
+                        connections.remove(conn)
+                    continue
+                try:
+                    reply = self.handle(request)
+                except Crash:
+                    os._exit(3)
+                conn.send(reply)
+                if self.app.quitting:
+                    return
+
+
+def run_server(config, pipe, authkey):
+    ''' The main function of a server process. Sends its address to the parent through pipe. '''
+    profile = Profile(**config)
+    time.sleep(sample(profile.startup, random.Random(profile.seed)))
+    listener = Listener(authkey=authkey)
+    pipe.send(listener.address)
+    pipe.close()
+    Server(profile).serve(listener)
+    listener.close()
+
+
+# =========================================================
+# The client
+# =========================================================
+
+class Connection(object):
+    ''' A client's connection to a server. Safe to share between threads. '''
+    def __init__(self, address, authkey, process=None):
+        self.conn = Client(address, authkey=authkey)
+        self.process = process
+        self.lock = threading.Lock()
+        self.broken = False
+        self.app = Dispatch(self, None, 'SimApplication', SimApplication.METHODS)
+
+    def request(self, op, ref, name, args=(), kwargs=None):
+        args = [arg._ref if isinstance(arg, Dispatch) else arg for arg in args]
+        kwargs = dict((key, value._ref if isinstance(value, Dispatch) else value)
+                      for key, value in (kwargs or {}).items())
+        with self.lock:
+            if self.broken:
+                raise com_error(RPC_E_DISCONNECTED, 'The object invoked has disconnected from its clients.',
+                                None, None)
+            try:
+                self.conn.send((op, ref, name, args, kwargs))
+                reply = self.conn.recv()
+            except (EOFError, IOError, OSError):
+                self.broken = True
+                raise com_error(RPC_S_SERVER_UNAVAILABLE, 'The RPC server is unavailable.', None, None)
+            if op == 'call' and name == 'Quit' and ref is None:
+                self.close()
+        if reply[0] == 'error':
+            raise com_error(*reply[1:] + (None,))
+        value = reply[1]
+        if isinstance(value, Ref):
+            return Dispatch(self, value, value.typename, value.methods)
+        return value
+
+    def close(self):
+        self.broken = True
+        self.conn.close()
+        if self.process is not None:
+            self.process.join(5)
+
+
+class Dispatch(object):
+    ''' A client's proxy of a server object, like a late-bound win32com dispatch. '''
+    def __init__(self, connection, ref, typename, methods):
+        self.__dict__.update(_connection=connection, _ref=ref, _typename=typename, _methods=methods)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if name in self._methods:
+            return functools.partial(self._call, name)
+        return self._connection.request('get', self._ref, name)
+
+    def __setattr__(self, name, value):
+        self._connection.request('set', self._ref, name, (value,))
+
+    def _call(self, name, *args, **kwargs):
+        return self._connection.request('call', self._ref, name, args, kwargs)
+
+    def __iter__(self):
+        for i in range(1, self.Count + 1):
+            yield self.Item(i)
+
+    def __eq__(self, other):
+        return isinstance(other, Dispatch) and other._connection is self._connection and \
+            getattr(other._ref, 'id', None) == getattr(self._ref, 'id', None)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(getattr(self._ref, 'id', None))
+
+    def __repr__(self):
+        return '<simulated %s>' % self._typename
+
+
+def start_server(**config):
+    '''
+    Start a simulated Word server process with the settings of a Profile and
+    return (process, address, authkey).
+    '''
+    Profile(**config)
+    authkey = os.urandom(16)
+    parent, child = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=run_server, args=(config, child, authkey))
+    process.daemon = True
+    process.start()
+    child.close()
+    address = parent.recv()
+    parent.close()
+    return process, address, authkey
+
+
+def connect(address, authkey, process=None):
+    ''' Connect to a running server and return its Application (like Dispatch). '''
+    return Connection(address, authkey, process).app
+
+
+def dispatch_ex(**config):
+    ''' Start a new server and return its Application (like DispatchEx). '''
+    process, address, authkey = start_server(**config)
+    return connect(address, authkey, process)
+
+
+def factory(**config):
+    '''
+    Return a function which starts a new server on each call, for the
+    'factory' of WordPool, Batch and JobQueue. Each server is given a
+    different seed.
+    '''
+    seeds = itertools.count(config.pop('seed', None) or 0)
+    lock = threading.Lock()
+
+    def new_instance():
+        with lock:
+            seed = next(seeds)
+        app = dispatch_ex(seed=seed, **config)
+        app.Visible = False
+        app.DisplayAlerts = msword_cli.C.wdAlertsNone
+        return app
+    return new_instance
+
+
+if __name__ == '__main__':
+    import click
+    import tempfile
+
+    @click.command()
+    @click.option('--docs', default=20, help='The number of documents to convert.')
+    @click.option('--size', default=100000, help='The size of each document in bytes.')
+    @click.option('-j', '--jobs', default=1, help='The number of simulated instances of Word.')
+    @click.option('--latency', default=0.001, help='The mean latency of each call in seconds.')
+    @click.option('--render-cost-per-mb', default=1.0, help='Seconds to render each MB.')
+    @click.option('--failure-rate', default=0.0, help='The probability that a command fails.')
+    def benchmark(docs, size, jobs, latency, render_cost_per_mb, failure_rate):
+        ''' Benchmark converting documents to PDF on simulated instances of Word. '''
+        tmpdir = tempfile.mkdtemp(prefix='simword-')
+        try:
+            items = []
+            for i in range(docs):
+                path = os.path.join(tmpdir, 'doc%d.docx' % i)
+                make_docx(path, parts={'padding.bin': os.urandom(size)})
+                items.append((path, path + '.pdf', msword_cli.C.wdFormatPDF, 65001))
+            new_instance = factory(latency=('exponential', latency) if latency else 0,
+                                   render_cost_per_mb=render_cost_per_mb, failure_rate=failure_rate)
+            batch = msword_cli.Batch('convert', jobs, new_instance, verbose=False)
+            start = time.time()
+            for item in batch.run(msword_cli.convert_document, items):
+                pass
+            elapsed = time.time() - start
+            click.echo('%d documents in %.2fs (%.1f/s), %d failed' % (
+                docs, elapsed, docs / elapsed, len(batch.failures)))
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    benchmark()
@@ -3,7 +3,7 @@ import mock
 from click.testing import CliRunner
 import msword_cli
 from .util import MockApp
-from pywintypes import com_error
+from msword_cli import com_error
 
 class TestListCommand(unittest.TestCase):
     def setUp(self):
@@ -0,0 +1,116 @@
+import unittest
+import mock
+from click.testing import CliRunner
+import msword_cli
+from .util import touch
+import os
+
+
+class TestRecordingBackend(unittest.TestCase):
+    def setUp(self):
+        self.runner = CliRunner()
+        self.addCleanup(msword_cli.set_backend, 'com')
+
+    def test_commands(self):
+        ''' Test a chain of commands is recorded rather than run. '''
+        with self.runner.isolated_filesystem():
+            touch('foo.docx')
+            result = self.runner.invoke(msword_cli.cli, ['--backend', 'recording', 'open', 'foo.docx',
+                                                         'export', '--pages', '2-3', 'out', 'docs', 'close'])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn('[1] foo.docx', result.output)
+            calls = msword_cli.BACKEND.calls
+            path = os.path.abspath('foo.docx')
+            self.assertEqual([(action, doc) for action, doc, details in calls],
+                             [('open', path), ('export', path), ('close', path)])
+            self.assertEqual(calls[1][2]['path'], os.path.abspath('out.pdf'))
+            self.assertEqual(calls[1][2]['Pages'], (2, 3))
+            self.assertFalse(os.path.exists('out.pdf'))
+
+    def test_errors(self):
+        ''' Test missing files and unsupported calls are reported as Word's errors. '''
+        with self.runner.isolated_filesystem():
+            result = self.runner.invoke(msword_cli.cli, ['--backend', 'recording', 'new', 'export', '--xps',
+                                                         '--current-page', 'out'])
+            self.assertEqual(result.exit_code, 1)
+            self.assertIn('Only whole documents and page ranges can be exported by the recording backend',
+                          result.output)
+            app = msword_cli.BACKEND.new_instance()
+            with self.assertRaises(msword_cli.com_error) as cm:
+                app.Documents.Open(FileName='missing.docx')
+            self.assertIn('missing.docx', msword_cli.error_message(cm.exception))
+            with self.assertRaises(msword_cli.com_error) as cm:
+                app.Options
+            self.assertEqual(msword_cli.error_message(cm.exception),
+                             'Options is not supported by the recording backend.')
+
+    def test_documents(self):
+        ''' Test the Documents collection tracks the active document. '''
+        with self.runner.isolated_filesystem():
+            touch('foo.docx')
+            app = msword_cli.RecordingApplication()
+            foo = app.Documents.Open(FileName='foo.docx')
+            new = app.Documents.Add()
+            self.assertEqual(app.ActiveDocument, new)
+            self.assertEqual(app.Documents.Item('foo.docx'), foo)
+            app.Documents.Item(1).Activate()
+            self.assertEqual(app.ActiveDocument, foo)
+            with self.assertRaises(msword_cli.com_error):
+                new.Save()
+            foo.Close()
+            self.assertEqual(app.ActiveDocument, new)
+            app.Quit()
+            self.assertEqual(app.Documents.Count, 0)
+
+    def test_batch(self):
+        ''' Test the batch commands use instances of the backend. '''
+        with self.runner.isolated_filesystem():
+            touch('foo.doc')
+            touch('bar.doc')
+            result = self.runner.invoke(msword_cli.cli, ['--backend', 'recording', 'convert', '--to', 'txt',
+                                                         '-j', '2', '--out', 'out', 'foo.doc', 'bar.doc'])
+            self.assertEqual(result.exit_code, 0, result.output)
+            saves = [details for action, doc, details in msword_cli.BACKEND.calls if action == 'save']
+            self.assertEqual(sorted(details['path'] for details in saves),
+                             [os.path.abspath(os.path.join('out', name)) for name in ['bar.txt', 'foo.txt']])
+            self.assertEqual(saves[0]['format'], msword_cli.C.wdFormatText)
+
+
+class TestSofficeBackend(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(msword_cli.set_backend, 'com')
+
+    @mock.patch('msword_cli.uno', None)
+    def test_unavailable(self):
+        ''' Test a missing UNO bridge is reported. '''
+        result = CliRunner().invoke(msword_cli.cli, ['--backend', 'soffice', 'docs'])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn('LibreOffice (with its Python UNO bridge) is not available', result.output)
+
+    @mock.patch('msword_cli.PropertyValue', lambda Name, Value: (Name, Value))
+    @mock.patch('msword_cli.uno')
+    def test_export(self, uno):
+        ''' Test exports are stored with the PDF filter and the options as its filter data. '''
+        uno.systemPathToFileUrl.side_effect = lambda path: 'file://' + path
+        uno.Any.side_effect = lambda kind, value: value
+        desktop = mock.MagicMock()
+        component = desktop.loadComponentFromURL.return_value
+        app = msword_cli.SofficeApplication(desktop)
+        with CliRunner().isolated_filesystem():
+            touch('foo.docx')
+            doc = msword_cli.open_hidden(app, 'foo.docx')
+            path = os.path.abspath('foo.pdf')
+            options = msword_cli.export_options(msword_cli.C.wdExportFormatPDF,
+                                                msword_cli.C.wdExportOptimizeForOnScreen, False, False, False,
+                                                msword_cli.C.wdExportCreateHeadingBookmarks, False, False, True)
+            msword_cli.export_fixed_format(doc, path, options, pages=(2, 3))
+            self.assertEqual(desktop.loadComponentFromURL.call_args[0][:2],
+                             ('file://' + os.path.abspath('foo.docx'), '_blank'))
+        url, properties = component.storeToURL.call_args[0]
+        self.assertEqual(url, 'file://' + path)
+        properties = dict(properties)
+        self.assertEqual(properties['FilterName'], 'writer_pdf_Export')
+        self.assertEqual(dict(properties['FilterData']), {
+            'ExportBookmarks': True, 'ExportNotes': False, 'PageRange': '2-3', 'ReduceImageResolution': True,
+            'SelectPdfVersion': 1, 'UseTaggedPDF': True
+        })
@@ -0,0 +1,76 @@
+import unittest
+import mock
+from click.testing import CliRunner
+import msword_cli
+from . import simword
+from .util import make_docx, make_pdf
+import os
+
+
+def titles(nodes):
+    return [(node['title'].text(), titles(node['children'])) for node in nodes]
+
+
+class TestBinderCommand(unittest.TestCase):
+    def setUp(self):
+        self.runner = CliRunner()
+
+    def make_docs(self):
+        make_docx('a.docx', parts={'padding.bin': os.urandom(40000)})
+        make_docx('b.docx')
+        make_pdf('c.pdf', pages=2)
+
+    def test_binder(self):
+        ''' Test documents are exported and merged with a bookmark for each. '''
+        with self.runner.isolated_filesystem():
+            self.make_docs()
+            with mock.patch('msword_cli.new_instance', simword.factory(page_size=20000)):
+                result = self.runner.invoke(msword_cli.binder, ['--cache', 'cache', '-j', '2', '--out', 'binder.pdf',
+                                                                'a.docx', 'c.pdf', 'b.docx'])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn('Wrote 5 page(s)', result.output)
+            with msword_cli.PdfReader('binder.pdf') as reader:
+                self.assertEqual(len(reader.pages()), 5)
+                outlines = reader.outlines()
+            self.assertEqual(titles(outlines), [
+                ('a', [('Page 1', []), ('Page 2', [])]),
+                ('c', []),
+                ('b', [('Page 1', [])])
+            ])
+            self.assertEqual(len(os.listdir('cache')), 2)
+
+    def test_cache(self):
+        ''' Test unchanged documents are not exported again. '''
+        with self.runner.isolated_filesystem():
+            self.make_docs()
+            args = ['--cache', 'cache', '--out', 'binder.pdf', 'a.docx', 'b.docx']
+            with mock.patch('msword_cli.new_instance', simword.factory()):
+                result = self.runner.invoke(msword_cli.binder, args)
+            self.assertEqual(result.exit_code, 0, result.output)
+            with mock.patch('msword_cli.new_instance') as new_instance:
+                result = self.runner.invoke(msword_cli.binder, args)
+                self.assertEqual(result.exit_code, 0, result.output)
+                self.assertIn('(2 from the cache)', result.output)
+                self.assertFalse(new_instance.called)
+                # A changed document is exported again
+                make_docx('b.docx', body='<w:p><w:r><w:t>Changed</w:t></w:r></w:p>')
+                new_instance.return_value = mock.MagicMock()
+                new_instance.return_value.Documents.Open.return_value.ExportAsFixedFormat.side_effect = \
+                    lambda OutputFileName, **kwargs: make_pdf(OutputFileName)
+                result = self.runner.invoke(msword_cli.binder, args)
+                self.assertEqual(result.exit_code, 0, result.output)
+                self.assertIn('(1 from the cache)', result.output)
+                kwargs = new_instance.return_value.Documents.Open.return_value.ExportAsFixedFormat.call_args[1]
+                self.assertEqual(kwargs['CreateBookmarks'], msword_cli.C.wdExportCreateHeadingBookmarks)
+
+    def test_failures(self):
+        ''' Test documents which fail to export are left out and reported. '''
+        with self.runner.isolated_filesystem():
+            self.make_docs()
+            with mock.patch('msword_cli.new_instance', simword.factory(fail_paths=['a.docx'])):
+                result = self.runner.invoke(msword_cli.binder, ['--no-cache', '--out', 'binder.pdf',
+                                                                'a.docx', 'b.docx', 'c.pdf'])
+            self.assertEqual(result.exit_code, 1, result.output)
+            self.assertIn('1 of 3 documents failed', result.output)
+            with msword_cli.PdfReader('binder.pdf') as reader:
+                self.assertEqual([title for title, children in titles(reader.outlines())], ['b', 'c'])
@@ -4,7 +4,7 @@ from click.testing import CliRunner
 import msword_cli
 from .util import MockApp
 
-@mock.patch('msword_cli.WORD', spec_set=MockApp(['foo.docx']))
+@mock.patch('msword_cli.WORD', spec_set=MockApp(['foo.docx']), BackgroundPrintingStatus=0)
 class TestCloseCommand(unittest.TestCase):
     def setUp(self):
         self.runner = CliRunner()
@@ -47,4 +47,12 @@ class TestCloseCommand(unittest.TestCase):
         result = self.runner.invoke(msword_cli.close)
         self.assertEqual(result.exit_code, 0)
         mock_app.ActiveDocument.Close.assert_called_with(msword_cli.C.wdPromptToSaveChanges)
-        self.assertEqual(mock_app.Quit.called, True)
\ No newline at end of file
+        self.assertEqual(mock_app.Quit.called, True)
+    def test_close_waits_for_spool(self, mock_app):
+        ''' Test close waits for background print jobs to spool. '''
+        with mock.patch('msword_cli.wait_for_spool') as wait:
+            mock_app.BackgroundPrintingStatus = 1
+            result = self.runner.invoke(msword_cli.close)
+            mock_app.BackgroundPrintingStatus = 0
+        self.assertEqual(result.exit_code, 0)
+        wait.assert_called_with(mock_app)
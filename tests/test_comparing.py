@@ -0,0 +1,110 @@
+import unittest
+import mock
+from click.testing import CliRunner
+import msword_cli
+from . import simword
+from .util import make_docx
+import io
+import os
+
+
+class TestCompareCommand(unittest.TestCase):
+    def setUp(self):
+        self.runner = CliRunner()
+        self.app = mock.MagicMock()
+        self.app.CompareDocuments.return_value.Revisions.Count = 3
+        patcher = mock.patch('msword_cli.new_instance', return_value=self.app)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_compare_pair(self):
+        ''' Test comparing a pair saves the redline and exports it with markup. '''
+        with self.runner.isolated_filesystem():
+            make_docx('draft.docx', body='<w:p><w:r><w:t>Draft</w:t></w:r></w:p>')
+            make_docx('final.docx', body='<w:p><w:r><w:t>Final</w:t></w:r></w:p>')
+            result = self.runner.invoke(msword_cli.compare, ['--pdf', '--author', 'Counsel', '--out', 'out',
+                                                             'draft.docx', 'final.docx'])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn('%s -> %s: 3 revision(s)' % (os.path.abspath('draft.docx'), os.path.abspath('final.docx')),
+                          result.output)
+            kwargs = self.app.CompareDocuments.call_args[1]
+            self.assertEqual(kwargs['Destination'], msword_cli.C.wdCompareDestinationNew)
+            self.assertEqual(kwargs['Granularity'], msword_cli.C.wdGranularityWordLevel)
+            self.assertEqual(kwargs['RevisedAuthor'], 'Counsel')
+            redline = self.app.CompareDocuments.return_value
+            stem = os.path.abspath(os.path.join('out', 'final-redline'))
+            redline.SaveAs2.assert_called_with(FileName=stem + '.docx', FileFormat=msword_cli.C.wdFormatXMLDocument,
+                                               AddToRecentFiles=False)
+            export = redline.ExportAsFixedFormat.call_args[1]
+            self.assertEqual(export['OutputFileName'], stem + '.pdf')
+            self.assertEqual(export['Item'], msword_cli.C.wdExportDocumentWithMarkup)
+            redline.Close.assert_called_with(msword_cli.C.wdDoNotSaveChanges)
+
+    def test_identical_skipped(self):
+        ''' Test byte-identical pairs are skipped without Word. '''
+        with self.runner.isolated_filesystem():
+            make_docx('draft.docx')
+            with io.open('draft.docx', 'rb') as f, io.open('copy.docx', 'wb') as g:
+                g.write(f.read())
+            result = self.runner.invoke(msword_cli.compare, ['--out', 'out', 'draft.docx', 'copy.docx'])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn('identical, skipped', result.output)
+            self.assertIn('1 identical pair(s) skipped', result.output)
+            self.assertFalse(self.app.CompareDocuments.called)
+
+    def test_pairs_file(self):
+        ''' Test pairs are read from a CSV file relative to its directory. '''
+        with self.runner.isolated_filesystem():
+            os.mkdir('deal')
+            for name in ('a1', 'a2', 'b1', 'b2'):
+                make_docx(os.path.join('deal', name + '.docx'), body='<w:p><w:r><w:t>%s</w:t></w:r></w:p>' % name)
+            with io.open(os.path.join('deal', 'pairs.csv'), 'w', encoding='utf-8') as f:
+                f.write(u'original,revised,name\na1.docx,a2.docx,Lease\nb1.docx,b2.docx,\n')
+            result = self.runner.invoke(msword_cli.compare, ['--pairs', 'deal/pairs.csv', '--no-docx', '--pdf',
+                                                             '-j', '2', '--out', 'out'])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn('Compared 2 pair(s): 6 revision(s)', result.output)
+            outputs = sorted(c[1]['OutputFileName'] for c in
+                             self.app.CompareDocuments.return_value.ExportAsFixedFormat.call_args_list)
+            self.assertEqual(outputs, [os.path.abspath(os.path.join('out', 'Lease.pdf')),
+                                       os.path.abspath(os.path.join('out', 'b2-redline.pdf'))])
+            self.assertFalse(self.app.CompareDocuments.return_value.SaveAs2.called)
+
+    def test_same_names(self):
+        ''' Test pairs whose redlines would be saved to the same file are rejected. '''
+        with self.runner.isolated_filesystem():
+            for deal in ('dealA', 'dealB'):
+                os.mkdir(deal)
+                make_docx(os.path.join(deal, 'draft.docx'), body='<w:p><w:r><w:t>Draft</w:t></w:r></w:p>')
+                make_docx(os.path.join(deal, 'final.docx'), body='<w:p><w:r><w:t>Final</w:t></w:r></w:p>')
+            result = self.runner.invoke(msword_cli.compare, ['--out', 'out', 'dealA/draft.docx', 'dealA/final.docx',
+                                                             'dealB/draft.docx', 'dealB/final.docx'])
+            self.assertEqual(result.exit_code, 2)
+            self.assertIn('would both be written to', result.output)
+            self.assertIn('final-redline.docx', result.output)
+            self.assertFalse(self.app.CompareDocuments.called)
+            self.assertFalse(os.path.exists('out'))
+
+    def test_bad_arguments(self):
+        ''' Test odd numbers of documents and missing documents are rejected. '''
+        with self.runner.isolated_filesystem():
+            make_docx('draft.docx')
+            result = self.runner.invoke(msword_cli.compare, ['--out', 'out', 'draft.docx'])
+            self.assertEqual(result.exit_code, 2)
+            self.assertIn('Expected pairs of documents', result.output)
+            with io.open('pairs.csv', 'w', encoding='utf-8') as f:
+                f.write(u'original,revised\ndraft.docx,missing.docx\n')
+            result = self.runner.invoke(msword_cli.compare, ['--out', 'out', '--pairs', 'pairs.csv'])
+            self.assertEqual(result.exit_code, 2)
+            self.assertIn('missing.docx', result.output)
+
+    def test_simulated_word(self):
+        ''' Test comparing on simulated instances of Word. '''
+        with self.runner.isolated_filesystem():
+            make_docx('draft.docx', body='<w:p><w:r><w:t>Draft</w:t></w:r></w:p>')
+            make_docx('final.docx', body='<w:p><w:r><w:t>Final text</w:t></w:r></w:p>')
+            with mock.patch('msword_cli.new_instance', simword.factory()):
+                result = self.runner.invoke(msword_cli.compare, ['--pdf', '--out', 'out', 'draft.docx', 'final.docx'])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertEqual(sorted(os.listdir('out')), ['final-redline.docx', 'final-redline.pdf'])
+            self.assertNotIn(': 0 revision(s)', result.output)
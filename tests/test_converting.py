@@ -0,0 +1,105 @@
+import unittest
+import mock
+from click.testing import CliRunner
+import msword_cli
+from .util import touch
+import os
+
+
+class TestConvertCommand(unittest.TestCase):
+    def setUp(self):
+        self.runner = CliRunner()
+        self.app = mock.MagicMock()
+        patcher = mock.patch('msword_cli.new_instance', return_value=self.app)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_convert_defaults(self):
+        ''' Test convert defaults. '''
+        with self.runner.isolated_filesystem():
+            touch('foo.doc')
+            result = self.runner.invoke(msword_cli.convert, ['--out', 'out', 'foo.doc'])
+            self.assertEqual(result.exit_code, 0)
+            self.assertTrue(os.path.isdir('out'))
+            self.app.Documents.Open.assert_called_with(
+                FileName=os.path.abspath('foo.doc'),
+                ReadOnly=True,
+                Visible=False,
+                AddToRecentFiles=False,
+                ConfirmConversions=False
+            )
+            doc = self.app.Documents.Open.return_value
+            doc.SaveAs2.assert_called_with(
+                FileName=os.path.abspath(os.path.join('out', 'foo.docx')),
+                FileFormat=msword_cli.C.wdFormatXMLDocument,
+                Encoding=65001,
+                AddToRecentFiles=False
+            )
+            doc.Close.assert_called_with(msword_cli.C.wdDoNotSaveChanges)
+
+    def test_convert_txt(self):
+        ''' Test convert to text with an encoding. '''
+        with self.runner.isolated_filesystem():
+            touch('foo.doc')
+            result = self.runner.invoke(msword_cli.convert, ['--to', 'txt', '--encoding', 'cp1252',
+                                                             '--out', '.', 'foo.doc'])
+            self.assertEqual(result.exit_code, 0)
+            self.app.Documents.Open.return_value.SaveAs2.assert_called_with(
+                FileName=os.path.abspath('foo.txt'),
+                FileFormat=msword_cli.C.wdFormatText,
+                Encoding=1252,
+                AddToRecentFiles=False
+            )
+
+    def test_convert_many(self):
+        ''' Test converting many documents in parallel. '''
+        with self.runner.isolated_filesystem():
+            names = ['doc%d.doc' % i for i in range(10)]
+            for name in names:
+                touch(name)
+            result = self.runner.invoke(msword_cli.convert, ['--to', 'odt', '-j', '3', '--out', '.'] + names)
+            self.assertEqual(result.exit_code, 0)
+            saved = sorted(c[1]['FileName'] for c in self.app.Documents.Open.return_value.SaveAs2.call_args_list)
+            self.assertEqual(saved, sorted(os.path.abspath(n[:-4] + '.odt') for n in names))
+
+    def test_convert_failure(self):
+        ''' Test a failed conversion is reported without stopping the batch. '''
+        self.app.Documents.Open.side_effect = [
+            msword_cli.com_error(-2147352567, 'Exception occurred.', (0, 'Word', 'Bad file.', None, 0, 0), None),
+            mock.DEFAULT
+        ]
+        with self.runner.isolated_filesystem():
+            touch('bad.doc')
+            touch('good.doc')
+            result = self.runner.invoke(msword_cli.convert, ['--out', '.', 'bad.doc', 'good.doc'])
+            self.assertEqual(result.exit_code, 1)
+            self.assertIn('Failed: %s: Bad file.' % os.path.abspath('bad.docx'), result.output)
+            self.assertIn('1 of 2 documents failed.', result.output)
+            self.assertEqual(self.app.Documents.Open.return_value.SaveAs2.call_count, 1)
+
+    def test_convert_same_names(self):
+        ''' Test documents which would be converted to the same file are rejected. '''
+        with self.runner.isolated_filesystem():
+            os.mkdir('a')
+            os.mkdir('b')
+            touch(os.path.join('a', 'report.doc'))
+            touch(os.path.join('b', 'report.doc'))
+            result = self.runner.invoke(msword_cli.convert, ['--out', 'out', os.path.join('a', 'report.doc'),
+                                                             os.path.join('b', 'report.doc')])
+            self.assertEqual(result.exit_code, 2)
+            self.assertIn('would both be written to "%s"' % os.path.abspath(os.path.join('out', 'report.docx')),
+                          result.output)
+            self.assertFalse(self.app.Documents.Open.called)
+            self.assertFalse(os.path.exists('out'))
+            # Nor can they be queued
+            result = self.runner.invoke(msword_cli.cli, ['queue', 'submit', 'q', 'convert', '--out', 'out',
+                                                         os.path.join('a', 'report.doc'),
+                                                         os.path.join('b', 'report.doc')])
+            self.assertEqual(result.exit_code, 2)
+            self.assertIn('would both be written', result.output)
+            self.assertEqual(msword_cli.JobQueue('q').status()['pending'], 0)
+
+    def test_convert_no_src(self):
+        ''' Test convert with no source documents. '''
+        result = self.runner.invoke(msword_cli.convert, ['--out', '.'])
+        self.assertEqual(result.exit_code, 2)
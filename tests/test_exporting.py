@@ -3,7 +3,7 @@ import mock
 from click.testing import CliRunner
 import msword_cli
 import os
-from .util import MockApp
+from .util import MockApp, make_pdf
 
 @mock.patch('msword_cli.WORD', spec_set=MockApp(['foo.docx']))
 class TestExportCommand(unittest.TestCase):
@@ -362,3 +362,56 @@ class TestExportCommand(unittest.TestCase):
             BitmapMissingFonts=True,
             UseISO19005_1=True                                          # <= Notable kwarg
         )
+
+
+class TestShardedExport(unittest.TestCase):
+    def setUp(self):
+        self.runner = CliRunner()
+
+    def make_instance(self):
+        ''' Return a mock instance of Word which writes PDFs of the requested pages. '''
+        def export(OutputFileName, From, To, **kwargs):
+            make_pdf(OutputFileName, pages=To - From + 1)
+        app = mock.MagicMock()
+        app.Documents.Open.return_value.ExportAsFixedFormat.side_effect = export
+        self.instances.append(app)
+        return app
+
+    def test_split_range(self):
+        ''' Test splitting a page range. '''
+        self.assertEqual(msword_cli.split_range(1, 10, 3), [(1, 4), (5, 7), (8, 10)])
+        self.assertEqual(msword_cli.split_range(3, 4, 3), [(3, 3), (4, 4)])
+
+    @mock.patch('msword_cli.WORD', spec_set=MockApp(['foo.docx']))
+    def test_export_shards(self, mock_app):
+        ''' Test export in shards. '''
+        self.instances = []
+        mock_app.ActiveDocument.ComputeStatistics.return_value = 10
+        with self.runner.isolated_filesystem():
+            with mock.patch('msword_cli.new_instance', self.make_instance):
+                result = self.runner.invoke(msword_cli.export, ['--shards', '3', 'foo.pdf'])
+            self.assertEqual(result.exit_code, 0)
+            self.assertTrue(1 <= len(self.instances) <= 3)
+            self.assertFalse(mock_app.ActiveDocument.ExportAsFixedFormat.called)
+            with msword_cli.PdfReader('foo.pdf') as reader:
+                self.assertEqual(len(reader.pages()), 10)
+            calls = sorted(call[1]['From'] for app in self.instances
+                           for call in app.Documents.Open.return_value.ExportAsFixedFormat.call_args_list)
+            self.assertEqual(calls, [1, 5, 8])
+
+    @mock.patch('msword_cli.WORD', spec_set=MockApp(['foo.docx']))
+    def test_export_shards_range(self, mock_app):
+        ''' Test export of a range of pages in shards. '''
+        self.instances = []
+        with self.runner.isolated_filesystem():
+            with mock.patch('msword_cli.new_instance', self.make_instance):
+                result = self.runner.invoke(msword_cli.export, ['--shards', '2', '--pages', '3-6', 'foo.pdf'])
+            self.assertEqual(result.exit_code, 0)
+            with msword_cli.PdfReader('foo.pdf') as reader:
+                self.assertEqual(len(reader.pages()), 4)
+
+    @mock.patch('msword_cli.WORD', spec_set=MockApp(['foo.docx']))
+    def test_export_shards_xps(self, mock_app):
+        ''' Test XPS exports cannot be sharded. '''
+        result = self.runner.invoke(msword_cli.export, ['--shards', '2', '--xps', 'foo.xps'])
+        self.assertEqual(result.exit_code, 2)
@@ -0,0 +1,102 @@
+import unittest
+import mock
+from click.testing import CliRunner
+import msword_cli
+import json
+import os
+from .util import make_docx, touch
+
+STYLES = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<w:styles xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+    '<w:style w:type="paragraph" w:styleId="Normal"><w:name w:val="Normal"/></w:style>'
+    '<w:style w:type="paragraph" w:styleId="Heading1"><w:name w:val="heading 1"/>'
+    '<w:pPr><w:outlineLvl w:val="0"/></w:pPr></w:style>'
+    '<w:style w:type="paragraph" w:styleId="Chapter"><w:name w:val="Chapter"/>'
+    '<w:basedOn w:val="Heading1"/></w:style>'
+    '<w:style w:type="paragraph" w:styleId="Heading2"><w:name w:val="heading 2"/></w:style>'
+    '</w:styles>'
+)
+
+BODY = (
+    '<w:p><w:pPr><w:pStyle w:val="Heading1"/></w:pPr><w:r><w:t>Title</w:t></w:r></w:p>'
+    '<w:p><w:r><w:t xml:space="preserve">Hello </w:t></w:r><w:ins w:id="1"><w:r><w:t>new</w:t></w:r></w:ins>'
+    '<w:del w:id="2"><w:r><w:delText>old</w:delText></w:r></w:del>'
+    '<w:r><w:tab/><w:t>world</w:t></w:r></w:p>'
+    '<w:tbl><w:tr><w:tc><w:p><w:r><w:t>Cell</w:t></w:r></w:p></w:tc></w:tr></w:tbl>'
+    '<w:p><w:pPr><w:pStyle w:val="Chapter"/></w:pPr><w:r><w:t>One</w:t></w:r></w:p>'
+    '<w:p><w:pPr><w:pStyle w:val="Heading2"/></w:pPr><w:r><w:t>Sub</w:t></w:r></w:p>'
+)
+
+
+class TestTextCommand(unittest.TestCase):
+    def setUp(self):
+        self.runner = CliRunner()
+
+    def test_package_paragraphs(self):
+        ''' Test reading paragraphs from a package. '''
+        with self.runner.isolated_filesystem():
+            make_docx('foo.docx', body=BODY, parts={'word/styles.xml': STYLES})
+            paras = list(msword_cli.package_paragraphs('foo.docx', styles=True))
+            self.assertEqual([p['text'] for p in paras], ['Title', 'Hello new\tworld', 'Cell', 'One', 'Sub'])
+            self.assertEqual([p['style'] for p in paras], ['heading 1', 'Normal', 'Normal', 'Chapter', 'heading 2'])
+            self.assertEqual([p['level'] for p in paras], [1, None, None, 1, 2])
+
+    def test_text(self):
+        ''' Test plain text output. '''
+        with self.runner.isolated_filesystem():
+            make_docx('foo.docx', body=BODY)
+            with mock.patch('msword_cli.WORD') as word:
+                result = self.runner.invoke(msword_cli.text, ['foo.docx'])
+            self.assertEqual(result.exit_code, 0)
+            self.assertEqual(word.mock_calls, [])
+            self.assertEqual(result.output, 'Title\nHello new\tworld\nCell\nOne\nSub\n')
+
+    def test_text_styles(self):
+        ''' Test text output with styles. '''
+        with self.runner.isolated_filesystem():
+            make_docx('foo.docx', body=BODY, parts={'word/styles.xml': STYLES})
+            result = self.runner.invoke(msword_cli.text, ['--styles', 'foo.docx'])
+            self.assertEqual(result.exit_code, 0)
+            self.assertEqual(result.output.splitlines()[:2], ['heading 1\t1\tTitle', 'Normal\t\tHello new\tworld'])
+
+    def test_text_json(self):
+        ''' Test JSON Lines output. '''
+        with self.runner.isolated_filesystem():
+            make_docx('foo.docx', body=BODY)
+            make_docx('bar.docx')
+            result = self.runner.invoke(msword_cli.text, ['--json', 'foo.docx', 'bar.docx'])
+            self.assertEqual(result.exit_code, 0)
+            records = [json.loads(line) for line in result.output.splitlines()]
+            self.assertEqual(len(records), 6)
+            self.assertEqual(records[1], {'path': os.path.abspath('foo.docx'), 'index': 1, 'text': 'Hello new\tworld'})
+            self.assertEqual(records[5], {'path': os.path.abspath('bar.docx'), 'index': 0, 'text': 'Hello'})
+
+    def test_text_bad_package(self):
+        ''' Test a corrupt package is reported. '''
+        with self.runner.isolated_filesystem():
+            with open('bad.docx', 'w') as f:
+                f.write('not a zip file')
+            make_docx('foo.docx')
+            result = self.runner.invoke(msword_cli.text, ['bad.docx', 'foo.docx'])
+            self.assertEqual(result.exit_code, 1)
+            self.assertIn('Hello\n', result.output)
+            self.assertIn('1 of 2 documents failed.', result.output)
+
+    def test_text_legacy(self):
+        ''' Test legacy documents are read with Word. '''
+        app = mock.MagicMock()
+        para = mock.MagicMock()
+        para.Range.Text = 'Legacy\r'
+        para.Style.NameLocal = 'Heading 1'
+        para.OutlineLevel = 1
+        doc = app.Documents.Open.return_value
+        doc.Paragraphs = [para]
+        with self.runner.isolated_filesystem():
+            touch('old.doc')
+            with mock.patch('msword_cli.new_instance', return_value=app):
+                result = self.runner.invoke(msword_cli.text, ['--styles', 'old.doc'])
+            self.assertEqual(result.exit_code, 0)
+            self.assertEqual(result.output, 'Heading 1\t1\tLegacy\n')
+            doc.Close.assert_called_with(msword_cli.C.wdDoNotSaveChanges)
+            app.Quit.assert_called_with(msword_cli.C.wdDoNotSaveChanges)
@@ -0,0 +1,134 @@
+import unittest
+import mock
+from click.testing import CliRunner
+import msword_cli
+import json
+import os
+from .util import make_docx
+
+SETTINGS_RELS = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/'
+    'attachedTemplate" Target="file:///C:\\Templates\\Contract.dotx" TargetMode="External"/>'
+    '</Relationships>'
+)
+
+
+def para(text):
+    return '<w:p><w:r><w:t>%s</w:t></w:r></w:p>' % text
+
+
+class TestIndexCommand(unittest.TestCase):
+    def setUp(self):
+        self.runner = CliRunner()
+
+    def make_corpus(self):
+        os.makedirs(os.path.join('docs', 'sub'))
+        make_docx(os.path.join('docs', 'a.docx'), body=para('The indemnity clause applies.'),
+                  core={'dc:title': 'Alpha', 'dc:creator': 'Jane'},
+                  app={'Template': 'Contract.dotx', 'Pages': 4},
+                  parts={'word/_rels/settings.xml.rels': SETTINGS_RELS})
+        make_docx(os.path.join('docs', 'sub', 'b.docx'), body=para('Nothing to see here.'),
+                  core={'dc:title': 'Beta', 'dc:creator': 'John'}, app={'Template': 'Normal.dotm'})
+        make_docx(os.path.join('docs', '~$a.docx'))
+
+    def invoke(self, *args):
+        return self.runner.invoke(msword_cli.index, list(args) + ['--db', 'index.sqlite'])
+
+    def test_build_and_query(self):
+        ''' Test building an index and querying it. '''
+        with self.runner.isolated_filesystem():
+            self.make_corpus()
+            result = self.invoke('build', 'docs')
+            self.assertEqual(result.exit_code, 0)
+            self.assertEqual(result.output, 'Indexed: 2 added, 0 updated, 0 unchanged, 0 removed, 0 failed.\n')
+            a = os.path.abspath(os.path.join('docs', 'a.docx'))
+            b = os.path.abspath(os.path.join('docs', 'sub', 'b.docx'))
+            self.assertEqual(self.invoke('query').output, '%s\n%s\n' % (a, b))
+            self.assertEqual(self.invoke('query', 'indemnity').output, '%s\n' % a)
+            self.assertEqual(self.invoke('query', '--author', 'jo*').output, '%s\n' % b)
+            # '%' and '_' are not wildcards
+            self.assertEqual(self.invoke('query', '--author', 'j_ne').output, '')
+            self.assertEqual(self.invoke('query', '--title', '%').output, '')
+            self.assertEqual(self.invoke('query', '--template', 'C:\\Templates\\*').output, '%s\n' % a)
+            self.assertEqual(self.invoke('query', '--template', 'normal.dotm').output, '%s\n' % b)
+            self.assertEqual(self.invoke('query', '--limit', '1').output, '%s\n' % a)
+            record = json.loads(self.invoke('query', '--json', '--title', 'Alpha').output)
+            self.assertEqual(record['path'], a)
+            self.assertEqual(record['pages'], 4)
+            self.assertEqual(record['template_path'], 'C:\\Templates\\Contract.dotx')
+
+    def test_incremental_build(self):
+        ''' Test rebuilding only reads changed documents. '''
+        with self.runner.isolated_filesystem():
+            self.make_corpus()
+            self.invoke('build', 'docs')
+            with mock.patch('msword_cli.inspect_package') as inspect:
+                result = self.invoke('build', 'docs')
+            self.assertEqual(result.output, 'Indexed: 0 added, 0 updated, 0 unchanged, 0 removed, 0 failed.\n')
+            self.assertEqual(inspect.call_count, 0)
+            a = os.path.join('docs', 'a.docx')
+            # Touched but not changed
+            os.utime(a, (1, 1))
+            result = self.invoke('build', 'docs')
+            self.assertEqual(result.output, 'Indexed: 0 added, 0 updated, 1 unchanged, 0 removed, 0 failed.\n')
+            # Changed and removed
+            make_docx(a, body=para('Replaced text.'))
+            os.utime(a, (2, 2))
+            os.remove(os.path.join('docs', 'sub', 'b.docx'))
+            result = self.invoke('build', 'docs')
+            self.assertEqual(result.output, 'Indexed: 0 added, 1 updated, 0 unchanged, 1 removed, 0 failed.\n')
+            self.assertEqual(self.invoke('query', 'indemnity').output, '')
+            self.assertEqual(self.invoke('query', 'replaced').output, '%s\n' % os.path.abspath(a))
+
+    def test_build_failure(self):
+        ''' Test a corrupt document is reported and the rest indexed. '''
+        with self.runner.isolated_filesystem():
+            self.make_corpus()
+            with open(os.path.join('docs', 'bad.docx'), 'w') as f:
+                f.write('not a zip file')
+            result = self.invoke('build', 'docs')
+            self.assertEqual(result.exit_code, 1)
+            self.assertIn('2 added, 0 updated, 0 unchanged, 0 removed, 1 failed.', result.output)
+            # A document which can no longer be read is not left in the index as it was
+            a = os.path.join('docs', 'a.docx')
+            with open(a, 'w') as f:
+                f.write('corrupted')
+            result = self.invoke('build', 'docs')
+            self.assertIn('0 added, 0 updated, 0 unchanged, 0 removed, 2 failed.', result.output)
+            self.assertEqual(self.invoke('query', 'indemnity').output, '')
+            self.assertEqual(self.invoke('query').output, '%s\n' % os.path.abspath(os.path.join('docs', 'sub',
+                                                                                                'b.docx')))
+
+    def test_build_legacy(self):
+        ''' Test legacy documents are indexed with Word. '''
+        app = mock.MagicMock()
+        doc = app.Documents.Open.return_value
+        doc.BuiltInDocumentProperties.return_value.Value = 'Value'
+        doc.AttachedTemplate.FullName = 'C:\\Templates\\Normal.dotm'
+        paragraph = mock.MagicMock()
+        paragraph.Range.Text = 'Legacy indemnity\r'
+        doc.Paragraphs = [paragraph]
+        with self.runner.isolated_filesystem():
+            os.mkdir('docs')
+            with open(os.path.join('docs', 'old.doc'), 'w') as f:
+                f.write('legacy')
+            with mock.patch('msword_cli.new_instance', return_value=app):
+                result = self.invoke('build', 'docs')
+            self.assertEqual(result.exit_code, 0)
+            self.assertEqual(self.invoke('query', 'indemnity', '--template', '*normal*').output,
+                             '%s\n' % os.path.abspath(os.path.join('docs', 'old.doc')))
+
+    def test_bad_query(self):
+        ''' Test an invalid full-text query. '''
+        with self.runner.isolated_filesystem():
+            result = self.invoke('query', '"unbalanced')
+            self.assertEqual(result.exit_code, 1)
+            self.assertIn('Invalid query', result.output)
+
+    def test_build_requires_dir(self):
+        ''' Test build without a directory. '''
+        with self.runner.isolated_filesystem():
+            result = self.invoke('build')
+            self.assertEqual(result.exit_code, 2)
@@ -0,0 +1,95 @@
+import unittest
+import mock
+from click.testing import CliRunner
+import msword_cli
+import json
+import os
+from .util import make_docx, touch
+
+
+class TestInspectCommand(unittest.TestCase):
+    def setUp(self):
+        self.runner = CliRunner()
+
+    def test_inspect_package(self):
+        ''' Test reading properties from a package. '''
+        with self.runner.isolated_filesystem():
+            make_docx('foo.docx', core={'dc:title': 'Foo', 'dc:creator': 'Jane', 'cp:revision': '3'},
+                      app={'Template': 'Normal.dotm', 'Pages': 2, 'Words': 120})
+            info = msword_cli.inspect_package('foo.docx')
+            self.assertEqual(info['title'], 'Foo')
+            self.assertEqual(info['author'], 'Jane')
+            self.assertEqual(info['revision'], 3)
+            self.assertEqual(info['template'], 'Normal.dotm')
+            self.assertEqual(info['pages'], 2)
+            self.assertEqual(info['words'], 120)
+            self.assertEqual(info['subject'], None)
+            self.assertNotIn('has_revisions', info)
+
+    def test_inspect_revisions(self):
+        ''' Test detecting tracked changes. '''
+        with self.runner.isolated_filesystem():
+            make_docx('plain.docx')
+            make_docx('changed.docx', body='<w:p><w:ins w:id="1" w:author="Jane"><w:r><w:t>New</w:t></w:r>'
+                                           '</w:ins></w:p>')
+            self.assertFalse(msword_cli.inspect_package('plain.docx', revisions=True)['has_revisions'])
+            self.assertTrue(msword_cli.inspect_package('changed.docx', revisions=True)['has_revisions'])
+
+    def test_inspect_json(self):
+        ''' Test inspect with JSON output never touches Word. '''
+        with self.runner.isolated_filesystem():
+            make_docx('foo.docx', core={'dc:title': 'Foo'})
+            make_docx('bar.docx', core={'dc:title': 'Bar'})
+            with mock.patch('msword_cli.WORD') as word:
+                result = self.runner.invoke(msword_cli.inspect, ['--json', 'foo.docx', 'bar.docx'])
+            self.assertEqual(result.exit_code, 0)
+            self.assertEqual(word.mock_calls, [])
+            records = [json.loads(line) for line in result.output.splitlines()]
+            self.assertEqual([r['title'] for r in records], ['Foo', 'Bar'])
+            self.assertEqual(records[0]['path'], os.path.abspath('foo.docx'))
+
+    def test_inspect_text(self):
+        ''' Test inspect with text output. '''
+        with self.runner.isolated_filesystem():
+            make_docx('foo.docx', core={'dc:title': 'Foo'})
+            result = self.runner.invoke(msword_cli.inspect, ['foo.docx'])
+            self.assertEqual(result.exit_code, 0)
+            self.assertEqual(result.output, '%s\n  title: Foo\n' % os.path.abspath('foo.docx'))
+
+    def test_inspect_bad_package(self):
+        ''' Test a corrupt package is reported. '''
+        with self.runner.isolated_filesystem():
+            with open('bad.docx', 'w') as f:
+                f.write('not a zip file')
+            make_docx('foo.docx')
+            result = self.runner.invoke(msword_cli.inspect, ['bad.docx', 'foo.docx'])
+            self.assertEqual(result.exit_code, 1)
+            self.assertIn('Failed: %s' % os.path.abspath('bad.docx'), result.output)
+            self.assertIn('1 of 2 documents failed.', result.output)
+
+    def test_inspect_legacy(self):
+        ''' Test legacy documents are read with Word. '''
+        app = mock.MagicMock()
+        doc = app.Documents.Open.return_value
+        doc.BuiltInDocumentProperties.return_value.Value = 'Value'
+        doc.Revisions.Count = 0
+        with self.runner.isolated_filesystem():
+            touch('old.doc')
+            with mock.patch('msword_cli.new_instance', return_value=app):
+                result = self.runner.invoke(msword_cli.inspect, ['--json', '--revisions', 'old.doc'])
+            self.assertEqual(result.exit_code, 0)
+            record = json.loads(result.output)
+            self.assertEqual(record['title'], 'Value')
+            self.assertEqual(record['has_revisions'], False)
+            doc.Close.assert_called_with(msword_cli.C.wdDoNotSaveChanges)
+
+    def test_inspect_parallel(self):
+        ''' Test inspecting packages in parallel processes. '''
+        with self.runner.isolated_filesystem():
+            names = ['doc%d.docx' % i for i in range(20)]
+            for i, name in enumerate(names):
+                make_docx(name, core={'dc:title': 'Doc %d' % i})
+            result = self.runner.invoke(msword_cli.inspect, ['--json', '-j', '2'] + names)
+            self.assertEqual(result.exit_code, 0)
+            titles = [json.loads(line)['title'] for line in result.output.splitlines()]
+            self.assertEqual(titles, ['Doc %d' % i for i in range(20)])
@@ -0,0 +1,172 @@
+import unittest
+import threading
+import mock
+from click.testing import CliRunner
+import msword_cli
+from .util import make_docx
+import subprocess
+import os
+
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
+
+
+def rpc_error():
+    return msword_cli.com_error(-2147023174, 'The RPC server is unavailable.', None, None)
+
+
+class TestFunctions(unittest.TestCase):
+    def setUp(self):
+        self.app = mock.MagicMock()
+        self.doc = mock.MagicMock()
+
+    def test_open_and_new(self):
+        ''' Test documents are opened and created in the given instance. '''
+        doc = msword_cli.open_document(self.app, 'foo.docx', visible=False)
+        self.app.Documents.Open.assert_called_with(FileName='foo.docx', Visible=False)
+        self.assertEqual(doc, self.app.Documents.Open.return_value)
+        msword_cli.new_document(self.app, 'foo.dotx')
+        self.app.Documents.Add.assert_called_with('foo.dotx', Visible=True)
+        msword_cli.new_document(self.app)
+        self.app.Documents.Add.assert_called_with(Visible=True)
+
+    def test_export_path(self):
+        ''' Test export paths take the name of the document and the extension of the format. '''
+        self.doc.Name = 'foo.docx'
+        with CliRunner().isolated_filesystem():
+            os.mkdir('out')
+            self.assertEqual(msword_cli.export_path(self.doc, 'out'), os.path.join('out', 'foo.pdf'))
+        self.assertEqual(msword_cli.export_path(self.doc, 'bar', msword_cli.C.wdExportFormatXPS), 'bar.xps')
+        self.assertEqual(msword_cli.export_path(self.doc, 'bar.PDF'), 'bar.PDF')
+
+    def test_export_fixed_format(self):
+        ''' Test the range of an export. '''
+        options = {'ExportFormat': msword_cli.C.wdExportFormatPDF}
+        msword_cli.export_fixed_format(self.doc, 'foo.pdf', options, pages=(2, 3))
+        self.doc.ExportAsFixedFormat.assert_called_with(OutputFileName='foo.pdf', OpenAfterExport=False,
+                                                        Range=msword_cli.C.wdExportFromTo, From=2, To=3,
+                                                        **options)
+        msword_cli.export_fixed_format(self.doc, 'foo.pdf', options, pages=(2, 3),
+                                       range=msword_cli.C.wdExportCurrentPage)
+        self.doc.ExportAsFixedFormat.assert_called_with(OutputFileName='foo.pdf', OpenAfterExport=False,
+                                                        Range=msword_cli.C.wdExportCurrentPage, **options)
+        # The options passed in are not changed
+        self.assertEqual(options, {'ExportFormat': msword_cli.C.wdExportFormatPDF})
+
+    def test_close_document(self):
+        ''' Test Word is quit once the last document is closed. '''
+        self.app.BackgroundPrintingStatus = 0
+        self.app.Documents.Count = 1
+        self.assertFalse(msword_cli.close_document(self.app, self.doc))
+        self.doc.Close.assert_called_with(msword_cli.C.wdPromptToSaveChanges)
+        self.app.Documents.Count = 0
+        self.assertTrue(msword_cli.close_document(self.app, self.doc, msword_cli.C.wdDoNotSaveChanges))
+        self.doc.Close.assert_called_with(msword_cli.C.wdDoNotSaveChanges)
+        self.app.Quit.assert_called_with()
+
+    def test_list_documents(self):
+        ''' Test the state of each open document is listed. '''
+        first, second = mock.MagicMock(Name='a.docx', Saved=True), mock.MagicMock(Name='b.docx', Saved=False)
+        self.app.Documents.__iter__.return_value = [first, second]
+        self.app.ActiveDocument = second
+        self.assertEqual(msword_cli.list_documents(self.app), [
+            {'index': 1, 'name': 'a.docx', 'active': False, 'saved': True},
+            {'index': 2, 'name': 'b.docx', 'active': True, 'saved': False},
+        ])
+
+
+class TestWordExecutor(unittest.TestCase):
+    def test_threads_share_nothing(self):
+        ''' Test each thread drives its own instance of Word. '''
+        apps = []
+        factory = mock.Mock(side_effect=lambda: apps.append(mock.MagicMock()) or apps[-1])
+        barrier = threading.Event()
+
+        def job(app, i):
+            barrier.wait(5)
+            return app, threading.current_thread().name, i
+
+        with msword_cli.WordExecutor(2, factory) as executor:
+            results = [executor.submit(job, i) for i in range(2)]
+            barrier.set()
+            results = [future.result(5) for future in results]
+        self.assertEqual([i for app, name, i in results], [0, 1])
+        self.assertNotEqual(results[0][1], results[1][1])
+        self.assertEqual(len(apps), 2)
+        for app in apps:
+            app.Quit.assert_called_with(msword_cli.C.wdDoNotSaveChanges)
+        with self.assertRaises(RuntimeError):
+            executor.submit(job, 2)
+
+    def test_restart(self):
+        ''' Test a thread whose instance dies is given a new one. '''
+        apps = [mock.MagicMock(), mock.MagicMock()]
+        apps[0].Documents.Open.side_effect = rpc_error()
+        restarts = msword_cli.METRICS.get('msw_word_restarts_total')
+
+        def job(app):
+            return app.Documents.Open('foo.docx')
+
+        with msword_cli.WordExecutor(1, mock.Mock(side_effect=apps)) as executor:
+            first = executor.submit(job)
+            second = executor.submit(job)
+            with self.assertRaises(msword_cli.com_error):
+                first.result(5)
+            self.assertEqual(second.result(5), apps[1].Documents.Open.return_value)
+        self.assertEqual(msword_cli.METRICS.get('msw_word_restarts_total'), restarts + 1)
+
+
+@unittest.skipIf(asyncio is None, 'Requires asyncio')
+class TestAsyncWord(unittest.TestCase):
+    def setUp(self):
+        self.runner = CliRunner()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.addCleanup(asyncio.set_event_loop, None)
+        self.addCleanup(self.loop.close)
+
+    def test_gather(self):
+        ''' Test a coroutine awaits conversions and exports on several instances. '''
+        app = mock.MagicMock()
+        with self.runner.isolated_filesystem():
+            make_docx('foo.docx')
+            word = msword_cli.AsyncWord(2, factory=lambda: app, loop=self.loop)
+            with word:
+                results = self.loop.run_until_complete(asyncio.gather(
+                    word.convert('foo.docx', 'foo.odt', format='odt'),
+                    word.export('foo.docx', 'foo.pdf', pages=(1, 2))
+                ))
+        doc = app.Documents.Open.return_value
+        self.assertEqual(results[1], 'foo.pdf')
+        doc.SaveAs2.assert_called_with(FileName='foo.odt', FileFormat=msword_cli.C.wdFormatOpenDocumentText,
+                                       Encoding=65001, AddToRecentFiles=False)
+        kwargs = doc.ExportAsFixedFormat.call_args[1]
+        self.assertEqual((kwargs['From'], kwargs['To']), (1, 2))
+        self.assertEqual(kwargs['OutputFileName'], 'foo.pdf')
+
+    def test_errors(self):
+        ''' Test Word's errors are raised in the coroutine. '''
+        app = mock.MagicMock()
+        app.Documents.Open.side_effect = msword_cli.com_error(-2146823114, 'Word',
+                                                              (0, 'Word', 'No such file.', None, 0, 0), None)
+        with msword_cli.AsyncWord(factory=lambda: app, loop=self.loop) as word:
+            with self.assertRaises(msword_cli.com_error):
+                self.loop.run_until_complete(word.run(msword_cli.open_document, 'missing.docx'))
+
+
+class TestCompatibility(unittest.TestCase):
+    def test_python2_syntax(self):
+        ''' Test the module still compiles on Python 2.7 when an interpreter for it is installed. '''
+        python = os.environ.get('PYTHON2', 'python2.7')
+        try:
+            if subprocess.call([python, '-c', 'import sys; sys.exit(sys.version_info[:2] != (2, 7))'],
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE):
+                raise OSError
+        except OSError:
+            self.skipTest('Python 2.7 is not available.')
+        process = subprocess.Popen([python, '-m', 'py_compile', msword_cli.__file__.replace('.pyc', '.py')],
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = process.communicate()
+        self.assertEqual(process.returncode, 0, err.decode('utf-8', 'replace'))
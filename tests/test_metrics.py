@@ -0,0 +1,93 @@
+import unittest
+import mock
+from click.testing import CliRunner
+import msword_cli
+from .util import MockApp
+
+try:
+    from urllib.request import urlopen
+except ImportError:  # Python 2
+    from urllib2 import urlopen
+
+
+def make_metrics():
+    ''' Return a fresh registry with the same declarations as msword_cli.METRICS. '''
+    metrics = msword_cli.Metrics()
+    metrics.declare('msw_documents_processed_total', 'counter', 'Documents processed successfully.')
+    metrics.declare('msw_failures_total', 'counter', 'Failed operations by error code.')
+    metrics.declare('msw_command_duration_seconds', 'histogram', 'Duration of each command in seconds.',
+                    buckets=[1, 10])
+    return metrics
+
+
+class TestMetrics(unittest.TestCase):
+    def test_render_counter(self):
+        ''' Test rendering a counter. '''
+        metrics = make_metrics()
+        metrics.inc('msw_documents_processed_total', command='export')
+        metrics.inc('msw_documents_processed_total', command='export')
+        output = metrics.render()
+        self.assertIn('# TYPE msw_documents_processed_total counter', output)
+        self.assertIn('msw_documents_processed_total{command="export"} 2', output)
+
+    def test_render_histogram(self):
+        ''' Test rendering a histogram. '''
+        metrics = make_metrics()
+        metrics.observe('msw_command_duration_seconds', 5, command='print')
+        output = metrics.render()
+        self.assertIn('msw_command_duration_seconds_bucket{command="print",le="1"} 0', output)
+        self.assertIn('msw_command_duration_seconds_bucket{command="print",le="10"} 1', output)
+        self.assertIn('msw_command_duration_seconds_bucket{command="print",le="+Inf"} 1', output)
+        self.assertIn('msw_command_duration_seconds_count{command="print"} 1', output)
+
+    def test_track_failure(self):
+        ''' Test a failure is recorded under its error code. '''
+        metrics = make_metrics()
+        with self.assertRaises(msword_cli.com_error):
+            with metrics.track('save'):
+                raise msword_cli.com_error(-2146823136, 'error', None, None)
+        self.assertEqual(metrics.get('msw_failures_total', command='save', code='0x800A1420'), 1)
+        self.assertEqual(metrics.get('msw_documents_processed_total', command='save'), 0)
+
+    def test_write(self):
+        ''' Test writing a textfile. '''
+        metrics = make_metrics()
+        metrics.inc('msw_documents_processed_total', command='open')
+        runner = CliRunner()
+        with runner.isolated_filesystem():
+            metrics.write('msw.prom')
+            with open('msw.prom') as f:
+                self.assertEqual(f.read(), metrics.render())
+
+    def test_serve(self):
+        ''' Test scraping the local endpoint. '''
+        metrics = make_metrics()
+        metrics.inc('msw_documents_processed_total', command='close')
+        server = msword_cli.serve_metrics(metrics, 0)
+        try:
+            url = 'http://127.0.0.1:%s/metrics' % server.server_address[1]
+            body = urlopen(url).read().decode('utf-8')
+        finally:
+            server.shutdown()
+        self.assertIn('msw_documents_processed_total{command="close"} 1', body)
+
+
+@mock.patch('msword_cli.WORD', spec_set=MockApp(['foo.docx']))
+class TestCommandMetrics(unittest.TestCase):
+    def setUp(self):
+        self.runner = CliRunner()
+
+    def test_export_metrics(self, mock_app):
+        ''' Test export updates the registry. '''
+        with mock.patch('msword_cli.METRICS', make_metrics()) as metrics:
+            result = self.runner.invoke(msword_cli.export, ['foo.pdf'])
+            self.assertEqual(result.exit_code, 0)
+            self.assertEqual(metrics.get('msw_documents_processed_total', command='export'), 1)
+
+    def test_metrics_file(self, mock_app):
+        ''' Test the --metrics-file option writes on exit. '''
+        with self.runner.isolated_filesystem():
+            result = self.runner.invoke(msword_cli.cli, ['--metrics-file', 'msw.prom', 'save'])
+            self.assertEqual(result.exit_code, 0)
+            with open('msw.prom') as f:
+                self.assertIn('msw_documents_processed_total{command="save"}', f.read())
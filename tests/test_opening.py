@@ -69,6 +69,13 @@ class TestNewCommand(unittest.TestCase):
     def test_new_template_default_path(self, mock_app):
         ''' Test new with template from directory set in Word's File Options dialog. '''
         filename = 'normal.dotm'
-        result = self.runner.invoke(msword_cli.new, ['--template', filename])
-        self.assertEqual(result.exit_code, 0)
-        mock_app.Documents.Add.assert_called_with(os.path.join(msword_cli.TEMPLATE_DIR, filename), Visible=True)
+        with self.runner.isolated_filesystem():
+            os.mkdir('templates')
+            touch(os.path.join('templates', filename))
+            with mock.patch('msword_cli.word_template_dirs', return_value=[os.path.abspath('templates')]), \
+                    mock.patch('msword_cli.TEMPLATE_CATALOG', os.path.abspath('catalog.json')), \
+                    mock.patch('msword_cli.CATALOG', None):
+                result = self.runner.invoke(msword_cli.new, ['--template', filename])
+                self.assertEqual(result.exit_code, 0)
+                mock_app.Documents.Add.assert_called_with(os.path.join(os.path.abspath('templates'), filename),
+                                                          Visible=True)
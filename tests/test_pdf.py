@@ -0,0 +1,116 @@
+import unittest
+from click.testing import CliRunner
+import msword_cli
+from .util import make_pdf
+
+
+class TestPdfReader(unittest.TestCase):
+    def setUp(self):
+        self.runner = CliRunner()
+
+    def test_parse_object(self):
+        ''' Test parsing nested objects. '''
+        obj, end = msword_cli.parse_object(b'<</A [1 2.5 (a\\(b\\)) <616263> /N#20x 3 0 R] /B true /C null>>')
+        self.assertEqual(obj['A'], [1, 2.5, b'a(b)', b'abc', 'N x', msword_cli.PdfRef(3, 0)])
+        self.assertEqual(obj['B'], True)
+        self.assertEqual(obj['C'], None)
+
+    def test_serialize_roundtrip(self):
+        ''' Test serialized objects parse back to the same value. '''
+        obj = {'Type': msword_cli.PdfName('Page'), 'Kids': [msword_cli.PdfRef(4), 1, -0.5],
+               'Title': msword_cli.PdfString(b'(x)')}
+        self.assertEqual(msword_cli.parse_object(msword_cli.serialize_object(obj))[0], obj)
+
+    def test_read_table(self):
+        ''' Test reading a file with an xref table. '''
+        with self.runner.isolated_filesystem():
+            make_pdf('a.pdf', pages=3, bookmarks=True, labels='0 <</S /r>>')
+            with msword_cli.PdfReader('a.pdf') as reader:
+                self.assertEqual(len(reader.pages()), 3)
+                self.assertEqual(reader.page_count(), 3)
+                self.assertEqual(reader.page_labels(), [(0, {'S': 'r'})])
+                self.assertEqual([n['title'] for n in reader.outlines()], [b'Page 1', b'Page 2', b'Page 3'])
+
+    def test_read_compressed(self):
+        ''' Test reading a file with an xref stream and object streams. '''
+        with self.runner.isolated_filesystem():
+            make_pdf('a.pdf', pages=2, bookmarks=True, compressed=True)
+            with msword_cli.PdfReader('a.pdf') as reader:
+                pages = reader.pages()
+                self.assertEqual(len(pages), 2)
+                # Inherited attributes are copied to the page
+                self.assertEqual(pages[0][1]['MediaBox'], [0, 0, 612, 792])
+                self.assertEqual(reader.outlines()[1]['dest'][0], pages[1][0])
+
+    def test_read_keywords_in_strings(self):
+        ''' Test strings which contain 'stream' or 'endobj' do not end their object. '''
+        with self.runner.isolated_filesystem():
+            make_pdf('a.pdf', pages=2, bookmarks=b'Upstream stream work %d')
+            make_pdf('b.pdf', pages=1, bookmarks=b'See endobj %d')
+            with msword_cli.PdfReader('a.pdf') as reader:
+                self.assertEqual([n['title'] for n in reader.outlines()],
+                                 [b'Upstream stream work 1', b'Upstream stream work 2'])
+            self.assertEqual(msword_cli.merge_pdfs(['a.pdf', 'b.pdf'], 'out.pdf'), 3)
+            with msword_cli.PdfReader('out.pdf') as reader:
+                self.assertEqual([n['title'] for n in reader.outlines()][-1], b'See endobj 1')
+
+    def test_read_truncated(self):
+        ''' Test a truncated file raises PdfError. '''
+        with self.runner.isolated_filesystem():
+            make_pdf('a.pdf')
+            with open('a.pdf', 'rb') as f:
+                data = f.read()
+            with open('a.pdf', 'wb') as f:
+                f.write(data[:len(data) // 2])
+            self.assertRaises(msword_cli.PdfError, msword_cli.PdfReader, 'a.pdf')
+
+
+class TestMergePdfs(unittest.TestCase):
+    def setUp(self):
+        self.runner = CliRunner()
+
+    def test_merge(self):
+        ''' Test merging preserves pages, bookmarks and page labels. '''
+        with self.runner.isolated_filesystem():
+            make_pdf('a.pdf', pages=3, bookmarks=True, labels='0 <</S /r>>')
+            make_pdf('b.pdf', pages=2, bookmarks=True, compressed=True)
+            self.assertEqual(msword_cli.merge_pdfs(['a.pdf', 'b.pdf'], 'out.pdf'), 5)
+            with msword_cli.PdfReader('out.pdf') as reader:
+                pages = reader.pages()
+                self.assertEqual(len(pages), 5)
+                self.assertEqual(reader.page_labels(), [(0, {'S': 'r'}), (3, {'S': 'D', 'St': 4})])
+                outlines = reader.outlines()
+                self.assertEqual(len(outlines), 5)
+                self.assertEqual([n['dest'][0] for n in outlines], [ref for ref, page in pages])
+
+    def test_merge_named_dests(self):
+        ''' Test links to named destinations still reach their page once merged. '''
+        with self.runner.isolated_filesystem():
+            make_pdf('a.pdf', pages=2, links=True)
+            make_pdf('b.pdf', pages=3, links=True, compressed=True)
+            msword_cli.merge_pdfs(['a.pdf', 'b.pdf'], 'out.pdf')
+            with msword_cli.PdfReader('out.pdf') as reader:
+                refs = [ref for ref, page in reader.pages()]
+                # The names of the first source to use each are kept
+                dests = reader.named_dests()
+                self.assertEqual(sorted(dests), [b'p1', b'p2', b'p3'])
+                self.assertEqual([dests[name][0] for name in (b'p1', b'p2', b'p3')], [refs[0], refs[1], refs[4]])
+                # Links are made explicit so that b.pdf's do not reach a.pdf's pages
+                links = []
+                for ref in (refs[0], refs[1], refs[2], refs[4]):
+                    annot = reader.resolve(reader.resolve(reader.get(ref)['Annots'])[0])
+                    dest = annot['A']['D'] if 'A' in annot else annot['Dest']
+                    links.append(dest[0])
+                self.assertEqual(links, [refs[1], refs[0], refs[4], refs[2]])
+
+    def test_merge_titles(self):
+        ''' Test merging with a top-level bookmark per source. '''
+        with self.runner.isolated_filesystem():
+            make_pdf('a.pdf', pages=1)
+            make_pdf('b.pdf', pages=2, bookmarks=True)
+            msword_cli.merge_pdfs(iter([('a.pdf', 'First'), ('b.pdf', 'Second')]), 'out.pdf')
+            with msword_cli.PdfReader('out.pdf') as reader:
+                outlines = reader.outlines()
+                self.assertEqual([n['title'] for n in outlines], [b'First', b'Second'])
+                self.assertEqual(len(outlines[1]['children']), 2)
+                self.assertEqual(reader.page_labels(), [])
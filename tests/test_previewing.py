@@ -0,0 +1,88 @@
+import unittest
+import mock
+from click.testing import CliRunner
+import msword_cli
+import io
+import os
+from .util import make_docx, touch
+
+
+def jpeg(width, height):
+    buf = io.BytesIO()
+    msword_cli.Image.new('RGB', (width, height), (200, 10, 10)).save(buf, 'JPEG')
+    return buf.getvalue()
+
+
+@unittest.skipIf(msword_cli.Image is None, 'Pillow is not installed')
+class TestPreviewCommand(unittest.TestCase):
+    def setUp(self):
+        self.runner = CliRunner()
+
+    def make_thumbnail_docx(self, filename):
+        make_docx(filename, parts={'docProps/thumbnail.jpeg': jpeg(400, 600)},
+                  rels={msword_cli.THUMBNAIL_REL: 'docProps/thumbnail.jpeg'})
+
+    def test_preview_thumbnail(self):
+        ''' Test a preview is made from the thumbnail without Word. '''
+        with self.runner.isolated_filesystem():
+            self.make_thumbnail_docx('foo.docx')
+            with mock.patch('msword_cli.new_instance') as new_instance:
+                result = self.runner.invoke(msword_cli.preview, ['foo.docx', '--out', 'previews', '--size', '100'])
+            self.assertEqual(result.exit_code, 0)
+            self.assertEqual(new_instance.call_count, 0)
+            self.assertEqual(result.output, 'Created 1 preview(s) (1 from thumbnails), 0 up to date.\n')
+            image = msword_cli.Image.open(os.path.join('previews', 'foo.png'))
+            self.assertEqual(image.format, 'PNG')
+            self.assertEqual(image.size, (67, 100))
+
+    def test_preview_up_to_date(self):
+        ''' Test previews newer than their document are skipped. '''
+        with self.runner.isolated_filesystem():
+            self.make_thumbnail_docx('foo.docx')
+            os.utime('foo.docx', (1, 1))
+            self.runner.invoke(msword_cli.preview, ['foo.docx', '-o', 'previews'])
+            result = self.runner.invoke(msword_cli.preview, ['foo.docx', '-o', 'previews'])
+            self.assertEqual(result.output, 'Created 0 preview(s) (0 from thumbnails), 1 up to date.\n')
+            result = self.runner.invoke(msword_cli.preview, ['foo.docx', '-o', 'previews', '--force'])
+            self.assertEqual(result.output, 'Created 1 preview(s) (1 from thumbnails), 0 up to date.\n')
+
+    def test_preview_word(self):
+        ''' Test documents without a thumbnail are rendered in Word. '''
+        app = mock.MagicMock()
+        doc = app.Documents.Open.return_value
+        doc.ActiveWindow.Panes.return_value.Pages.return_value.EnhMetaFileBits = jpeg(50, 50)
+        with self.runner.isolated_filesystem():
+            make_docx('plain.docx')
+            touch('old.doc')
+            self.make_thumbnail_docx('thumb.docx')
+            with mock.patch('msword_cli.new_instance', return_value=app):
+                result = self.runner.invoke(msword_cli.preview, ['plain.docx', 'old.doc', 'thumb.docx',
+                                                                 '--no-thumbnail', '-o', 'previews'])
+            self.assertEqual(result.exit_code, 0)
+            self.assertEqual(result.output, 'Created 3 preview(s) (0 from thumbnails), 0 up to date.\n')
+            self.assertEqual(sorted(os.listdir('previews')), ['old.png', 'plain.png', 'thumb.png'])
+            doc.ActiveWindow.Panes.return_value.Pages.assert_called_with(1)
+            self.assertEqual(doc.ActiveWindow.View.Type, msword_cli.C.wdPrintView)
+
+    def test_preview_pdf(self):
+        ''' Test PDF previews export the first page for screen. '''
+        app = mock.MagicMock()
+        doc = app.Documents.Open.return_value
+        with self.runner.isolated_filesystem():
+            self.make_thumbnail_docx('foo.docx')
+            with mock.patch('msword_cli.new_instance', return_value=app):
+                result = self.runner.invoke(msword_cli.preview, ['foo.docx', '--pdf', '-o', 'previews'])
+            self.assertEqual(result.exit_code, 0)
+            doc.ExportAsFixedFormat.assert_called_with(
+                OutputFileName=os.path.abspath(os.path.join('previews', 'foo.pdf')),
+                ExportFormat=msword_cli.C.wdExportFormatPDF, OptimizeFor=msword_cli.C.wdExportOptimizeForOnScreen,
+                Range=msword_cli.C.wdExportFromTo, From=1, To=1)
+
+    def test_preview_without_pillow(self):
+        ''' Test PNG previews require Pillow. '''
+        with self.runner.isolated_filesystem():
+            make_docx('foo.docx')
+            with mock.patch('msword_cli.Image', None):
+                result = self.runner.invoke(msword_cli.preview, ['foo.docx', '-o', 'previews'])
+            self.assertEqual(result.exit_code, 1)
+            self.assertIn('require Pillow', result.output)
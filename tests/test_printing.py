@@ -3,7 +3,7 @@ import mock
 from click.testing import CliRunner
 import msword_cli
 import os
-from .util import MockApp
+from .util import MockApp, touch
 
 @mock.patch('msword_cli.WORD', spec_set=MockApp(['foo.docx']))
 class TestPrintCommand(unittest.TestCase):
@@ -174,4 +174,160 @@ class TestPrintCommand(unittest.TestCase):
             Range=msword_cli.C.wdPrintAllDocument,
             PrintZoomColumn=2,                  # <= The notable kwarg
             PrintZoomRow=4                      # <= The notable kwarg
-        )
\ No newline at end of file
+        )
+
+class TestSpooler(unittest.TestCase):
+    def setUp(self):
+        self.app = mock.MagicMock()
+        self.reports = []
+        self.spooler = msword_cli.Spooler(self.app, {'Background': True},
+                                          lambda *args: self.reports.append(args), max_pending=2, interval=0)
+
+    def set_status(self, *values):
+        type(self.app).BackgroundPrintingStatus = mock.PropertyMock(side_effect=values)
+
+    def test_submit_back_to_back(self):
+        ''' Test documents are submitted without waiting until max_pending is reached. '''
+        self.set_status()
+        self.spooler.submit('a.docx')
+        self.spooler.submit('b.docx')
+        self.assertEqual(self.app.Documents.Open.call_count, 2)
+        self.assertEqual(self.reports, [])
+        self.assertFalse(self.app.Documents.Open.return_value.Close.called)
+
+    def test_close_once_spooled(self):
+        ''' Test documents are only closed once their jobs have spooled. '''
+        # a and b pending; then 2, 1 (a done), 1 (b still pending), 0 (b done)
+        self.set_status(2, 1, 1, 0)
+        self.spooler.submit('a.docx')
+        self.spooler.submit('b.docx')
+        self.spooler.submit('c.docx')
+        self.assertEqual([r[0] for r in self.reports], ['a.docx'])
+        self.spooler.reap()
+        self.assertEqual([r[0] for r in self.reports], ['a.docx', 'b.docx', 'c.docx'])
+        self.assertTrue(all(r[2] is None for r in self.reports))
+        self.assertEqual(self.app.Documents.Open.return_value.Close.call_count, 3)
+
+    def test_timeout(self):
+        ''' Test a job which never spools is reported as a failure. '''
+        self.spooler.timeout = 0
+        self.set_status(1, 1, 0)
+        self.spooler.submit('a.docx')
+        self.spooler.reap()
+        self.assertEqual(self.reports[0][0], 'a.docx')
+        self.assertIsInstance(self.reports[0][2], Exception)
+
+
+class TestPrintBatchCommand(unittest.TestCase):
+    def setUp(self):
+        self.runner = CliRunner()
+        self.app = mock.MagicMock()
+        self.app.BackgroundPrintingStatus = 0
+        patcher = mock.patch('msword_cli.new_instance', return_value=self.app)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_print_batch(self):
+        ''' Test printing many documents. '''
+        with self.runner.isolated_filesystem():
+            names = ['a.docx', 'b.docx', 'c.docx']
+            for name in names:
+                touch(name)
+            result = self.runner.invoke(msword_cli.print_batch, ['--copies', '2'] + names)
+            self.assertEqual(result.exit_code, 0)
+            self.assertEqual(result.output.count('Spooled in'), 3)
+            doc = self.app.Documents.Open.return_value
+            self.assertEqual(doc.PrintOut.call_count, 3)
+            self.assertEqual(doc.PrintOut.call_args[1]['Copies'], 2)
+            self.assertEqual(doc.Close.call_count, 3)
+            self.app.Quit.assert_called_with(msword_cli.C.wdDoNotSaveChanges)
+
+    def write_segment(self, OutputFileName=None, **kwargs):
+        ''' Simulate printing a document to file. '''
+        src = self.app.Documents.Open.call_args[1]['FileName']
+        with open(OutputFileName, 'wb') as f:
+            f.write(('<%s>' % os.path.basename(src)).encode('ascii'))
+
+    def test_print_batch_to_file(self):
+        ''' Test printing many documents to one file. '''
+        self.app.Documents.Open.return_value.PrintOut.side_effect = self.write_segment
+        with self.runner.isolated_filesystem():
+            for name in ['a.docx', 'b.docx', 'c.docx']:
+                touch(name)
+            result = self.runner.invoke(msword_cli.print_batch, ['--to-file', 'out.prn',
+                                                                 'a.docx', 'b.docx', 'c.docx'])
+            self.assertEqual(result.exit_code, 0)
+            with open('out.prn', 'rb') as f:
+                self.assertEqual(f.read(), b'<a.docx><b.docx><c.docx>')
+            entries = msword_cli.read_print_index('out.prn.idx')
+            self.assertEqual([(e['offset'], e['length']) for i, e in sorted(entries.items())],
+                             [(0, 8), (8, 8), (16, 8)])
+            self.assertFalse(os.path.exists('out.prn.segments'))
+
+    def test_print_batch_to_file_resume(self):
+        ''' Test only failed documents are reprinted with --resume. '''
+        doc = self.app.Documents.Open.return_value
+        doc.PrintOut.side_effect = self.side_effects([
+            self.write_segment,
+            msword_cli.com_error(-1, 'error', (0, 'Word', 'Printer error.', None, 0, 0), None),
+            self.write_segment
+        ])
+        with self.runner.isolated_filesystem():
+            for name in ['a.docx', 'b.docx', 'c.docx']:
+                touch(name)
+            args = ['--to-file', 'out.prn', 'a.docx', 'b.docx', 'c.docx']
+            result = self.runner.invoke(msword_cli.print_batch, args)
+            self.assertEqual(result.exit_code, 1)
+            self.assertIn('Printer error.', result.output)
+            with open('out.prn', 'rb') as f:
+                self.assertEqual(f.read(), b'<a.docx><c.docx>')
+            self.assertTrue(os.path.exists('out.prn.segments'))
+
+            doc.PrintOut.side_effect = self.write_segment
+            doc.PrintOut.reset_mock()
+            result = self.runner.invoke(msword_cli.print_batch, ['--resume'] + args)
+            self.assertEqual(result.exit_code, 0)
+            self.assertEqual(doc.PrintOut.call_count, 1)
+            with open('out.prn', 'rb') as f:
+                self.assertEqual(f.read(), b'<a.docx><b.docx><c.docx>')
+
+    def test_print_batch_to_file_resume_changed(self):
+        ''' Test documents which changed since the previous run are reprinted with --resume. '''
+        doc = self.app.Documents.Open.return_value
+        doc.PrintOut.side_effect = self.write_segment
+        with self.runner.isolated_filesystem():
+            for name in ['a.docx', 'b.docx']:
+                touch(name)
+            args = ['--to-file', 'out.prn', 'a.docx', 'b.docx']
+            result = self.runner.invoke(msword_cli.print_batch, args)
+            self.assertEqual(result.exit_code, 0, result.output)
+            os.mkdir('out.prn.segments')
+            for i, name in enumerate(['a.docx', 'b.docx']):
+                with open(os.path.join('out.prn.segments', '%06d.prn' % i), 'wb') as f:
+                    f.write(('<%s>' % name).encode('ascii'))
+            with open('b.docx', 'wb') as f:
+                f.write(b'changed')
+            os.utime('b.docx', (1, 1))
+            doc.PrintOut.reset_mock()
+            result = self.runner.invoke(msword_cli.print_batch, ['--resume'] + args)
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertEqual(doc.PrintOut.call_count, 1)
+            self.assertIn('Printing 1 of 2 document(s)', result.output)
+            self.assertIn(os.path.abspath('b.docx'), result.output)
+
+    def side_effects(self, effects):
+        ''' Return a side effect which calls or raises each of effects in turn. '''
+        effects = iter(effects)
+        def side_effect(**kwargs):
+            effect = next(effects)
+            if isinstance(effect, Exception):
+                raise effect
+            return effect(**kwargs)
+        return side_effect
+
+    def test_print_batch_resume_requires_to_file(self):
+        ''' Test --resume without --to-file. '''
+        with self.runner.isolated_filesystem():
+            touch('a.docx')
+            result = self.runner.invoke(msword_cli.print_batch, ['--resume', 'a.docx'])
+            self.assertEqual(result.exit_code, 2)
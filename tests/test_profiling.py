@@ -0,0 +1,65 @@
+import unittest
+import mock
+from click.testing import CliRunner
+import msword_cli
+import os
+from .util import MockApp
+
+
+@mock.patch('msword_cli.WORD', spec_set=MockApp(['foo.docx']))
+class TestProfileOption(unittest.TestCase):
+    def setUp(self):
+        self.runner = CliRunner()
+        self.profiler = msword_cli.Profiler(msword_cli.time.time())
+
+    def test_profile(self, mock_app):
+        ''' Test --profile prints a phase breakdown. '''
+        with mock.patch('msword_cli.PROFILER', self.profiler):
+            result = self.runner.invoke(msword_cli.cli, ['--profile', 'save'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('Profile (wall-clock):', result.output)
+        self.assertIn('command:save', result.output)
+        self.assertIn('parse', result.output)
+
+    def test_profile_envvar(self, mock_app):
+        ''' Test MSW_PROFILE enables profiling. '''
+        with mock.patch('msword_cli.PROFILER', self.profiler):
+            result = self.runner.invoke(msword_cli.cli, ['save'], env={'MSW_PROFILE': '1'})
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('command:save', result.output)
+
+    def test_no_profile(self, mock_app):
+        ''' Test no breakdown is printed by default. '''
+        with mock.patch('msword_cli.PROFILER', self.profiler):
+            result = self.runner.invoke(msword_cli.cli, ['save'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertNotIn('Profile (wall-clock):', result.output)
+
+    def test_profile_output(self, mock_app):
+        ''' Test --profile-output writes a pstats file. '''
+        import pstats
+        with self.runner.isolated_filesystem():
+            with mock.patch('msword_cli.PROFILER', self.profiler):
+                result = self.runner.invoke(msword_cli.cli, ['--profile-output', 'msw.pstats', 'save'])
+            self.assertEqual(result.exit_code, 0)
+            self.assertTrue(os.path.exists('msw.pstats'))
+            pstats.Stats('msw.pstats')
+
+
+class TestProfilerReport(unittest.TestCase):
+    def test_nested_phases(self):
+        ''' Test a phase within another is subtracted from it. '''
+        start = msword_cli.time.time() - 10
+        profiler = msword_cli.Profiler(start)
+        profiler.record('import', start, start + 1)
+        # Word is dispatched during the command
+        profiler.record('dispatch', start + 3, start + 5)
+        profiler.record('command:save', start + 2, start + 6)
+        lines = profiler.report()
+        rows = dict((line.split()[0], line.split()[1:]) for line in lines[1:])
+        self.assertEqual(rows['command:save'][0], '2.000s')
+        self.assertEqual(rows['dispatch'][0], '2.000s')
+        self.assertEqual(rows['import'][0], '1.000s')
+        self.assertAlmostEqual(float(rows['other'][0][:-1]), 5, places=1)
+        self.assertAlmostEqual(sum(float(row[1][:-1]) for name, row in rows.items() if name != 'total'),
+                               100, places=0)
@@ -0,0 +1,123 @@
+import unittest
+import mock
+from click.testing import CliRunner
+import msword_cli
+import zipfile
+import json
+import os
+from .util import make_docx, touch
+
+CUSTOM = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Properties xmlns="http://schemas.openxmlformats.org/officeDocument/2006/custom-properties" '
+    'xmlns:vt="http://schemas.openxmlformats.org/officeDocument/2006/docPropsVTypes">'
+    '<property fmtid="{D5CDD505-2E9C-101B-9397-08002B2CF9AE}" pid="2" name="Client">'
+    '<vt:lpwstr>Acme</vt:lpwstr></property>'
+    '<property fmtid="{D5CDD505-2E9C-101B-9397-08002B2CF9AE}" pid="3" name="Approved">'
+    '<vt:bool>true</vt:bool></property>'
+    '</Properties>'
+)
+
+
+class TestPropsCommand(unittest.TestCase):
+    def setUp(self):
+        self.runner = CliRunner()
+
+    def test_get(self):
+        ''' Test getting core and custom properties. '''
+        with self.runner.isolated_filesystem():
+            make_docx('foo.docx', core={'dc:title': 'Foo', 'cp:keywords': 'a, b'},
+                      parts={'docProps/custom.xml': CUSTOM})
+            result = self.runner.invoke(msword_cli.props, ['get', '--json', 'foo.docx'])
+            self.assertEqual(result.exit_code, 0)
+            record = json.loads(result.output)
+            self.assertEqual(record['title'], 'Foo')
+            self.assertEqual(record['keywords'], 'a, b')
+            self.assertEqual(record['Client'], 'Acme')
+            self.assertEqual(record['Approved'], 'true')
+
+    def test_set(self):
+        ''' Test setting properties rewrites only the property parts. '''
+        with self.runner.isolated_filesystem():
+            make_docx('foo.docx', core={'dc:title': 'Foo'}, parts={'docProps/custom.xml': CUSTOM,
+                                                                   'word/media/image1.png': b'x' * 1000})
+            with zipfile.ZipFile('foo.docx') as z:
+                before = dict((i.filename, (i.CRC, i.compress_size)) for i in z.infolist())
+            with mock.patch('msword_cli.WORD') as word:
+                result = self.runner.invoke(msword_cli.props, ['set', 'foo.docx', '-p', 'title=Bar & Co',
+                                                               '-p', 'subject=Sub', '-p', 'Client=Globex',
+                                                               '-p', 'custom:title=Custom'])
+            self.assertEqual(result.exit_code, 0)
+            self.assertEqual(word.mock_calls, [])
+            self.assertEqual(result.output, 'Set properties on 1 of 1 document(s).\n')
+            with zipfile.ZipFile('foo.docx') as z:
+                self.assertIsNone(z.testzip())
+                after = dict((i.filename, (i.CRC, i.compress_size)) for i in z.infolist())
+                core = z.read('docProps/core.xml').decode('utf-8')
+            self.assertEqual(sorted(before), sorted(after))
+            for name in before:
+                if name not in ('docProps/core.xml', 'docProps/custom.xml'):
+                    self.assertEqual(before[name], after[name])
+            self.assertIn('xmlns:dc="http://purl.org/dc/elements/1.1/"', core)
+            props = msword_cli.package_properties('foo.docx')
+            self.assertEqual(props['title'], 'Bar & Co')
+            self.assertEqual(props['subject'], 'Sub')
+            self.assertEqual(props['Client'], 'Globex')
+            with zipfile.ZipFile('foo.docx') as z:
+                custom = msword_cli.read_custom_properties(z)
+            self.assertEqual(list(custom.items()), [('Client', ('lpwstr', 'Globex')), ('Approved', ('bool', 'true')),
+                                                    ('title', ('lpwstr', 'Custom'))])
+
+    def test_set_new_custom_part(self):
+        ''' Test setting a custom property on a package without custom properties. '''
+        with self.runner.isolated_filesystem():
+            make_docx('foo.docx')
+            result = self.runner.invoke(msword_cli.props, ['set', 'foo.docx', '-p', 'Client=Acme'])
+            self.assertEqual(result.exit_code, 0)
+            with zipfile.ZipFile('foo.docx') as z:
+                types = z.read('[Content_Types].xml').decode('utf-8')
+                rels = z.read('_rels/.rels').decode('utf-8')
+            self.assertIn('PartName="/docProps/custom.xml"', types)
+            self.assertIn('Target="docProps/custom.xml"', rels)
+            self.assertEqual(msword_cli.package_properties('foo.docx')['Client'], 'Acme')
+
+    def test_set_csv(self):
+        ''' Test setting properties per document from a CSV file. '''
+        with self.runner.isolated_filesystem():
+            os.mkdir('docs')
+            make_docx(os.path.join('docs', 'a.docx'), core={'dc:title': 'A'})
+            make_docx(os.path.join('docs', 'b.docx'), core={'dc:title': 'B'})
+            with open(os.path.join('docs', 'props.csv'), 'w') as f:
+                f.write('path,title,Client\na.docx,New A,\nb.docx,,Acme\n')
+            result = self.runner.invoke(msword_cli.props, ['set', '--csv', os.path.join('docs', 'props.csv')])
+            self.assertEqual(result.exit_code, 0)
+            a = msword_cli.package_properties(os.path.join('docs', 'a.docx'))
+            b = msword_cli.package_properties(os.path.join('docs', 'b.docx'))
+            self.assertEqual((a['title'], a.get('Client')), ('New A', None))
+            self.assertEqual((b['title'], b['Client']), ('B', 'Acme'))
+
+    def test_set_legacy(self):
+        ''' Test setting properties of legacy documents with Word. '''
+        app = mock.MagicMock()
+        doc = app.Documents.Open.return_value
+        doc.CustomDocumentProperties.side_effect = msword_cli.com_error(-2147352567, 'Exception occurred.',
+                                                                        (0, None, 'Invalid', None, 0, 0), None)
+        with self.runner.isolated_filesystem():
+            touch('old.doc')
+            with mock.patch('msword_cli.new_instance', return_value=app):
+                result = self.runner.invoke(msword_cli.props, ['set', 'old.doc', '-p', 'title=T', '-p', 'Client=C'])
+            self.assertEqual(result.exit_code, 0)
+            doc.BuiltInDocumentProperties.assert_called_with('Title')
+            self.assertEqual(doc.BuiltInDocumentProperties.return_value.Value, 'T')
+            doc.CustomDocumentProperties.Add.assert_called_with(Name='Client', LinkToContent=False,
+                                                                Type=msword_cli.C.msoPropertyTypeString, Value='C')
+            doc.Save.assert_called_with()
+
+    def test_set_requires_values(self):
+        ''' Test set without properties. '''
+        with self.runner.isolated_filesystem():
+            make_docx('foo.docx')
+            result = self.runner.invoke(msword_cli.props, ['set', 'foo.docx'])
+            self.assertEqual(result.exit_code, 2)
+            result = self.runner.invoke(msword_cli.props, ['set', 'foo.docx', '-p', 'title'])
+            self.assertEqual(result.exit_code, 2)
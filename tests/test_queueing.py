@@ -0,0 +1,342 @@
+import unittest
+import multiprocessing
+import mock
+from click.testing import CliRunner
+import msword_cli
+from .util import touch
+import functools
+import itertools
+import json
+import time
+import io
+import os
+
+
+class FakeDocument(object):
+    ''' A document which appends the name of each file it is saved to to a log. '''
+    def __init__(self, log):
+        self.log = log
+
+    def SaveAs2(self, FileName, **kwargs):
+        with io.open(self.log, 'a', encoding='utf-8') as f:
+            f.write(FileName + '\n')
+
+    def Close(self, *args):
+        pass
+
+
+class FakeWord(object):
+    ''' A stand in for a hidden instance of Word. '''
+    def __init__(self, log):
+        self.Documents = mock.MagicMock()
+        self.Documents.Open.return_value = FakeDocument(log)
+
+    def Quit(self, *args):
+        pass
+
+
+def work(path, name, log):
+    msword_cli.JobQueue(path).work(name, factory=lambda: FakeWord(log), exit_when_empty=True, poll=0.01)
+
+
+class TestJobQueue(unittest.TestCase):
+    def setUp(self):
+        self.runner = CliRunner()
+
+    def submit(self, jobs, count):
+        for i in range(count):
+            jobs.submit('convert', ['doc%d.doc' % i, 'doc%d.docx' % i, 16, 65001])
+
+    def test_claim_is_exclusive(self):
+        ''' Test each pending job is claimed once. '''
+        with self.runner.isolated_filesystem():
+            jobs = msword_cli.JobQueue('q')
+            self.submit(jobs, 2)
+            first = jobs.claim('a')
+            second = jobs.claim('b')
+            self.assertIsNone(jobs.claim('c'))
+            self.assertEqual(first.job['args'][0], 'doc0.doc')
+            self.assertEqual(second.job['args'][0], 'doc1.doc')
+            self.assertEqual(jobs.status(), {'pending': 0, 'leased': 2, 'done': 0, 'failed': 0})
+            self.assertTrue(jobs.complete(first, 'a', result='doc0.docx'))
+            self.assertTrue(jobs.complete(second, 'b', error='Boom'))
+            self.assertEqual(jobs.status(), {'pending': 0, 'leased': 0, 'done': 1, 'failed': 1})
+            with io.open(os.path.join('q', 'failed', second.job['id'] + '.json'), encoding='utf-8') as f:
+                self.assertEqual(json.load(f)['error'], 'Boom')
+
+    def test_reclaim_expired_lease(self):
+        ''' Test the job of a dead worker is returned to the queue and then fails. '''
+        with self.runner.isolated_filesystem():
+            jobs = msword_cli.JobQueue('q', lease_timeout=10, max_attempts=2)
+            self.submit(jobs, 1)
+            lease = jobs.claim('dead')
+            self.assertEqual(jobs.reclaim('b'), 0)
+            os.utime(lease.path, (time.time() - 20, time.time() - 20))
+            self.assertEqual(jobs.reclaim('b'), 1)
+            self.assertEqual(jobs.status()['pending'], 1)
+            # The dead worker cannot complete a job it has lost
+            self.assertFalse(jobs.complete(lease, 'dead', result='late'))
+            self.assertEqual(jobs.status()['done'], 0)
+            lease = jobs.claim('dead')
+            self.assertEqual(lease.job['attempts'], 1)
+            os.utime(lease.path, (time.time() - 20, time.time() - 20))
+            jobs.reclaim('b')
+            self.assertEqual(jobs.status(), {'pending': 0, 'leased': 0, 'done': 0, 'failed': 1})
+
+    def test_claim_old_job(self):
+        ''' Test a job which waited longer than the lease timeout is not reclaimed once claimed. '''
+        with self.runner.isolated_filesystem():
+            jobs = msword_cli.JobQueue('q', lease_timeout=10)
+            self.submit(jobs, 1)
+            pending = os.path.join('q', 'pending', os.listdir(os.path.join('q', 'pending'))[0])
+            os.utime(pending, (time.time() - 20, time.time() - 20))
+            real_rename = os.rename
+
+            def rename(src, dest):
+                real_rename(src, dest)
+                if dest.startswith(os.path.join('q', 'leased')):
+                    # Another worker looks for expired leases in the meantime
+                    self.assertEqual(jobs.reclaim('b'), 0)
+
+            with mock.patch('os.rename', rename):
+                lease = jobs.claim('a')
+            self.assertEqual(lease.job['args'][0], 'doc0.doc')
+            self.assertEqual(jobs.status()['leased'], 1)
+
+    def test_heartbeat(self):
+        ''' Test an active lease is kept alive and notices when it is lost. '''
+        with self.runner.isolated_filesystem():
+            jobs = msword_cli.JobQueue('q', lease_timeout=0.3)
+            self.submit(jobs, 1)
+            lease = jobs.claim('a')
+            with lease:
+                time.sleep(0.6)
+                self.assertEqual(jobs.reclaim('b'), 0)
+                os.remove(lease.path)
+                time.sleep(0.3)
+            self.assertTrue(lease.lost)
+
+    def test_work_processes(self):
+        ''' Test several worker processes complete each job exactly once. '''
+        with self.runner.isolated_filesystem():
+            jobs = msword_cli.JobQueue('q')
+            self.submit(jobs, 40)
+            log = os.path.abspath('log.txt')
+            workers = [multiprocessing.Process(target=work, args=('q', 'w%d' % i, log)) for i in range(4)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join(60)
+            self.assertEqual(jobs.status(), {'pending': 0, 'leased': 0, 'done': 40, 'failed': 0})
+            with io.open(log, encoding='utf-8') as f:
+                saved = f.read().split()
+            self.assertEqual(sorted(saved), sorted('doc%d.docx' % i for i in range(40)))
+
+
+class TestScheduling(unittest.TestCase):
+    def setUp(self):
+        self.runner = CliRunner()
+
+    def submit(self, jobs, names, **kwargs):
+        for name in names:
+            jobs.submit('convert', [name + '.doc', name + '.docx', 16, 65001], **kwargs)
+
+    def claim_all(self, jobs):
+        names = []
+        lease = jobs.claim('a')
+        while lease is not None:
+            names.append(lease.job['args'][0][:-4])
+            jobs.complete(lease, 'a')
+            lease = jobs.claim('a')
+        return names
+
+    def test_priority(self):
+        ''' Test more urgent jobs are claimed first and their wait is recorded by class. '''
+        with self.runner.isolated_filesystem():
+            jobs = msword_cli.JobQueue('q')
+            self.submit(jobs, ['b1', 'b2'], priority='backfill')
+            self.submit(jobs, ['n1'])
+            self.submit(jobs, ['u1'], priority='urgent')
+            waiting = jobs.waiting()
+            self.assertEqual([count for count, longest in waiting.values()], [1, 1, 2])
+            self.assertGreaterEqual(waiting['backfill'][1], 0)
+            with mock.patch.object(msword_cli.METRICS, 'observe') as observe:
+                self.assertEqual(self.claim_all(jobs), ['u1', 'n1', 'b1', 'b2'])
+            self.assertEqual(observe.call_args_list[0][0][0], 'msw_queue_wait_seconds')
+            self.assertEqual([call[1] for call in observe.call_args_list], [
+                {'priority': 'urgent'}, {'priority': 'normal'}, {'priority': 'backfill'}, {'priority': 'backfill'}
+            ])
+            self.assertEqual(jobs.waiting()['backfill'], (0, None))
+
+    def test_fair_share(self):
+        ''' Test the tenants of a priority class take turns. '''
+        with self.runner.isolated_filesystem():
+            jobs = msword_cli.JobQueue('q')
+            self.submit(jobs, ['a1', 'a2', 'a3'], tenant='alpha')
+            self.submit(jobs, ['b1', 'b2'], tenant='beta team')
+            self.assertEqual(self.claim_all(jobs), ['a1', 'b1', 'a2', 'b2', 'a3'])
+            # A tenant with jobs running on other hosts waits its turn
+            self.submit(jobs, ['a4', 'a5'], tenant='alpha')
+            self.submit(jobs, ['b3'], tenant='beta team')
+            running = msword_cli.JobQueue('q').claim('other')
+            self.assertEqual(running.job['args'][0], 'a4.doc')
+            self.assertEqual(jobs.claim('a').job['args'][0], 'b3.doc')
+
+    def test_legacy_names(self):
+        ''' Test jobs named before there were priorities are normal jobs of the default tenant. '''
+        self.assertEqual(msword_cli.job_fields('1490000000000-000001-0123abcd.json'), (1, 'default'))
+        self.assertEqual(msword_cli.job_fields('2-1490000000000-000001-0123abcd-x.y~host-1-0.json'), (2, 'x.y'))
+
+
+@mock.patch('msword_cli.psutil')
+class TestAdmission(unittest.TestCase):
+    def test_load(self, psutil):
+        ''' Test jobs are held back while the CPU is busy or memory is short. '''
+        psutil.cpu_percent.return_value = 95.0
+        psutil.virtual_memory.return_value.available = 2048 * 1048576
+        reasons = []
+        admission = msword_cli.Admission(max_cpu=80, min_memory=1024, interval=0, on_throttle=reasons.append)
+        self.assertEqual(admission.check(), 'CPU at 95% (limit 80%).')
+        admission.check()
+        psutil.cpu_percent.return_value = 10.0
+        psutil.virtual_memory.return_value.available = 512 * 1048576
+        self.assertEqual(admission.check(), '512 MB of memory available (limit 1024 MB).')
+        psutil.virtual_memory.return_value.available = 4096 * 1048576
+        self.assertIsNone(admission.check())
+        self.assertEqual(reasons, ['CPU at 95% (limit 80%).'])
+
+    def test_restarts(self, psutil):
+        ''' Test jobs are held back while Word keeps failing. '''
+        psutil.cpu_percent.return_value = 99.0
+        admission = msword_cli.Admission(max_restarts=2, window=0.2)
+        admission.restarted()
+        self.assertIsNone(admission.check())
+        admission.restarted()
+        self.assertIn('2 instances of Word restarted', admission.check())
+        time.sleep(0.3)
+        self.assertIsNone(admission.check())
+
+    def test_work(self, psutil):
+        ''' Test a worker claims no job while it is held back. '''
+        admission = mock.Mock()
+        admission.check.side_effect = ['Busy.', 'Busy.', None, None, None]
+        with CliRunner().isolated_filesystem():
+            jobs = msword_cli.JobQueue('q')
+            jobs.submit('convert', ['foo.doc', 'foo.docx', 16, 65001])
+            log = os.path.abspath('log.txt')
+            self.assertEqual(jobs.work('a', factory=lambda: FakeWord(log), exit_when_empty=True, poll=0.01,
+                                       admission=admission), 1)
+            self.assertEqual(admission.check.call_count, 4)
+
+
+class TestQueueCommand(unittest.TestCase):
+    def setUp(self):
+        self.runner = CliRunner()
+        self.app = mock.MagicMock()
+        patcher = mock.patch('msword_cli.new_instance', return_value=self.app)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_submit_and_work(self):
+        ''' Test jobs submitted with the convert options are run by workers. '''
+        with self.runner.isolated_filesystem():
+            touch('foo.doc')
+            touch('bar.doc')
+            result = self.runner.invoke(msword_cli.cli, ['queue', 'submit', 'q', 'convert', '--to', 'txt',
+                                                         '--out', 'out', 'foo.doc', 'bar.doc'])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn('Submitted 2 job(s)', result.output)
+            result = self.runner.invoke(msword_cli.cli, ['queue', '--workers', '2', '--exit-when-empty',
+                                                         '--poll', '0.01', 'work', 'q'])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn('Done: convert %s' % os.path.abspath('foo.doc'), result.output)
+            self.app.Documents.Open.return_value.SaveAs2.assert_any_call(
+                FileName=os.path.abspath(os.path.join('out', 'bar.txt')),
+                FileFormat=msword_cli.C.wdFormatText,
+                Encoding=65001,
+                AddToRecentFiles=False
+            )
+            result = self.runner.invoke(msword_cli.cli, ['queue', 'status', 'q'])
+            self.assertIn('done: 2', result.output)
+
+    def test_submit_export(self):
+        ''' Test export jobs take the export options. '''
+        with self.runner.isolated_filesystem():
+            touch('foo.docx')
+            result = self.runner.invoke(msword_cli.cli, ['queue', 'submit', 'q', 'export', '--for-screen',
+                                                         '--pages', '2-3', 'out.pdf', 'foo.docx'])
+            self.assertEqual(result.exit_code, 0, result.output)
+            jobs = msword_cli.JobQueue('q')
+            lease = jobs.claim('a')
+            src, dest, options = lease.job['args']
+            self.assertEqual(dest, os.path.abspath('out.pdf'))
+            self.assertEqual(options['OptimizeFor'], msword_cli.C.wdExportOptimizeForOnScreen)
+            self.assertEqual((options['From'], options['To']), (2, 3))
+            msword_cli.export_document(self.app, (src, dest, options))
+            self.app.Documents.Open.return_value.ExportAsFixedFormat.assert_called_with(
+                OutputFileName=dest, **options)
+
+    def test_submit_print_to_files(self):
+        ''' Test print jobs print in the foreground to files in '--out'. '''
+        with self.runner.isolated_filesystem():
+            touch('foo.docx')
+            result = self.runner.invoke(msword_cli.cli, ['queue', 'submit', 'q', 'print', '-c', '2',
+                                                         '--out', 'out', 'foo.docx'])
+            self.assertEqual(result.exit_code, 0, result.output)
+            lease = msword_cli.JobQueue('q').claim('a')
+            msword_cli.print_document(self.app, tuple(lease.job['args']))
+            kwargs = self.app.Documents.Open.return_value.PrintOut.call_args[1]
+            self.assertEqual(kwargs['OutputFileName'], os.path.abspath(os.path.join('out', 'foo.prn')))
+            self.assertTrue(kwargs['PrintToFile'])
+            self.assertFalse(kwargs['Background'])
+            self.assertEqual(kwargs['Copies'], 2)
+
+    def test_submit_rejects(self):
+        ''' Test options which cannot be queued are rejected. '''
+        with self.runner.isolated_filesystem():
+            touch('foo.docx')
+            result = self.runner.invoke(msword_cli.cli, ['queue', 'submit', 'q', 'export', '--show',
+                                                         'out.pdf', 'foo.docx'])
+            self.assertEqual(result.exit_code, 2)
+            self.assertIn('Cannot be queued', result.output)
+            result = self.runner.invoke(msword_cli.cli, ['queue', 'submit', 'q', 'save', 'foo.docx'])
+            self.assertEqual(result.exit_code, 2)
+            self.assertEqual(msword_cli.JobQueue('q').status()['pending'], 0)
+
+    def test_failed_job(self):
+        ''' Test a job which raises is recorded as failed. '''
+        self.app.Documents.Open.side_effect = msword_cli.com_error(-2146823114, 'Word',
+                                                                   (0, 'Word', 'No such file.', None, 0, 0), None)
+        with self.runner.isolated_filesystem():
+            jobs = msword_cli.JobQueue('q')
+            jobs.submit('convert', ['foo.doc', 'foo.docx', 16, 65001])
+            self.assertEqual(jobs.work('a', exit_when_empty=True, poll=0.01), 1)
+            self.assertEqual(jobs.status()['failed'], 1)
+
+    def test_priority_and_status(self):
+        ''' Test submitted jobs take the priority class and tenant and their wait is reported. '''
+        with self.runner.isolated_filesystem():
+            touch('foo.doc')
+            result = self.runner.invoke(msword_cli.cli, ['queue', '--priority', 'urgent', '--tenant', 'legal',
+                                                         'submit', 'q', 'convert', '--to', 'txt', '--out', 'out',
+                                                         'foo.doc'])
+            self.assertEqual(result.exit_code, 0, result.output)
+            result = self.runner.invoke(msword_cli.cli, ['queue', 'status', 'q'])
+            self.assertIn('pending: 1', result.output)
+            self.assertIn('pending urgent: 1 (longest wait', result.output)
+            self.assertNotIn('pending normal', result.output)
+            lease = msword_cli.JobQueue('q').claim('a')
+            self.assertEqual((lease.job['priority'], lease.job['tenant']), ('urgent', 'legal'))
+
+    @mock.patch('msword_cli.psutil')
+    def test_admission(self, psutil):
+        ''' Test workers report when they hold back jobs. '''
+        psutil.cpu_percent.side_effect = itertools.chain([100.0], itertools.repeat(0.0))
+        with self.runner.isolated_filesystem():
+            msword_cli.JobQueue('q').submit('convert', ['foo.doc', 'foo.docx', 16, 65001])
+            with mock.patch('msword_cli.Admission', functools.partial(msword_cli.Admission, interval=0)):
+                result = self.runner.invoke(msword_cli.cli, ['queue', '--max-cpu', '90', '--exit-when-empty',
+                                                             '--poll', '0.01', 'work', 'q'])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn('Holding back jobs: CPU at 100% (limit 90%).', result.output)
+            self.assertIn('Done: convert foo.doc', result.output)
@@ -0,0 +1,186 @@
+import unittest
+import mock
+from click.testing import CliRunner
+import msword_cli
+import zipfile
+import json
+import os
+from .util import make_docx
+
+BODY = (
+    '<w:p><w:r><w:t>Dear {{</w:t></w:r><w:r><w:rPr><w:b/></w:rPr><w:t>name</w:t></w:r>'
+    '<w:r><w:t>}}, you owe {{ amount }}.</w:t></w:r></w:p>'
+    '<w:sdt><w:sdtPr><w:tag w:val="city"/><w:showingPlcHdr/></w:sdtPr>'
+    '<w:sdtContent><w:p><w:r><w:t>Click here</w:t></w:r><w:r><w:t> to enter text.</w:t></w:r></w:p>'
+    '</w:sdtContent></w:sdt>'
+    '<w:p><w:r><w:t xml:space="preserve">Ref: </w:t></w:r><w:bookmarkStart w:id="0" w:name="ref"/>'
+    '<w:r><w:t>XXX</w:t></w:r><w:bookmarkEnd w:id="0"/><w:bookmarkStart w:id="1" w:name="_GoBack"/>'
+    '<w:bookmarkEnd w:id="1"/></w:p>'
+    '<w:p><w:r><w:t>No fields &amp; text</w:t></w:r></w:p>'
+)
+
+HEADER = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<w:hdr xmlns:mc="http://schemas.openxmlformats.org/markup-compatibility/2006" '
+    'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main" '
+    'xmlns:w14="http://schemas.microsoft.com/office/word/2010/wordml" mc:Ignorable="w14">'
+    '<w:p><w:r><w:t>Account {{ref}}</w:t></w:r></w:p></w:hdr>'
+)
+
+
+class TestRenderCommand(unittest.TestCase):
+    def setUp(self):
+        self.runner = CliRunner()
+
+    def make_template(self):
+        make_docx('letter.dotx', body=BODY, parts={'word/header1.xml': HEADER,
+                                                   'word/media/image1.png': b'\x89PNG not really'})
+        with open('data.csv', 'w') as f:
+            f.write('name,amount,city,ref\nJane,$5,Paris,A1\nJohn <Jr>,"1\n2",Oslo,B2\n')
+
+    def read(self, path):
+        paras = [p['text'] for p in msword_cli.package_paragraphs(path)]
+        with zipfile.ZipFile(path) as z:
+            self.assertIsNone(z.testzip())
+            header = z.read('word/header1.xml').decode('utf-8')
+            types = z.read('[Content_Types].xml').decode('utf-8')
+            self.assertEqual(z.read('word/media/image1.png'), b'\x89PNG not really')
+        return paras, header, types
+
+    def test_template_fields(self):
+        ''' Test the fields of a template are found. '''
+        with self.runner.isolated_filesystem():
+            self.make_template()
+            tmpl = msword_cli.DocumentTemplate('letter.dotx')
+            self.assertEqual(tmpl.fields, set(['name', 'amount', 'city', 'ref']))
+            self.assertFalse(tmpl.macros)
+
+    def test_render_csv(self):
+        ''' Test rendering a document for each row of a CSV file. '''
+        with self.runner.isolated_filesystem():
+            self.make_template()
+            with mock.patch('msword_cli.WORD') as word:
+                result = self.runner.invoke(msword_cli.render, ['letter.dotx', 'data.csv', '--out', 'out'])
+            self.assertEqual(result.exit_code, 0)
+            self.assertEqual(word.mock_calls, [])
+            self.assertEqual(sorted(os.listdir('out')), ['letter-1.docx', 'letter-2.docx'])
+            paras, header, types = self.read(os.path.join('out', 'letter-1.docx'))
+            self.assertEqual(paras, ['Dear Jane, you owe $5.', 'Paris', 'Ref: A1', 'No fields & text'])
+            self.assertIn('Account A1', header)
+            self.assertIn('xmlns:w14="http://schemas.microsoft.com/office/word/2010/wordml"', header)
+            self.assertIn('mc:Ignorable="w14"', header)
+            self.assertIn('wordprocessingml.document.main+xml', types)
+            self.assertNotIn('showingPlcHdr', paras)
+            paras, header, types = self.read(os.path.join('out', 'letter-2.docx'))
+            self.assertEqual(paras[:3], ['Dear John <Jr>, you owe 1\n2.', 'Oslo', 'Ref: B2'])
+
+    def test_render_json_names(self):
+        ''' Test rendering JSON rows with a name pattern. '''
+        with self.runner.isolated_filesystem():
+            self.make_template()
+            with open('data.json', 'w') as f:
+                json.dump([{'name': 'A/B', 'amount': 3, 'city': None, 'ref': 'X'}], f)
+            result = self.runner.invoke(msword_cli.render, ['letter.dotx', 'data.json', '-o', 'out',
+                                                            '--name', '{name}-{n:03}'])
+            self.assertEqual(result.exit_code, 0)
+            paras, header, types = self.read(os.path.join('out', 'A_B-001.docx'))
+            self.assertEqual(paras[:2], ['Dear A/B, you owe 3.', ''])
+
+    def test_render_missing_field(self):
+        ''' Test a row without a value for a field fails. '''
+        with self.runner.isolated_filesystem():
+            self.make_template()
+            with open('data.jsonl', 'w') as f:
+                f.write('{"name": "A", "amount": 1, "city": "C", "ref": "R"}\n{"name": "B"}\n')
+            result = self.runner.invoke(msword_cli.render, ['letter.dotx', 'data.jsonl', '-o', 'out'])
+            self.assertEqual(result.exit_code, 1)
+            self.assertIn("Failed: row 2: No value for field 'amount'", result.output)
+            self.assertIn('1 of 2 documents failed.', result.output)
+            self.assertEqual(os.listdir('out'), ['letter-1.docx'])
+
+    def test_render_other_bookmarks(self):
+        ''' Test bookmarks and content controls which are not fields of the data are left alone. '''
+        body = BODY + (
+            '<w:p><w:bookmarkStart w:id="2" w:name="Appendix"/><w:r><w:t>Appendix</w:t></w:r>'
+            '<w:bookmarkEnd w:id="2"/></w:p>'
+            '<w:sdt><w:sdtPr><w:alias w:val="Signature"/></w:sdtPr>'
+            '<w:sdtContent><w:p><w:r><w:t>Signed</w:t></w:r></w:p></w:sdtContent></w:sdt>'
+        )
+        with self.runner.isolated_filesystem():
+            make_docx('letter.dotx', body=body)
+            with open('data.csv', 'w') as f:
+                f.write('name,amount,city,ref,n\nJane,$5,Paris,A1,x\n')
+            result = self.runner.invoke(msword_cli.render, ['letter.dotx', 'data.csv', '-o', 'out',
+                                                            '--name', '{name}-{n}'])
+            self.assertEqual(result.exit_code, 0, result.output)
+            paras = [p['text'] for p in msword_cli.package_paragraphs(os.path.join('out', 'Jane-1.docx'))]
+            self.assertEqual(paras[2:], ['Ref: A1', 'No fields & text', 'Appendix', 'Signed'])
+            tmpl = msword_cli.DocumentTemplate('letter.dotx', set(['name', 'amount']))
+            self.assertEqual(tmpl.fields, set(['name', 'amount']))
+
+    def test_render_block_bookmarks(self):
+        ''' Test bookmarks which start between paragraphs or rows mark the next paragraph. '''
+        body = (
+            '<w:bookmarkStart w:id="0" w:name="name"/><w:p><w:pPr><w:jc w:val="center"/></w:pPr>'
+            '<w:r><w:t>Name</w:t></w:r></w:p><w:p><w:r><w:t>Kept</w:t></w:r></w:p><w:bookmarkEnd w:id="0"/>'
+            '<w:tbl><w:bookmarkStart w:id="1" w:name="ref"/><w:tr><w:tc><w:p><w:r><w:t>Ref</w:t></w:r></w:p>'
+            '</w:tc></w:tr><w:bookmarkEnd w:id="1"/></w:tbl>'
+            '<w:bookmarkStart w:id="2" w:name="empty"/><w:bookmarkEnd w:id="2"/><w:p/>'
+        )
+        with self.runner.isolated_filesystem():
+            make_docx('letter.dotx', body=body)
+            tmpl = msword_cli.DocumentTemplate('letter.dotx')
+            self.assertEqual(tmpl.fields, set(['name', 'ref']))
+            tmpl.render('out.docx', {'name': 'Jane', 'ref': 'A1'})
+            paras = [p['text'] for p in msword_cli.package_paragraphs('out.docx')]
+            self.assertEqual(paras, ['Jane', 'Kept', 'A1', ''])
+            with zipfile.ZipFile('out.docx') as z:
+                root = msword_cli.ElementTree.fromstring(z.read('word/document.xml'))
+            for tag in ('body', 'tbl', 'tr'):
+                for parent in root.iter(msword_cli.wtag(tag)):
+                    self.assertIsNone(parent.find(msword_cli.wtag('r')))
+            self.assertEqual(root.find('.//' + msword_cli.wtag('p'))[0].tag, msword_cli.wtag('pPr'))
+
+    def test_render_macro_template_without_macros(self):
+        ''' Test a macro-enabled template without macros renders documents of the .docx type. '''
+        with self.runner.isolated_filesystem():
+            make_docx('tmp.dotm', body=BODY)
+            with zipfile.ZipFile('tmp.dotm') as src, zipfile.ZipFile('letter.dotm', 'w') as dest:
+                for info in src.infolist():
+                    data = src.read(info)
+                    if info.filename == '[Content_Types].xml':
+                        data = data.replace(b'application/vnd.openxmlformats-officedocument.wordprocessingml.'
+                                            b'document.main+xml',
+                                            b'application/vnd.ms-word.template.macroEnabledTemplate.main+xml')
+                    dest.writestr(info, data)
+            with open('data.csv', 'w') as f:
+                f.write('name,amount,city,ref\nJane,$5,Paris,A1\n')
+            result = self.runner.invoke(msword_cli.render, ['letter.dotm', 'data.csv', '-o', 'out'])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertEqual(os.listdir('out'), ['letter-1.docx'])
+            with zipfile.ZipFile(os.path.join('out', 'letter-1.docx')) as z:
+                types = z.read('[Content_Types].xml').decode('utf-8')
+            self.assertIn('wordprocessingml.document.main+xml', types)
+            self.assertNotIn('macroEnabled', types)
+
+    def test_render_pdf(self):
+        ''' Test rendered documents are exported to PDF with Word. '''
+        app = mock.MagicMock()
+        with self.runner.isolated_filesystem():
+            self.make_template()
+            with mock.patch('msword_cli.new_instance', return_value=app):
+                result = self.runner.invoke(msword_cli.render, ['letter.dotx', 'data.csv', '-o', 'out', '--pdf'])
+            self.assertEqual(result.exit_code, 0)
+            doc = app.Documents.Open.return_value
+            self.assertEqual(doc.SaveAs2.call_count, 2)
+            self.assertEqual(doc.SaveAs2.call_args[1]['FileName'], os.path.abspath(os.path.join('out', 'letter-2.pdf')))
+            self.assertEqual(doc.SaveAs2.call_args[1]['FileFormat'], msword_cli.C.wdFormatPDF)
+
+    def test_render_not_ooxml(self):
+        ''' Test a legacy template is rejected. '''
+        with self.runner.isolated_filesystem():
+            self.make_template()
+            with open('old.dot', 'w') as f:
+                f.write('legacy')
+            result = self.runner.invoke(msword_cli.render, ['old.dot', 'data.csv', '-o', 'out'])
+            self.assertEqual(result.exit_code, 2)
@@ -0,0 +1,140 @@
+import unittest
+import mock
+from click.testing import CliRunner
+import msword_cli
+import zipfile
+import os
+from .util import make_docx, touch
+
+BODY = (
+    '<w:p><w:r><w:t>Acme </w:t></w:r><w:r><w:rPr><w:b/></w:rPr><w:t>Wid</w:t></w:r>'
+    '<w:r><w:t>gets Ltd makes widgets. See clause 4.2 and clause 7.1.</w:t></w:r></w:p>'
+    '<w:p><w:r><w:t>ACME WIDGETS</w:t></w:r></w:p>'
+)
+
+
+def paragraphs(path):
+    return [p['text'] for p in msword_cli.package_paragraphs(path)]
+
+
+class TestReplace(unittest.TestCase):
+    def test_wildcard_regex(self):
+        ''' Test translating Word wildcards to regular expressions. '''
+        regex, template = msword_cli.compile_replace('<(clause) ([0-9]@).([0-9])>', '\\1 \\3^&', 'wildcards')
+        self.assertEqual(regex.sub(template, 'see clause 4.2.'), 'see clause 2clause 4.2.')
+        regex, template = msword_cli.compile_replace('c?t[!s]', 'x', 'wildcards')
+        self.assertEqual(regex.sub(template, 'cats cut cot.'), 'cats xx')
+        regex, template = msword_cli.compile_replace('a\\*b', 'c', 'wildcards')
+        self.assertEqual(regex.sub(template, 'a*b ab'), 'c ab')
+
+    def test_literal(self):
+        ''' Test literal patterns are escaped. '''
+        regex, template = msword_cli.compile_replace('4.2 (a)', 'x\\y', whole_word=True)
+        self.assertEqual(regex.sub(template, '4.2 (a) 4x2 (a)'), 'x\\y 4x2 (a)')
+
+
+class TestReplaceCommand(unittest.TestCase):
+    def setUp(self):
+        self.runner = CliRunner()
+
+    def test_replace_across_runs(self):
+        ''' Test replacing text split across runs. '''
+        with self.runner.isolated_filesystem():
+            make_docx('foo.docx', body=BODY)
+            with mock.patch('msword_cli.WORD') as word:
+                result = self.runner.invoke(msword_cli.replace, ['Acme Widgets', 'Globex', 'foo.docx'])
+            self.assertEqual(result.exit_code, 0)
+            self.assertEqual(word.mock_calls, [])
+            self.assertEqual(paragraphs('foo.docx'),
+                             ['Globex Ltd makes widgets. See clause 4.2 and clause 7.1.', 'Globex'])
+            self.assertIn('Replaced 2 occurrence(s) in 1 of 1 document(s).', result.output)
+            with zipfile.ZipFile('foo.docx') as z:
+                self.assertIsNone(z.testzip())
+
+    def test_replace_match_case(self):
+        ''' Test case sensitive replacement. '''
+        with self.runner.isolated_filesystem():
+            make_docx('foo.docx', body=BODY)
+            result = self.runner.invoke(msword_cli.replace, ['-c', 'ACME', 'Globex', 'foo.docx'])
+            self.assertEqual(result.exit_code, 0)
+            self.assertEqual(paragraphs('foo.docx')[1], 'Globex WIDGETS')
+
+    def test_replace_regex(self):
+        ''' Test replacing with a regular expression. '''
+        with self.runner.isolated_filesystem():
+            make_docx('foo.docx', body=BODY)
+            result = self.runner.invoke(msword_cli.replace, ['--regex', r'clause (\d+)\.(\d+)', r'section \1(\2)',
+                                                             'foo.docx'])
+            self.assertEqual(result.exit_code, 0)
+            self.assertEqual(paragraphs('foo.docx')[0],
+                             'Acme Widgets Ltd makes widgets. See section 4(2) and section 7(1).')
+
+    def test_dry_run(self):
+        ''' Test a dry run reports matches and changes nothing. '''
+        with self.runner.isolated_filesystem():
+            make_docx('foo.docx', body=BODY)
+            make_docx('bar.docx')
+            with open('foo.docx', 'rb') as f:
+                before = f.read()
+            result = self.runner.invoke(msword_cli.replace, ['-n', 'widgets', 'x', 'foo.docx', 'bar.docx'])
+            self.assertEqual(result.exit_code, 0)
+            self.assertEqual(result.output, '%s: 3 match(es)\nFound 3 match(es) in 1 of 2 document(s).\n' %
+                             os.path.abspath('foo.docx'))
+            with open('foo.docx', 'rb') as f:
+                self.assertEqual(f.read(), before)
+
+    def test_replace_bad_pattern(self):
+        ''' Test an invalid regular expression. '''
+        with self.runner.isolated_filesystem():
+            make_docx('foo.docx')
+            result = self.runner.invoke(msword_cli.replace, ['--regex', '(', 'x', 'foo.docx'])
+            self.assertEqual(result.exit_code, 2)
+
+    def test_replace_legacy(self):
+        ''' Test legacy documents are changed with Word. '''
+        app = mock.MagicMock()
+        doc = app.Documents.Open.return_value
+        story = mock.MagicMock()
+        story.NextStoryRange = None
+        story.Duplicate.Find.Execute.side_effect = [True, True, False]
+        doc.StoryRanges = [story]
+        with self.runner.isolated_filesystem():
+            touch('old.doc')
+            with mock.patch('msword_cli.new_instance', return_value=app):
+                result = self.runner.invoke(msword_cli.replace, ['50^ off', 'half off', 'old.doc'])
+            self.assertEqual(result.exit_code, 0)
+            self.assertIn('old.doc: 2 replacement(s)', result.output)
+            kwargs = story.Find.Execute.call_args[1]
+            self.assertEqual(kwargs['FindText'], '50^^ off')
+            self.assertEqual(kwargs['ReplaceWith'], 'half off')
+            self.assertEqual(kwargs['Replace'], msword_cli.C.wdReplaceAll)
+            self.assertFalse(kwargs['MatchWildcards'])
+            doc.Save.assert_called_with()
+
+    def test_track_changes(self):
+        ''' Test revisions are tracked before the replacements are made. '''
+        app = mock.MagicMock()
+        doc = app.Documents.Open.return_value
+        doc.TrackRevisions = False
+        story = mock.MagicMock()
+        story.NextStoryRange = None
+        story.Duplicate.Find.Execute.side_effect = [True, False]
+        tracked = []
+        story.Find.Execute.side_effect = lambda **kwargs: tracked.append(doc.TrackRevisions)
+        doc.StoryRanges = [story]
+        with self.runner.isolated_filesystem():
+            make_docx('foo.docx', BODY)
+            with mock.patch('msword_cli.new_instance', return_value=app):
+                result = self.runner.invoke(msword_cli.replace, ['--track-changes', 'Acme', 'Globex', 'foo.docx'])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertEqual(tracked, [True])
+            doc.Save.assert_called_with()
+
+    def test_replace_regex_legacy(self):
+        ''' Test regular expressions fail for legacy documents. '''
+        with self.runner.isolated_filesystem():
+            touch('old.doc')
+            with mock.patch('msword_cli.new_instance'):
+                result = self.runner.invoke(msword_cli.replace, ['--regex', 'a+', 'b', 'old.doc'])
+            self.assertEqual(result.exit_code, 1)
+            self.assertIn('only supported for OOXML', result.output)
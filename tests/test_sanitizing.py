@@ -0,0 +1,139 @@
+import unittest
+import zipfile
+import json
+import mock
+from click.testing import CliRunner
+import msword_cli
+from .util import make_docx, make_pdf, touch
+import os
+
+REL = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/'
+
+BODY = (
+    '<w:p><w:r><w:t>Keep </w:t></w:r>'
+    '<w:ins w:id="1" w:author="Ann"><w:r><w:t>added </w:t></w:r></w:ins>'
+    '<w:del w:id="2" w:author="Ann"><w:r><w:delText>removed </w:delText></w:r></w:del>'
+    '<w:commentRangeStart w:id="0"/><w:r><w:rPr><w:rPrChange w:id="3" w:author="Ann"><w:rPr/></w:rPrChange>'
+    '</w:rPr><w:t>end</w:t></w:r><w:commentRangeEnd w:id="0"/>'
+    '<w:r><w:commentReference w:id="0"/></w:r></w:p>'
+    # A paragraph whose mark was deleted is joined to the next
+    '<w:p><w:pPr><w:rPr><w:del w:id="4" w:author="Ann"/></w:rPr></w:pPr><w:r><w:t>Joined </w:t></w:r></w:p>'
+    '<w:p><w:pPr><w:jc w:val="center"/></w:pPr><w:r><w:t>paragraph</w:t></w:r></w:p>'
+    '<w:tbl><w:tr><w:trPr><w:del w:id="5" w:author="Ann"/></w:trPr><w:tc><w:p/></w:tc></w:tr>'
+    '<w:tr><w:tc><w:p><w:r><w:t>Row</w:t></w:r></w:p></w:tc></w:tr></w:tbl>'
+)
+
+COMMENTS = ('<w:comments xmlns:w="%s"><w:comment w:id="0" w:author="Bob"><w:p><w:r><w:t>Secret</w:t></w:r>'
+            '</w:p></w:comment></w:comments>' % msword_cli.W_NS)
+
+DOCUMENT_RELS = ('<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                 '<Relationship Id="rId1" Type="%sstyles" Target="styles.xml"/>'
+                 '<Relationship Id="rId2" Type="%scomments" Target="comments.xml"/>'
+                 '</Relationships>' % (REL, REL))
+
+
+def make_reviewed(filename):
+    make_docx(filename, body=BODY, core={'dc:creator': 'Ann', 'cp:lastModifiedBy': 'Bob', 'dc:title': 'Report'},
+              app={'Company': 'Acme', 'Pages': 1},
+              parts={'word/comments.xml': COMMENTS, 'word/_rels/document.xml.rels': DOCUMENT_RELS,
+                     'word/styles.xml': '<w:styles xmlns:w="%s"/>' % msword_cli.W_NS})
+
+
+class TestSanitizePackage(unittest.TestCase):
+    def setUp(self):
+        self.runner = CliRunner()
+
+    def test_sanitize(self):
+        ''' Test tracked changes are accepted and comments and personal properties removed. '''
+        with self.runner.isolated_filesystem():
+            make_reviewed('foo.docx')
+            with zipfile.ZipFile('foo.docx') as package:
+                styles = package.getinfo('word/styles.xml')
+            record = msword_cli.sanitize_package('foo.docx')
+            self.assertEqual(dict(record), {
+                'path': 'foo.docx', 'insertions': 1, 'deletions': 3, 'formatting': 1, 'comments': 1,
+                'properties': 'author, last_modified_by, company'
+            })
+            with zipfile.ZipFile('foo.docx') as package:
+                names = package.namelist()
+                document = package.read('word/document.xml').decode('utf-8')
+                rels = package.read('word/_rels/document.xml.rels').decode('utf-8')
+                core = package.read('docProps/core.xml').decode('utf-8')
+                app = package.read('docProps/app.xml').decode('utf-8')
+                # Unchanged parts are copied as they are
+                self.assertEqual(package.getinfo('word/styles.xml').CRC, styles.CRC)
+            self.assertNotIn('word/comments.xml', names)
+            self.assertNotIn('comments.xml', rels)
+            self.assertIn('styles.xml', rels)
+            for text in ('removed', 'w:ins', 'comment', 'rPrChange', 'w:del '):
+                self.assertNotIn(text, document)
+            self.assertIn('<w:t>added </w:t>', document)
+            self.assertIn('<w:jc w:val="center" /><w:r><w:t>Joined </w:t></w:r><w:r><w:t>paragraph</w:t>',
+                          document.replace('</w:pPr>', ''))
+            self.assertEqual(document.count('<w:tr>'), 1)
+            self.assertNotIn('Ann', core)
+            self.assertNotIn('Bob', core)
+            self.assertIn('Report', core)
+            self.assertNotIn('Acme', app)
+
+    def test_dry_run_and_dest(self):
+        ''' Test a dry run changes nothing and dest leaves the package as it is. '''
+        with self.runner.isolated_filesystem():
+            make_reviewed('foo.docx')
+            with open('foo.docx', 'rb') as f:
+                original = f.read()
+            record = msword_cli.sanitize_package('foo.docx', dry_run=True)
+            self.assertEqual(record['comments'], 1)
+            msword_cli.sanitize_package('foo.docx', 'clean.docx')
+            with open('foo.docx', 'rb') as f:
+                self.assertEqual(f.read(), original)
+            self.assertEqual(msword_cli.sanitize_package('clean.docx', dry_run=True)['properties'], None)
+            make_docx('plain.docx')
+            record = msword_cli.sanitize_package('plain.docx', 'plain-copy.docx')
+            self.assertEqual(msword_cli.sanitize_summary(record), 'plain.docx: nothing to remove')
+            self.assertTrue(zipfile.is_zipfile('plain-copy.docx'))
+
+
+class TestSanitizeCommand(unittest.TestCase):
+    def setUp(self):
+        self.runner = CliRunner()
+
+    def test_report(self):
+        ''' Test each document is reported and legacy formats fail. '''
+        with self.runner.isolated_filesystem():
+            make_reviewed('foo.docx')
+            touch('bar.doc')
+            result = self.runner.invoke(msword_cli.sanitize, ['--out', 'clean', 'foo.docx', 'bar.doc'])
+            self.assertEqual(result.exit_code, 1)
+            self.assertIn('%s: 1 insertion(s) accepted; 3 deletion(s) accepted; 1 formatting change(s) accepted; '
+                          '1 comment(s) removed; properties removed: author, last_modified_by, company'
+                          % os.path.abspath('foo.docx'), result.output)
+            self.assertIn('Only Word documents in OOXML format can be sanitized', result.output)
+            self.assertTrue(os.path.isfile(os.path.join('clean', 'foo.docx')))
+            result = self.runner.invoke(msword_cli.sanitize, ['--json', '--dry-run', 'foo.docx'])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertEqual(json.loads(result.output)['deletions'], 3)
+
+    def test_binder(self):
+        ''' Test the binder exports sanitized copies. '''
+        app = mock.MagicMock()
+        exported = []
+
+        def export(OutputFileName, **kwargs):
+            make_pdf(OutputFileName)
+        app.Documents.Open.return_value.ExportAsFixedFormat.side_effect = export
+        app.Documents.Open.side_effect = lambda FileName, **kwargs: exported.append(FileName) or \
+            app.Documents.Open.return_value
+
+        with self.runner.isolated_filesystem():
+            make_reviewed('foo.docx')
+            with mock.patch('msword_cli.new_instance', return_value=app):
+                result = self.runner.invoke(msword_cli.binder, ['--sanitize', '--no-cache', '-o', 'out.pdf',
+                                                                'foo.docx'])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn('Sanitized %s: 1 insertion(s)' % os.path.abspath('foo.docx'), result.output)
+            self.assertEqual(len(exported), 1)
+            self.assertNotEqual(exported[0], os.path.abspath('foo.docx'))
+            self.assertEqual(os.path.basename(exported[0]), 'foo.docx')
+            # The original is left as it is
+            self.assertEqual(msword_cli.sanitize_package('foo.docx', dry_run=True)['comments'], 1)
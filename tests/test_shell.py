@@ -0,0 +1,90 @@
+import unittest
+import mock
+from click.testing import CliRunner
+import msword_cli
+from .util import MockApp, touch
+import os
+
+
+@mock.patch('msword_cli.WORD', spec_set=MockApp(['foo.docx', 'bar baz.docx']))
+class TestShellCommand(unittest.TestCase):
+    def setUp(self):
+        self.runner = CliRunner()
+
+    def test_run_commands(self, mock_app):
+        ''' Test commands run with the same arguments as on the command line. '''
+        with self.runner.isolated_filesystem():
+            result = self.runner.invoke(msword_cli.cli, ['shell'],
+                                        input='docs\nexport --for-screen out.pdf\nexit\n')
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn('Open Documents', result.output)
+            self.assertIn('Exporting to "%s"' % os.path.abspath('out.pdf'), result.output)
+            mock_app.ActiveDocument.ExportAsFixedFormat.assert_called()
+
+    def test_errors_continue(self, mock_app):
+        ''' Test a failing command is reported and the shell continues. '''
+        result = self.runner.invoke(msword_cli.cli, ['shell'], input='export\nfoo\nshell\n"docs\ndocs\n')
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Missing argument 'PATH'", result.output)
+        self.assertIn("No such command 'foo'", result.output)
+        self.assertIn('The shell is already running', result.output)
+        self.assertIn('No closing quotation', result.output)
+        self.assertIn('Open Documents', result.output)
+
+    def test_activate_by_name(self, mock_app):
+        ''' Test activating a document by its name. '''
+        result = self.runner.invoke(msword_cli.cli, ['shell'], input='activate "bar baz.docx"\n')
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Activate document at index "bar baz.docx"', result.output)
+
+
+class TestShellCompletion(unittest.TestCase):
+    def setUp(self):
+        self.app = mock.MagicMock()
+        self.app.Documents.Count = 2
+        docs = [mock.Mock(), mock.Mock()]
+        docs[0].Name = 'foo.docx'
+        docs[1].Name = 'bar baz.docx'
+        self.app.Documents.__iter__.side_effect = lambda: iter(docs)
+        self.shell = msword_cli.Shell(msword_cli.cli, self.app)
+
+    def complete(self, line):
+        text = line.rpartition(' ')[2]
+        begidx = len(line) - len(text)
+        if not begidx:
+            return self.shell.completenames(text)
+        return self.shell.completedefault(text, line, begidx, len(line))
+
+    def test_commands(self):
+        ''' Test completing commands. '''
+        self.assertEqual(sorted(self.complete('ex')), ['exit', 'export'])
+        self.assertIn('print-batch', self.complete('print-'))
+        # The next command of a chain
+        self.assertIn('close', self.complete('open foo.docx cl'))
+
+    def test_options(self):
+        ''' Test completing the options and choices of the current command. '''
+        self.assertEqual(self.complete('export --for-'), ['--for-print', '--for-screen'])
+        self.assertEqual(self.complete('open foo.docx close --f'), ['--force'])
+        self.assertEqual(self.complete('convert --to o'), ['odt'])
+
+    def test_document_names(self):
+        ''' Test completing document names from a cache. '''
+        self.assertEqual(self.complete('activate b'), ['"bar baz.docx"'])
+        self.assertEqual(self.complete('activate f'), ['foo.docx'])
+        # The next command of a chain once the document is given
+        self.assertEqual(self.complete('activate foo.docx clo'), ['close'])
+        self.assertEqual(self.app.Documents.__iter__.call_count, 1)
+        self.app.Documents.Count = 1
+        self.complete('activate f')
+        self.assertEqual(self.app.Documents.__iter__.call_count, 2)
+
+    def test_paths(self):
+        ''' Test completing paths. '''
+        with CliRunner().isolated_filesystem():
+            touch('report.docx')
+            os.mkdir('reports')
+            # Or the next command of a chain
+            self.assertEqual(sorted(self.complete('open rep')),
+                             ['replace', 'report.docx', 'reports' + os.sep])
+            self.assertEqual(self.complete('print-batch --to-file rep'), ['report.docx', 'reports' + os.sep])
@@ -0,0 +1,178 @@
+import unittest
+import threading
+import mock
+from click.testing import CliRunner
+import msword_cli
+import time
+import os
+from . import simword
+from .util import make_docx
+
+
+def make_docs(count, size=0):
+    ''' Write count docx files padded to about size bytes and return their names. '''
+    names = []
+    for i in range(count):
+        name = 'doc%d.docx' % i
+        make_docx(name, parts={'padding.bin': os.urandom(size)} if size else None)
+        names.append(name)
+    return names
+
+
+class TestSimulatedWord(unittest.TestCase):
+    def setUp(self):
+        self.runner = CliRunner()
+
+    def test_object_model(self):
+        ''' Test documents are opened, exported and closed in another process. '''
+        with self.runner.isolated_filesystem():
+            make_docs(1)
+            app = simword.dispatch_ex()
+            try:
+                doc = app.Documents.Open(FileName='doc0.docx', ReadOnly=True)
+                self.assertEqual(doc.Name, 'doc0.docx')
+                self.assertEqual(app.ActiveDocument, doc)
+                self.assertEqual([d.Name for d in app.Documents], ['doc0.docx'])
+                doc.ExportAsFixedFormat(OutputFileName='doc0.pdf', ExportFormat=msword_cli.C.wdExportFormatPDF)
+                self.assertEqual(len(msword_cli.PdfReader('doc0.pdf').pages()), 1)
+                doc.Close(msword_cli.C.wdDoNotSaveChanges)
+                self.assertEqual(app.Documents.Count, 0)
+                with self.assertRaises(msword_cli.com_error) as cm:
+                    app.ActiveDocument
+                self.assertEqual(cm.exception.excepinfo[5], simword.WD_NO_DOCUMENT)
+                self.assertNotEqual(app.SimStats()['pid'], os.getpid())
+            finally:
+                app.Quit()
+            with self.assertRaises(msword_cli.com_error) as cm:
+                app.Visible
+            self.assertIn(cm.exception.args[0], msword_cli.RPC_ERRORS)
+
+    def test_missing_file(self):
+        ''' Test opening a missing file raises Word's error. '''
+        app = simword.dispatch_ex()
+        try:
+            with self.assertRaises(msword_cli.com_error) as cm:
+                app.Documents.Open(FileName='missing.docx')
+            self.assertIn('missing.docx', msword_cli.error_message(cm.exception))
+        finally:
+            app.Quit()
+
+    def test_calls_are_serialized(self):
+        ''' Test calls from several clients to one server are handled one at a time. '''
+        process, address, authkey = simword.start_server(latency=0.02)
+        apps = [simword.connect(address, authkey) for i in range(2)]
+
+        def call(app):
+            for i in range(10):
+                app.Visible
+        threads = [threading.Thread(target=call, args=(app,)) for app in apps]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertGreaterEqual(time.time() - start, 0.4)
+        apps[0].Quit()
+        process.join(5)
+        self.assertFalse(process.is_alive())
+
+    def test_memory_limit(self):
+        ''' Test the server grows with each document and dies at its memory limit. '''
+        with self.runner.isolated_filesystem():
+            make_docs(1)
+            app = simword.dispatch_ex(memory_per_document=2 ** 20, memory_limit=2.5 * 2 ** 20)
+            for i in range(2):
+                app.Documents.Open(FileName='doc0.docx').Close()
+            self.assertEqual(app.SimStats()['memory'], 2 * 2 ** 20)
+            with self.assertRaises(msword_cli.com_error) as cm:
+                app.Documents.Open(FileName='doc0.docx')
+            self.assertEqual(cm.exception.args[0], simword.RPC_S_SERVER_UNAVAILABLE)
+
+    def test_busy(self):
+        ''' Test calls are rejected at the busy rate. '''
+        app = simword.dispatch_ex(busy_rate=0.5, seed=1)
+        rejected = 0
+        for i in range(40):
+            try:
+                app.Visible
+            except msword_cli.com_error as e:
+                self.assertEqual(e.args[0], simword.RPC_E_CALL_REJECTED)
+                rejected += 1
+        self.assertTrue(5 < rejected < 35)
+        while True:
+            try:
+                app.Quit()
+                break
+            except msword_cli.com_error:
+                pass
+
+
+class TestSimulatedBatches(unittest.TestCase):
+    def setUp(self):
+        self.runner = CliRunner()
+
+    def test_convert_in_parallel(self):
+        ''' Test a parallel batch overlaps the render cost of documents on separate servers. '''
+        with self.runner.isolated_filesystem():
+            names = make_docs(8)
+            with mock.patch('msword_cli.new_instance', simword.factory(render_cost=0.1)):
+                start = time.time()
+                result = self.runner.invoke(msword_cli.convert, ['--to', 'odt', '-j', '4', '--out', 'out'] + names)
+                elapsed = time.time() - start
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertEqual(sorted(os.listdir('out')), sorted(n.replace('.docx', '.odt') for n in names))
+            self.assertLess(elapsed, 0.7)
+
+    def test_pool_replaces_crashed_instance(self):
+        ''' Test a worker whose instance dies is given a new one. '''
+        with self.runner.isolated_filesystem():
+            names = make_docs(4)
+            restarts = msword_cli.METRICS.get('msw_word_restarts_total')
+            # Each conversion takes 3 calls, so the instance dies during the second
+            with mock.patch('msword_cli.new_instance', simword.factory(crash_after=6)):
+                result = self.runner.invoke(msword_cli.convert, ['-j', '1', '--out', 'out'] + names)
+            self.assertEqual(result.exit_code, 1)
+            self.assertIn('2 of 4 documents failed', result.output)
+            self.assertEqual(msword_cli.METRICS.get('msw_word_restarts_total'), restarts + 2)
+            self.assertEqual(sorted(os.listdir('out')), ['doc0.docx', 'doc2.docx'])
+
+    def test_failures(self):
+        ''' Test injected failures are reported without stopping the batch. '''
+        with self.runner.isolated_filesystem():
+            names = make_docs(4)
+            with mock.patch('msword_cli.new_instance', simword.factory(fail_paths=['doc1'])):
+                result = self.runner.invoke(msword_cli.convert, ['-j', '2', '--out', 'out'] + names)
+            self.assertEqual(result.exit_code, 1)
+            self.assertIn("Failed: %s: Sorry, we couldn't find your file" % os.path.abspath('out/doc1.docx'),
+                          result.output)
+            self.assertEqual(len(os.listdir('out')), 3)
+
+    def test_export_shards(self):
+        ''' Test a sharded export merges the pages rendered by several servers. '''
+        with self.runner.isolated_filesystem():
+            make_docs(1, size=100000)
+            app = simword.dispatch_ex(page_size=10000)
+            try:
+                app.Documents.Open(FileName=os.path.abspath('doc0.docx'))
+                with mock.patch('msword_cli.WORD', app), \
+                        mock.patch('msword_cli.new_instance', simword.factory(page_size=10000)):
+                    result = self.runner.invoke(msword_cli.export, ['--shards', '3', 'out.pdf'])
+                self.assertEqual(result.exit_code, 0, result.output)
+                pages = app.ActiveDocument.ComputeStatistics(msword_cli.C.wdStatisticPages)
+                self.assertEqual(len(msword_cli.PdfReader('out.pdf').pages()), pages)
+            finally:
+                app.Quit()
+
+    def test_queue_workers(self):
+        ''' Test queue workers recover from crashing instances. '''
+        with self.runner.isolated_filesystem():
+            names = make_docs(6)
+            jobs = msword_cli.JobQueue('q', max_attempts=1)
+            for name in names:
+                jobs.submit('convert', [os.path.abspath(name), os.path.abspath(name + '.pdf'),
+                                        msword_cli.C.wdFormatPDF, 65001])
+            count = jobs.work('w', factory=simword.factory(crash_after=9), exit_when_empty=True, poll=0.01)
+            self.assertEqual(count, 6)
+            status = jobs.status()
+            self.assertEqual(status['done'] + status['failed'], 6)
+            self.assertTrue(status['failed'])
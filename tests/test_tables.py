@@ -0,0 +1,156 @@
+import unittest
+import mock
+from click.testing import CliRunner
+import msword_cli
+import json
+import os
+from .util import make_docx, touch
+
+
+def cell(text, props=''):
+    return '<w:tc>%s<w:p><w:r><w:t>%s</w:t></w:r></w:p></w:tc>' % (
+        '<w:tcPr>%s</w:tcPr>' % props if props else '', text)
+
+
+def row(*cells):
+    return '<w:tr>%s</w:tr>' % ''.join(cells)
+
+
+NESTED = '<w:tbl>%s</w:tbl>' % row(cell('n1'), cell('n2'))
+
+BODY = (
+    '<w:p><w:r><w:t>Before</w:t></w:r></w:p>'
+    '<w:tbl>' +
+    row(cell('Region'), cell('Q1'), cell('Q2')) +
+    row(cell('North', '<w:vMerge w:val="restart"/>'), cell('1,000'), cell('2')) +
+    row(cell('', '<w:vMerge/>'), cell('Total', '<w:gridSpan w:val="2"/>')) +
+    row('<w:tc><w:p><w:r><w:t>Line 1</w:t></w:r></w:p><w:p><w:r><w:t>Line 2</w:t></w:r></w:p>%s</w:tc>' % NESTED,
+        cell('x'), cell('y')) +
+    '</w:tbl>'
+    '<w:p/>'
+    '<w:tbl>' + row(cell('a'), '<w:sdt><w:sdtContent>%s</w:sdtContent></w:sdt>' % cell('b')) + '</w:tbl>'
+)
+
+
+class TestTablesCommand(unittest.TestCase):
+    def setUp(self):
+        self.runner = CliRunner()
+
+    def test_package_tables(self):
+        ''' Test reading the rows of tables from a package. '''
+        with self.runner.isolated_filesystem():
+            make_docx('foo.docx', body=BODY)
+            rows = list(msword_cli.package_tables('foo.docx'))
+            self.assertEqual(rows, [
+                ('1', 1, ['Region', 'Q1', 'Q2']),
+                ('1', 2, ['North', '1,000', '2']),
+                ('1', 3, ['', 'Total', '']),
+                ('1', 4, ['Line 1\nLine 2', 'x', 'y']),
+                ('1.1', 1, ['n1', 'n2']),
+                ('2', 1, ['a', 'b']),
+            ])
+            rows = list(msword_cli.package_tables('foo.docx', fill_merged=True))
+            self.assertEqual(rows[2], ('1', 3, ['North', 'Total', 'Total']))
+
+    def test_tables_csv(self):
+        ''' Test CSV output. '''
+        with self.runner.isolated_filesystem():
+            make_docx('foo.docx', body=BODY)
+            with mock.patch('msword_cli.WORD') as word:
+                result = self.runner.invoke(msword_cli.tables, ['foo.docx'])
+            self.assertEqual(result.exit_code, 0)
+            self.assertEqual(word.mock_calls, [])
+            path = os.path.abspath('foo.docx')
+            lines = result.output.splitlines()
+            self.assertEqual(lines[0], '%s,1,1,Region,Q1,Q2' % path)
+            self.assertEqual(lines[1], '%s,1,2,North,"1,000",2' % path)
+            self.assertEqual(lines[-1], '%s,2,1,a,b' % path)
+
+    def test_tables_json(self):
+        ''' Test JSON Lines output. '''
+        with self.runner.isolated_filesystem():
+            make_docx('foo.docx', body=BODY)
+            result = self.runner.invoke(msword_cli.tables, ['--json', 'foo.docx'])
+            self.assertEqual(result.exit_code, 0)
+            records = [json.loads(line) for line in result.output.splitlines()]
+            self.assertEqual(len(records), 6)
+            self.assertEqual(records[4], {'path': os.path.abspath('foo.docx'), 'table': '1.1', 'row': 1,
+                                          'cells': ['n1', 'n2']})
+
+    def test_tables_legacy_bulk(self):
+        ''' Test legacy tables are read with one call for the text of each table. '''
+        app = mock.MagicMock()
+        table = mock.MagicMock()
+        table.Tables.Count = 0
+        table.Tables.__iter__.return_value = []
+        table.Uniform = True
+        table.Rows.Count = 2
+        table.Rows.return_value.Cells.Count = 2
+        table.Range.Text = 'a\r\x07b\rc\r\x07\r\x07d\r\x07\r\x07\r\x07'
+        app.Documents.Open.return_value.Tables = [table]
+        with self.runner.isolated_filesystem():
+            touch('old.doc')
+            with mock.patch('msword_cli.new_instance', return_value=app):
+                result = self.runner.invoke(msword_cli.tables, ['--json', 'old.doc'])
+            self.assertEqual(result.exit_code, 0)
+            records = [json.loads(line) for line in result.output.splitlines()]
+            self.assertEqual([r['cells'] for r in records], [['a', 'b\nc'], ['d', '']])
+            self.assertFalse(table.Cell.called)
+
+    def test_tables_legacy_merged(self):
+        ''' Test legacy tables with merged cells are read from the XML of the table in one call. '''
+        app = mock.MagicMock()
+        table = mock.MagicMock()
+        table.Tables.Count = 0
+        table.Tables.__iter__.return_value = []
+        table.Rows.side_effect = msword_cli.com_error(-2146822296, 'Exception occurred.',
+                                                      (0, None, 'Vertically merged', None, 0, 0), None)
+        table.Range.WordOpenXML = (
+            '<pkg:package xmlns:pkg="http://schemas.microsoft.com/office/2006/xmlPackage">'
+            '<pkg:part pkg:name="/word/document.xml"><pkg:xmlData>'
+            '<w:document xmlns:w="%s"><w:body><w:tbl>'
+            '<w:tr><w:tc><w:tcPr><w:vMerge w:val="restart"/></w:tcPr><w:p><w:r><w:t>a</w:t></w:r></w:p></w:tc>'
+            '<w:tc><w:p><w:r><w:t>b</w:t></w:r></w:p></w:tc></w:tr>'
+            '<w:tr><w:tc><w:tcPr><w:vMerge/></w:tcPr><w:p/></w:tc><w:tc><w:p><w:r><w:t>c</w:t></w:r></w:p></w:tc>'
+            '</w:tr></w:tbl></w:body></w:document></pkg:xmlData></pkg:part></pkg:package>'
+        ) % msword_cli.W_NS
+        app.Documents.Open.return_value.Tables = [table]
+        with self.runner.isolated_filesystem():
+            touch('old.doc')
+            with mock.patch('msword_cli.new_instance', return_value=app):
+                result = self.runner.invoke(msword_cli.tables, ['--json', 'old.doc'])
+                self.assertEqual(result.exit_code, 0)
+                records = [json.loads(line) for line in result.output.splitlines()]
+                self.assertEqual([r['cells'] for r in records], [['a', 'b'], ['', 'c']])
+                result = self.runner.invoke(msword_cli.tables, ['--json', '--fill-merged', 'old.doc'])
+            records = [json.loads(line) for line in result.output.splitlines()]
+            self.assertEqual([r['cells'] for r in records], [['a', 'b'], ['a', 'c']])
+            self.assertFalse(table.Cell.called)
+
+    def test_tables_legacy_spanned(self):
+        ''' Test legacy tables with horizontally merged cells are read from XML and aligned to the grid. '''
+        app = mock.MagicMock()
+        table = mock.MagicMock()
+        table.Tables.Count = 0
+        table.Tables.__iter__.return_value = []
+        table.Uniform = False
+        table.Rows.Count = 2
+        table.Rows.side_effect = lambda i: mock.Mock(Cells=mock.Mock(Count=1 if i == 1 else 2))
+        table.Range.Text = 'ab\r\x07\r\x07c\r\x07d\r\x07\r\x07'
+        table.Range.WordOpenXML = (
+            '<pkg:package xmlns:pkg="http://schemas.microsoft.com/office/2006/xmlPackage">'
+            '<pkg:part pkg:name="/word/document.xml"><pkg:xmlData>'
+            '<w:document xmlns:w="%s"><w:body><w:tbl>'
+            '<w:tr><w:tc><w:tcPr><w:gridSpan w:val="2"/></w:tcPr><w:p><w:r><w:t>ab</w:t></w:r></w:p></w:tc></w:tr>'
+            '<w:tr><w:tc><w:p><w:r><w:t>c</w:t></w:r></w:p></w:tc><w:tc><w:p><w:r><w:t>d</w:t></w:r></w:p></w:tc>'
+            '</w:tr></w:tbl></w:body></w:document></pkg:xmlData></pkg:part></pkg:package>'
+        ) % msword_cli.W_NS
+        app.Documents.Open.return_value.Tables = [table]
+        with self.runner.isolated_filesystem():
+            touch('old.doc')
+            with mock.patch('msword_cli.new_instance', return_value=app):
+                result = self.runner.invoke(msword_cli.tables, ['--json', 'old.doc'])
+            self.assertEqual(result.exit_code, 0, result.output)
+            records = [json.loads(line) for line in result.output.splitlines()]
+            self.assertEqual([r['cells'] for r in records], [['ab', ''], ['c', 'd']])
+            self.assertFalse(table.Rows.called)
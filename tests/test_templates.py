@@ -0,0 +1,117 @@
+import unittest
+import mock
+from click.testing import CliRunner
+import msword_cli
+from .util import MockApp, touch
+import os
+
+
+class TestTemplateCatalog(unittest.TestCase):
+    def setUp(self):
+        self.runner = CliRunner()
+
+    def make_dirs(self):
+        user = os.path.abspath('user')
+        group = os.path.abspath('group')
+        extra = os.path.abspath('extra')
+        for path in ('user/Letters', 'group/Legal/Contracts', 'extra'):
+            os.makedirs(path)
+        touch(os.path.join('user', 'Normal.dotm'))
+        touch(os.path.join('user', 'Letters', 'Formal.dotx'))
+        touch(os.path.join('user', 'Letters', '~$Formal.dotx'))
+        touch(os.path.join('user', 'notes.txt'))
+        touch(os.path.join('group', 'Legal', 'Contracts', 'NDA.dotx'))
+        touch(os.path.join('group', 'Legal', 'Formal.dotx'))
+        touch(os.path.join('extra', 'Memo.dot'))
+        return user, group, extra
+
+    def catalog(self, dirs, refresh=False):
+        with mock.patch('msword_cli.word_template_dirs', return_value=dirs) as lookup, \
+                mock.patch.dict('os.environ', {'MSW_TEMPLATE_PATH': 'extra'}):
+            catalog = msword_cli.TemplateCatalog('catalog.json', refresh)
+        return catalog, lookup
+
+    def test_resolve(self):
+        ''' Test resolving names through the catalog. '''
+        with self.runner.isolated_filesystem():
+            user, group, extra = self.make_dirs()
+            catalog, lookup = self.catalog([user, group])
+            self.assertEqual(len(catalog.paths()), 5)
+            self.assertEqual(catalog.resolve('Normal'), os.path.join(user, 'Normal.dotm'))
+            self.assertEqual(catalog.resolve('nda.dotx'), os.path.join(group, 'Legal', 'Contracts', 'NDA.dotx'))
+            self.assertEqual(catalog.resolve(os.path.join('Contracts', 'NDA')),
+                             os.path.join(group, 'Legal', 'Contracts', 'NDA.dotx'))
+            self.assertEqual(catalog.resolve('Memo'), os.path.join(extra, 'Memo.dot'))
+            self.assertEqual(catalog.resolve(os.path.join('Letters', 'Formal')),
+                             os.path.join(user, 'Letters', 'Formal.dotx'))
+            self.assertEqual(catalog.resolve('notes.txt'), os.path.join(user, 'notes.txt'))
+            with self.assertRaises(LookupError) as cm:
+                catalog.resolve('Formal')
+            self.assertIn('ambiguous', cm.exception.args[0])
+            with self.assertRaises(LookupError):
+                catalog.resolve('Missing')
+
+    def test_cache(self):
+        ''' Test the catalog is cached until a directory changes. '''
+        with self.runner.isolated_filesystem():
+            user, group, extra = self.make_dirs()
+            catalog, lookup = self.catalog([user, group])
+            self.assertEqual(lookup.call_count, 1)
+            with mock.patch('msword_cli.TemplateCatalog.scan') as scan:
+                catalog, lookup = self.catalog([user, group])
+            self.assertEqual(lookup.call_count, 0)
+            self.assertEqual(scan.call_count, 0)
+            self.assertEqual(len(catalog.paths()), 5)
+            touch(os.path.join('group', 'Legal', 'Contracts', 'Lease.dotx'))
+            os.utime(os.path.join('group', 'Legal', 'Contracts'), (1, 1))
+            catalog, lookup = self.catalog([user, group])
+            self.assertEqual(lookup.call_count, 0)
+            self.assertEqual(catalog.resolve('Lease'), os.path.join(group, 'Legal', 'Contracts', 'Lease.dotx'))
+            catalog, lookup = self.catalog([user], refresh=True)
+            self.assertEqual(lookup.call_count, 1)
+            self.assertEqual(len(catalog.paths()), 3)
+
+
+@mock.patch('msword_cli.WORD', spec_set=MockApp([]))
+class TestTemplatesCommand(unittest.TestCase):
+    def setUp(self):
+        self.runner = CliRunner()
+
+    def invoke(self, command, args):
+        with mock.patch('msword_cli.word_template_dirs', return_value=[os.path.abspath('templates')]), \
+                mock.patch('msword_cli.TEMPLATE_CATALOG', os.path.abspath('catalog.json')), \
+                mock.patch('msword_cli.CATALOG', None):
+            return self.runner.invoke(command, args)
+
+    def test_templates(self, mock_app):
+        ''' Test listing templates. '''
+        with self.runner.isolated_filesystem():
+            os.makedirs(os.path.join('templates', 'Letters'))
+            touch(os.path.join('templates', 'Normal.dotm'))
+            touch(os.path.join('templates', 'Letters', 'Formal.dotx'))
+            result = self.invoke(msword_cli.templates, [])
+            self.assertEqual(result.exit_code, 0)
+            self.assertEqual(result.output, '%s\n%s\n' % (os.path.abspath(os.path.join('templates', 'Normal.dotm')),
+                                                          os.path.abspath(os.path.join('templates', 'Letters',
+                                                                                       'Formal.dotx'))))
+            result = self.invoke(msword_cli.templates, ['formal'])
+            self.assertEqual(result.output, '%s\n' % os.path.abspath(os.path.join('templates', 'Letters',
+                                                                                  'Formal.dotx')))
+
+    def test_new_partial_name(self, mock_app):
+        ''' Test new with a template name from a subdirectory. '''
+        with self.runner.isolated_filesystem():
+            os.makedirs(os.path.join('templates', 'Letters'))
+            touch(os.path.join('templates', 'Letters', 'Formal.dotx'))
+            result = self.invoke(msword_cli.new, ['-t', 'Formal'])
+            self.assertEqual(result.exit_code, 0)
+            mock_app.Documents.Add.assert_called_with(
+                os.path.abspath(os.path.join('templates', 'Letters', 'Formal.dotx')), Visible=True)
+
+    def test_new_missing_template(self, mock_app):
+        ''' Test new with an unknown template. '''
+        with self.runner.isolated_filesystem():
+            os.mkdir('templates')
+            result = self.invoke(msword_cli.new, ['-t', 'Missing'])
+            self.assertEqual(result.exit_code, 2)
+            self.assertIn('Template "Missing" was not found', result.output)
@@ -0,0 +1,155 @@
+import unittest
+import mock
+from click.testing import CliRunner
+import msword_cli
+from .util import MockApp, make_pdf, touch
+import os
+
+XMP = b'''<x:xmpmeta xmlns:x="adobe:ns:meta/"><rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
+<rdf:Description rdf:about="" xmlns:pdfaid="http://www.aiim.org/pdfa/ns/id/" pdfaid:part="1" pdfaid:conformance="A"/>
+</rdf:RDF></x:xmpmeta>'''
+
+
+def truncate(filename):
+    ''' Cut the end off of a file, as an interrupted export would. '''
+    with open(filename, 'rb+') as f:
+        f.truncate(os.path.getsize(filename) // 2)
+
+
+class TestVerifyPdf(unittest.TestCase):
+    def setUp(self):
+        self.runner = CliRunner()
+
+    def test_pages(self):
+        ''' Test the page count is checked against the expected count. '''
+        with self.runner.isolated_filesystem():
+            make_pdf('foo.pdf', pages=3)
+            make_pdf('bar.pdf', pages=3, compressed=True)
+            self.assertEqual(msword_cli.verify_pdf('foo.pdf'), 3)
+            self.assertEqual(msword_cli.verify_pdf('bar.pdf', 3), 3)
+            with self.assertRaises(msword_cli.VerificationError) as cm:
+                msword_cli.verify_pdf('foo.pdf', 2)
+            self.assertIn('3 pages rather than 2', str(cm.exception))
+
+    def test_incomplete(self):
+        ''' Test empty, truncated and pageless PDFs fail. '''
+        with self.runner.isolated_filesystem():
+            touch('empty.pdf')
+            make_pdf('truncated.pdf', pages=3)
+            truncate('truncated.pdf')
+            make_pdf('none.pdf', pages=0)
+            for name in ('empty.pdf', 'truncated.pdf', 'none.pdf'):
+                with self.assertRaises(msword_cli.VerificationError):
+                    msword_cli.verify_pdf(name)
+
+    def test_pdfa(self):
+        ''' Test PDF/A-1 exports must say so in their metadata. '''
+        with self.runner.isolated_filesystem():
+            make_pdf('plain.pdf')
+            make_pdf('pdfa.pdf', metadata=XMP)
+            make_pdf('pdfa2.pdf', metadata=XMP.replace(b'pdfaid:part="1"', b'pdfaid:part="2"'))
+            self.assertEqual(msword_cli.verify_pdf('pdfa.pdf', 1, pdfa=True), 1)
+            self.assertEqual(msword_cli.verify_pdf('plain.pdf', 1), 1)
+            for name in ('plain.pdf', 'pdfa2.pdf'):
+                with self.assertRaises(msword_cli.VerificationError) as cm:
+                    msword_cli.verify_pdf(name, pdfa=True)
+                self.assertIn('ISO 19005-1', str(cm.exception))
+
+
+@mock.patch('msword_cli.WORD', spec_set=MockApp(['foo.docx']))
+class TestExportVerify(unittest.TestCase):
+    def setUp(self):
+        self.runner = CliRunner()
+
+    def test_retry(self, mock_app):
+        ''' Test a truncated export is exported again. '''
+        exports = []
+
+        def export(OutputFileName, **kwargs):
+            make_pdf(OutputFileName, pages=2)
+            if not exports:
+                truncate(OutputFileName)
+            exports.append(kwargs)
+
+        with self.runner.isolated_filesystem():
+            with mock.patch.object(mock_app.ActiveDocument, 'ExportAsFixedFormat', export):
+                result = self.runner.invoke(msword_cli.export, ['--verify', '--pages', '2-3', 'foo.pdf'])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn('Exporting again', result.output)
+            self.assertIn('Verified 2 page(s)', result.output)
+            self.assertEqual(len(exports), 2)
+
+    def test_page_count(self, mock_app):
+        ''' Test an export missing pages of the document fails. '''
+        def export(OutputFileName, **kwargs):
+            make_pdf(OutputFileName, pages=1)
+
+        with self.runner.isolated_filesystem():
+            with mock.patch.object(mock_app.ActiveDocument, 'ExportAsFixedFormat', export), \
+                    mock.patch.object(mock_app.ActiveDocument, 'ComputeStatistics', return_value=3):
+                result = self.runner.invoke(msword_cli.export, ['--verify', 'foo.pdf'])
+            self.assertEqual(result.exit_code, 1)
+            self.assertIn('1 pages rather than 3', result.output)
+
+    def test_xps(self, mock_app):
+        ''' Test XPS exports cannot be verified. '''
+        result = self.runner.invoke(msword_cli.export, ['--verify', '--xps', 'foo.xps'])
+        self.assertEqual(result.exit_code, 2)
+
+
+class TestQueueVerify(unittest.TestCase):
+    def test_requeue(self):
+        ''' Test a queued export which fails verification is run again. '''
+        app = mock.MagicMock()
+        doc = app.Documents.Open.return_value
+        doc.ComputeStatistics.return_value = 2
+        exports = []
+
+        def export(OutputFileName, **kwargs):
+            make_pdf(OutputFileName, pages=2 if exports else 1)
+            exports.append(OutputFileName)
+        doc.ExportAsFixedFormat.side_effect = export
+
+        with CliRunner().isolated_filesystem():
+            touch('foo.docx')
+            result = CliRunner().invoke(msword_cli.cli, ['queue', 'submit', 'q', 'export', '--verify',
+                                                         'foo.pdf', 'foo.docx'])
+            self.assertEqual(result.exit_code, 0, result.output)
+            jobs = msword_cli.JobQueue('q')
+            self.assertEqual(jobs.work('a', factory=lambda: app, exit_when_empty=True, poll=0.01), 1)
+            self.assertEqual(jobs.status()['done'], 1)
+            self.assertEqual(len(exports), 2)
+            # A job which keeps failing is failed after max_attempts
+            del exports[:]
+            doc.ComputeStatistics.return_value = 5
+            jobs = msword_cli.JobQueue('q', max_attempts=2)
+            jobs.submit('export', [os.path.abspath('foo.docx'), os.path.abspath('bar.pdf'), {}, True])
+            jobs.work('a', factory=lambda: app, exit_when_empty=True, poll=0.01)
+            self.assertEqual(jobs.status()['failed'], 1)
+            self.assertEqual(len(exports), 2)
+
+
+class TestBinderVerify(unittest.TestCase):
+    def test_retry(self):
+        ''' Test a batch export which fails verification is exported again. '''
+        app = mock.MagicMock()
+        doc = app.Documents.Open.return_value
+        doc.ComputeStatistics.return_value = 2
+        exports = []
+
+        def export(OutputFileName, **kwargs):
+            make_pdf(OutputFileName, pages=2)
+            if not exports:
+                truncate(OutputFileName)
+            exports.append(OutputFileName)
+        doc.ExportAsFixedFormat.side_effect = export
+
+        runner = CliRunner()
+        with runner.isolated_filesystem():
+            touch('foo.docx')
+            with mock.patch('msword_cli.new_instance', return_value=app):
+                result = runner.invoke(msword_cli.binder, ['--verify', '--no-cache', '-o', 'out.pdf', 'foo.docx'])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn('Retrying %s' % os.path.abspath('foo.docx'), result.output)
+            self.assertEqual(len(exports), 2)
+            self.assertEqual(msword_cli.verify_pdf('out.pdf'), 2)
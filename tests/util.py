@@ -1,4 +1,6 @@
 import os
+import zlib
+import zipfile
 
 # =========================================================
 # Dummy Mock objects to patch the com objects for testing
@@ -8,6 +10,15 @@ class MockDoc(object):
     ''' A Document object. '''
     def __init__(self, Name):
         self.Name = Name
+        self.FullName = os.path.abspath(Name)
+        self.Path = os.path.dirname(self.FullName)
+        self.Saved = True
+
+    def ComputeStatistics(self, Statistic):
+        return 1
+
+    def Close(self, *args, **kwargs):
+        pass
 
     def PrintOut(self, **kwargs):
         pass
@@ -56,6 +67,8 @@ class MockApp(object):
         if self.Documents.Count:
             self.ActiveDocument = self.Documents[-1]
 
+    BackgroundPrintingStatus = 0
+
     def Quit(self):
         pass
 
@@ -70,4 +83,170 @@ class MockApp(object):
 def touch(filename, times=None):
     ''' Simulate a file touch operation. '''
     with open(filename, 'a'):
-        os.utime(filename, times)
\ No newline at end of file
+        os.utime(filename, times)
+
+
+def make_pdf(filename, pages=1, bookmarks=False, labels=None, compressed=False, metadata=None, links=False):
+    '''
+    Write a minimal PDF with the given number of pages. Each page displays
+    its number. If bookmarks is True, each page gets a bookmark titled
+    "Page n" (or bookmarks % n if it is a byte string). If given, labels is a PDF number tree array (eg. '0 <</S /r>>')
+    and metadata the XMP metadata of the document (as bytes). If compressed
+    is True, objects are stored in an object stream and indexed by a
+    cross-reference stream rather than a table. If links is True, page n is
+    the named destination (pn), the first page links to the last by name
+    (with a GoTo action) and the last page links to the first (with a Dest).
+    '''
+    objects = {}
+    num = [4]
+
+    def add(body):
+        num[0] += 1
+        objects[num[0]] = body
+        return num[0]
+
+    kids = []
+    outline = []
+    for i in range(pages):
+        text = ('BT /F1 24 Tf 72 720 Td (Page %d) Tj ET' % (i + 1)).encode('ascii')
+        content = add(b'<</Length %d>>\nstream\n' % len(text) + text + b'\nendstream')
+        annots = b''
+        if links and i == 0:
+            annots = b' /Annots [<</Type /Annot /Subtype /Link /Rect [0 0 9 9] /A <</S /GoTo /D (p%d)>>>>]' % pages
+        elif links and i == pages - 1:
+            annots = b' /Annots [%d 0 R]' % add(b'<</Type /Annot /Subtype /Link /Rect [0 0 9 9] /Dest (p1)>>')
+        kids.append(add(b'<</Type /Page /Parent 2 0 R /Contents %d 0 R%s>>' % (content, annots)))
+    if bookmarks:
+        for i, page in enumerate(kids):
+            outline.append(num[0] + 1 + i)
+        for i, page in enumerate(kids):
+            title = (bookmarks if isinstance(bookmarks, bytes) else b'Page %d') % (i + 1)
+            item = b'<</Title (' + title + b') /Parent 3 0 R /Dest [%d 0 R /Fit]' % page
+            if i:
+                item += b' /Prev %d 0 R' % outline[i - 1]
+            if i + 1 < len(outline):
+                item += b' /Next %d 0 R' % outline[i + 1]
+            add(item + b'>>')
+    catalog = b'<</Type /Catalog /Pages 2 0 R'
+    if metadata:
+        catalog += b' /Metadata %d 0 R' % add(b'<</Type /Metadata /Subtype /XML /Length %d>>\nstream\n' % len(
+            metadata) + metadata + b'\nendstream')
+    if bookmarks:
+        catalog += b' /Outlines 3 0 R'
+    if labels:
+        catalog += b' /PageLabels <</Nums [' + labels.encode('ascii') + b']>>'
+    if links:
+        catalog += b' /Names <</Dests <</Names [' + b' '.join(
+            b'(p%d) [%d 0 R /XYZ 0 792 0]' % (i + 1, page) for i, page in enumerate(kids)) + b']>>>>'
+    objects[1] = catalog + b'>>'
+    objects[2] = b'<</Type /Pages /Kids [' + b' '.join(b'%d 0 R' % k for k in kids) + \
+        b'] /Count %d /MediaBox [0 0 612 792] /Resources <<>>>>' % len(kids)
+    if bookmarks:
+        objects[3] = b'<</Type /Outlines /First %d 0 R /Last %d 0 R /Count %d>>' % (
+            outline[0], outline[-1], len(outline))
+    else:
+        objects[3] = b'null'
+    objects[4] = b'<</Title (Test)>>'
+
+    out = bytearray(b'%PDF-1.5\n')
+    offsets = {}
+    if not compressed:
+        for n in sorted(objects):
+            offsets[n] = len(out)
+            out += b'%d 0 obj\n' % n + objects[n] + b'\nendobj\n'
+        start = len(out)
+        size = max(objects) + 1
+        out += b'xref\n0 %d\n0000000000 65535 f \n' % size
+        for n in range(1, size):
+            out += b'%010d 00000 n \n' % offsets[n]
+        out += b'trailer\n<</Size %d /Root 1 0 R /Info 4 0 R>>\nstartxref\n%d\n%%%%EOF\n' % (size, start)
+    else:
+        packed = [n for n in sorted(objects) if b'stream' not in objects[n]]
+        header = b' '.join(b'%d %d' % (n, 0) for n in packed)
+        body = b''
+        positions = []
+        for n in packed:
+            positions.append(len(body))
+            body += objects[n] + b'\n'
+        header = b' '.join(b'%d %d' % (n, p) for n, p in zip(packed, positions)) + b'\n'
+        data = zlib.compress(header + body)
+        objstm = max(objects) + 1
+        objects[objstm] = b'<</Type /ObjStm /N %d /First %d /Filter /FlateDecode /Length %d>>\nstream\n' % (
+            len(packed), len(header), len(data)) + data + b'\nendstream'
+        for n in sorted(objects):
+            if n not in packed:
+                offsets[n] = len(out)
+                out += b'%d 0 obj\n' % n + objects[n] + b'\nendobj\n'
+        xref = objstm + 1
+        size = xref + 1
+        rows = [bytearray([0, 0, 0, 0, 0xFF])]
+        for n in range(1, size):
+            if n in packed:
+                row = [2, objstm >> 8 & 0xFF, objstm & 0xFF, 0, packed.index(n)]
+            elif n == xref:
+                row = [1, len(out) >> 8 & 0xFF, len(out) & 0xFF, 0, 0]
+            else:
+                row = [1, offsets[n] >> 8 & 0xFF, offsets[n] & 0xFF, 0, 0]
+            rows.append(bytearray(row))
+        # Encode the rows with the PNG "Up" predictor
+        encoded = bytearray()
+        prev = bytearray(5)
+        for row in rows:
+            encoded += bytearray([2]) + bytearray((row[i] - prev[i]) & 0xFF for i in range(5))
+            prev = row
+        data = zlib.compress(bytes(encoded))
+        start = len(out)
+        out += b'%d 0 obj\n<</Type /XRef /Size %d /W [1 2 2] /Root 1 0 R /Info 4 0 R ' % (xref, size)
+        out += b'/Filter /FlateDecode /DecodeParms <</Predictor 12 /Columns 5>> /Length %d>>\n' % len(data)
+        out += b'stream\n' + data + b'\nendstream\nendobj\nstartxref\n%d\n%%%%EOF\n' % start
+    with open(filename, 'wb') as f:
+        f.write(bytes(out))
+
+
+W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+
+
+def make_docx(filename, body='<w:p><w:r><w:t>Hello</w:t></w:r></w:p>', core=None, app=None, parts=None,
+              rels=None):
+    '''
+    Write a minimal docx package. body is the WordprocessingML inside
+    <w:body> (the 'w' prefix is declared). core and app are dicts of
+    properties written to docProps/core.xml (eg. {'dc:title': 'Foo'}) and
+    docProps/app.xml (eg. {'Pages': 3}). parts is a dict of any other parts
+    and rels a dict of the targets of other package relationships by type.
+    '''
+    core = core or {}
+    app = app or {}
+    with zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr('[Content_Types].xml',
+                   '<?xml version="1.0" encoding="UTF-8"?>'
+                   '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                   '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                   '<Default Extension="xml" ContentType="application/xml"/>'
+                   '<Override PartName="/word/document.xml" ContentType="application/'
+                   'vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+                   '</Types>')
+        z.writestr('_rels/.rels',
+                   '<?xml version="1.0" encoding="UTF-8"?>'
+                   '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                   '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/'
+                   'relationships/officeDocument" Target="word/document.xml"/>%s'
+                   '</Relationships>' % ''.join('<Relationship Id="rId%d" Type="%s" Target="%s"/>' % (i, t, target)
+                                                for i, (t, target) in enumerate(sorted((rels or {}).items()), 2)))
+        z.writestr('word/document.xml',
+                   '<?xml version="1.0" encoding="UTF-8"?>'
+                   '<w:document xmlns:w="%s"><w:body>%s</w:body></w:document>' % (W_NS, body))
+        z.writestr('docProps/core.xml',
+                   '<?xml version="1.0" encoding="UTF-8"?>'
+                   '<cp:coreProperties xmlns:cp="http://schemas.openxmlformats.org/package/2006/metadata/'
+                   'core-properties" xmlns:dc="http://purl.org/dc/elements/1.1/" '
+                   'xmlns:dcterms="http://purl.org/dc/terms/" '
+                   'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">%s</cp:coreProperties>' %
+                   ''.join('<%s>%s</%s>' % (k, v, k) for k, v in sorted(core.items())))
+        z.writestr('docProps/app.xml',
+                   '<?xml version="1.0" encoding="UTF-8"?>'
+                   '<Properties xmlns="http://schemas.openxmlformats.org/officeDocument/2006/'
+                   'extended-properties">%s</Properties>' %
+                   ''.join('<%s>%s</%s>' % (k, v, k) for k, v in sorted(app.items())))
+        for name, data in sorted((parts or {}).items()):
+            z.writestr(name, data)